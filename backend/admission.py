@@ -0,0 +1,320 @@
+"""
+Priority admission control and load shedding for the detection endpoints
+
+AdmissionController bounds how many detection requests run at once and
+queues the rest per priority class: waiting interactive requests are always
+admitted before batch ones, and batch requests never take the slots kept
+for interactive ones. A request is refused up front, rather than left to
+time out in the queue, when its class's queue is full (429) or it could
+not finish within its deadline: estimated wait plus the usual time a request
+takes (503); both carry Retry-After.
+
+The wait is estimated from the recent time requests of the same class held
+a slot (an exponentially weighted mean per class of each completed request's
+hold time divided by its slots, so a long batch neither inflates the
+interactive estimate nor counts as one huge request) and the slots needed
+before the request can start. AdmissionMiddleware applies the controller to
+the detection routes before their body is read and sets the request's
+deadline, so the queue wait counts against the budget of its Gemini calls.
+"""
+import asyncio
+import math
+import time
+from collections import deque
+from typing import Deque, Dict, Iterable, Optional, Tuple
+from urllib.parse import parse_qs
+
+from fastapi import HTTPException
+from fastapi.responses import JSONResponse
+
+import metrics
+from resilience import request_deadline
+
+PRIORITIES = ("interactive", "batch")
+
+
+class _Waiter:
+    """Queued request: granted by resolving its future"""
+    
+    __slots__ = ("future", "weight")
+    
+    def __init__(self, future: asyncio.Future, weight: int):
+        self.future = future
+        self.weight = weight
+
+
+class AdmissionController:
+    """Bounded in-flight limit with priority queues and deadline-based shedding"""
+    
+    def __init__(self, max_in_flight: int, batch_max_in_flight: int, max_queue: int,
+                 smoothing: float = 0.2):
+        """
+        Initialize controller
+        
+        Args:
+            max_in_flight: Slots shared by all requests
+            batch_max_in_flight: Slots batch requests may hold at once
+            max_queue: Waiting requests allowed per priority class
+            smoothing: Weight of the newest hold time in the running means
+        """
+        self.max_in_flight = max_in_flight
+        self.batch_max_in_flight = batch_max_in_flight
+        self.max_queue = max_queue
+        self.smoothing = smoothing
+        self.in_flight = {priority: 0 for priority in PRIORITIES}
+        # Per class: running mean of seconds a slot is held
+        self.mean_hold_seconds: Dict[str, Optional[float]] = {priority: None for priority in PRIORITIES}
+        self.counts = {priority: {"admitted": 0, "queue_full": 0, "over_deadline": 0, "expired": 0}
+                       for priority in PRIORITIES}
+        self._queues: Dict[str, Deque[_Waiter]] = {priority: deque() for priority in PRIORITIES}
+    
+    def capacity(self, priority: str) -> int:
+        """Slots a class may hold at once"""
+        return self.max_in_flight if priority == "interactive" else self.batch_max_in_flight
+    
+    def estimate_wait(self, priority: str, weight: int = 1) -> float:
+        """
+        Estimated seconds before a new request of this class would be admitted
+        
+        Args:
+            priority: Priority class
+            weight: Slots the request needs
+            
+        Returns:
+            0 when it would start at once; otherwise the slots that must free
+            up first (queued ahead of it plus its own) over the class's
+            capacity, times the mean time a request of the class holds a slot
+        """
+        if not self._waiting_ahead(priority) and self._fits(priority, weight):
+            return 0.0
+        ahead = sum(waiter.weight for waiter in self._queues["interactive"] if not waiter.future.done())
+        if priority == "batch":
+            ahead += sum(waiter.weight for waiter in self._queues["batch"] if not waiter.future.done())
+        return (ahead + weight) / self.capacity(priority) * (self.mean_hold_seconds[priority] or 0.0)
+    
+    async def acquire(self, priority: str, weight: int = 1, deadline: Optional[float] = None) -> float:
+        """
+        Wait for slots, or refuse the request
+        
+        Args:
+            priority: Priority class
+            weight: Slots the request needs (at most its class's capacity)
+            deadline: Seconds the request may wait in total
+            
+        Returns:
+            Seconds waited
+            
+        Raises:
+            HTTPException: 429 when the class's queue is full, 503 when the
+                estimated (or actual) wait leaves less of the deadline than a
+                request usually takes; both with Retry-After
+        """
+        if not self._waiting_ahead(priority) and self._fits(priority, weight):
+            self._take(priority, weight)
+            self._record(priority, "admitted", 0.0)
+            return 0.0
+        
+        queue = self._queues[priority]
+        estimate = self.estimate_wait(priority, weight)
+        service = self.mean_hold_seconds[priority] or 0.0
+        if self._queued(priority) >= self.max_queue:
+            raise self._rejection(priority, "queue_full", 429, estimate,
+                                  f"Too many {priority} requests waiting; retry later")
+        if deadline is not None and estimate + service > deadline:
+            # Admitting it would only spend upstream capacity on a request bound to time out
+            raise self._rejection(priority, "over_deadline", 503, estimate,
+                                  f"Server busy: estimated wait {estimate:.1f}s leaves too little "
+                                  f"of the {deadline:g}s deadline")
+        
+        start = time.perf_counter()
+        waiter = _Waiter(asyncio.get_running_loop().create_future(), weight)
+        queue.append(waiter)
+        self._update_queued(priority)
+        try:
+            await asyncio.wait_for(waiter.future, None if deadline is None else deadline - service)
+        except (asyncio.TimeoutError, asyncio.CancelledError) as e:
+            if waiter.future.done() and not waiter.future.cancelled():
+                # Granted just as the wait ended: hand the slots back
+                self.release(priority, weight)
+            else:
+                self._dispatch()
+            self._update_queued(priority)
+            if isinstance(e, asyncio.CancelledError):
+                raise
+            raise self._rejection(priority, "expired", 503, self.estimate_wait(priority, weight),
+                                  f"Server busy: no slot within the {deadline:g}s deadline")
+        waited = time.perf_counter() - start
+        self._record(priority, "admitted", waited)
+        return waited
+    
+    def release(self, priority: str, weight: int = 1, held_seconds: Optional[float] = None) -> None:
+        """
+        Return slots and admit waiting requests
+        
+        Args:
+            priority: Priority class the slots were taken for
+            weight: Slots returned
+            held_seconds: How long the request held them (updates the class's wait estimate)
+        """
+        self.in_flight[priority] -= weight
+        if held_seconds is not None:
+            # A request holding several slots (a batch) frees them in parallel: count per slot
+            per_slot = held_seconds / weight
+            mean = self.mean_hold_seconds[priority]
+            self.mean_hold_seconds[priority] = per_slot if mean is None else mean + self.smoothing * (per_slot - mean)
+        self._dispatch()
+    
+    def get_stats(self) -> dict:
+        """Slots, queues, the wait estimate and decision counts, for /health"""
+        return {
+            "max_in_flight": self.max_in_flight,
+            "batch_max_in_flight": self.batch_max_in_flight,
+            "classes": {
+                priority: {
+                    "mean_hold_seconds": (round(self.mean_hold_seconds[priority], 3)
+                                          if self.mean_hold_seconds[priority] is not None else None),
+                    "in_flight": self.in_flight[priority],
+                    "queued": self._queued(priority),
+                    "estimated_wait_seconds": round(self.estimate_wait(priority), 3),
+                    **self.counts[priority]
+                }
+                for priority in PRIORITIES
+            }
+        }
+    
+    def _queued(self, priority: str) -> int:
+        """Requests of a class still waiting (timed-out ones leave the deque lazily)"""
+        return sum(not waiter.future.done() for waiter in self._queues[priority])
+    
+    def _waiting_ahead(self, priority: str) -> bool:
+        """Whether queued requests go before a new one of this class"""
+        classes = ("interactive",) if priority == "interactive" else PRIORITIES
+        return any(not waiter.future.done() for name in classes for waiter in self._queues[name])
+    
+    def _fits(self, priority: str, weight: int) -> bool:
+        if sum(self.in_flight.values()) + weight > self.max_in_flight:
+            return False
+        return priority == "interactive" or self.in_flight["batch"] + weight <= self.batch_max_in_flight
+    
+    def _take(self, priority: str, weight: int) -> None:
+        self.in_flight[priority] += weight
+    
+    def _dispatch(self) -> None:
+        """Admit queued requests in priority order while slots are free"""
+        for priority in PRIORITIES:
+            queue = self._queues[priority]
+            while queue:
+                waiter = queue[0]
+                if waiter.future.done():
+                    # Timed out or cancelled while waiting
+                    queue.popleft()
+                    continue
+                if not self._fits(priority, waiter.weight):
+                    break
+                queue.popleft()
+                self._take(priority, waiter.weight)
+                waiter.future.set_result(None)
+            self._update_queued(priority)
+    
+    def _update_queued(self, priority: str) -> None:
+        metrics.ADMISSION_QUEUED.labels(priority).set(self._queued(priority))
+    
+    def _record(self, priority: str, outcome: str, wait: Optional[float] = None) -> None:
+        self.counts[priority][outcome] += 1
+        metrics.record_admission(priority, outcome, wait)
+    
+    def _rejection(self, priority: str, outcome: str, status_code: int, estimate: float,
+                   detail: str) -> HTTPException:
+        self._record(priority, outcome)
+        return HTTPException(status_code=status_code, detail=detail,
+                             headers={"Retry-After": str(max(1, math.ceil(estimate)))})
+
+
+class AdmissionMiddleware:
+    """
+    ASGI middleware admitting requests to some paths through an AdmissionController
+    
+    The slots are held until the response has been sent, streamed bodies
+    included. Their number is left in request.state.admission_slots so a
+    batch runs no more images at once than the slots it was granted. The request's deadline (REQUEST_DEADLINE_SECONDS, the batch
+    deadline_seconds parameter, or a shorter X-Deadline-Seconds header)
+    starts on arrival, so time spent queued is taken from it.
+    """
+    
+    def __init__(self, app, controller: AdmissionController, routes: Dict[str, Tuple[str, int, float]],
+                 batch_paths: Iterable[str] = (), interactive_keys: Iterable[str] = (),
+                 batch_keys: Iterable[str] = ()):
+        """
+        Initialize middleware
+        
+        Args:
+            app: ASGI application
+            controller: Admission controller
+            routes: Path -> (default priority class, slots, deadline in seconds)
+            batch_paths: Paths whose concurrency and deadline_seconds query
+                         parameters set the slots and the deadline
+            interactive_keys: API keys (X-API-Key) of interactive clients
+            batch_keys: API keys of batch clients
+        """
+        self.app = app
+        self.controller = controller
+        self.routes = routes
+        self.batch_paths = set(batch_paths)
+        self.interactive_keys = set(interactive_keys)
+        self.batch_keys = set(batch_keys)
+    
+    def classify(self, scope) -> Tuple[str, int, float]:
+        """
+        Priority class, slots and deadline of a request
+        
+        Returns:
+            Tuple of (priority, weight, deadline in seconds)
+        """
+        priority, weight, deadline = self.routes[scope["path"]]
+        headers = {name: value.decode("latin-1") for name, value in scope["headers"]}
+        api_key = headers.get(b"x-api-key")
+        if api_key in self.interactive_keys:
+            priority = "interactive"
+        elif api_key in self.batch_keys:
+            priority = "batch"
+        elif headers.get(b"x-priority", "").lower() in PRIORITIES:
+            priority = headers[b"x-priority"].lower()
+        
+        if scope["path"] in self.batch_paths:
+            # A batch request runs up to `concurrency` images at once
+            query = parse_qs(scope.get("query_string", b"").decode("latin-1"))
+            weight = _positive(query.get("concurrency", [None])[0], weight)
+            deadline = _positive(query.get("deadline_seconds", [None])[0], deadline)
+        deadline = min(deadline, _positive(headers.get(b"x-deadline-seconds"), deadline))
+        return priority, max(1, min(int(weight), self.controller.capacity(priority))), deadline
+    
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["path"] not in self.routes:
+            await self.app(scope, receive, send)
+            return
+        
+        priority, weight, deadline = self.classify(scope)
+        with request_deadline(deadline):
+            try:
+                await self.controller.acquire(priority, weight, deadline)
+            except HTTPException as he:
+                response = JSONResponse({"detail": he.detail}, status_code=he.status_code, headers=he.headers)
+                await response(scope, receive, send)
+                return
+            
+            # The endpoint runs at most the slots it holds (request.state.admission_slots)
+            scope.setdefault("state", {})["admission_slots"] = weight
+            start = time.perf_counter()
+            try:
+                await self.app(scope, receive, send)
+            finally:
+                self.controller.release(priority, weight, time.perf_counter() - start)
+
+
+def _positive(value: Optional[str], default: float) -> float:
+    """Parse a positive number from a header or query value, else the default"""
+    try:
+        number = float(value)
+    except (TypeError, ValueError):
+        return default
+    return number if number > 0 and math.isfinite(number) else default
@@ -1,43 +1,148 @@
 """
 AI service for ingredient detection using Google Gemini
+
+The llama_index / Google GenAI stack takes seconds to import, so it is
+loaded when the client is built (at startup, in the background) rather than
+when this module is imported.
 """
-import tempfile
+import asyncio
 import os
-from typing import List, Tuple, Optional
-from llama_index.llms.google_genai import GoogleGenAI
-from llama_index.core.llms import ChatMessage, ImageBlock, MessageRole, TextBlock
+import threading
+from functools import partial
+from typing import TYPE_CHECKING, Any, AsyncIterator, List, Tuple, Optional
 from fastapi import HTTPException
-import cv2
-import numpy as np
-from config import GOOGLE_API_KEY
+from config import GOOGLE_API_KEY, STRUCTURED_OUTPUT_ENABLED, GEMINI_MODEL, GEMINI_WARMUP, LLM_CALL_TIMEOUT_SECONDS
+from detection_parser import STRUCTURED_BOX_KEY, STRUCTURED_LABEL_KEY
+from detection_backends import BackendResponse, DetectionBackend
+from image_processor import ImageProcessor
+from resilience import ResilientCaller
+
+if TYPE_CHECKING:
+    from llama_index.core.llms import ChatMessage
+
+# Gemini response schema for structured output mode
+DETECTION_RESPONSE_SCHEMA = {
+    "type": "OBJECT",
+    "properties": {
+        "detections": {
+            "type": "ARRAY",
+            "items": {
+                "type": "OBJECT",
+                "properties": {
+                    STRUCTURED_BOX_KEY: {"type": "ARRAY", "items": {"type": "INTEGER"}},
+                    STRUCTURED_LABEL_KEY: {"type": "STRING"}
+                },
+                "required": [STRUCTURED_BOX_KEY, STRUCTURED_LABEL_KEY]
+            }
+        }
+    },
+    "required": ["detections"]
+}
+
+STRUCTURED_OUTPUT_INSTRUCTIONS = f"""
 
-class GeminiAIService:
+SALIDA: responde en JSON con la forma {{"detections": [{{"{STRUCTURED_BOX_KEY}": [ymin, xmin, ymax, xmax], "{STRUCTURED_LABEL_KEY}": "nombre_ingrediente"}}]}}"""
+
+def load_llm_modules() -> None:
+    """Import the LLM stack (e.g. before forking workers, so they share it)"""
+    import llama_index.core.llms  # noqa: F401
+    import llama_index.llms.google_genai  # noqa: F401
+
+class GeminiAIService(DetectionBackend):
     """Service for interacting with Google Gemini AI"""
     
-    def __init__(self):
-        """Initialize Gemini AI service"""
-        self.gemini_pro = None
-        self._initialize_gemini()
+    name = "gemini"
+    
+    # Bump whenever the prompts change so cached results are not reused
+    PROMPT_VERSION = "2"
+    
+    def __init__(self, llm: Optional[Any] = None, structured_output: bool = STRUCTURED_OUTPUT_ENABLED,
+                 api_key: Optional[str] = GOOGLE_API_KEY, resilience: Optional[ResilientCaller] = None):
+        """
+        Initialize Gemini AI service
+        
+        The Gemini client is not built here: start() builds it at application
+        startup, or the first detection call does if that comes first.
+        
+        Args:
+            llm: Optional pre-built chat LLM (e.g. a local fake for benchmarks).
+                 When omitted the Gemini client is created from api_key.
+            structured_output: Request JSON matching DETECTION_RESPONSE_SCHEMA
+            api_key: Google API key (GOOGLE_API_KEY)
+            resilience: Timeouts, retries and circuit breaker of the chat calls
+                        (default: from the LLM_RETRY_* / CIRCUIT_* settings)
+        """
+        self.gemini_pro = llm
+        self.structured_output = structured_output
+        self.api_key = api_key
+        self.initialized = llm is not None
+        self.init_error: Optional[str] = None
+        self._init_lock = threading.Lock()
+        self.resilience = resilience if resilience is not None else ResilientCaller(self.name)
     
-    def _initialize_gemini(self):
-        """Initialize Gemini AI model"""
+    def initialize(self) -> bool:
+        """
+        Build the Gemini client once (blocking: imports the LLM stack)
+        
+        Returns:
+            True if the client is available
+        """
+        with self._init_lock:
+            if self.initialized:
+                return self.gemini_pro is not None
+            try:
+                if not self.api_key:
+                    raise ValueError("GOOGLE_API_KEY no configurada")
+                
+                from google.genai.types import HttpOptions
+                from llama_index.llms.google_genai import GoogleGenAI
+                
+                os.environ["GOOGLE_API_KEY"] = self.api_key
+                # Retries are ours (deadline-aware); the client's own would wait up to 20s
+                # between attempts regardless of the request's budget
+                self.gemini_pro = GoogleGenAI(
+                    model=GEMINI_MODEL, max_retries=0,
+                    http_options=HttpOptions(timeout=int(LLM_CALL_TIMEOUT_SECONDS * 1000))
+                )
+                print("✅ Gemini AI initialized successfully")
+            except Exception as e:
+                print(f"⚠️ Warning: Could not initialize Gemini AI: {e}")
+                print("The server will start but detection calls will fail with 503")
+                print("💡 Tip: Asegúrate de configurar tu archivo .env con GOOGLE_API_KEY")
+                self.gemini_pro = None
+                self.init_error = str(e)
+            self.initialized = True
+            return self.gemini_pro is not None
+    
+    async def start(self) -> None:
+        """Build the client off the event loop and, with GEMINI_WARMUP, open its connection"""
+        if not await asyncio.to_thread(self.initialize) or not GEMINI_WARMUP:
+            return
+        from llama_index.core.llms import ChatMessage, MessageRole
+        
         try:
-            if not GOOGLE_API_KEY:
-                raise ValueError("GOOGLE_API_KEY no configurada")
-            
-            os.environ["GOOGLE_API_KEY"] = GOOGLE_API_KEY
-            self.gemini_pro = GoogleGenAI(model_name="gemini-1.5-flash")
-            print("✅ Gemini AI initialized successfully")
+            await self.gemini_pro.achat(messages=[ChatMessage(role=MessageRole.USER, content="ok")])
+            print("✅ Gemini AI warm-up completed")
         except Exception as e:
-            print(f"⚠️ Warning: Could not initialize Gemini AI: {e}")
-            print("The server will start but API calls may fail until connection is restored")
-            print("💡 Tip: Asegúrate de configurar tu archivo .env con GOOGLE_API_KEY")
-            self.gemini_pro = None
+            print(f"⚠️ Warning: Gemini AI warm-up failed: {e}")
     
     def is_available(self) -> bool:
-        """Check if Gemini AI is available"""
+        """Check if Gemini AI is available (before start(), whether a key is configured)"""
+        if not self.initialized:
+            return bool(self.api_key)
         return self.gemini_pro is not None
     
+    def describe(self) -> dict:
+        """Availability, client initialization state, circuit breaker and retries for /health"""
+        description = {
+            **super().describe(),
+            "initialized": self.initialized,
+            "resilience": self.resilience.describe()
+        }
+        if self.init_error is not None:
+            description["error"] = self.init_error
+        return description
+    
     def _create_primary_prompt(self, image_width: int, image_height: int) -> str:
         """Create the primary prompt for ingredient detection"""
         return f"""Eres un experto en análisis de imágenes de comida. Analiza esta imagen de {image_width}x{image_height} píxeles y detecta CADA ingrediente alimentario visible con MÁXIMA PRECISIÓN.
@@ -100,43 +205,188 @@ REGLAS:
 - Detecta MÍNIMO 4 ingredientes
 - Solo texto de respuesta"""
     
-    def detect_ingredients(self, image_path: str, image_width: int, image_height: int) -> Tuple[str, str]:
+    def _build_message(self, prompt: str, image_data: bytes) -> "ChatMessage":
+        """Build a chat message with the prompt text and the in-memory image (JPEG or WebP)"""
+        from llama_index.core.llms import ChatMessage, ImageBlock, MessageRole, TextBlock
+        
+        if self.structured_output:
+            prompt += STRUCTURED_OUTPUT_INSTRUCTIONS
+        return ChatMessage(
+            role=MessageRole.USER,
+            blocks=[
+                TextBlock(text=prompt),
+                ImageBlock(image=image_data, image_mimetype=ImageProcessor.mime_type(image_data)),
+            ],
+        )
+    
+    def _chat_kwargs(self) -> dict:
+        """Extra chat arguments: the JSON response schema in structured output mode"""
+        if not self.structured_output:
+            return {}
+        return {
+            "generation_config": {
+                "response_mime_type": "application/json",
+                "response_schema": DETECTION_RESPONSE_SCHEMA
+            }
+        }
+    
+    def _ensure_available(self) -> None:
+        """Build the client if startup has not yet, and raise 503 if it could not be initialized"""
+        if not self.initialize():
+            raise HTTPException(status_code=503, detail=self._unavailable_detail())
+    
+    async def _ensure_available_async(self) -> None:
+        """_ensure_available without blocking the event loop on a first-time client build"""
+        if not self.initialized:
+            await asyncio.to_thread(self.initialize)
+        if self.gemini_pro is None:
+            raise HTTPException(status_code=503, detail=self._unavailable_detail())
+    
+    def _unavailable_detail(self) -> str:
+        """503 message for a missing key or a failed client build"""
+        if not self.api_key:
+            return "Gemini AI service is not available: GOOGLE_API_KEY is not configured."
+        return "Gemini AI service is not available. Please check internet connection."
+    
+    def detect_primary(self, image_data: bytes, image_width: int, image_height: int) -> str:
         """
-        Detect ingredients in image using Gemini AI
+        Run the primary detection prompt
         
         Args:
-            image_path: Path to the temporary image file
+            image_data: Encoded image bytes (JPEG or WebP)
             image_width: Width of the processed image
             image_height: Height of the processed image
             
         Returns:
-            Tuple of (primary_response, alternative_response)
+            Primary response text
+        """
+        self._ensure_available()
+        primary_msg = self._build_message(self._create_primary_prompt(image_width, image_height), image_data)
+        primary_response = self.resilience.call_sync(
+            partial(self.gemini_pro.chat, messages=[primary_msg], **self._chat_kwargs())
+        )
+        return BackendResponse(primary_response.message.content, self.name)
+    
+    def detect_alternative(self, image_data: bytes) -> str:
         """
-        if not self.is_available():
-            raise HTTPException(status_code=503, detail="Gemini AI service is not available. Please check internet connection.")
+        Run the alternative detection prompt
         
-        # Primary detection
-        primary_msg = ChatMessage(
-            role=MessageRole.USER,
-            blocks=[
-                TextBlock(text=self._create_primary_prompt(image_width, image_height)),
-                ImageBlock(path=image_path, image_mimetype="image/jpeg"),
-            ],
+        Args:
+            image_data: Encoded image bytes (JPEG or WebP)
+            
+        Returns:
+            Alternative response text
+        """
+        self._ensure_available()
+        alternative_msg = self._build_message(self._create_alternative_prompt(), image_data)
+        alternative_response = self.resilience.call_sync(
+            partial(self.gemini_pro.chat, messages=[alternative_msg], **self._chat_kwargs())
         )
+        return BackendResponse(alternative_response.message.content, self.name)
+    
+    async def detect_primary_async(self, image_data: bytes, image_width: int, image_height: int) -> str:
+        """
+        Run the primary detection prompt through the async chat API
         
-        primary_response = self.gemini_pro.chat(messages=[primary_msg])
-        primary_text = primary_response.message.content
+        Args:
+            image_data: Encoded image bytes (JPEG or WebP)
+            image_width: Width of the processed image
+            image_height: Height of the processed image
+            
+        Returns:
+            Primary response text
+        """
+        await self._ensure_available_async()
+        primary_msg = self._build_message(self._create_primary_prompt(image_width, image_height), image_data)
+        primary_response = await self.resilience.call(
+            partial(self.gemini_pro.achat, messages=[primary_msg], **self._chat_kwargs())
+        )
+        return BackendResponse(primary_response.message.content, self.name)
+    
+    async def detect_alternative_async(self, image_data: bytes) -> str:
+        """
+        Run the alternative detection prompt through the async chat API
         
-        # Alternative detection (if needed)
-        alternative_msg = ChatMessage(
-            role=MessageRole.USER,
-            blocks=[
-                TextBlock(text=self._create_alternative_prompt()),
-                ImageBlock(path=image_path, image_mimetype="image/jpeg"),
-            ],
+        Args:
+            image_data: Encoded image bytes (JPEG or WebP)
+            
+        Returns:
+            Alternative response text
+        """
+        await self._ensure_available_async()
+        alternative_msg = self._build_message(self._create_alternative_prompt(), image_data)
+        alternative_response = await self.resilience.call(
+            partial(self.gemini_pro.achat, messages=[alternative_msg], **self._chat_kwargs())
+        )
+        return BackendResponse(alternative_response.message.content, self.name)
+    
+    async def _stream_chat(self, prompt: str, image_data: bytes) -> AsyncIterator[str]:
+        """Yield response text deltas from the streaming chat API (retried until the first chunk)"""
+        await self._ensure_available_async()
+        message = self._build_message(prompt, image_data)
+        chunks = self.resilience.stream(
+            partial(self.gemini_pro.astream_chat, messages=[message], **self._chat_kwargs())
         )
+        async for chunk in chunks:
+            if chunk.delta:
+                yield chunk.delta
+    
+    def stream_primary_async(self, image_data: bytes, image_width: int, image_height: int) -> AsyncIterator[str]:
+        """
+        Stream the primary detection prompt response
         
-        alternative_response = self.gemini_pro.chat(messages=[alternative_msg])
-        alternative_text = alternative_response.message.content
+        Args:
+            image_data: Encoded image bytes (JPEG or WebP)
+            image_width: Width of the processed image
+            image_height: Height of the processed image
+            
+        Returns:
+            Async iterator of response text chunks
+        """
+        return self._stream_chat(self._create_primary_prompt(image_width, image_height), image_data)
+    
+    def stream_alternative_async(self, image_data: bytes) -> AsyncIterator[str]:
+        """
+        Stream the alternative detection prompt response
         
+        Args:
+            image_data: Encoded image bytes (JPEG or WebP)
+            
+        Returns:
+            Async iterator of response text chunks
+        """
+        return self._stream_chat(self._create_alternative_prompt(), image_data)
+    
+    def detect_ingredients(self, image_data: bytes, image_width: int, image_height: int) -> Tuple[str, str]:
+        """
+        Detect ingredients in image using both Gemini prompts back to back
+        
+        Args:
+            image_data: Encoded image bytes (JPEG or WebP)
+            image_width: Width of the processed image
+            image_height: Height of the processed image
+            
+        Returns:
+            Tuple of (primary_response, alternative_response)
+        """
+        primary_text = self.detect_primary(image_data, image_width, image_height)
+        alternative_text = self.detect_alternative(image_data)
+        return primary_text, alternative_text
+    
+    async def detect_ingredients_async(self, image_data: bytes, image_width: int, image_height: int) -> Tuple[str, str]:
+        """
+        Detect ingredients using both Gemini prompts, concurrently
+        
+        Args:
+            image_data: Encoded image bytes (JPEG or WebP)
+            image_width: Width of the processed image
+            image_height: Height of the processed image
+            
+        Returns:
+            Tuple of (primary_response, alternative_response)
+        """
+        primary_text, alternative_text = await asyncio.gather(
+            self.detect_primary_async(image_data, image_width, image_height),
+            self.detect_alternative_async(image_data),
+        )
         return primary_text, alternative_text
@@ -0,0 +1,156 @@
+"""
+Short-lived store for annotated images served from /images/{id}
+"""
+import json
+import secrets
+import threading
+import time
+from typing import Any, Dict, List, Optional
+
+from image_processor import ImageProcessor
+from result_cache import MemoryLRUCache, SQLiteDatabase
+
+
+class SQLiteImageTable(SQLiteDatabase):
+    """
+    Image entries in a SQLite file every pre-forked worker can read
+    
+    With several workers on one socket, the request that issued an image id
+    and the one fetching it usually land on different processes, so the
+    entries cannot live in process memory.
+    """
+    
+    def __init__(self, path: str, max_entries: int, ttl_seconds: float):
+        """
+        Initialize image table
+        
+        Args:
+            path: Database file path (shared by the workers)
+            max_entries: Maximum images kept
+            ttl_seconds: Seconds an image id stays valid
+        """
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        super().__init__(path)
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS annotated_images ("
+            "id TEXT PRIMARY KEY, stored_at REAL NOT NULL, source BLOB, "
+            "detections TEXT NOT NULL, rendered BLOB)"
+        )
+        self._conn.execute(
+            "CREATE INDEX IF NOT EXISTS annotated_images_stored_at ON annotated_images (stored_at)"
+        )
+        self._conn.commit()
+    
+    def get(self, image_id: str) -> Optional[Dict[str, Any]]:
+        """Return the entry or None if missing or expired"""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT stored_at, source, detections, rendered FROM annotated_images WHERE id = ?",
+                (image_id,)
+            ).fetchone()
+            if row is None:
+                return None
+            stored_at, source, detections, rendered = row
+            if time.time() - stored_at > self.ttl_seconds:
+                self._conn.execute("DELETE FROM annotated_images WHERE id = ?", (image_id,))
+                self._conn.commit()
+                return None
+        return {"source": source, "detections": json.loads(detections), "rendered": rendered}
+    
+    def set(self, image_id: str, entry: Dict[str, Any]) -> None:
+        """Store an entry, deleting expired rows and the oldest beyond max_entries"""
+        with self._lock:
+            now = time.time()
+            self._conn.execute(
+                "INSERT OR REPLACE INTO annotated_images (id, stored_at, source, detections, rendered) "
+                "VALUES (?, ?, ?, ?, ?)",
+                (image_id, now, entry["source"], json.dumps(entry["detections"]), entry["rendered"])
+            )
+            self._conn.execute("DELETE FROM annotated_images WHERE stored_at < ?", (now - self.ttl_seconds,))
+            self._conn.execute(
+                "DELETE FROM annotated_images WHERE id IN ("
+                "SELECT id FROM annotated_images ORDER BY stored_at DESC, rowid DESC LIMIT -1 OFFSET ?)",
+                (self.max_entries,)
+            )
+            self._conn.commit()
+    
+    def set_rendered(self, image_id: str, rendered: bytes) -> None:
+        """Replace an entry's source with its rendered JPEG, keeping its expiry"""
+        with self._lock:
+            self._conn.execute(
+                "UPDATE annotated_images SET rendered = ?, source = NULL WHERE id = ?", (rendered, image_id)
+            )
+            self._conn.commit()
+    
+    def __len__(self) -> int:
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM annotated_images").fetchone()[0]
+
+
+class AnnotatedImageStore:
+    """
+    Keeps the undrawn JPEG and detections per image id and renders lazily
+    
+    Bounding boxes are drawn and the JPEG encoded only when the URL is first
+    fetched; the rendered bytes then replace the source entry until it expires.
+    Entries live in process memory, or in a SQLite file when the ids must be
+    readable from every worker process.
+    """
+    
+    def __init__(self, max_entries: int, ttl_seconds: float, sqlite_path: Optional[str] = None):
+        """
+        Initialize store
+        
+        Args:
+            max_entries: Maximum images kept
+            ttl_seconds: Seconds an image id stays valid
+            sqlite_path: Optional database path shared by the worker processes
+        """
+        self.ttl_seconds = ttl_seconds
+        self._shared = sqlite_path is not None
+        self._entries = (SQLiteImageTable(sqlite_path, max_entries, ttl_seconds) if self._shared
+                         else MemoryLRUCache(max_entries, ttl_seconds))
+        self._render_lock = threading.Lock()
+    
+    def add(self, image_data: bytes, detections: List[Dict[str, Any]]) -> str:
+        """
+        Register an image to be rendered on demand
+        
+        Args:
+            image_data: JPEG of the resized, undrawn image
+            detections: Detection results to draw
+            
+        Returns:
+            Image id for /images/{id}
+        """
+        image_id = secrets.token_urlsafe(16)
+        self._entries.set(image_id, {"source": image_data, "detections": detections, "rendered": None})
+        return image_id
+    
+    def render(self, image_id: str) -> Optional[bytes]:
+        """
+        Get the annotated JPEG, drawing it on first access
+        
+        Args:
+            image_id: Id returned by add
+            
+        Returns:
+            JPEG bytes, or None if the id is unknown or expired
+        """
+        entry = self._entries.get(image_id)
+        if entry is None:
+            return None
+        if entry["rendered"] is not None:
+            return entry["rendered"]
+        
+        with self._render_lock:
+            if entry["rendered"] is None:
+                img = ImageProcessor.decode_image(entry["source"])
+                ImageProcessor.draw_detections(img, entry["detections"])
+                entry["rendered"] = ImageProcessor.encode_jpeg(img)
+                entry["source"] = None
+                if self._shared:
+                    # Another worker may render it too before this lands; both results are identical
+                    self._entries.set_rendered(image_id, entry["rendered"])
+        return entry["rendered"]
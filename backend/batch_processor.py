@@ -0,0 +1,208 @@
+"""
+Batch processing utilities for analysing many images per request
+"""
+import asyncio
+import io
+import os
+import tarfile
+import zipfile
+import zlib
+from typing import Any, AsyncIterator, Dict, List, Tuple
+
+from fastapi import HTTPException
+
+from config import INTAKE_MAX_BYTES
+from resilience import request_deadline
+
+IMAGE_EXTENSIONS = {'.jpg', '.jpeg', '.png', '.webp', '.bmp', '.tif', '.tiff'}
+ARCHIVE_EXTENSIONS = ('.zip', '.tar', '.tar.gz', '.tgz', '.tar.bz2')
+
+
+def is_archive(filename: str, content_type: str) -> bool:
+    """
+    Check if an uploaded file is a zip or tar archive
+    
+    Args:
+        filename: Uploaded file name
+        content_type: Uploaded file content type
+        
+    Returns:
+        True if the file should be extracted
+    """
+    name = (filename or "").lower()
+    return name.endswith(ARCHIVE_EXTENSIONS) or content_type in (
+        'application/zip', 'application/x-zip-compressed', 'application/x-tar', 'application/gzip'
+    )
+
+
+class BatchBudget:
+    """Image count and total image bytes of one batch request, within their limits"""
+    
+    def __init__(self, max_images: int, max_bytes: int):
+        """
+        Initialize budget
+        
+        Args:
+            max_images: Maximum number of images in the batch
+            max_bytes: Maximum total bytes of the images (uncompressed archive entries)
+        """
+        self.max_images = max_images
+        self.max_bytes = max_bytes
+        self.images = 0
+        self.bytes = 0
+    
+    def reserve(self, size: int) -> None:
+        """
+        Count one more image of `size` bytes
+        
+        Raises:
+            HTTPException: 413 when the batch would exceed either limit
+        """
+        if self.images + 1 > self.max_images:
+            raise HTTPException(status_code=413, detail=f"Batch exceeds {self.max_images} images")
+        if self.bytes + size > self.max_bytes:
+            raise HTTPException(status_code=413, detail=f"Batch exceeds {self.max_bytes} bytes of images")
+        self.images += 1
+        self.bytes += size
+
+
+def extract_archive(filename: str, data: bytes, budget: BatchBudget,
+                    max_entry_bytes: int = INTAKE_MAX_BYTES) -> List[Tuple[str, bytes]]:
+    """
+    Extract image files from a zip or tar archive
+    
+    Each entry's declared size is checked against max_entry_bytes and the
+    batch budget before it is decompressed, and reading stops at that size,
+    so an archive cannot expand past the limits (zip bombs). Blocking; run
+    it off the event loop.
+    
+    Args:
+        filename: Archive file name (used in entry names)
+        data: Archive bytes
+        budget: Image count and bytes left for the batch (updated)
+        max_entry_bytes: Maximum uncompressed size of one image
+        
+    Returns:
+        List of (entry_name, image_bytes)
+        
+    Raises:
+        HTTPException: 413 when an entry or the batch exceeds its limits,
+            400 for an unreadable archive
+    """
+    images = []
+    
+    def add(entry_name: str, size: int, open_entry) -> None:
+        if os.path.splitext(entry_name.lower())[1] not in IMAGE_EXTENSIONS:
+            return
+        if size > max_entry_bytes:
+            raise HTTPException(status_code=413,
+                                detail=f"Archive entry {entry_name} exceeds {max_entry_bytes} bytes")
+        budget.reserve(size)
+        with open_entry() as entry:
+            # The declared size may lie; never decompress more than it
+            image_bytes = entry.read(size + 1)
+        if len(image_bytes) != size:
+            raise HTTPException(status_code=400, detail=f"Corrupt archive entry: {entry_name}")
+        images.append((f"{filename}/{entry_name}", image_bytes))
+    
+    buffer = io.BytesIO(data)
+    try:
+        if zipfile.is_zipfile(buffer):
+            with zipfile.ZipFile(buffer) as archive:
+                for info in archive.infolist():
+                    if not info.is_dir():
+                        add(info.filename, info.file_size, lambda info=info: archive.open(info))
+            return images
+        
+        buffer.seek(0)
+        with tarfile.open(fileobj=buffer, mode='r:*') as archive:
+            for member in archive:
+                if member.isfile():
+                    add(member.name, member.size, lambda member=member: archive.extractfile(member))
+    except (tarfile.TarError, zipfile.BadZipFile, zlib.error, EOFError):
+        raise HTTPException(status_code=400, detail=f"Could not read archive: {filename}")
+    return images
+
+
+async def stream_batch(detection_service: Any, images: List[Tuple[str, bytes]],
+                       concurrency: int, deadline_seconds: float,
+                       image_mode: str = "inline") -> AsyncIterator[Dict[str, Any]]:
+    """
+    Run images through the detection pipeline and yield results as they finish
+    
+    At most `concurrency` images are processed at once. A failure only marks
+    its own image as failed. Images still running when the deadline expires
+    are cancelled and reported as timed out, followed by a summary item.
+    
+    Args:
+        detection_service: IngredientDetectionService instance
+        images: List of (filename, image_bytes)
+        concurrency: Maximum images processed at the same time
+        deadline_seconds: Total time budget for the batch
+        image_mode: How to return processed_image ("none", "inline" or "url")
+        
+    Yields:
+        One dictionary per image, then a summary dictionary
+    """
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + deadline_seconds
+    semaphore = asyncio.Semaphore(concurrency)
+    succeeded = 0
+    failed = 0
+    
+    async def run(index: int, filename: str, image_bytes: bytes) -> Dict[str, Any]:
+        async with semaphore:
+            item = {"type": "result", "index": index, "filename": filename}
+            try:
+                # Calls still running at the batch deadline would be cancelled anyway
+                with request_deadline(deadline - loop.time()):
+                    result = await detection_service.process_image_async(image_bytes, image_mode)
+                return {**item, "success": True, "result": result}
+            except HTTPException as he:
+                return {**item, "success": False, "status_code": he.status_code, "error": he.detail}
+            except Exception as e:
+                return {**item, "success": False, "status_code": 500, "error": str(e)}
+    
+    tasks = {
+        asyncio.create_task(run(index, filename, image_bytes)): (index, filename)
+        for index, (filename, image_bytes) in enumerate(images)
+    }
+    pending = set(tasks)
+    
+    try:
+        while pending:
+            timeout = deadline - loop.time()
+            if timeout <= 0:
+                break
+            done, pending = await asyncio.wait(pending, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                item = task.result()
+                if item["success"]:
+                    succeeded += 1
+                else:
+                    failed += 1
+                yield item
+        
+        for task in pending:
+            index, filename = tasks[task]
+            failed += 1
+            yield {
+                "type": "result", "index": index, "filename": filename, "success": False,
+                "status_code": 504, "error": f"Batch deadline of {deadline_seconds}s exceeded"
+            }
+        
+        yield {
+            "type": "summary",
+            "total_images": len(images),
+            "succeeded": succeeded,
+            "failed": failed,
+            "deadline_exceeded": bool(pending)
+        }
+    
+    finally:
+        # Also reached when the client disconnects mid-stream
+        unfinished = [task for task in tasks if not task.done()]
+        for task in unfinished:
+            task.cancel()
+        if unfinished:
+            await asyncio.gather(*unfinished, return_exceptions=True)
@@ -0,0 +1,5 @@
+"""
+Offline benchmarks for the NutriVision AI backend
+
+Run from the backend directory, e.g.: python -m benchmarks.bench_async_pipeline
+"""
@@ -0,0 +1,125 @@
+"""
+Load test: interactive latency during a batch flood, with and without admission control
+
+Runs the ASGI app in-process with Gemini replaced by a fake LLM of limited
+capacity (--upstream-capacity calls at once, --latency each; further calls
+queue, like a rate-limited upstream). --batch-clients closed-loop clients
+flood /detect-objects-base64 (batch class, X-Deadline-Seconds
+--batch-deadline, honouring Retry-After up to 1s) while --interactive-clients
+upload photos to /detect-objects. Reports the interactive latency
+percentiles, batch throughput and the refused requests, first with the
+limits lifted (every request is admitted and queues behind the upstream),
+then with --max-in-flight / --batch-max-in-flight.
+
+Usage (from backend/):
+    python -m benchmarks.bench_admission --seconds 15 --batch-clients 40
+"""
+import argparse
+import asyncio
+import base64
+import collections
+import contextlib
+import io
+import os
+import time
+
+os.environ.setdefault("GOOGLE_API_KEY", "offline-benchmark")
+
+import httpx
+import numpy as np
+
+from ai_service import GeminiAIService
+from benchmarks.bench_async_pipeline import make_image_bytes
+from benchmarks.fake_llm import FakeLLM
+
+
+async def interactive_client(client: httpx.AsyncClient, image_bytes: bytes, stop: float,
+                             latencies: list, statuses: collections.Counter) -> None:
+    """Upload a photo, wait a little, repeat"""
+    while time.perf_counter() < stop:
+        start = time.perf_counter()
+        response = await client.post("/detect-objects", params={"processed_image": "none"},
+                                     files={"file": ("photo.jpg", image_bytes, "image/jpeg")})
+        statuses[response.status_code] += 1
+        if response.status_code == 200:
+            latencies.append(time.perf_counter() - start)
+        await asyncio.sleep(0.1)
+
+
+async def batch_client(client: httpx.AsyncClient, body: dict, deadline: float, stop: float,
+                       latencies: list, statuses: collections.Counter) -> None:
+    """Send base64 requests back to back, backing off as told by Retry-After"""
+    while time.perf_counter() < stop:
+        start = time.perf_counter()
+        response = await client.post("/detect-objects-base64", params={"processed_image": "none"}, json=body,
+                                     headers={"X-Deadline-Seconds": str(deadline)})
+        statuses[response.status_code] += 1
+        if response.status_code == 200:
+            latencies.append(time.perf_counter() - start)
+        elif "retry-after" in response.headers:
+            await asyncio.sleep(min(float(response.headers["retry-after"]), 1.0))
+
+
+async def run(app, args, image_bytes: bytes) -> dict:
+    """One load test run against the app as configured"""
+    body = {"image": base64.b64encode(image_bytes).decode()}
+    stop = time.perf_counter() + args.seconds
+    results = {name: ([], collections.Counter()) for name in ("interactive", "batch")}
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=None) as client:
+        await asyncio.gather(
+            *(interactive_client(client, image_bytes, stop, *results["interactive"])
+              for _ in range(args.interactive_clients)),
+            *(batch_client(client, body, args.batch_deadline, stop, *results["batch"])
+              for _ in range(args.batch_clients))
+        )
+    return results
+
+
+def summarize(name: str, latencies: list, statuses: collections.Counter, seconds: float) -> str:
+    values = np.array(latencies or [0.0]) * 1000
+    return (f"  {name:<12} ok {len(latencies):5d} ({len(latencies) / seconds:5.1f}/s)  "
+            f"p50 {np.percentile(values, 50):7.0f}  p95 {np.percentile(values, 95):7.0f}  "
+            f"p99 {np.percentile(values, 99):7.0f} ms  statuses {dict(sorted(statuses.items()))}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--seconds", type=float, default=15)
+    parser.add_argument("--interactive-clients", type=int, default=2)
+    parser.add_argument("--batch-clients", type=int, default=40)
+    parser.add_argument("--batch-deadline", type=float, default=2.0, help="X-Deadline-Seconds of batch requests")
+    parser.add_argument("--latency", type=float, default=0.25, help="Fake LLM latency per call (s)")
+    parser.add_argument("--upstream-capacity", type=int, default=8, help="Fake LLM calls served at once")
+    parser.add_argument("--max-in-flight", type=int, default=4)
+    parser.add_argument("--batch-max-in-flight", type=int, default=2)
+    args = parser.parse_args()
+    
+    import main as app_module
+    
+    service = app_module.detection_service
+    # Every request uses the same photo; measure queueing, not the cache or coalescing
+    service.result_cache = None
+    service.single_flight = None
+    controller = app_module.admission
+    if controller is None:
+        raise SystemExit("Set ADMISSION_ENABLED=True to run this benchmark")
+    image_bytes = make_image_bytes(640, 480)
+    
+    print(f"{args.interactive_clients} interactive + {args.batch_clients} batch clients for {args.seconds:g}s; "
+          f"upstream {args.upstream_capacity} calls at once x {args.latency:g}s\n")
+    for label, max_in_flight, batch_max in (("limits lifted", 10 ** 6, 10 ** 6),
+                                            (f"admission {args.max_in_flight}/{args.batch_max_in_flight}",
+                                             args.max_in_flight, args.batch_max_in_flight)):
+        controller.max_in_flight, controller.batch_max_in_flight = max_in_flight, batch_max
+        controller.mean_hold_seconds = {priority: None for priority in controller.mean_hold_seconds}
+        service.ai_service = GeminiAIService(llm=FakeLLM(args.latency, max_concurrency=args.upstream_capacity))
+        with contextlib.redirect_stdout(io.StringIO()):
+            results = asyncio.run(run(app_module.app, args, image_bytes))
+        print(label)
+        for name, (latencies, statuses) in results.items():
+            print(summarize(name, latencies, statuses, args.seconds))
+
+
+if __name__ == "__main__":
+    main()
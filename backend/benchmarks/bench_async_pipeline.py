@@ -0,0 +1,68 @@
+"""
+Throughput benchmark: blocking vs async detection pipeline on a single event loop
+
+Usage (from backend/):
+    python -m benchmarks.bench_async_pipeline --requests 16 --latency 0.5
+"""
+import argparse
+import asyncio
+import os
+import time
+
+os.environ.setdefault("GOOGLE_API_KEY", "offline-benchmark")
+
+import cv2
+import numpy as np
+
+from ai_service import GeminiAIService
+from benchmarks.fake_llm import FakeLLM
+from detection_service import IngredientDetectionService
+
+
+def make_image_bytes(width: int = 1600, height: int = 1200) -> bytes:
+    """Create a synthetic JPEG to feed the pipeline"""
+    rng = np.random.default_rng(0)
+    img = rng.integers(0, 255, size=(height, width, 3), dtype=np.uint8)
+    _, buffer = cv2.imencode('.jpg', img)
+    return buffer.tobytes()
+
+
+async def run_blocking(service: IngredientDetectionService, image_bytes: bytes, n: int) -> float:
+    """Issue n requests at once through the blocking process_image path"""
+    async def one():
+        return service.process_image(image_bytes)
+    
+    start = time.perf_counter()
+    await asyncio.gather(*(one() for _ in range(n)))
+    return time.perf_counter() - start
+
+
+async def run_async(service: IngredientDetectionService, image_bytes: bytes, n: int) -> float:
+    """Issue n requests at once through process_image_async"""
+    start = time.perf_counter()
+    await asyncio.gather(*(service.process_image_async(image_bytes) for _ in range(n)))
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--requests", type=int, default=16)
+    parser.add_argument("--latency", type=float, default=0.5, help="Fake LLM latency per call (s)")
+    args = parser.parse_args()
+    
+    service = IngredientDetectionService(ai_service=GeminiAIService(llm=FakeLLM(args.latency)))
+    # Every request uses the same image; measure the pipeline, not the result cache
+    service.result_cache = None
+    image_bytes = make_image_bytes()
+    
+    blocking = asyncio.run(run_blocking(service, image_bytes, args.requests))
+    concurrent = asyncio.run(run_async(service, image_bytes, args.requests))
+    
+    print(f"{args.requests} requests, {args.latency:.2f}s per LLM call")
+    print(f"  blocking : {blocking:7.2f}s  {args.requests / blocking:6.2f} req/s")
+    print(f"  async    : {concurrent:7.2f}s  {args.requests / concurrent:6.2f} req/s")
+    print(f"  speedup  : {blocking / concurrent:6.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,101 @@
+"""
+Box ops benchmark: pairwise Python loops vs the vectorized box_ops module
+
+For 10, 100 and 1000 random boxes, times:
+  - overlap check: every box against the boxes before it (the old _has_overlap
+    loop over ImageProcessor.calculate_overlap vs one box_ops.iou_matrix)
+  - dedup: the old label-only remove_duplicates vs the new merge + NMS
+    DetectionParser.remove_duplicates (which also handles repeats and
+    overlapping boxes with different labels, so it does more work)
+    
+Usage (from backend/):
+    python -m benchmarks.bench_box_ops --sizes 10 100 1000
+"""
+import argparse
+import os
+import time
+
+import numpy as np
+
+os.environ.setdefault("GOOGLE_API_KEY", "offline-benchmark")
+
+import box_ops
+from detection_parser import DetectionParser
+from image_processor import ImageProcessor
+
+LABELS = ["tomate", "lechuga", "pollo", "arroz", "huevo", "queso", "cebolla", "aguacate"]
+
+
+def random_results(count: int, rng: np.random.Generator) -> list:
+    """Detection results with random boxes inside an 800x800 image"""
+    xy = rng.integers(0, 700, size=(count, 2))
+    wh = rng.integers(20, 100, size=(count, 2))
+    results = []
+    for i, ((x1, y1), (w, h)) in enumerate(zip(xy.tolist(), wh.tolist())):
+        results.append({
+            "id": i + 1,
+            "label": LABELS[i % len(LABELS)].title(),
+            "confidence": float(rng.random()),
+            "bbox": [x1, y1, x1 + w, y1 + h],
+            "normalized_bbox": [y1, x1, y1 + h, x1 + w],
+            "area": w * h
+        })
+    return results
+
+
+def legacy_has_overlap(bbox, existing_results, threshold=0.3) -> bool:
+    """Previous _has_overlap: pairwise calculate_overlap in a Python loop"""
+    for existing in existing_results:
+        if ImageProcessor.calculate_overlap(bbox, existing['bbox']) > threshold:
+            return True
+    return False
+
+
+def legacy_remove_duplicates(results: list) -> list:
+    """Previous remove_duplicates: first box per label"""
+    unique_results = []
+    seen_labels = set()
+    for result in results:
+        label_key = result['label'].lower()
+        if label_key not in seen_labels:
+            unique_results.append(result)
+            seen_labels.add(label_key)
+    return unique_results
+
+
+def mean_ms(fn, repeat: int) -> float:
+    """Mean wall time of fn() in milliseconds"""
+    start = time.perf_counter()
+    for _ in range(repeat):
+        fn()
+    return (time.perf_counter() - start) / repeat * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10, 100, 1000])
+    args = parser.parse_args()
+    
+    rng = np.random.default_rng(0)
+    print(f"{'boxes':>6} {'overlap loop ms':>16} {'iou_matrix ms':>14} {'speedup':>8} "
+          f"{'label dedup ms':>15} {'merge+nms ms':>13} {'kept old/new':>13}")
+    for size in args.sizes:
+        results = random_results(size, rng)
+        repeat = max(1, 2000 // size)
+        
+        # Each box against the ones before it, as _has_overlap sees the accepted results
+        loop_ms = mean_ms(lambda: [legacy_has_overlap(r['bbox'], results[:i]) for i, r in enumerate(results)],
+                          max(1, repeat // 10))
+        boxes = box_ops.as_boxes([r['bbox'] for r in results])
+        matrix_ms = mean_ms(lambda: (np.tril(box_ops.iou_matrix(boxes, boxes), -1) > 0.3).any(axis=1), repeat)
+        
+        label_ms = mean_ms(lambda: legacy_remove_duplicates(results), repeat)
+        nms_ms = mean_ms(lambda: DetectionParser.remove_duplicates([dict(r) for r in results]), repeat)
+        kept = f"{len(legacy_remove_duplicates(results))}/{len(DetectionParser.remove_duplicates([dict(r) for r in results]))}"
+        
+        print(f"{size:>6} {loop_ms:>16.3f} {matrix_ms:>14.3f} {loop_ms / matrix_ms:>7.1f}x "
+              f"{label_ms:>15.3f} {nms_ms:>13.3f} {kept:>13}")
+
+
+if __name__ == "__main__":
+    main()
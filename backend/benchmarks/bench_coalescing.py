@@ -0,0 +1,100 @@
+"""
+Single-flight coalescing: identical concurrent requests with and without it
+
+Sends --requests copies of the same image at once through
+process_image_async on a fake LLM and reports wall time and LLM calls, then
+checks the edge cases: the leader request is cancelled while the others wait
+(they still get the result), and the shared call fails (every request gets
+the same error from a single upstream call).
+
+Usage (from backend/):
+    python -m benchmarks.bench_coalescing --requests 20 --latency 0.5
+"""
+import argparse
+import asyncio
+import contextlib
+import io
+import os
+import time
+
+os.environ.setdefault("GOOGLE_API_KEY", "offline-benchmark")
+
+from fastapi import HTTPException
+
+from ai_service import GeminiAIService
+from benchmarks.bench_async_pipeline import make_image_bytes
+from benchmarks.fake_llm import FakeLLM
+from detection_service import IngredientDetectionService
+from resilience import CircuitBreaker, ResilientCaller
+from single_flight import SingleFlight
+
+
+def make_service(llm: FakeLLM, coalescing: bool) -> IngredientDetectionService:
+    """Detection service on the fake LLM, without the result cache, single attempt per call"""
+    caller = ResilientCaller("gemini", CircuitBreaker("gemini", 1000, 1.0), max_attempts=1)
+    service = IngredientDetectionService(ai_service=GeminiAIService(llm=llm, resilience=caller))
+    service.result_cache = None
+    service.single_flight = SingleFlight() if coalescing else None
+    return service
+
+
+async def identical(service: IngredientDetectionService, image_bytes: bytes, n: int) -> float:
+    """Send n copies of the same image at once; wall time in seconds"""
+    start = time.perf_counter()
+    await asyncio.gather(*(service.process_image_async(image_bytes, "none") for _ in range(n)))
+    return time.perf_counter() - start
+
+
+async def leader_cancelled(service: IngredientDetectionService, image_bytes: bytes, n: int) -> str:
+    """Cancel the first request mid-flight; the others must still complete"""
+    leader = asyncio.create_task(service.process_image_async(image_bytes, "none"))
+    await asyncio.sleep(0.01)
+    followers = [asyncio.create_task(service.process_image_async(image_bytes, "none")) for _ in range(n - 1)]
+    await asyncio.sleep(0.05)
+    leader.cancel()
+    results = await asyncio.gather(*followers, return_exceptions=True)
+    completed = sum(isinstance(result, dict) for result in results)
+    return f"leader cancelled: {leader.cancelled()}, followers completed {completed}/{n - 1}"
+
+
+async def shared_failure(service: IngredientDetectionService, image_bytes: bytes, n: int) -> str:
+    """The shared call fails; every request sees the error"""
+    results = await asyncio.gather(
+        *(service.process_image_async(image_bytes, "none") for _ in range(n)), return_exceptions=True
+    )
+    codes = sorted({result.status_code for result in results if isinstance(result, HTTPException)})
+    return f"{sum(isinstance(result, HTTPException) for result in results)}/{n} failed with {codes}"
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=20)
+    parser.add_argument("--latency", type=float, default=0.5, help="Fake LLM latency per call (s)")
+    args = parser.parse_args()
+    
+    image_bytes = make_image_bytes()
+    print(f"{args.requests} identical requests at once, {args.latency:.2f}s per LLM call")
+    
+    for coalescing in (False, True):
+        llm = FakeLLM(args.latency)
+        service = make_service(llm, coalescing)
+        with contextlib.redirect_stdout(io.StringIO()):
+            elapsed = asyncio.run(identical(service, image_bytes, args.requests))
+        print(f"  coalescing {'on ' if coalescing else 'off'}: {elapsed:6.2f}s  LLM calls {llm.calls:3d}"
+              + (f"  {service.single_flight.get_stats()}" if coalescing else ""))
+    
+    llm = FakeLLM(args.latency)
+    service = make_service(llm, True)
+    with contextlib.redirect_stdout(io.StringIO()):
+        outcome = asyncio.run(leader_cancelled(service, image_bytes, args.requests))
+    print(f"  {outcome}, LLM calls {llm.calls}")
+    
+    llm = FakeLLM(args.latency, error_rate=1.0)
+    service = make_service(llm, True)
+    with contextlib.redirect_stdout(io.StringIO()):
+        outcome = asyncio.run(shared_failure(service, image_bytes, args.requests))
+    print(f"  shared failure: {outcome}, upstream calls {llm.failures}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,71 @@
+"""
+Microbenchmark: temp-file handoff vs in-memory JPEG handoff to the LLM image block
+
+The old path wrote the resized image with cv2.imwrite, built an ImageBlock
+from the path (read back from disk when the request is serialized) and
+deleted the file. The new path encodes once with cv2.imencode and hands the
+bytes to the block directly.
+
+Usage (from backend/):
+    python -m benchmarks.bench_image_handoff --iterations 200
+"""
+import argparse
+import os
+import tempfile
+import time
+
+os.environ.setdefault("GOOGLE_API_KEY", "offline-benchmark")
+
+import cv2
+import numpy as np
+from llama_index.core.llms import ImageBlock
+
+from image_processor import ImageProcessor
+
+
+def temp_file_handoff(img: np.ndarray) -> bytes:
+    """Previous path: save_temp_image + ImageBlock(path=...) + unlink"""
+    with tempfile.NamedTemporaryFile(delete=False, suffix=".jpg") as tmp:
+        cv2.imwrite(tmp.name, img)
+        path = tmp.name
+    try:
+        block = ImageBlock(path=path, image_mimetype="image/jpeg")
+        return block.resolve_image(as_base64=False).read()
+    finally:
+        os.unlink(path)
+
+
+def in_memory_handoff(img: np.ndarray) -> bytes:
+    """Current path: encode_jpeg + ImageBlock(image=...)"""
+    block = ImageBlock(image=ImageProcessor.encode_jpeg(img), image_mimetype="image/jpeg")
+    return block.resolve_image(as_base64=False).read()
+
+
+def measure(fn, img: np.ndarray, iterations: int) -> np.ndarray:
+    """Return per-call timings in milliseconds"""
+    fn(img)
+    timings = []
+    for _ in range(iterations):
+        start = time.perf_counter()
+        fn(img)
+        timings.append(time.perf_counter() - start)
+    return np.array(timings) * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--iterations", type=int, default=200)
+    args = parser.parse_args()
+    
+    rng = np.random.default_rng(0)
+    img = cv2.GaussianBlur(rng.integers(0, 255, size=(600, 800, 3), dtype=np.uint8), (15, 15), 0)
+    
+    print(f"{'path':<12} {'mean ms':>8} {'p50 ms':>8} {'p99 ms':>8}")
+    for name, fn in (("temp file", temp_file_handoff), ("in memory", in_memory_handoff)):
+        timings = measure(fn, img, args.iterations)
+        print(f"{name:<12} {timings.mean():>8.2f} {np.percentile(timings, 50):>8.2f} "
+              f"{np.percentile(timings, 99):>8.2f}")
+
+
+if __name__ == "__main__":
+    main()
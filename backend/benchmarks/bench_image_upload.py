@@ -0,0 +1,105 @@
+"""
+Upload preparation benchmark: full decode + default resize/encode vs the adaptive stage
+
+For synthetic photos of several sizes, times decode, resize and encode and
+reports the bytes that would be uploaded to Gemini:
+  - legacy: cv2.imdecode at full size, cv2.resize with the default
+    (bilinear) interpolation, cv2.imencode at the default JPEG quality (95)
+  - adaptive: reduced-size decode (IMREAD_REDUCED_COLOR_2/4/8), INTER_AREA
+    and the quality ladder within UPLOAD_MAX_BYTES, in JPEG and WebP
+The adaptive decode keeps at least --min-side pixels (TARGET_IMAGE_SIZE
+without tiled mode, at least a tile or TILING_MIN_SIDE with it).
+
+Usage (from backend/):
+    python -m benchmarks.bench_image_upload --megapixels 2 12 48 --min-side 800
+"""
+import argparse
+import os
+import time
+
+import cv2
+import numpy as np
+
+os.environ.setdefault("GOOGLE_API_KEY", "offline-benchmark")
+
+from config import TARGET_IMAGE_SIZE, UPLOAD_MAX_BYTES
+from image_processor import ImageProcessor
+
+
+def synthetic_photo(megapixels: float, rng: np.random.Generator) -> bytes:
+    """4:3 JPEG with smooth gradients, filled shapes and sensor-like noise"""
+    width = int(np.sqrt(megapixels * 1e6 * 4 / 3))
+    height = width * 3 // 4
+    small = rng.integers(0, 255, size=(height // 64 + 1, width // 64 + 1, 3), dtype=np.uint8)
+    img = cv2.resize(small, (width, height), interpolation=cv2.INTER_CUBIC)
+    for _ in range(60):
+        center = (int(rng.integers(0, width)), int(rng.integers(0, height)))
+        radius = int(rng.integers(width // 80, width // 8))
+        cv2.circle(img, center, radius, tuple(int(c) for c in rng.integers(0, 255, 3)), -1)
+    img = cv2.add(img, rng.integers(0, 12, size=img.shape, dtype=np.uint8))
+    return cv2.imencode('.jpg', img, [cv2.IMWRITE_JPEG_QUALITY, 92])[1].tobytes()
+
+
+def target_size(width: int, height: int) -> tuple:
+    """Resized dimensions, as ImageProcessor.resize_image computes them"""
+    if width > height:
+        return TARGET_IMAGE_SIZE, int(TARGET_IMAGE_SIZE * height / width)
+    return int(TARGET_IMAGE_SIZE * width / height), TARGET_IMAGE_SIZE
+
+
+def legacy(image_bytes: bytes) -> tuple:
+    """Previous path; returns (decode ms, resize ms, encode ms, upload bytes)"""
+    start = time.perf_counter()
+    img = cv2.imdecode(np.frombuffer(image_bytes, np.uint8), cv2.IMREAD_COLOR)
+    decoded = time.perf_counter()
+    resized_img = cv2.resize(img, target_size(img.shape[1], img.shape[0]))
+    resized = time.perf_counter()
+    data = cv2.imencode('.jpg', resized_img)[1].tobytes()
+    encoded = time.perf_counter()
+    return (decoded - start) * 1000, (resized - decoded) * 1000, (encoded - resized) * 1000, len(data)
+
+
+def adaptive(image_bytes: bytes, min_side: int, image_format: str) -> tuple:
+    """Upload preparation stage; returns (decode ms, resize ms, encode ms, upload bytes, quality, reduction)"""
+    start = time.perf_counter()
+    img, reduction = ImageProcessor.decode_reduced(image_bytes, min_side)
+    decoded = time.perf_counter()
+    width, height = target_size(img.shape[1], img.shape[0])
+    resized_img = cv2.resize(img, (width, height), interpolation=cv2.INTER_AREA)
+    resized = time.perf_counter()
+    data, quality = ImageProcessor.encode_for_upload(resized_img, image_format)
+    encoded = time.perf_counter()
+    return ((decoded - start) * 1000, (resized - decoded) * 1000, (encoded - resized) * 1000,
+            len(data), quality, reduction)
+
+
+def mean(rows: list) -> list:
+    """Column means of a list of result tuples"""
+    return [sum(column) / len(column) for column in zip(*rows)]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--megapixels", type=float, nargs="+", default=[2, 12, 48])
+    parser.add_argument("--min-side", type=int, default=TARGET_IMAGE_SIZE)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+    
+    rng = np.random.default_rng(0)
+    print(f"Upload budget: {UPLOAD_MAX_BYTES} bytes, min decoded side: {args.min_side}px")
+    print(f"{'MP':>4} {'path':<14} {'decode ms':>10} {'resize ms':>10} {'encode ms':>10} "
+          f"{'total ms':>9} {'upload KB':>10} {'quality':>8} {'reduce':>7}")
+    for megapixels in args.megapixels:
+        image_bytes = synthetic_photo(megapixels, rng)
+        runs = {
+            "legacy": mean([legacy(image_bytes) for _ in range(args.repeat)]) + [95, 1],
+            "adaptive jpeg": mean([adaptive(image_bytes, args.min_side, "jpeg") for _ in range(args.repeat)]),
+            "adaptive webp": mean([adaptive(image_bytes, args.min_side, "webp") for _ in range(args.repeat)])
+        }
+        for name, (decode_ms, resize_ms, encode_ms, size, quality, reduction) in runs.items():
+            print(f"{megapixels:>4g} {name:<14} {decode_ms:>10.1f} {resize_ms:>10.1f} {encode_ms:>10.1f} "
+                  f"{decode_ms + resize_ms + encode_ms:>9.1f} {size / 1024:>10.1f} {quality:>8.0f} {reduction:>6.0f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,58 @@
+"""
+Near-duplicate index benchmark: lookup latency and recall at a large corpus size
+
+Usage (from backend/):
+    python -m benchmarks.bench_near_duplicate --size 1000000 --queries 2000
+"""
+import argparse
+import time
+
+import numpy as np
+
+from hamming_index import HammingIndex
+
+
+def flip_bits(value: int, count: int, rng: np.random.Generator) -> int:
+    """Flip `count` distinct random bits of a 64-bit hash"""
+    for bit in rng.choice(64, size=count, replace=False):
+        value ^= 1 << int(bit)
+    return value
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--size", type=int, default=1_000_000)
+    parser.add_argument("--queries", type=int, default=2000)
+    parser.add_argument("--distance", type=int, default=6)
+    args = parser.parse_args()
+    
+    rng = np.random.default_rng(42)
+    hashes = rng.integers(0, 2**63, size=args.size, dtype=np.uint64) * np.uint64(2) + \
+        rng.integers(0, 2, size=args.size, dtype=np.uint64)
+    
+    index = HammingIndex(args.distance)
+    start = time.perf_counter()
+    for i, value in enumerate(hashes.tolist()):
+        index.add(value, i)
+    build = time.perf_counter() - start
+    print(f"Indexed {args.size} hashes in {build:.1f}s")
+    
+    print(f"{'flips':>5} {'recall':>7} {'mean us':>8} {'p99 us':>8}")
+    targets = rng.integers(0, args.size, size=args.queries)
+    for flips in range(0, args.distance + 3):
+        found = 0
+        timings = []
+        for target in targets.tolist():
+            query = flip_bits(int(hashes[target]), flips, rng)
+            start = time.perf_counter()
+            match = index.search(query)
+            timings.append(time.perf_counter() - start)
+            if match is not None and match[0] == target:
+                found += 1
+        timings_us = np.array(timings) * 1e6
+        print(f"{flips:>5} {found / args.queries:>7.1%} {timings_us.mean():>8.1f} "
+              f"{np.percentile(timings_us, 99):>8.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,131 @@
+"""
+Nutrition lookup benchmark: linear substring scan vs NutritionIndex at 50k foods
+
+Builds a synthetic database (the real entries plus generated dishes), then
+times lookups of labels as the model returns them: exact names, plurals,
+missing accents, English synonyms, misspellings, dishes and unknown items.
+
+Usage (from backend/):
+    python -m benchmarks.bench_nutrition_lookup --size 50000
+"""
+import argparse
+import itertools
+import os
+import time
+
+import numpy as np
+
+os.environ.setdefault("GOOGLE_API_KEY", "offline-benchmark")
+
+from nutrition import NUTRITION_SYNONYMS, get_nutrition_store
+from nutrition_index import NutritionIndex
+
+BASES = [
+    "acelga", "ajo", "alcachofa", "almendra", "apio", "arveja", "atún", "avena", "bacalao", "batata",
+    "berenjena", "brócoli", "calabacín", "calabaza", "camarón", "cangrejo", "castaña", "cereza", "champiñón",
+    "chícharo", "coco", "coliflor", "cordero", "durazno", "espárrago", "espinaca", "frambuesa", "fresa",
+    "garbanzo", "guayaba", "haba", "higo", "kiwi", "langosta", "maíz", "mango", "manzana", "melón", "mora",
+    "nabo", "naranja", "nuez", "papa", "papaya", "pasta", "pavo", "pepino", "pera", "piña", "plátano",
+    "pulpo", "quinoa", "rábano", "remolacha", "sandía", "sardina", "tofu", "trigo", "uva", "yuca"
+]
+PREPARATIONS = [
+    "asado", "frito", "cocido", "al vapor", "crudo", "horneado", "a la plancha", "guisado", "en puré",
+    "salteado", "ahumado", "gratinado", "marinado", "empanizado", "deshidratado", "en conserva",
+    "a la parrilla", "rehogado", "escalfado", "confitado", "encurtido", "en salsa", "relleno", "rallado",
+    "picado", "en almíbar", "glaseado", "caramelizado", "flambeado", "estofado"
+]
+STYLES = [
+    "casero", "orgánico", "light", "integral", "tradicional", "mexicano", "andino", "mediterráneo",
+    "criollo", "picante", "dulce", "salado", "con hierbas", "con limón", "con ajo", "con queso", "con miel",
+    "con especias", "sin sal", "bajo en grasa", "premium", "rústico", "gourmet", "típico", "de temporada",
+    "congelado", "fresco", "seco", "tierno", "maduro"
+]
+
+QUERIES = [
+    "tomate", "Tomates", "tomato", "jamon", "limones", "arroz con pollo", "pollo asado", "lechga",
+    "tomatte", "frijol", "carne de res", "aceite de oliva", "brocoli al vapor", "espinacas",
+    "champinones salteados", "salsa verde", "pan", "mango maduro", "camarones a la plancha",
+    "papas fritas", "guacamole", "zanahorias", "calabacin relleno casero", "uvas"
+]
+
+
+def round_nutritional_values(nutrition_info: dict) -> dict:
+    """Previous per-call rounding of every numeric field"""
+    return {key: round(value, 2) if isinstance(value, (int, float)) else value for key, value in nutrition_info.items()}
+
+
+def legacy_lookup(database: dict, ingredient_name: str) -> dict:
+    """Previous get_nutritional_info: exact key, then first substring match in insertion order"""
+    ingredient_key = ingredient_name.lower().strip()
+    if ingredient_key in database:
+        return round_nutritional_values(database[ingredient_key])
+    for key, value in database.items():
+        if key in ingredient_key or ingredient_key in key:
+            return round_nutritional_values(value)
+    return {}
+
+
+def build_database(size: int) -> dict:
+    """Real entries first, then generated "base preparation style" dishes up to `size`"""
+    rng = np.random.default_rng(7)
+    store = get_nutrition_store()
+    database = {store.name(row): dict(store.record(row)) for row in range(len(store))}
+    for base, preparation, style in itertools.product(BASES, PREPARATIONS, STYLES):
+        if len(database) >= size:
+            break
+        calories, protein, carbs, fat, fiber = (rng.random(5) * [400, 30, 60, 30, 10]).tolist()
+        database[f"{base} {preparation} {style}"] = {
+            "calories": calories, "protein": protein, "carbs": carbs, "fat": fat,
+            "fiber": fiber, "vitamin_c": 0, "benefits": ""
+        }
+    return database
+
+
+def time_per_call(fn, labels, repeat: int) -> float:
+    """Mean time per lookup in microseconds"""
+    start = time.perf_counter()
+    for _ in range(repeat):
+        for label in labels:
+            fn(label)
+    return (time.perf_counter() - start) / (repeat * len(labels)) * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--size", type=int, default=50_000)
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+    
+    database = build_database(args.size)
+    print(f"Database entries: {len(database)}")
+    
+    start = time.perf_counter()
+    index = NutritionIndex(database, synonyms=NUTRITION_SYNONYMS)
+    records = list(database.values())
+    print(f"Index build: {(time.perf_counter() - start) * 1000:.0f} ms")
+    
+    def cold_lookup(label):
+        index.lookup.cache_clear()
+        return index.lookup(label)
+    
+    legacy_us = time_per_call(lambda label: legacy_lookup(database, label), QUERIES, max(args.repeat // 10, 1))
+    cold_us = time_per_call(cold_lookup, QUERIES, args.repeat)
+    index.lookup.cache_clear()
+    warm_us = time_per_call(index.lookup, QUERIES, args.repeat * 50)
+    
+    print(f"{'lookup':<26} {'mean us':>10}")
+    print(f"{'linear scan':<26} {legacy_us:>10.1f}")
+    print(f"{'index (uncached)':<26} {cold_us:>10.1f}")
+    print(f"{'index (memoized)':<26} {warm_us:>10.2f}")
+    
+    print()
+    print(f"{'label':<28} {'linear scan':>12} {'index':>12}")
+    for label in QUERIES:
+        legacy = legacy_lookup(database, label).get("calories", "N/A")
+        row = index.lookup(label)
+        indexed = records[row]["calories"] if row is not None else "N/A"
+        print(f"{label:<28} {legacy!s:>12} {indexed!s:>12}")
+
+
+if __name__ == "__main__":
+    main()
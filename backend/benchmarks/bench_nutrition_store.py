@@ -0,0 +1,125 @@
+"""
+Nutrition database benchmark: in-process dict vs memory-mapped NutritionStore
+
+Generates a USDA-scale CSV (rows x nutrients), then starts worker processes
+that each load the table the old way (a dict of dicts, as the hardcoded
+literal would be at scale) or open the mmap file, and look up random rows.
+Each worker reports load time, RSS and private memory; with the mmap store
+most of RSS is shared page cache counted once across workers.
+
+Usage (from backend/):
+    python -m benchmarks.bench_nutrition_store --rows 300000 --nutrients 40 --workers 4
+"""
+import argparse
+import csv
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+from nutrition_store import build_nutrition_file
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Runs in each worker: load, touch `lookups` random rows, report timings and memory
+WORKER = r"""
+import csv, json, sys, time
+import numpy as np
+
+mode, csv_path, db_path, lookups = sys.argv[1], sys.argv[2], sys.argv[3], int(sys.argv[4])
+
+def memory():
+    fields = {}
+    with open("/proc/self/smaps_rollup") as f:
+        for line in f:
+            parts = line.split()
+            if len(parts) >= 2 and parts[1].isdigit():
+                fields[parts[0].rstrip(":")] = int(parts[1])
+    return fields["Rss"] / 1024, (fields["Private_Clean"] + fields["Private_Dirty"]) / 1024
+
+start = time.perf_counter()
+if mode == "dict":
+    with open(csv_path, newline="", encoding="utf-8") as f:
+        reader = csv.DictReader(f)
+        table = {}
+        for row in reader:
+            name = row.pop("name")
+            benefits = row.pop("benefits")
+            record = {key: round(float(value), 2) for key, value in row.items()}
+            record["benefits"] = benefits
+            table[name] = record
+    names = list(table)
+    get = lambda row: dict(table[names[row]])
+else:
+    from nutrition_store import NutritionStore
+    store = NutritionStore(db_path)
+    get = lambda row: dict(store.record(row))
+load_ms = (time.perf_counter() - start) * 1000
+
+rng = np.random.default_rng()
+start = time.perf_counter()
+for row in rng.integers(0, int(sys.argv[5]), size=lookups).tolist():
+    get(row)
+lookup_us = (time.perf_counter() - start) / lookups * 1e6
+
+rss, private = memory()
+print(json.dumps({"load_ms": load_ms, "lookup_us": lookup_us, "rss_mb": rss, "private_mb": private}))
+"""
+
+
+def write_csv(path: str, rows: int, nutrients: int) -> None:
+    """Random table with `rows` foods and `nutrients` numeric columns"""
+    rng = np.random.default_rng(0)
+    values = np.round(rng.random((rows, nutrients)) * 100, 2)
+    with open(path, "w", newline="", encoding="utf-8") as f:
+        writer = csv.writer(f)
+        writer.writerow(["name"] + [f"nutrient_{i}" for i in range(nutrients)] + ["benefits"])
+        for i in range(rows):
+            writer.writerow([f"alimento {i}"] + values[i].tolist() + ["Fuente de nutrientes"])
+
+
+def run_workers(mode: str, csv_path: str, db_path: str, workers: int, lookups: int, rows: int) -> list:
+    """Start `workers` processes at once and collect their reports"""
+    env = {**os.environ, "PYTHONPATH": BACKEND_DIR}
+    processes = [
+        subprocess.Popen(
+            [sys.executable, "-c", WORKER, mode, csv_path, db_path, str(lookups), str(rows)],
+            stdout=subprocess.PIPE, env=env, text=True
+        )
+        for _ in range(workers)
+    ]
+    return [json.loads(process.communicate()[0]) for process in processes]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--rows", type=int, default=300_000)
+    parser.add_argument("--nutrients", type=int, default=40)
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--lookups", type=int, default=10_000)
+    args = parser.parse_args()
+    
+    with tempfile.TemporaryDirectory() as tmp:
+        csv_path = os.path.join(tmp, "nutrition.csv")
+        db_path = os.path.join(tmp, "nutrition.bin")
+        write_csv(csv_path, args.rows, args.nutrients)
+        
+        start = time.perf_counter()
+        build_nutrition_file(csv_path, db_path)
+        print(f"{args.rows} rows x {args.nutrients} nutrients: CSV {os.path.getsize(csv_path) / 2**20:.1f} MB, "
+              f"binary {os.path.getsize(db_path) / 2**20:.1f} MB, built in {time.perf_counter() - start:.1f}s")
+        
+        print(f"{'approach':<8} {'load ms':>9} {'lookup us':>10} {'RSS MB':>8} {'private MB':>11}  (mean of {args.workers} workers)")
+        for mode in ("dict", "mmap"):
+            reports = run_workers(mode, csv_path, db_path, args.workers, args.lookups, args.rows)
+            mean = {key: sum(report[key] for report in reports) / len(reports) for key in reports[0]}
+            print(f"{mode:<8} {mean['load_ms']:>9.1f} {mean['lookup_us']:>10.2f} "
+                  f"{mean['rss_mb']:>8.1f} {mean['private_mb']:>11.1f}")
+
+
+if __name__ == "__main__":
+    main()
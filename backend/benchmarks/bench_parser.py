@@ -0,0 +1,92 @@
+"""
+Parser benchmark: legacy multi-regex parser vs DetectionParser
+
+Runs both parsers over a corpus of recorded model responses (clean, noisy,
+markdown-wrapped, truncated, structured JSON, ...) and reports detections
+found and time per response. DetectionParser decodes structured responses
+with orjson and falls back to the single-pass DETECTION_PATTERN otherwise;
+the final line shows its fallback rate over the corpus.
+
+Usage (from backend/):
+    python -m benchmarks.bench_parser --iterations 2000
+"""
+import argparse
+import json
+import os
+import re
+import time
+
+os.environ.setdefault("GOOGLE_API_KEY", "offline-benchmark")
+
+from detection_parser import DetectionParser
+
+CORPUS_PATH = os.path.join(os.path.dirname(__file__), "fixtures", "parser_corpus.json")
+
+LEGACY_PATTERNS = [
+    r'\[(\d+(?:\.\d+)?),?\s*(\d+(?:\.\d+)?),?\s*(\d+(?:\.\d+)?),?\s*(\d+(?:\.\d+)?),?\s*([^\]]+)\]',
+    r'\[\s*(\d+(?:\.\d+)?)\s*,\s*(\d+(?:\.\d+)?)\s*,\s*(\d+(?:\.\d+)?)\s*,\s*(\d+(?:\.\d+)?)\s*,\s*([^\]]+)\s*\]',
+    r'\[(\d+(?:\.\d+)?)\s+(\d+(?:\.\d+)?)\s+(\d+(?:\.\d+)?)\s+(\d+(?:\.\d+)?)\s+([^\]]+)\]'
+]
+
+
+def legacy_parse(response_text: str) -> list:
+    """Previous parser: up to three findall passes, then a line-by-line fallback"""
+    bounding_boxes = []
+    for pattern in LEGACY_PATTERNS:
+        matches = re.findall(pattern, response_text)
+        if matches:
+            bounding_boxes.extend(matches)
+            break
+    
+    if not bounding_boxes:
+        for line in response_text.split('\n'):
+            line = line.strip()
+            if '[' in line and ']' in line:
+                bracket_content = re.search(r'\[([^\]]+)\]', line)
+                if bracket_content:
+                    parts = [part.strip() for part in re.split(r'[,\s]+', bracket_content.group(1))]
+                    if len(parts) >= 5:
+                        try:
+                            numbers = [float(parts[i]) for i in range(4)]
+                            bounding_boxes.append((*numbers, ' '.join(parts[4:])))
+                        except (ValueError, IndexError):
+                            continue
+    
+    # _process_detections converted every field afterwards
+    return [(float(a), float(b), float(c), float(d), label) for a, b, c, d, label in bounding_boxes]
+
+
+def time_per_call(fn, text: str, iterations: int) -> float:
+    """Mean time per call in microseconds"""
+    start = time.perf_counter()
+    for _ in range(iterations):
+        fn(text)
+    return (time.perf_counter() - start) / iterations * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--iterations", type=int, default=2000)
+    args = parser.parse_args()
+    
+    with open(CORPUS_PATH, encoding="utf-8") as f:
+        corpus = json.load(f)
+    
+    detection_parser = DetectionParser()
+    
+    print(f"{'response':<22} {'legacy n':>8} {'new n':>6} {'legacy us':>10} {'new us':>8} {'speedup':>8}")
+    total_legacy = total_new = 0.0
+    for name, text in corpus.items():
+        legacy_n = len(legacy_parse(text))
+        new_n = len(detection_parser.parse_detection_response(text))
+        legacy_us = time_per_call(legacy_parse, text, args.iterations)
+        new_us = time_per_call(detection_parser.parse_detection_response, text, args.iterations)
+        total_legacy += legacy_us
+        total_new += new_us
+        print(f"{name:<22} {legacy_n:>8} {new_n:>6} {legacy_us:>10.1f} {new_us:>8.1f} {legacy_us / new_us:>7.1f}x")
+    print(f"{'total':<22} {'':>8} {'':>6} {total_legacy:>10.1f} {total_new:>8.1f} {total_legacy / total_new:>7.1f}x")
+    print(f"fallback rate: {detection_parser.get_stats()['fallback_rate']:.0%}")
+
+
+if __name__ == "__main__":
+    main()
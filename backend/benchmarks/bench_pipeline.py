@@ -0,0 +1,262 @@
+"""
+Stage benchmark suite for the detection pipeline, offline and comparable between commits
+
+Runs every stage of a /detect-objects request on the same code paths the
+service uses and reports p50/p95/p99 per stage:
+  - decode, resize, encode: upload preparation of the photo
+  - parse: both detection responses into boxes
+  - nutrition: label lookups, portion estimates and the nutritional summary
+  - dedup: merging/NMS and sorting of the combined detections
+  - draw: bounding boxes on the resized image
+  - request: the whole endpoint (multipart upload to JSON response) through
+    the ASGI app, with the Gemini calls answered by ReplayBackend
+The replay backend reads a fixtures file (default: a canned plate; record
+real ones by running the server with RECORD_FIXTURES_PATH set) and waits
+--latency ± --jitter seconds per call. With the default latency of 0 the
+request stage measures only the backend's own work.
+
+Results can be written to JSON and compared with an earlier run; the
+comparison fails (exit code 1) when a stage's p50 regresses by more than
+--threshold.
+
+Usage (from backend/):
+    python -m benchmarks.bench_pipeline --iterations 50 --output bench.json
+    python -m benchmarks.bench_pipeline --compare bench.json
+    python -m benchmarks.bench_pipeline --images photos/*.jpg --fixtures recorded.json --latency 1.2 --jitter 0.4
+"""
+import argparse
+import asyncio
+import contextlib
+import io
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+from datetime import datetime, timezone
+from typing import Callable, Dict, List
+
+os.environ.setdefault("GOOGLE_API_KEY", "offline-benchmark")
+
+import cv2
+import httpx
+import numpy as np
+
+from benchmarks.bench_image_upload import synthetic_photo
+from config import TILING_ENABLED, UPLOAD_IMAGE_FORMAT
+from detection_backends import ReplayBackend
+from image_processor import ImageProcessor
+from nutrition import calculate_nutritional_summary, estimate_portion_grams, get_nutritional_info
+
+FIXTURES_PATH = os.path.join(os.path.dirname(__file__), "fixtures", "pipeline_replay.json")
+PERCENTILES = (50, 95, 99)
+
+
+def summarize(samples: List[float]) -> Dict[str, float]:
+    """Mean and percentiles (ms) of per-iteration times in seconds"""
+    values = np.array(samples) * 1000
+    stats = {f"p{p}": round(float(np.percentile(values, p)), 3) for p in PERCENTILES}
+    stats["mean"] = round(float(values.mean()), 3)
+    stats["n"] = len(samples)
+    return stats
+
+
+def measure(func: Callable[[], object], iterations: int, warmup: int) -> List[float]:
+    """Time func per call, after warm-up calls; the service's logging is silenced"""
+    samples = []
+    with contextlib.redirect_stdout(io.StringIO()):
+        for i in range(warmup + iterations):
+            start = time.perf_counter()
+            func()
+            elapsed = time.perf_counter() - start
+            if i >= warmup:
+                samples.append(elapsed)
+    return samples
+
+
+async def measure_requests(app, images: List[bytes], iterations: int, warmup: int) -> List[float]:
+    """Time sequential POST /detect-objects requests through the ASGI app"""
+    samples = []
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+        with contextlib.redirect_stdout(io.StringIO()):
+            for i in range(warmup + iterations):
+                image_bytes = images[i % len(images)]
+                start = time.perf_counter()
+                response = await client.post(
+                    "/detect-objects", params={"processed_image": "inline"},
+                    files={"file": ("photo.jpg", image_bytes, "image/jpeg")}
+                )
+                elapsed = time.perf_counter() - start
+                response.raise_for_status()
+                if i >= warmup:
+                    samples.append(elapsed)
+    return samples
+
+
+def run_suite(images: List[bytes], backend: ReplayBackend, iterations: int, warmup: int) -> Dict[str, dict]:
+    """
+    Benchmark every stage
+    
+    Args:
+        images: Encoded photos (stages cycle through them)
+        backend: Replay backend answering the detection calls
+        iterations: Timed iterations per stage
+        warmup: Untimed iterations per stage
+        
+    Returns:
+        Stage name -> latency statistics
+    """
+    import main
+    
+    service = main.detection_service
+    service.ai_service = backend
+    # Every iteration repeats the same photos; measure the pipeline, not the result cache
+    service.result_cache = None
+    
+    min_side = service._decode_min_side()
+    prepared = []
+    for image_bytes in images:
+        img, _ = ImageProcessor.decode_reduced(image_bytes, min_side)
+        img_resized, width, height, _, _ = ImageProcessor.resize_image(img)
+        image_data, _ = ImageProcessor.encode_for_upload(img_resized)
+        primary = backend._response(image_data, "primary")
+        alternative = backend._response(image_data, "alternative")
+        with contextlib.redirect_stdout(io.StringIO()):
+            results = service._process_detections(primary, width, height, True)
+            results += service._process_detections(alternative, width, height, False, results)
+        prepared.append((img, img_resized, width, height, primary, alternative, results))
+    
+    def cycle(stage: Callable) -> Callable[[], object]:
+        state = {"i": 0}
+        
+        def call():
+            index = state["i"] % len(images)
+            state["i"] += 1
+            return stage(index)
+        return call
+    
+    def nutrition(index):
+        _, _, width, height, _, _, results = prepared[index]
+        for result in results:
+            get_nutritional_info(result["label"])
+        estimate_portion_grams(results, width * height)
+        return calculate_nutritional_summary(results)
+    
+    stages = {
+        "decode": lambda i: ImageProcessor.decode_reduced(images[i], min_side),
+        "resize": lambda i: ImageProcessor.resize_image(prepared[i][0]),
+        "encode": lambda i: ImageProcessor.encode_for_upload(prepared[i][1]),
+        "parse": lambda i: (service.parser.parse_detection_response(prepared[i][4]),
+                            service.parser.parse_detection_response(prepared[i][5])),
+        "nutrition": nutrition,
+        "dedup": lambda i: service.parser.sort_by_area(
+            service.parser.remove_duplicates([dict(result) for result in prepared[i][6]])),
+        "draw": lambda i: ImageProcessor.draw_detections(prepared[i][1].copy(), prepared[i][6]),
+    }
+    report = {}
+    for name, stage in stages.items():
+        report[name] = summarize(measure(cycle(stage), iterations, warmup))
+    report["request"] = summarize(asyncio.run(measure_requests(main.app, images, iterations, warmup)))
+    return report
+
+
+def git_commit() -> str:
+    """Current commit hash, or "unknown" outside a git checkout"""
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def compare(stages: Dict[str, dict], baseline: dict, threshold: float) -> bool:
+    """
+    Print p50/p95 changes against a baseline run
+    
+    Returns:
+        True if any stage's p50 is more than threshold slower
+    """
+    print(f"\nvs {baseline.get('commit', '?')} ({baseline.get('timestamp', '?')})")
+    print(f"{'stage':<10} {'p50 ms':>10} {'base':>10} {'change':>8} {'p95 change':>11}")
+    regressed = False
+    for name, stats in stages.items():
+        base = baseline.get("stages", {}).get(name)
+        if base is None:
+            print(f"{name:<10} {stats['p50']:>10.3f} {'-':>10}")
+            continue
+        change = stats["p50"] / base["p50"] - 1 if base["p50"] else 0.0
+        change_p95 = stats["p95"] / base["p95"] - 1 if base["p95"] else 0.0
+        flag = "  REGRESSION" if change > threshold else ""
+        regressed |= change > threshold
+        print(f"{name:<10} {stats['p50']:>10.3f} {base['p50']:>10.3f} {change:>+8.1%} {change_p95:>+11.1%}{flag}")
+    return regressed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--images", nargs="*", default=[], help="Photos to use (default: a synthetic photo)")
+    parser.add_argument("--megapixels", type=float, default=12, help="Size of the synthetic photo")
+    parser.add_argument("--fixtures", default=FIXTURES_PATH, help="Replay fixtures file")
+    parser.add_argument("--latency", type=float, default=0.0, help="Simulated Gemini latency per call (s)")
+    parser.add_argument("--jitter", type=float, default=0.0, help="Uniform jitter around --latency (s)")
+    parser.add_argument("--iterations", type=int, default=50)
+    parser.add_argument("--warmup", type=int, default=5)
+    parser.add_argument("--output", help="Write results to this JSON file")
+    parser.add_argument("--compare", help="JSON results of an earlier run to compare against")
+    parser.add_argument("--threshold", type=float, default=0.15, help="p50 slowdown counted as a regression")
+    args = parser.parse_args()
+    
+    if args.images:
+        images = []
+        for path in args.images:
+            with open(path, "rb") as f:
+                images.append(f.read())
+    else:
+        images = [synthetic_photo(args.megapixels, np.random.default_rng(0))]
+    backend = ReplayBackend(args.fixtures, latency=args.latency, jitter=args.jitter, seed=0)
+    
+    print(f"{len(images)} image(s), {args.iterations} iterations, replay latency "
+          f"{args.latency * 1000:.0f} ± {args.jitter * 1000:.0f} ms")
+    stages = run_suite(images, backend, args.iterations, args.warmup)
+    
+    print(f"\n{'stage':<10} {'p50 ms':>10} {'p95 ms':>10} {'p99 ms':>10} {'mean ms':>10}")
+    for name, stats in stages.items():
+        print(f"{name:<10} {stats['p50']:>10.3f} {stats['p95']:>10.3f} {stats['p99']:>10.3f} {stats['mean']:>10.3f}")
+    
+    results = {
+        "commit": git_commit(),
+        "timestamp": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "environment": {
+            "python": platform.python_version(),
+            "opencv": cv2.__version__,
+            "numpy": np.__version__,
+            "cpus": os.cpu_count(),
+            "upload_format": UPLOAD_IMAGE_FORMAT,
+            "tiling": TILING_ENABLED
+        },
+        "parameters": {
+            "images": args.images or [f"synthetic {args.megapixels} MP"],
+            "fixtures": os.path.relpath(args.fixtures),
+            "latency": args.latency,
+            "jitter": args.jitter,
+            "iterations": args.iterations,
+            "warmup": args.warmup
+        },
+        "stages": stages
+    }
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+        print(f"\nResults written to {args.output}")
+    
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        if compare(stages, baseline, args.threshold):
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
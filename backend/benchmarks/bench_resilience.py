@@ -0,0 +1,132 @@
+"""
+Fault-injection run of the Gemini call path: deadlines, retries and the circuit breaker
+
+Drives process_image_async with GeminiAIService on a local fake LLM that
+injects errors and latency, and reports per scenario the outcome of every
+request (status codes), latency percentiles, attempts, retries and the
+breaker state:
+  - flaky:  a fraction of calls fail with 503; with and without retries
+  - slow:   the upstream hangs; the request deadline bounds the wait (504)
+  - outage: every call fails until the breaker opens and later requests are
+            refused at once (503 + Retry-After); the upstream then recovers
+            and the half-open probe closes the circuit
+            
+Usage (from backend/):
+    python -m benchmarks.bench_resilience
+    python -m benchmarks.bench_resilience --requests 60 --error-rate 0.4 --deadline 3
+"""
+import argparse
+import asyncio
+import collections
+import contextlib
+import io
+import os
+import time
+from typing import List, Tuple
+
+os.environ.setdefault("GOOGLE_API_KEY", "offline-benchmark")
+
+import numpy as np
+from fastapi import HTTPException
+
+from ai_service import GeminiAIService
+from benchmarks.bench_async_pipeline import make_image_bytes
+from benchmarks.fake_llm import FakeLLM
+from detection_service import IngredientDetectionService
+from resilience import CircuitBreaker, ResilientCaller, request_deadline
+
+
+def make_service(llm: FakeLLM, max_attempts: int, call_timeout: float,
+                 failure_threshold: int, reset_seconds: float) -> IngredientDetectionService:
+    """Detection service on the fake LLM with its own breaker and retry settings"""
+    caller = ResilientCaller(
+        "gemini", CircuitBreaker("gemini", failure_threshold, reset_seconds),
+        max_attempts=max_attempts, base_delay=0.1, max_delay=1.0, call_timeout=call_timeout,
+        min_budget=0.2, seed=0
+    )
+    service = IngredientDetectionService(ai_service=GeminiAIService(llm=llm, resilience=caller))
+    # Every request uses the same image; measure the call path, not the result cache
+    service.result_cache = None
+    return service
+
+
+async def run_requests(service: IngredientDetectionService, image_bytes: bytes, n: int,
+                       concurrency: int, deadline: float) -> List[Tuple[int, float, str]]:
+    """
+    Send n requests, at most `concurrency` at a time
+    
+    Returns:
+        (status code, latency in seconds, Retry-After header or "") per request
+    """
+    semaphore = asyncio.Semaphore(concurrency)
+    
+    async def one() -> Tuple[int, float, str]:
+        async with semaphore:
+            start = time.perf_counter()
+            try:
+                with request_deadline(deadline):
+                    await service.process_image_async(image_bytes, "none")
+                return 200, time.perf_counter() - start, ""
+            except HTTPException as he:
+                return he.status_code, time.perf_counter() - start, (he.headers or {}).get("Retry-After", "")
+    
+    with contextlib.redirect_stdout(io.StringIO()):
+        return await asyncio.gather(*(one() for _ in range(n)))
+
+
+def report(name: str, outcomes: List[Tuple[int, float, str]], service: IngredientDetectionService) -> None:
+    """Print one scenario's outcomes"""
+    statuses = collections.Counter(status for status, _, _ in outcomes)
+    latencies = np.array([latency for _, latency, _ in outcomes]) * 1000
+    stats = service.ai_service.resilience.describe()
+    retry_after = sorted({header for _, _, header in outcomes if header})
+    print(f"{name:<22} {dict(sorted(statuses.items()))!s:<28} "
+          f"p50 {np.percentile(latencies, 50):7.0f} ms  p95 {np.percentile(latencies, 95):7.0f} ms  "
+          f"max {latencies.max():7.0f} ms  attempts {stats['attempts']:3d}  retries {stats['retries']:3d}  "
+          f"circuit {stats['circuit']['state']}" + (f"  Retry-After {','.join(retry_after)}" if retry_after else ""))
+
+
+async def outage(args, image_bytes: bytes) -> None:
+    """Every call fails, then the upstream recovers"""
+    llm = FakeLLM(args.latency, error_rate=1.0)
+    service = make_service(llm, 3, 10.0, args.failure_threshold, args.reset_seconds)
+    report("outage", await run_requests(service, image_bytes, args.requests, args.concurrency, args.deadline), service)
+    print(f"{'':<22} upstream calls made: {llm.calls + llm.failures} for {args.requests} requests")
+    
+    llm.error_rate = 0.0
+    await asyncio.sleep(args.reset_seconds)
+    report("outage, recovered", await run_requests(service, image_bytes, args.requests, args.concurrency,
+                                                   args.deadline), service)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=40)
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--latency", type=float, default=0.2, help="Fake LLM latency per call (s)")
+    parser.add_argument("--error-rate", type=float, default=0.3, help="Failed call fraction in the flaky scenario")
+    parser.add_argument("--deadline", type=float, default=2.0, help="Request deadline (s)")
+    parser.add_argument("--failure-threshold", type=int, default=5)
+    parser.add_argument("--reset-seconds", type=float, default=1.0)
+    args = parser.parse_args()
+    
+    image_bytes = make_image_bytes(800, 600)
+    print(f"{args.requests} requests, {args.concurrency} concurrent, {args.latency:.2f}s per call, "
+          f"deadline {args.deadline}s\n")
+    
+    for label, attempts in (("flaky, no retries", 1), ("flaky, 3 attempts", 3)):
+        service = make_service(FakeLLM(args.latency, error_rate=args.error_rate), attempts, 10.0,
+                               args.requests * 4, args.reset_seconds)
+        report(label, asyncio.run(run_requests(service, image_bytes, args.requests, args.concurrency,
+                                               args.deadline)), service)
+    
+    service = make_service(FakeLLM(args.latency, slow_rate=1.0, slow_latency=30.0), 3, 10.0,
+                           args.requests * 4, args.reset_seconds)
+    report("slow (30s upstream)", asyncio.run(run_requests(service, image_bytes, args.requests,
+                                                           args.concurrency, args.deadline)), service)
+    
+    asyncio.run(outage(args, image_bytes))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,206 @@
+"""
+Upload intake benchmark: peak server memory with whole-body reads vs streaming intake
+
+Starts the API in a fresh uvicorn process per mode (Gemini replaced by the
+fake LLM) and sends concurrent uploads of a large JPEG:
+  - legacy multipart: await file.read() of the whole upload
+  - legacy base64: JSON body parsed into a dict, split(',') and base64.b64decode
+  - streaming multipart / base64: /detect-objects and /detect-objects-base64
+    (chunked reads into a preallocated buffer, incremental base64 decoding)
+Reports the server's peak resident memory (VmHWM) above its idle footprint,
+plus the 413 latency for an upload above INTAKE_MAX_BYTES.
+
+Usage (from backend/):
+    python -m benchmarks.bench_upload_intake --megabytes 20 --concurrency 8
+"""
+import argparse
+import base64
+import os
+import subprocess
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+os.environ.setdefault("GOOGLE_API_KEY", "offline-benchmark")
+
+import cv2
+import httpx
+import numpy as np
+
+MODES = {
+    "legacy multipart": ("/legacy/detect-objects", "multipart"),
+    "streaming multipart": ("/detect-objects", "multipart"),
+    "legacy base64": ("/legacy/detect-objects-base64", "base64"),
+    "streaming base64": ("/detect-objects-base64", "base64")
+}
+
+
+def serve(port: int, latency: float):
+    """Run the API with the fake LLM and the legacy intake routes"""
+    from fastapi import File, UploadFile
+    from fastapi.responses import JSONResponse
+    
+    import main
+    from ai_service import GeminiAIService
+    from benchmarks.fake_llm import FakeLLM
+    from detection_service import IngredientDetectionService
+    
+    main.detection_service = IngredientDetectionService(ai_service=GeminiAIService(llm=FakeLLM(latency)))
+    service = main.detection_service
+    
+    @main.app.post("/legacy/detect-objects")
+    async def legacy_multipart(file: UploadFile = File(...)):
+        image_bytes = await file.read()
+        return JSONResponse(content=await service.process_image_async(image_bytes, "none"))
+    
+    @main.app.post("/legacy/detect-objects-base64")
+    async def legacy_base64(image_data: dict):
+        base64_string = image_data["image"]
+        if base64_string.startswith('data:image'):
+            base64_string = base64_string.split(',')[1]
+        image_bytes = base64.b64decode(base64_string)
+        return JSONResponse(content=await service.process_image_async(image_bytes, "none"))
+    
+    @main.app.post("/bench/reset-peak")
+    async def reset_peak():
+        # Writing 5 to clear_refs resets VmHWM to the current resident size
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+        return memory()
+    
+    @main.app.get("/bench/memory")
+    async def read_memory():
+        return memory()
+    
+    import uvicorn
+    uvicorn.run(main.app, host="127.0.0.1", port=port, log_level="warning")
+
+
+def memory() -> dict:
+    """Current and peak resident memory of this process in MB"""
+    values = {}
+    with open("/proc/self/status") as f:
+        for line in f:
+            key, _, value = line.partition(":")
+            if key in ("VmRSS", "VmHWM"):
+                values[key] = int(value.split()[0]) / 1024
+    return values
+
+
+def large_jpeg(megabytes: float) -> bytes:
+    """Noisy JPEG of roughly the requested size (noise barely compresses)"""
+    rng = np.random.default_rng(0)
+    side = int(np.sqrt(megabytes * 1024 * 1024 / 1.6))
+    img = rng.integers(0, 255, size=(side * 3 // 4, side * 4 // 3, 3), dtype=np.uint8)
+    return cv2.imencode('.jpg', img, [cv2.IMWRITE_JPEG_QUALITY, 97])[1].tobytes()
+
+
+def start_server(port: int, latency: float) -> subprocess.Popen:
+    """Start a server process and wait until it answers"""
+    process = subprocess.Popen(
+        [sys.executable, "-m", "benchmarks.bench_upload_intake", "--serve", "--port", str(port),
+         "--latency", str(latency)],
+        env={**os.environ, "TILING_ENABLED": "False"}, stdout=subprocess.DEVNULL
+    )
+    for _ in range(300):
+        try:
+            httpx.get(f"http://127.0.0.1:{port}/bench/memory", timeout=1)
+            return process
+        except httpx.HTTPError:
+            time.sleep(0.1)
+    process.kill()
+    raise RuntimeError("Server did not start")
+
+
+def post(client: httpx.Client, path: str, kind: str, image_bytes: bytes, body: bytes) -> int:
+    """Send one upload and return the status code"""
+    if kind == "multipart":
+        response = client.post(path + "?processed_image=none",
+                               files={"file": ("photo.jpg", image_bytes, "image/jpeg")})
+    else:
+        response = client.post(path + "?processed_image=none", content=body,
+                               headers={"content-type": "application/json"})
+    return response.status_code
+
+
+def run_mode(name: str, image_bytes: bytes, body: bytes, args, port: int) -> tuple:
+    """Peak memory above idle (MB), wall time and status codes for one mode"""
+    path, kind = MODES[name]
+    process = start_server(port, args.latency)
+    base = f"http://127.0.0.1:{port}"
+    try:
+        with httpx.Client(base_url=base, timeout=120) as client:
+            # Warm up code paths and allocator arenas with one request, then reset the peak
+            post(client, path, kind, image_bytes, body)
+            idle = client.post("/bench/reset-peak").json()["VmRSS"]
+            start = time.perf_counter()
+            with ThreadPoolExecutor(args.concurrency) as pool:
+                statuses = list(pool.map(lambda _: post(client, path, kind, image_bytes, body),
+                                         range(args.requests)))
+            elapsed = time.perf_counter() - start
+            peak = client.get("/bench/memory").json()["VmHWM"]
+    finally:
+        process.terminate()
+        process.wait()
+    return peak - idle, elapsed, sorted(set(statuses))
+
+
+def oversize_rejection(image_bytes: bytes, args, port: int) -> float:
+    """Milliseconds until a base64 upload decoding past INTAKE_MAX_BYTES gets its 413"""
+    from config import INTAKE_MAX_BYTES
+    
+    process = start_server(port, args.latency)
+    try:
+        # A real JPEG header followed by enough base64 to cross the cap
+        unit = base64.b64encode(image_bytes[:len(image_bytes) // 3 * 3])
+        repeats = INTAKE_MAX_BYTES * 4 // 3 // len(unit) + 1
+        payload = b'{"image": "' + unit * repeats + b'"}'
+        
+        def chunks():
+            # No Content-Length: the server has to count the bytes as they arrive
+            for offset in range(0, len(payload), 1024 * 1024):
+                yield payload[offset:offset + 1024 * 1024]
+        
+        with httpx.Client(timeout=120) as client:
+            start = time.perf_counter()
+            try:
+                status = client.post(f"http://127.0.0.1:{port}/detect-objects-base64", content=chunks(),
+                                     headers={"content-type": "application/json"}).status_code
+            except httpx.HTTPError:
+                status = "connection closed"
+            elapsed = (time.perf_counter() - start) * 1000
+    finally:
+        process.terminate()
+        process.wait()
+    print(f"Oversize chunked base64 upload ({len(payload) / 1e6:.0f} MB): {status} after {elapsed:.0f} ms")
+    return elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--megabytes", type=float, default=20)
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--requests", type=int, default=16)
+    parser.add_argument("--latency", type=float, default=0.5, help="Fake LLM latency per call (s)")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--serve", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    
+    if args.serve:
+        serve(args.port, args.latency)
+        return
+    
+    image_bytes = large_jpeg(args.megabytes)
+    body = b'{"image": "data:image/jpeg;base64,' + base64.b64encode(image_bytes) + b'"}'
+    print(f"Upload: {len(image_bytes) / 1e6:.1f} MB JPEG ({len(body) / 1e6:.1f} MB as base64 JSON), "
+          f"{args.requests} requests, {args.concurrency} concurrent")
+    print(f"{'mode':<20} {'peak MB over idle':>18} {'per upload MB':>14} {'wall s':>7} {'status':>8}")
+    for name in MODES:
+        peak, elapsed, statuses = run_mode(name, image_bytes, body, args, args.port)
+        print(f"{name:<20} {peak:>18.0f} {peak / args.concurrency:>14.1f} {elapsed:>7.2f} "
+              f"{','.join(map(str, statuses)):>8}")
+    oversize_rejection(image_bytes, args, args.port)
+
+
+if __name__ == "__main__":
+    main()
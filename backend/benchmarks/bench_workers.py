@@ -0,0 +1,146 @@
+"""
+Throughput benchmark: requests/sec vs number of pre-forked server workers
+
+For each configuration a fresh serve.py launcher (preloaded app, fake LLM,
+result cache off) is started and loaded with concurrent /detect-objects
+uploads of a synthetic photo for a fixed time. Each configuration is a
+number of server workers and, optionally, CPU_PROCESS_WORKERS processes per
+worker for the decode/resize and encode stages (e.g. "1", "4", "1x2").
+Also reports how much of each worker's memory is still shared with the
+preloaded parent (Pss vs Rss).
+
+Usage (from backend/):
+    python -m benchmarks.bench_workers --configs 1 2 4 1x2 --seconds 15 --latency 0.2
+"""
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import threading
+import time
+
+os.environ.setdefault("GOOGLE_API_KEY", "offline-benchmark")
+
+import httpx
+import numpy as np
+
+from benchmarks.bench_image_upload import synthetic_photo
+
+
+def serve(port: int, workers: int, latency: float):
+    """Preload the app, swap Gemini for the fake LLM and run the pre-fork launcher"""
+    import main
+    import serve as launcher
+    from ai_service import GeminiAIService
+    from benchmarks.fake_llm import FakeLLM
+    
+    app = launcher.preload()
+    service = main.detection_service
+    service.ai_service = GeminiAIService(llm=FakeLLM(latency))
+    # Every request uploads the same photo; measure the pipeline, not the result cache
+    service.result_cache = None
+    launcher.serve(app, "127.0.0.1", port, workers)
+
+
+def worker_memory(parent_pid: int) -> tuple:
+    """Mean Rss and Pss (MB) of the launcher's worker processes"""
+    with open(f"/proc/{parent_pid}/task/{parent_pid}/children") as f:
+        children = f.read().split()
+    rss, pss = [], []
+    for pid in children:
+        values = {}
+        with open(f"/proc/{pid}/smaps_rollup") as f:
+            for line in f:
+                key, _, value = line.partition(":")
+                if key in ("Rss", "Pss"):
+                    values[key] = int(value.split()[0]) / 1024
+        rss.append(values["Rss"])
+        pss.append(values["Pss"])
+    return statistics.mean(rss), statistics.mean(pss)
+
+
+def run_config(config: str, image_bytes: bytes, args) -> dict:
+    """Load one launcher configuration and return its throughput and latency"""
+    workers, _, processes = config.partition("x")
+    env = {**os.environ, "CPU_PROCESS_WORKERS": processes or "0", "TILING_ENABLED": "False"}
+    process = subprocess.Popen(
+        [sys.executable, "-m", "benchmarks.bench_workers", "--serve", "--workers", workers,
+         "--port", str(args.port), "--latency", str(args.latency)],
+        env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+    )
+    url = f"http://127.0.0.1:{args.port}/detect-objects?processed_image=none"
+    try:
+        for _ in range(300):
+            try:
+                httpx.get(f"http://127.0.0.1:{args.port}/health", timeout=1)
+                break
+            except httpx.HTTPError:
+                time.sleep(0.1)
+        
+        latencies, errors = [], 0
+        lock = threading.Lock()
+        deadline = time.perf_counter() + args.warmup + args.seconds
+        
+        def client():
+            nonlocal errors
+            with httpx.Client(timeout=60) as session:
+                while time.perf_counter() < deadline:
+                    start = time.perf_counter()
+                    status = session.post(url, files={"file": ("photo.jpg", image_bytes, "image/jpeg")}).status_code
+                    elapsed = time.perf_counter() - start
+                    # Requests finishing during warm-up (pool start, first imports) are not counted
+                    if deadline - args.seconds <= time.perf_counter():
+                        with lock:
+                            latencies.append(elapsed)
+                            errors += status != 200
+        
+        threads = [threading.Thread(target=client) for _ in range(args.concurrency)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        rss, pss = worker_memory(process.pid)
+    finally:
+        process.terminate()
+        process.wait()
+    return {
+        "rps": len(latencies) / args.seconds,
+        "p50": statistics.median(latencies) * 1000,
+        "p95": float(np.percentile(latencies, 95)) * 1000,
+        "errors": errors,
+        "rss": rss,
+        "pss": pss
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--configs", nargs="+", default=["1", "2", "4", "1x2"],
+                        help="WORKERS or WORKERSxCPU_PROCESS_WORKERS")
+    parser.add_argument("--megapixels", type=float, default=12)
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--seconds", type=float, default=15)
+    parser.add_argument("--warmup", type=float, default=3)
+    parser.add_argument("--latency", type=float, default=0.2, help="Fake LLM latency per call (s)")
+    parser.add_argument("--port", type=int, default=8766)
+    parser.add_argument("--serve", action="store_true", help=argparse.SUPPRESS)
+    parser.add_argument("--workers", type=int, default=1, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    
+    if args.serve:
+        serve(args.port, args.workers, args.latency)
+        return
+    
+    image_bytes = synthetic_photo(args.megapixels, np.random.default_rng(0))
+    print(f"{os.cpu_count()} CPUs, {len(image_bytes) / 1e6:.1f} MB photo, {args.concurrency} clients, "
+          f"fake LLM {args.latency * 1000:.0f} ms")
+    print(f"{'config':<8} {'req/s':>7} {'p50 ms':>8} {'p95 ms':>8} {'errors':>7} {'worker Rss MB':>14} {'Pss MB':>7}")
+    for config in args.configs:
+        stats = run_config(config, image_bytes, args)
+        print(f"{config:<8} {stats['rps']:>7.1f} {stats['p50']:>8.0f} {stats['p95']:>8.0f} {stats['errors']:>7} "
+              f"{stats['rss']:>14.0f} {stats['pss']:>7.0f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,111 @@
+"""
+Local fake LLM that mimics the llama_index chat interface used by GeminiAIService
+"""
+import asyncio
+import random
+import time
+from types import SimpleNamespace
+from typing import Any, AsyncIterator, List, Optional
+
+DEFAULT_RESPONSE = """[120, 200, 280, 350, tomate]
+[300, 150, 450, 320, lechuga]
+[180, 400, 320, 580, pollo]
+[50, 100, 180, 250, cebolla]
+[400, 200, 500, 400, arroz]"""
+
+
+class FakeAPIError(Exception):
+    """Upstream error shaped like google-genai's APIError (HTTP status in .code)"""
+    
+    def __init__(self, code: int):
+        super().__init__(f"{code} fake upstream error")
+        self.code = code
+
+
+class FakeLLM:
+    """Chat LLM stand-in that answers with a canned response after a fixed latency"""
+    
+    def __init__(self, latency: float = 0.5, response_text: str = DEFAULT_RESPONSE, chunk_size: int = 16,
+                 error_rate: float = 0.0, error_code: int = 503, slow_rate: float = 0.0,
+                 slow_latency: float = 30.0, seed: int = 0, max_concurrency: Optional[int] = None):
+        """
+        Initialize fake LLM
+        
+        The fault settings are plain attributes and can be changed between
+        calls (e.g. an outage followed by a recovery).
+        
+        Args:
+            latency: Simulated round-trip time in seconds
+            response_text: Text returned for every chat call
+            chunk_size: Characters per chunk for streaming chat
+            error_rate: Fraction of calls that fail with FakeAPIError(error_code) after the latency
+            error_code: HTTP status of the injected errors
+            slow_rate: Fraction of calls that take slow_latency instead of latency
+            slow_latency: Round-trip time of the slow calls
+            seed: Random seed of the fault injection
+            max_concurrency: Async calls served at once (an upstream with limited
+                             capacity: further calls queue); None for unlimited
+        """
+        self.latency = latency
+        self.response_text = response_text
+        self.chunk_size = chunk_size
+        self.error_rate = error_rate
+        self.error_code = error_code
+        self.slow_rate = slow_rate
+        self.slow_latency = slow_latency
+        self.calls = 0
+        self.failures = 0
+        self._random = random.Random(seed)
+        self._slots = asyncio.Semaphore(max_concurrency) if max_concurrency else None
+    
+    def _fault(self) -> tuple:
+        """Latency of the next call and whether it fails"""
+        latency = self.slow_latency if self._random.random() < self.slow_rate else self.latency
+        return latency, self._random.random() < self.error_rate
+    
+    def _fail(self) -> None:
+        self.failures += 1
+        raise FakeAPIError(self.error_code)
+    
+    def _response(self) -> Any:
+        """Build a response object shaped like llama_index's ChatResponse"""
+        self.calls += 1
+        return SimpleNamespace(message=SimpleNamespace(content=self.response_text))
+    
+    def chat(self, messages: List[Any], **kwargs) -> Any:
+        """Blocking chat call"""
+        latency, fails = self._fault()
+        time.sleep(latency)
+        if fails:
+            self._fail()
+        return self._response()
+    
+    async def achat(self, messages: List[Any], **kwargs) -> Any:
+        """Async chat call"""
+        latency, fails = self._fault()
+        if self._slots is not None:
+            async with self._slots:
+                await asyncio.sleep(latency)
+        else:
+            await asyncio.sleep(latency)
+        if fails:
+            self._fail()
+        return self._response()
+    
+    async def astream_chat(self, messages: List[Any], **kwargs) -> AsyncIterator[Any]:
+        """Async streaming chat call; the latency is spread evenly over the chunks (errors fail the call)"""
+        latency, fails = self._fault()
+        if fails:
+            await asyncio.sleep(latency)
+            self._fail()
+        text = self.response_text
+        chunks = [text[i:i + self.chunk_size] for i in range(0, len(text), self.chunk_size)]
+        delay = latency / max(len(chunks), 1)
+        
+        async def generate():
+            for chunk in chunks:
+                await asyncio.sleep(delay)
+                yield SimpleNamespace(delta=chunk)
+            self._response()
+        
+        return generate()
@@ -0,0 +1,214 @@
+"""
+Vectorized bounding box operations: IoU matrices, non-maximum suppression and box merging
+
+Boxes are arrays of shape (N, 4) in [x1, y1, x2, y2] order.
+"""
+from typing import List, Optional, Sequence, Tuple
+
+import numpy as np
+
+
+def as_boxes(boxes: Sequence[Sequence[float]]) -> np.ndarray:
+    """Convert a list of [x1, y1, x2, y2] boxes to a float64 (N, 4) array"""
+    return np.asarray(boxes, dtype=np.float64).reshape(-1, 4)
+
+
+def box_areas(boxes: np.ndarray) -> np.ndarray:
+    """Area of each box (zero for degenerate boxes)"""
+    return np.clip(boxes[:, 2] - boxes[:, 0], 0, None) * np.clip(boxes[:, 3] - boxes[:, 1], 0, None)
+
+
+def _intersections(boxes_a: np.ndarray, boxes_b: np.ndarray) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Intersection areas of every pair of boxes
+    
+    Computed in float32 with in-place updates: pixel coordinates are exact in
+    float32 and the (N, M) temporaries dominate the cost for large N.
+    
+    Returns:
+        Tuple of ((N, M) float32 intersection areas, areas of boxes_a, areas of boxes_b)
+    """
+    boxes_a = boxes_a.astype(np.float32, copy=False)
+    boxes_b = boxes_b.astype(np.float32, copy=False)
+    
+    intersection = np.minimum(boxes_a[:, 2, None], boxes_b[None, :, 2])
+    intersection -= np.maximum(boxes_a[:, 0, None], boxes_b[None, :, 0])
+    np.maximum(intersection, 0, out=intersection)
+    height = np.minimum(boxes_a[:, 3, None], boxes_b[None, :, 3])
+    height -= np.maximum(boxes_a[:, 1, None], boxes_b[None, :, 1])
+    np.maximum(height, 0, out=height)
+    intersection *= height
+    return intersection, box_areas(boxes_a), box_areas(boxes_b)
+
+
+def _safe_ratio(numerator: np.ndarray, denominator: np.ndarray) -> np.ndarray:
+    """numerator / denominator in place, 0 where the denominator is empty"""
+    valid = denominator > 0
+    np.divide(numerator, denominator, out=numerator, where=valid)
+    numerator[~valid] = 0
+    return numerator
+
+
+def iou_matrix(boxes_a: np.ndarray, boxes_b: np.ndarray) -> np.ndarray:
+    """
+    Intersection over union of every pair of boxes
+    
+    Args:
+        boxes_a: (N, 4) boxes
+        boxes_b: (M, 4) boxes
+        
+    Returns:
+        (N, M) float32 IoU matrix (0 where the union is empty)
+    """
+    intersection, areas_a, areas_b = _intersections(boxes_a, boxes_b)
+    union = areas_a[:, None] + areas_b[None, :]
+    union -= intersection
+    return _safe_ratio(intersection, union)
+
+
+def ios_matrix(boxes_a: np.ndarray, boxes_b: np.ndarray) -> np.ndarray:
+    """
+    Intersection over the smaller box of every pair of boxes
+    
+    Unlike IoU this is close to 1 when one box is a fragment of the other,
+    e.g. half of an ingredient cut at a tile seam against the whole one.
+    
+    Args:
+        boxes_a: (N, 4) boxes
+        boxes_b: (M, 4) boxes
+        
+    Returns:
+        (N, M) float32 matrix (0 where either box is empty)
+    """
+    intersection, areas_a, areas_b = _intersections(boxes_a, boxes_b)
+    return _safe_ratio(intersection, np.minimum(areas_a[:, None], areas_b[None, :]))
+
+
+def max_iou(box: Sequence[float], boxes: np.ndarray) -> float:
+    """Largest IoU between one box and a set of boxes (0 if the set is empty)"""
+    if len(boxes) == 0:
+        return 0.0
+    return float(iou_matrix(as_boxes(box), boxes).max())
+
+
+def _same_class(labels: Optional[Sequence[str]], count: int) -> np.ndarray:
+    """(N, N) mask of pairs sharing a label; all True when labels is None"""
+    if labels is None:
+        return np.ones((count, count), dtype=bool)
+    codes = np.unique(np.asarray(labels), return_inverse=True)[1]
+    return codes[:, None] == codes[None, :]
+
+
+def nms(boxes: np.ndarray, scores: np.ndarray, iou_threshold: float,
+        labels: Optional[Sequence[str]] = None) -> np.ndarray:
+    """
+    Greedy non-maximum suppression
+    
+    Boxes are visited from highest to lowest score; each kept box suppresses
+    the remaining boxes overlapping it by more than iou_threshold. With
+    labels the suppression is class-aware (only boxes with the same label
+    suppress each other), otherwise it is class-agnostic.
+    
+    Args:
+        boxes: (N, 4) boxes
+        scores: (N,) scores
+        iou_threshold: IoU above which a lower-scored box is suppressed
+        labels: Optional label per box for class-aware NMS
+        
+    Returns:
+        Indices of kept boxes, highest score first
+    """
+    if len(boxes) == 0:
+        return np.zeros(0, dtype=np.int64)
+    
+    order = np.argsort(-np.asarray(scores), kind='stable')
+    overlaps = (iou_matrix(boxes, boxes) > iou_threshold) & _same_class(labels, len(boxes))
+    overlaps = overlaps[np.ix_(order, order)]
+    
+    suppressed = np.zeros(len(boxes), dtype=bool)
+    keep = []
+    for rank in range(len(order)):
+        if suppressed[rank]:
+            continue
+        keep.append(order[rank])
+        suppressed |= overlaps[rank]
+    return np.array(keep, dtype=np.int64)
+
+
+def merge_boxes(boxes: np.ndarray, scores: np.ndarray, labels: Sequence[str],
+                iou_threshold: float) -> List[Tuple[int, List[int], np.ndarray]]:
+    """
+    Merge overlapping boxes that share a label
+    
+    Like class-aware NMS, but instead of dropping the suppressed boxes each
+    cluster is fused into one box: the score-weighted mean of its members.
+    
+    Args:
+        boxes: (N, 4) boxes
+        scores: (N,) scores
+        labels: Label per box
+        iou_threshold: IoU above which same-label boxes are merged
+        
+    Returns:
+        List of (representative index, member indices, merged box), one per
+        cluster, highest score first. The representative is the top-scored member.
+    """
+    if len(boxes) == 0:
+        return []
+    
+    scores = np.asarray(scores, dtype=np.float64)
+    order = np.argsort(-scores, kind='stable')
+    overlaps = (iou_matrix(boxes, boxes) > iou_threshold) & _same_class(labels, len(boxes))
+    np.fill_diagonal(overlaps, True)
+    
+    assigned = np.zeros(len(boxes), dtype=bool)
+    clusters = []
+    for index in order:
+        if assigned[index]:
+            continue
+        members = np.flatnonzero(overlaps[index] & ~assigned)
+        assigned[members] = True
+        weights = np.maximum(scores[members], 1e-9)
+        merged = (boxes[members] * weights[:, None]).sum(axis=0) / weights.sum()
+        clusters.append((int(index), members.tolist(), merged))
+    return clusters
+
+
+def fuse_fragments(boxes: np.ndarray, labels: Sequence[str],
+                   ios_threshold: float) -> List[Tuple[List[int], np.ndarray]]:
+    """
+    Fuse same-label boxes that are fragments of one object
+    
+    Boxes are visited from largest to smallest; each unassigned box absorbs
+    the unassigned same-label boxes whose intersection over the smaller box
+    exceeds ios_threshold, and the cluster becomes their enclosing box. Used
+    at tile seams, where an ingredient may be cut in two or also be seen
+    whole by another view.
+    
+    Args:
+        boxes: (N, 4) boxes
+        labels: Label per box
+        ios_threshold: Intersection over smaller box above which boxes are fused
+        
+    Returns:
+        List of (member indices, enclosing box), one per cluster, largest first
+    """
+    if len(boxes) == 0:
+        return []
+    
+    boxes = np.asarray(boxes, dtype=np.float64)
+    order = np.argsort(-box_areas(boxes), kind='stable')
+    overlaps = (ios_matrix(boxes, boxes) > ios_threshold) & _same_class(labels, len(boxes))
+    np.fill_diagonal(overlaps, True)
+    
+    assigned = np.zeros(len(boxes), dtype=bool)
+    clusters = []
+    for index in order:
+        if assigned[index]:
+            continue
+        members = np.flatnonzero(overlaps[index] & ~assigned)
+        assigned[members] = True
+        member_boxes = boxes[members]
+        fused = np.concatenate([member_boxes[:, :2].min(axis=0), member_boxes[:, 2:].max(axis=0)])
+        clusters.append((members.tolist(), fused))
+    return clusters
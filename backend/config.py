@@ -8,15 +8,15 @@ from dotenv import load_dotenv
 load_dotenv()
 
 # API Configuration
+# Without GOOGLE_API_KEY the server still starts; only Gemini detection calls fail (503)
 GOOGLE_API_KEY = os.getenv("GOOGLE_API_KEY")
-if not GOOGLE_API_KEY:
-    raise ValueError(
-        "GOOGLE_API_KEY no encontrada. "
-        "Por favor configura tu archivo .env basándote en .env.example"
-    )
+GEMINI_MODEL = os.getenv("GEMINI_MODEL", "gemini-2.0-flash")
+# Send one short request at startup so the first detection does not pay for the
+# connection setup (costs one tiny Gemini call per worker start)
+GEMINI_WARMUP = os.getenv("GEMINI_WARMUP", "False").lower() == "true"
 
 # Image Processing Configuration
-TARGET_IMAGE_SIZE = 800
+TARGET_IMAGE_SIZE = int(os.getenv("TARGET_IMAGE_SIZE", "800"))
 BBOX_OFFSET_X = 70  # Píxeles hacia la derecha
 BBOX_OFFSET_Y = 20  # Píxeles hacia abajo
 
@@ -27,6 +27,94 @@ APP_VERSION = "2.0.0"
 HOST = os.getenv("HOST", "0.0.0.0")
 PORT = int(os.getenv("PORT", "8000"))
 
+# Upload encoding for the AI service: format, byte budget and the qualities tried;
+# the highest quality whose encoding fits UPLOAD_MAX_BYTES is sent
+UPLOAD_IMAGE_FORMATS = ("jpeg", "webp")
+UPLOAD_IMAGE_FORMAT = os.getenv("UPLOAD_IMAGE_FORMAT", "jpeg").lower()
+if UPLOAD_IMAGE_FORMAT not in UPLOAD_IMAGE_FORMATS:
+    raise ValueError(
+        f"UPLOAD_IMAGE_FORMAT inválido: {UPLOAD_IMAGE_FORMAT}. "
+        f"Valores permitidos: {', '.join(UPLOAD_IMAGE_FORMATS)}"
+    )
+UPLOAD_MAX_BYTES = int(os.getenv("UPLOAD_MAX_BYTES", "150000"))
+UPLOAD_QUALITY_LADDER = tuple(
+    sorted((int(q) for q in os.getenv("UPLOAD_QUALITY_LADDER", "90,80,70,60,50").split(",")), reverse=True)
+)
+
+# Upload intake: hard caps on image bytes and decoded pixels, streaming chunk size and
+# the bytes received before the header (format, dimensions) is sniffed
+INTAKE_MAX_BYTES = int(os.getenv("INTAKE_MAX_BYTES", str(25 * 1024 * 1024)))
+INTAKE_MAX_PIXELS = int(os.getenv("INTAKE_MAX_PIXELS", "100000000"))
+INTAKE_CHUNK_SIZE = int(os.getenv("INTAKE_CHUNK_SIZE", str(256 * 1024)))
+INTAKE_SNIFF_BYTES = int(os.getenv("INTAKE_SNIFF_BYTES", str(64 * 1024)))
+INTAKE_IMAGE_FORMATS = ("JPEG", "MPO", "PNG", "WEBP", "BMP", "TIFF")  # Formatos de Pillow aceptados
+
+# Async pipeline: max threads for CPU-bound OpenCV stages (decode, resize, draw, encode)
+IMAGE_PROCESSING_WORKERS = int(os.getenv("IMAGE_PROCESSING_WORKERS", "4"))
+# Processes per server worker for the decode/resize and upload encode stages (0 = use the threads)
+CPU_PROCESS_WORKERS = int(os.getenv("CPU_PROCESS_WORKERS", "0"))
+
+# Production launcher (serve.py): pre-forked server processes sharing the preloaded app
+WORKERS = int(os.getenv("WORKERS", str(os.cpu_count() or 1)))
+WORKER_TIMEOUT_SECONDS = float(os.getenv("WORKER_TIMEOUT_SECONDS", "30"))  # Espera al apagar
+
+# Ask Gemini for JSON matching a response schema instead of free text
+STRUCTURED_OUTPUT_ENABLED = os.getenv("STRUCTURED_OUTPUT_ENABLED", "True").lower() == "true"
+
+# Nutrition database: CSV source and the memory-mapped binary built from it
+NUTRITION_CSV_PATH = os.getenv(
+    "NUTRITION_CSV_PATH", os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "nutrition.csv")
+)
+NUTRITION_DB_PATH = os.getenv("NUTRITION_DB_PATH", os.path.splitext(NUTRITION_CSV_PATH)[0] + ".bin")
+
+# Nutrition lookup: minimum word similarity (trigram Dice, 0-1) and memoized labels
+NUTRITION_MATCH_THRESHOLD = float(os.getenv("NUTRITION_MATCH_THRESHOLD", "0.6"))
+NUTRITION_LOOKUP_CACHE_SIZE = int(os.getenv("NUTRITION_LOOKUP_CACHE_SIZE", "4096"))
+
+# Portion estimate: grams of food covering the whole photo, scaled by box area share and
+# the food's density prior (data/nutrition.csv "density" column), clipped to [min, max]
+PORTION_FULL_FRAME_GRAMS = float(os.getenv("PORTION_FULL_FRAME_GRAMS", "500"))
+PORTION_MIN_GRAMS = float(os.getenv("PORTION_MIN_GRAMS", "5"))
+PORTION_MAX_GRAMS = float(os.getenv("PORTION_MAX_GRAMS", "600"))
+PORTION_DEFAULT_DENSITY = float(os.getenv("PORTION_DEFAULT_DENSITY", "1.0"))
+
+# Detection result cache (keyed by resized image content + prompt version)
+RESULT_CACHE_ENABLED = os.getenv("RESULT_CACHE_ENABLED", "True").lower() == "true"
+RESULT_CACHE_MAX_ENTRIES = int(os.getenv("RESULT_CACHE_MAX_ENTRIES", "256"))
+RESULT_CACHE_TTL_SECONDS = float(os.getenv("RESULT_CACHE_TTL_SECONDS", "3600"))
+RESULT_CACHE_SQLITE_PATH = os.getenv("RESULT_CACHE_SQLITE_PATH", "")  # Vacío = sin caché en disco
+RESULT_CACHE_SQLITE_MAX_ENTRIES = int(os.getenv("RESULT_CACHE_SQLITE_MAX_ENTRIES", "10000"))
+
+# Near-duplicate reuse: perceptual hash (dHash) within this Hamming distance
+NEAR_DUPLICATE_ENABLED = os.getenv("NEAR_DUPLICATE_ENABLED", "True").lower() == "true"
+NEAR_DUPLICATE_MAX_DISTANCE = int(os.getenv("NEAR_DUPLICATE_MAX_DISTANCE", "6"))
+# Hashes kept in the index (0 = as many as the cache tiers hold results); a hash is
+# dropped as soon as its result leaves every tier
+NEAR_DUPLICATE_MAX_ENTRIES = int(os.getenv("NEAR_DUPLICATE_MAX_ENTRIES", "0"))
+
+# Request coalescing: concurrent requests with identical image bytes (and processed_image
+# mode) share one pipeline run and its Gemini calls, before the result cache can be filled
+COALESCING_ENABLED = os.getenv("COALESCING_ENABLED", "True").lower() == "true"
+
+# processed_image response mode: none | inline (base64 JPEG) | url (/images/{id})
+PROCESSED_IMAGE_MODES = ("none", "inline", "url")
+PROCESSED_IMAGE_DEFAULT_MODE = "inline"
+ANNOTATED_IMAGE_MAX_ENTRIES = int(os.getenv("ANNOTATED_IMAGE_MAX_ENTRIES", "256"))
+ANNOTATED_IMAGE_TTL_SECONDS = float(os.getenv("ANNOTATED_IMAGE_TTL_SECONDS", "300"))
+# SQLite file holding the url-mode images so every worker can serve them
+# (serve.py sets the variable to a temporary file when it is empty and there are several workers)
+ANNOTATED_IMAGE_SQLITE_PATH = os.getenv("ANNOTATED_IMAGE_SQLITE_PATH", "")
+
+# Batch detection (/detect-objects/batch)
+BATCH_MAX_IMAGES = int(os.getenv("BATCH_MAX_IMAGES", "500"))
+# Total bytes of a batch's images (archive entries counted uncompressed); the
+# request body is capped at this plus multipart overhead
+BATCH_MAX_BYTES = int(os.getenv("BATCH_MAX_BYTES", str(256 * 1024 * 1024)))
+BATCH_DEFAULT_CONCURRENCY = int(os.getenv("BATCH_DEFAULT_CONCURRENCY", "4"))
+BATCH_MAX_CONCURRENCY = int(os.getenv("BATCH_MAX_CONCURRENCY", "16"))
+BATCH_DEFAULT_DEADLINE_SECONDS = float(os.getenv("BATCH_DEFAULT_DEADLINE_SECONDS", "300"))
+BATCH_MAX_DEADLINE_SECONDS = float(os.getenv("BATCH_MAX_DEADLINE_SECONDS", "3600"))
+
 # Debug mode
 DEBUG = os.getenv("DEBUG", "False").lower() == "true"
 
@@ -43,6 +131,126 @@ MIN_INGREDIENTS_THRESHOLD = 3
 CONFIDENCE_BASE = 0.75
 CONFIDENCE_VARIATION = 0.20
 ALTERNATIVE_CONFIDENCE_BASE = 0.70
+# IoU thresholds: alternative-prompt boxes overlapping a primary box are skipped;
+# same-label boxes are merged; different-label boxes that almost coincide are suppressed
+OVERLAP_IOU_THRESHOLD = float(os.getenv("OVERLAP_IOU_THRESHOLD", "0.3"))
+DEDUP_SAME_LABEL_IOU = float(os.getenv("DEDUP_SAME_LABEL_IOU", "0.5"))
+DEDUP_CROSS_LABEL_IOU = float(os.getenv("DEDUP_CROSS_LABEL_IOU", "0.7"))
+
+# Alternative prompt strategy:
+#   lazy       - send the alternative prompt only when the primary misses MIN_INGREDIENTS_THRESHOLD
+#   concurrent - send both prompts at once; the alternative is only consumed if needed
+#   hedged     - start the alternative once the primary exceeds HEDGE_DELAY_SECONDS
+DETECTION_STRATEGIES = ("lazy", "concurrent", "hedged")
+DETECTION_STRATEGY = os.getenv("DETECTION_STRATEGY", "lazy").lower()
+if DETECTION_STRATEGY not in DETECTION_STRATEGIES:
+    raise ValueError(
+        f"DETECTION_STRATEGY inválida: {DETECTION_STRATEGY}. "
+        f"Valores permitidos: {', '.join(DETECTION_STRATEGIES)}"
+    )
+HEDGE_DELAY_SECONDS = float(os.getenv("HEDGE_DELAY_SECONDS", "2.0"))
+
+# Detection backend routing:
+#   gemini      - every request goes to Gemini
+#   local       - local CPU detector only (ONNX model, no network)
+#   replay      - recorded responses (REPLAY_FIXTURES_PATH), deterministic
+#   local_first - local detector; Gemini only when its mean score is below LOCAL_MIN_CONFIDENCE
+#   race        - local detector and Gemini at once; the first usable answer wins
+DETECTION_BACKENDS = ("gemini", "local", "replay", "local_first", "race")
+DETECTION_BACKEND = os.getenv("DETECTION_BACKEND", "gemini").lower()
+if DETECTION_BACKEND not in DETECTION_BACKENDS:
+    raise ValueError(
+        f"DETECTION_BACKEND inválido: {DETECTION_BACKEND}. "
+        f"Valores permitidos: {', '.join(DETECTION_BACKENDS)}"
+    )
+LOCAL_MIN_CONFIDENCE = float(os.getenv("LOCAL_MIN_CONFIDENCE", "0.5"))
+
+# Local detector: YOLO-style ONNX export (v5 or v8 output layout) run with ONNX Runtime
+# when installed, otherwise OpenCV DNN; labels file has one class name per line
+LOCAL_DETECTOR_MODEL_PATH = os.getenv("LOCAL_DETECTOR_MODEL_PATH", "")
+LOCAL_DETECTOR_LABELS_PATH = os.getenv("LOCAL_DETECTOR_LABELS_PATH", "")
+LOCAL_DETECTOR_INPUT_SIZE = int(os.getenv("LOCAL_DETECTOR_INPUT_SIZE", "640"))
+LOCAL_DETECTOR_SCORE_THRESHOLD = float(os.getenv("LOCAL_DETECTOR_SCORE_THRESHOLD", "0.25"))
+LOCAL_DETECTOR_NMS_IOU = float(os.getenv("LOCAL_DETECTOR_NMS_IOU", "0.45"))
+
+# Replay backend: JSON file of recorded responses keyed by SHA-256 of the uploaded image,
+# answered after REPLAY_LATENCY_SECONDS ± REPLAY_JITTER_SECONDS (uniform) to mimic Gemini
+REPLAY_FIXTURES_PATH = os.getenv("REPLAY_FIXTURES_PATH", "")
+REPLAY_LATENCY_SECONDS = float(os.getenv("REPLAY_LATENCY_SECONDS", "0"))
+REPLAY_JITTER_SECONDS = float(os.getenv("REPLAY_JITTER_SECONDS", "0"))
+
+# Recording: when set, every response of the configured backend is also written to
+# this fixtures file (same format REPLAY_FIXTURES_PATH reads)
+RECORD_FIXTURES_PATH = os.getenv("RECORD_FIXTURES_PATH", "")
+
+# Gemini call resilience. Every detection request gets REQUEST_DEADLINE_SECONDS,
+# shared by all of its calls (a batch's remaining deadline caps it); each attempt
+# is also capped at LLM_CALL_TIMEOUT_SECONDS. Timeouts, connection errors, 429
+# and 5xx are retried up to LLM_RETRY_MAX_ATTEMPTS attempts in total with full
+# jitter exponential backoff (BASE * 2^n, at most MAX), only while at least
+# LLM_RETRY_MIN_BUDGET_SECONDS of the deadline would remain for the next attempt.
+REQUEST_DEADLINE_SECONDS = float(os.getenv("REQUEST_DEADLINE_SECONDS", "60"))
+LLM_CALL_TIMEOUT_SECONDS = float(os.getenv("LLM_CALL_TIMEOUT_SECONDS", "30"))
+LLM_RETRY_MAX_ATTEMPTS = int(os.getenv("LLM_RETRY_MAX_ATTEMPTS", "3"))
+LLM_RETRY_BASE_DELAY_SECONDS = float(os.getenv("LLM_RETRY_BASE_DELAY_SECONDS", "0.5"))
+LLM_RETRY_MAX_DELAY_SECONDS = float(os.getenv("LLM_RETRY_MAX_DELAY_SECONDS", "8"))
+LLM_RETRY_MIN_BUDGET_SECONDS = float(os.getenv("LLM_RETRY_MIN_BUDGET_SECONDS", "1"))
+# Circuit breaker: after CIRCUIT_FAILURE_THRESHOLD consecutive failed attempts, calls
+# fail at once (503 + Retry-After) for CIRCUIT_RESET_SECONDS; then one probe call
+# is let through and closes the circuit if it succeeds
+CIRCUIT_FAILURE_THRESHOLD = int(os.getenv("CIRCUIT_FAILURE_THRESHOLD", "5"))
+CIRCUIT_RESET_SECONDS = float(os.getenv("CIRCUIT_RESET_SECONDS", "30"))
+
+# Admission control in front of the detection endpoints (limits are per worker).
+# At most ADMISSION_MAX_IN_FLIGHT requests run the pipeline at once, batch-class
+# requests at most ADMISSION_BATCH_MAX_IN_FLIGHT of them (a /detect-objects/batch
+# request counts as its concurrency and runs at most the slots it is granted),
+# so interactive uploads always find room.
+# Waiting requests are admitted interactive first. A request is refused at once
+# with 429 when ADMISSION_MAX_QUEUE requests of its class are already waiting, or
+# with 503 when its estimated wait plus the usual time a request takes exceeds
+# its deadline; both carry Retry-After.
+# The class comes from the API key (X-API-Key in one of the lists below), else
+# the X-Priority header ("interactive" or "batch"), else the endpoint: uploads
+# are interactive, base64 and batch requests are batch.
+ADMISSION_ENABLED = os.getenv("ADMISSION_ENABLED", "True").lower() == "true"
+ADMISSION_MAX_IN_FLIGHT = int(os.getenv("ADMISSION_MAX_IN_FLIGHT", "16"))
+ADMISSION_BATCH_MAX_IN_FLIGHT = int(os.getenv("ADMISSION_BATCH_MAX_IN_FLIGHT", "8"))
+ADMISSION_MAX_QUEUE = int(os.getenv("ADMISSION_MAX_QUEUE", "64"))
+ADMISSION_INTERACTIVE_API_KEYS = [key for key in os.getenv("ADMISSION_INTERACTIVE_API_KEYS", "").split(",") if key]
+ADMISSION_BATCH_API_KEYS = [key for key in os.getenv("ADMISSION_BATCH_API_KEYS", "").split(",") if key]
+if not 0 < ADMISSION_BATCH_MAX_IN_FLIGHT <= ADMISSION_MAX_IN_FLIGHT:
+    raise ValueError(
+        f"ADMISSION_BATCH_MAX_IN_FLIGHT inválido: {ADMISSION_BATCH_MAX_IN_FLIGHT}. "
+        f"Debe estar entre 1 y ADMISSION_MAX_IN_FLIGHT ({ADMISSION_MAX_IN_FLIGHT})"
+    )
+
+# Tiled high-resolution mode: the original image is split into overlapping tiles
+# analysed concurrently next to the whole (resized) image. It kicks in when the
+# whole-image prompt returns TILING_MIN_DETECTIONS or more boxes (crowded plate)
+# and the original is larger than TARGET_IMAGE_SIZE, or, if TILING_MIN_SIDE is
+# set (0 = off), when the longest side reaches it before any call is made. Tile
+# boxes are fused at the seams when their intersection over the smaller box
+# exceeds TILING_SEAM_IOS.
+# Cost: a tiled image takes one Gemini call per tile plus the whole-image call
+# (up to TILING_MAX_TILES + 1, instead of 1-2), so it is off by default. Keep
+# TILING_MIN_SIDE at 0 or well above phone photo sizes (>= 4096): at 2048 every
+# 12 MP photo (4032x3024) would be tiled.
+TILING_ENABLED = os.getenv("TILING_ENABLED", "False").lower() == "true"
+TILING_MIN_SIDE = int(os.getenv("TILING_MIN_SIDE", "0"))
+TILING_MIN_DETECTIONS = int(os.getenv("TILING_MIN_DETECTIONS", "12"))
+TILING_TILE_SIZE = int(os.getenv("TILING_TILE_SIZE", "1024"))
+TILING_OVERLAP = float(os.getenv("TILING_OVERLAP", "0.2"))
+TILING_MAX_TILES = int(os.getenv("TILING_MAX_TILES", "6"))
+TILING_CONCURRENCY = int(os.getenv("TILING_CONCURRENCY", "4"))
+TILING_SEAM_IOS = float(os.getenv("TILING_SEAM_IOS", "0.5"))
+
+# Metrics: per-stage histograms at GET /metrics and a Server-Timing header on every
+# response. With several workers prometheus_client's multiprocess mode keeps each
+# worker's values in METRICS_MULTIPROCESS_DIR so /metrics reports all of them
+# (serve.py picks a temporary directory when this is empty)
+METRICS_ENABLED = os.getenv("METRICS_ENABLED", "True").lower() == "true"
+METRICS_MULTIPROCESS_DIR = os.getenv("METRICS_MULTIPROCESS_DIR", "")
 
 # Non-food items to filter out
 NON_FOOD_ITEMS = {
@@ -0,0 +1,156 @@
+"""
+CPU-bound image stages and the optional process pool that runs them
+
+The stages are module-level functions of plain arguments so they can run in
+a worker process; with CPU_PROCESS_WORKERS = 0 they run on the detection
+service's thread pool instead.
+"""
+import asyncio
+import multiprocessing
+import time
+from concurrent.futures import Executor, ProcessPoolExecutor
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from image_processor import ImageProcessor
+from config import UPLOAD_IMAGE_FORMAT
+from tiling import Tile
+
+
+def prepare_image(image_bytes: bytes, min_side: int,
+                  keep_decoded: bool = False) -> Tuple[Optional[Any], Any, int, int, Dict[str, Any]]:
+    """
+    Decode and resize image for the AI service
+    
+    Args:
+        image_bytes: Raw image bytes
+        min_side: Smallest longest side the decoded image must keep
+        keep_decoded: Return the decoded image too (only tiled mode needs it;
+                      from a worker process it would be pickled back in full)
+        
+    Returns:
+        Tuple of (decoded_image or None, resized_image, image_width, image_height, preparation),
+        where preparation reports sizes and decode/resize timings
+    """
+    start = time.perf_counter()
+    img, reduction = ImageProcessor.decode_reduced(image_bytes, min_side)
+    decoded = time.perf_counter()
+    img_resized, image_width, image_height, orig_width, orig_height = ImageProcessor.resize_image(img)
+    resized = time.perf_counter()
+    
+    preparation = {
+        "input_bytes": len(image_bytes),
+        "decode_reduction": reduction,
+        "decoded_size": {"width": orig_width, "height": orig_height},
+        "timings_ms": {
+            "decode": round((decoded - start) * 1000, 1),
+            "resize": round((resized - decoded) * 1000, 1)
+        }
+    }
+    return img if keep_decoded else None, img_resized, image_width, image_height, preparation
+
+
+def encode_upload(img_resized: Any) -> Tuple[bytes, Dict[str, Any]]:
+    """
+    Encode the resized image for the AI service
+    
+    Args:
+        img_resized: Resized OpenCV image
+        
+    Returns:
+        Tuple of (encoded bytes, encoding report with size, format, quality and time)
+    """
+    start = time.perf_counter()
+    image_data, quality = ImageProcessor.encode_for_upload(img_resized)
+    return image_data, {
+        "encode_ms": round((time.perf_counter() - start) * 1000, 1),
+        "upload_bytes": len(image_data),
+        "upload_format": UPLOAD_IMAGE_FORMAT,
+        "upload_quality": quality
+    }
+
+
+def encode_tiles(image_bytes: bytes, min_side: int, tiles: List[Tile],
+                 img: Optional[Any] = None) -> Tuple[List[Tuple[bytes, int, int]], float]:
+    """
+    Crop, downscale to TARGET_IMAGE_SIZE and encode tiles of the decoded image for upload
+    
+    Without img the image bytes are decoded again at min_side, which gives
+    the image prepare_image reported and the tiles were planned on; in a
+    worker process only the tile uploads then cross the process boundary.
+    
+    Args:
+        image_bytes: Raw image bytes
+        min_side: Smallest longest side passed to prepare_image
+        tiles: Tiles to encode, in decoded image pixels
+        img: Decoded image, when the caller still holds it
+        
+    Returns:
+        Tuple of (list of (encoded bytes, width, height) as sent to the AI service, seconds taken)
+    """
+    start = time.perf_counter()
+    if img is None:
+        img, _ = ImageProcessor.decode_reduced(image_bytes, min_side)
+    encoded = []
+    for tile in tiles:
+        crop = ImageProcessor.fit_within(img[tile.y:tile.y + tile.height, tile.x:tile.x + tile.width])
+        tile_data, _ = ImageProcessor.encode_for_upload(crop)
+        encoded.append((tile_data, crop.shape[1], crop.shape[0]))
+    return encoded, time.perf_counter() - start
+
+
+class CpuStagePool:
+    """
+    Runs CPU stages on a process pool, or on a thread executor when disabled
+    
+    The pool is created on first use, so a server process forked by the
+    launcher starts its own pool instead of inheriting a broken one. Worker
+    processes come from a forkserver that has already imported this module.
+    """
+    
+    def __init__(self, processes: int, fallback: Executor):
+        """
+        Initialize pool
+        
+        Args:
+            processes: Worker processes (0 runs every stage on fallback)
+            fallback: Executor used when processes is 0
+        """
+        self.processes = processes
+        self.fallback = fallback
+        self._pool: Optional[ProcessPoolExecutor] = None
+    
+    @property
+    def enabled(self) -> bool:
+        """Whether stages run in worker processes"""
+        return self.processes > 0
+    
+    def _executor(self) -> Executor:
+        """Process pool (created on first use) or the fallback executor"""
+        if not self.enabled:
+            return self.fallback
+        if self._pool is None:
+            methods = multiprocessing.get_all_start_methods()
+            context = multiprocessing.get_context("forkserver" if "forkserver" in methods else "spawn")
+            if context.get_start_method() == "forkserver":
+                context.set_forkserver_preload(["cpu_stages"])
+            self._pool = ProcessPoolExecutor(max_workers=self.processes, mp_context=context)
+        return self._pool
+    
+    async def run(self, func: Callable, *args: Any) -> Any:
+        """
+        Run a module-level stage function
+        
+        Args:
+            func: Picklable function (e.g. prepare_image, encode_upload)
+            *args: Its arguments
+            
+        Returns:
+            The function's result
+        """
+        return await asyncio.get_running_loop().run_in_executor(self._executor(), func, *args)
+    
+    def shutdown(self) -> None:
+        """Stop the worker processes, if any"""
+        if self._pool is not None:
+            self._pool.shutdown(cancel_futures=True)
+            self._pool = None
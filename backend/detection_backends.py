@@ -0,0 +1,766 @@
+"""
+Detection backends behind IngredientDetectionService and the routing between them
+
+Every backend answers the primary and alternative detection calls with
+response text the detection parser understands (Gemini's structured JSON
+or line format), so the pipeline after the call is shared:
+  - GeminiAIService (ai_service.py): the remote model
+  - LocalDetectorBackend: a YOLO-style ONNX food detector on the CPU,
+    through ONNX Runtime when installed or OpenCV DNN otherwise
+  - ReplayBackend: recorded responses, offline, with optional simulated latency
+  - RecordingBackend: wraps any backend and writes its responses to a
+    fixtures file for ReplayBackend
+  - RoutedDetectionBackend: local first with Gemini for low-confidence
+    images, or a race between both
+"""
+import ast
+import asyncio
+import hashlib
+import os
+import random
+import threading
+import time
+from abc import ABC, abstractmethod
+from typing import AsyncIterator, Awaitable, Callable, List, Optional, Tuple
+
+import cv2
+import numpy as np
+import orjson
+from fastapi import HTTPException
+
+import box_ops
+from config import (
+    BBOX_OFFSET_X, BBOX_OFFSET_Y, LOCAL_MIN_CONFIDENCE,
+    LOCAL_DETECTOR_MODEL_PATH, LOCAL_DETECTOR_LABELS_PATH, LOCAL_DETECTOR_INPUT_SIZE,
+    LOCAL_DETECTOR_SCORE_THRESHOLD, LOCAL_DETECTOR_NMS_IOU, REPLAY_FIXTURES_PATH,
+    REPLAY_LATENCY_SECONDS, REPLAY_JITTER_SECONDS, RECORD_FIXTURES_PATH
+)
+from detection_parser import STRUCTURED_BOX_KEY, STRUCTURED_LABEL_KEY
+
+try:
+    import onnxruntime
+except ImportError:  # Opcional: sin ONNX Runtime se usa OpenCV DNN
+    onnxruntime = None
+
+
+class BackendResponse(str):
+    """Response text tagged with the backend that produced it"""
+    
+    def __new__(cls, text: str, backend: str):
+        response = super().__new__(cls, text)
+        response.backend = backend
+        return response
+
+
+class DetectionBackend(ABC):
+    """
+    Base class of detection backends
+    
+    Subclasses implement the blocking detect_primary / detect_alternative;
+    the async and streaming variants default to running them on a thread
+    and yielding the whole response at once.
+    """
+    
+    name = "backend"
+    # Part of the result cache key: bump when the responses for an image change
+    PROMPT_VERSION = "1"
+    structured_output = True
+    
+    async def start(self) -> None:
+        """Prepare clients or models at application startup (default: nothing to do)"""
+    
+    def is_available(self) -> bool:
+        """Check if the backend can serve requests"""
+        return True
+    
+    def describe(self) -> dict:
+        """Backend name and availability for /health"""
+        return {"name": self.name, "available": self.is_available()}
+    
+    def startup_timings(self) -> dict:
+        """Milliseconds taken by each step of start(), for /health (default: none)"""
+        return {}
+    
+    @abstractmethod
+    def detect_primary(self, image_data: bytes, image_width: int, image_height: int) -> str:
+        """
+        Run the primary detection
+        
+        Args:
+            image_data: Encoded image bytes (JPEG or WebP)
+            image_width: Width of the processed image
+            image_height: Height of the processed image
+            
+        Returns:
+            Response text
+        """
+    
+    @abstractmethod
+    def detect_alternative(self, image_data: bytes) -> str:
+        """
+        Run the alternative (recall-oriented) detection
+        
+        Args:
+            image_data: Encoded image bytes (JPEG or WebP)
+            
+        Returns:
+            Response text
+        """
+    
+    async def detect_primary_async(self, image_data: bytes, image_width: int, image_height: int) -> str:
+        """Async primary detection (blocking call on a thread)"""
+        return await asyncio.to_thread(self.detect_primary, image_data, image_width, image_height)
+    
+    async def detect_alternative_async(self, image_data: bytes) -> str:
+        """Async alternative detection (blocking call on a thread)"""
+        return await asyncio.to_thread(self.detect_alternative, image_data)
+    
+    async def stream_primary_async(self, image_data: bytes, image_width: int, image_height: int) -> AsyncIterator[str]:
+        """Stream the primary response (as a single chunk)"""
+        yield await self.detect_primary_async(image_data, image_width, image_height)
+    
+    async def stream_alternative_async(self, image_data: bytes) -> AsyncIterator[str]:
+        """Stream the alternative response (as a single chunk)"""
+        yield await self.detect_alternative_async(image_data)
+    
+    def detect_ingredients(self, image_data: bytes, image_width: int, image_height: int) -> Tuple[str, str]:
+        """
+        Run both detections back to back
+        
+        Returns:
+            Tuple of (primary_response, alternative_response)
+        """
+        return self.detect_primary(image_data, image_width, image_height), self.detect_alternative(image_data)
+    
+    async def detect_ingredients_async(self, image_data: bytes, image_width: int, image_height: int) -> Tuple[str, str]:
+        """
+        Run both detections concurrently
+        
+        Returns:
+            Tuple of (primary_response, alternative_response)
+        """
+        primary_text, alternative_text = await asyncio.gather(
+            self.detect_primary_async(image_data, image_width, image_height),
+            self.detect_alternative_async(image_data),
+        )
+        return primary_text, alternative_text
+
+
+class LocalDetection:
+    """Scored detections of the local model with their response text"""
+    
+    def __init__(self, text: str, scores: np.ndarray):
+        """
+        Initialize detections
+        
+        Args:
+            text: Structured response text
+            scores: Score of each detection
+        """
+        self.text = text
+        self.scores = scores
+    
+    @property
+    def confidence(self) -> float:
+        """Mean detection score (0 when nothing was detected)"""
+        return float(self.scores.mean()) if len(self.scores) else 0.0
+
+
+class LocalDetectorBackend(DetectionBackend):
+    """
+    Food detector running on the CPU from a YOLO-style ONNX export
+    
+    Accepts YOLOv8 outputs (1, 4 + classes, N) and YOLOv5 outputs
+    (1, N, 5 + classes) with boxes as center/size in input pixels. The
+    alternative detection reruns the model with half the score threshold.
+    The model is loaded by start() at application startup, or by the first
+    detection call if that comes first.
+    """
+    
+    name = "local"
+    
+    def __init__(self, model_path: str = LOCAL_DETECTOR_MODEL_PATH, labels_path: str = LOCAL_DETECTOR_LABELS_PATH,
+                 input_size: int = LOCAL_DETECTOR_INPUT_SIZE, score_threshold: float = LOCAL_DETECTOR_SCORE_THRESHOLD,
+                 nms_iou: float = LOCAL_DETECTOR_NMS_IOU):
+        """
+        Initialize local detector
+        
+        Args:
+            model_path: ONNX model file
+            labels_path: Class names, one per line (optional with ONNX Runtime if the
+                model metadata has "names")
+            input_size: Square model input size in pixels
+            score_threshold: Minimum class score kept by the primary detection
+            nms_iou: IoU threshold of the per-class NMS
+        """
+        self.model_path = model_path
+        self.labels_path = labels_path
+        self.input_size = input_size
+        self.score_threshold = score_threshold
+        self.nms_iou = nms_iou
+        self.PROMPT_VERSION = f"local-{os.path.basename(model_path)}"
+        self.labels: List[str] = []
+        self._session = None
+        self._net = None
+        # cv2.dnn.Net keeps per-call state; ONNX Runtime sessions are thread-safe
+        self._lock = threading.Lock()
+        self.initialized = False
+        self.load_ms: Optional[float] = None
+        self._init_lock = threading.Lock()
+    
+    def initialize(self) -> bool:
+        """
+        Load the model once (blocking: reads and compiles the ONNX file)
+        
+        Returns:
+            True if the model is available
+        """
+        with self._init_lock:
+            if not self.initialized:
+                start = time.perf_counter()
+                self._initialize(self.labels_path)
+                self.load_ms = round((time.perf_counter() - start) * 1000, 1)
+                self.initialized = True
+            return self._session is not None or self._net is not None
+    
+    def _initialize(self, labels_path: str) -> None:
+        """Load the model and its labels"""
+        if not self.model_path:
+            return
+        try:
+            if onnxruntime is not None:
+                self._session = onnxruntime.InferenceSession(self.model_path, providers=["CPUExecutionProvider"])
+                names = self._session.get_modelmeta().custom_metadata_map.get("names")
+                if names:
+                    names = ast.literal_eval(names)
+                    self.labels = [names[index] for index in sorted(names)]
+            else:
+                self._net = cv2.dnn.readNetFromONNX(self.model_path)
+            if labels_path:
+                with open(labels_path, encoding="utf-8") as f:
+                    self.labels = [line.strip() for line in f if line.strip()]
+            print(f"✅ Local detector loaded: {self.model_path} ({len(self.labels)} classes)")
+        except Exception as e:
+            print(f"⚠️ Warning: Could not load local detector: {e}")
+            self._session = None
+            self._net = None
+    
+    async def start(self) -> None:
+        """Load the model off the event loop at application startup"""
+        await asyncio.to_thread(self.initialize)
+    
+    def is_available(self) -> bool:
+        """Check if the model was loaded (before start(), whether a model is configured)"""
+        if not self.initialized:
+            return bool(self.model_path)
+        return self._session is not None or self._net is not None
+    
+    def describe(self) -> dict:
+        """Availability and model load state for /health"""
+        return {**super().describe(), "initialized": self.initialized}
+    
+    def startup_timings(self) -> dict:
+        """Model load time once loaded"""
+        return {} if self.load_ms is None else {"local_model": self.load_ms}
+    
+    def _ensure_available(self) -> None:
+        """Load the model if startup has not yet, and raise 503 if none could be loaded"""
+        if not self.initialize():
+            raise HTTPException(status_code=503, detail="Local detector is not available. Set LOCAL_DETECTOR_MODEL_PATH.")
+    
+    def _letterbox(self, img: np.ndarray) -> Tuple[np.ndarray, float, int, int]:
+        """
+        Fit the image into the square model input, padding the rest
+        
+        Returns:
+            Tuple of (NCHW float32 blob, scale, x padding, y padding)
+        """
+        height, width = img.shape[:2]
+        scale = self.input_size / max(width, height)
+        resized = cv2.resize(img, (round(width * scale), round(height * scale)), interpolation=cv2.INTER_AREA)
+        pad_x = (self.input_size - resized.shape[1]) // 2
+        pad_y = (self.input_size - resized.shape[0]) // 2
+        canvas = np.full((self.input_size, self.input_size, 3), 114, dtype=np.uint8)
+        canvas[pad_y:pad_y + resized.shape[0], pad_x:pad_x + resized.shape[1]] = resized
+        blob = cv2.dnn.blobFromImage(canvas, 1 / 255.0, swapRB=True)
+        return blob, scale, pad_x, pad_y
+    
+    def _infer(self, blob: np.ndarray) -> np.ndarray:
+        """Run the model on a blob and return its first output"""
+        if self._session is not None:
+            return self._session.run(None, {self._session.get_inputs()[0].name: blob})[0]
+        with self._lock:
+            self._net.setInput(blob)
+            return self._net.forward()
+    
+    @staticmethod
+    def decode_outputs(output: np.ndarray, num_classes: int,
+                       score_threshold: float) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """
+        Decode raw YOLO outputs
+        
+        Args:
+            output: Model output, (1, 4 + classes, N) for YOLOv8 or (1, N, 5 + classes) for YOLOv5
+            num_classes: Number of classes
+            score_threshold: Minimum class score
+            
+        Returns:
+            Tuple of ((K, 4) [x1, y1, x2, y2] boxes in input pixels, (K,) scores, (K,) class ids)
+        """
+        rows = output.reshape(output.shape[-2], output.shape[-1])
+        if rows.shape[0] == 4 + num_classes and rows.shape[1] != 5 + num_classes:
+            rows = rows.T
+            class_scores = rows[:, 4:]
+        else:
+            class_scores = rows[:, 5:] * rows[:, 4:5]
+        class_ids = class_scores.argmax(axis=1)
+        scores = class_scores[np.arange(len(rows)), class_ids]
+        keep = scores >= score_threshold
+        
+        centers, sizes = rows[keep, 0:2], rows[keep, 2:4]
+        boxes = np.concatenate([centers - sizes / 2, centers + sizes / 2], axis=1)
+        return boxes, scores[keep], class_ids[keep]
+    
+    def detect_scored(self, image_data: bytes, score_threshold: Optional[float] = None) -> LocalDetection:
+        """
+        Detect food items and return the scored response
+        
+        Boxes are written in Gemini's convention (0-1000, [ymin, xmin, ymax,
+        xmax]) and pre-shifted by BBOX_OFFSET_X/Y, the correction the shared
+        pipeline applies to every response, so they land on the detector's pixels.
+        
+        Args:
+            image_data: Encoded image bytes
+            score_threshold: Minimum class score (defaults to the configured one)
+            
+        Returns:
+            Scored detections with their structured response text
+        """
+        self._ensure_available()
+        img = cv2.imdecode(np.frombuffer(image_data, np.uint8), cv2.IMREAD_COLOR)
+        if img is None:
+            raise ValueError("Could not decode image")
+        height, width = img.shape[:2]
+        
+        blob, scale, pad_x, pad_y = self._letterbox(img)
+        output = self._infer(blob)
+        num_classes = len(self.labels) or output.shape[1] - 4
+        threshold = self.score_threshold if score_threshold is None else score_threshold
+        boxes, scores, class_ids = self.decode_outputs(output, num_classes, threshold)
+        keep = box_ops.nms(boxes, scores, self.nms_iou, labels=class_ids.tolist())
+        boxes, scores, class_ids = boxes[keep], scores[keep], class_ids[keep]
+        
+        # Input pixels -> image pixels -> Gemini's 0-1000 grid (offset pre-compensated)
+        boxes = (boxes - [pad_x, pad_y, pad_x, pad_y]) / scale
+        boxes -= [BBOX_OFFSET_X, BBOX_OFFSET_Y, BBOX_OFFSET_X, BBOX_OFFSET_Y]
+        boxes = boxes / [width, height, width, height] * 1000
+        detections = [
+            {
+                STRUCTURED_BOX_KEY: [round(y1), round(x1), round(y2), round(x2)],
+                STRUCTURED_LABEL_KEY: self.labels[class_id] if class_id < len(self.labels) else f"class_{class_id}"
+            }
+            for (x1, y1, x2, y2), class_id in zip(boxes.tolist(), class_ids.tolist())
+        ]
+        text = BackendResponse(orjson.dumps({"detections": detections}).decode(), self.name)
+        return LocalDetection(text, scores)
+    
+    async def detect_scored_async(self, image_data: bytes, score_threshold: Optional[float] = None) -> LocalDetection:
+        """Async detect_scored (inference on a thread)"""
+        return await asyncio.to_thread(self.detect_scored, image_data, score_threshold)
+    
+    def detect_primary(self, image_data: bytes, image_width: int, image_height: int) -> str:
+        """Detect with the configured score threshold"""
+        return self.detect_scored(image_data).text
+    
+    def detect_alternative(self, image_data: bytes) -> str:
+        """Detect again with half the score threshold (more recall, like the alternative prompt)"""
+        return self.detect_scored(image_data, self.score_threshold / 2).text
+
+
+def image_key(image_data: bytes) -> str:
+    """Fixture key of an uploaded image"""
+    return hashlib.sha256(image_data).hexdigest()
+
+
+def load_fixtures(path: str) -> dict:
+    """
+    Read a fixtures file
+    
+    Args:
+        path: JSON fixtures file (missing or empty path gives no recordings)
+        
+    Returns:
+        Dictionary with "responses" and "default"
+    """
+    fixtures = {}
+    if path and os.path.exists(path):
+        with open(path, "rb") as f:
+            fixtures = orjson.loads(f.read())
+    return {"responses": fixtures.get("responses", {}), "default": fixtures.get("default", {})}
+
+
+class ReplayBackend(DetectionBackend):
+    """
+    Deterministic backend answering from recorded responses
+    
+    Fixtures file: {"responses": {"<sha256 of image>": {"primary": text,
+    "alternative": text}}, "default": {"primary": text, "alternative": text}}.
+    Images without a recording get the default, or no detections. Each call
+    waits latency ± jitter seconds first, so benchmarks and load tests see
+    Gemini-like timings without a network.
+    """
+    
+    name = "replay"
+    PROMPT_VERSION = "replay"
+    EMPTY_RESPONSE = '{"detections": []}'
+    
+    def __init__(self, fixtures_path: str = REPLAY_FIXTURES_PATH, latency: float = REPLAY_LATENCY_SECONDS,
+                 jitter: float = REPLAY_JITTER_SECONDS, seed: Optional[int] = None):
+        """
+        Initialize replay backend
+        
+        Args:
+            fixtures_path: JSON fixtures file (empty for no recordings)
+            latency: Mean simulated call time in seconds
+            jitter: Maximum deviation from latency (uniform), in seconds
+            seed: Random seed for reproducible jitter
+        """
+        if fixtures_path and not os.path.exists(fixtures_path):
+            raise FileNotFoundError(f"REPLAY_FIXTURES_PATH no existe: {fixtures_path}")
+        self.fixtures_path = fixtures_path
+        fixtures = load_fixtures(fixtures_path)
+        self.responses = fixtures["responses"]
+        self.default = fixtures["default"]
+        self.latency = latency
+        self.jitter = jitter
+        self._random = random.Random(seed)
+    
+    def describe(self) -> dict:
+        """Backend name, recordings and simulated timing for /health"""
+        return {
+            **super().describe(),
+            "recordings": len(self.responses),
+            "latency_seconds": self.latency,
+            "jitter_seconds": self.jitter
+        }
+    
+    def _delay(self) -> float:
+        """Simulated duration of one call"""
+        return max(0.0, self.latency + self._random.uniform(-self.jitter, self.jitter))
+    
+    def _response(self, image_data: bytes, prompt: str) -> str:
+        """Recorded response of an image for a prompt"""
+        recorded = self.responses.get(image_key(image_data), self.default)
+        return BackendResponse(recorded.get(prompt, self.EMPTY_RESPONSE), self.name)
+    
+    def detect_primary(self, image_data: bytes, image_width: int, image_height: int) -> str:
+        """Recorded primary response"""
+        time.sleep(self._delay())
+        return self._response(image_data, "primary")
+    
+    def detect_alternative(self, image_data: bytes) -> str:
+        """Recorded alternative response"""
+        time.sleep(self._delay())
+        return self._response(image_data, "alternative")
+    
+    async def detect_primary_async(self, image_data: bytes, image_width: int, image_height: int) -> str:
+        """Recorded primary response (no thread hop)"""
+        await asyncio.sleep(self._delay())
+        return self._response(image_data, "primary")
+    
+    async def detect_alternative_async(self, image_data: bytes) -> str:
+        """Recorded alternative response (no thread hop)"""
+        await asyncio.sleep(self._delay())
+        return self._response(image_data, "alternative")
+
+
+class RecordingBackend(DetectionBackend):
+    """
+    Pass-through backend that saves every response to a fixtures file
+    
+    Responses are keyed like ReplayBackend reads them (SHA-256 of the image
+    sent, so tile calls are recorded too) and the file is rewritten
+    atomically after each new recording, merging into what it already holds.
+    Streamed responses are recorded once the stream completes.
+    """
+    
+    def __init__(self, inner: DetectionBackend, fixtures_path: str = RECORD_FIXTURES_PATH):
+        """
+        Initialize recorder
+        
+        Args:
+            inner: Backend whose responses are recorded (usually Gemini)
+            fixtures_path: JSON fixtures file to create or extend
+        """
+        self.inner = inner
+        self.fixtures_path = fixtures_path
+        self.name = inner.name
+        self.PROMPT_VERSION = inner.PROMPT_VERSION
+        self.structured_output = inner.structured_output
+        self.fixtures = load_fixtures(fixtures_path)
+        self._lock = threading.Lock()
+    
+    async def start(self) -> None:
+        """Start the recorded backend"""
+        await self.inner.start()
+    
+    def is_available(self) -> bool:
+        """Check if the recorded backend can serve requests"""
+        return self.inner.is_available()
+    
+    def describe(self) -> dict:
+        """Recorded backend's description plus the fixtures file"""
+        return {**self.inner.describe(), "recording": self.fixtures_path,
+                "recordings": len(self.fixtures["responses"])}
+    
+    def startup_timings(self) -> dict:
+        """Startup timings of the recorded backend"""
+        return self.inner.startup_timings()
+    
+    def record(self, image_data: bytes, prompt: str, response_text: str) -> None:
+        """
+        Store one response and rewrite the fixtures file
+        
+        Args:
+            image_data: Image sent to the backend
+            prompt: "primary" or "alternative"
+            response_text: Backend response
+        """
+        with self._lock:
+            self.fixtures["responses"].setdefault(image_key(image_data), {})[prompt] = str(response_text)
+            payload = orjson.dumps(self.fixtures, option=orjson.OPT_INDENT_2)
+            temp_path = f"{self.fixtures_path}.{os.getpid()}.tmp"
+            with open(temp_path, "wb") as f:
+                f.write(payload)
+            os.replace(temp_path, self.fixtures_path)
+    
+    async def _record_async(self, image_data: bytes, prompt: str, response_text: str) -> None:
+        """Record without blocking the event loop on the file write"""
+        await asyncio.to_thread(self.record, image_data, prompt, response_text)
+    
+    def detect_primary(self, image_data: bytes, image_width: int, image_height: int) -> str:
+        """Primary detection, recorded"""
+        response = self.inner.detect_primary(image_data, image_width, image_height)
+        self.record(image_data, "primary", response)
+        return response
+    
+    def detect_alternative(self, image_data: bytes) -> str:
+        """Alternative detection, recorded"""
+        response = self.inner.detect_alternative(image_data)
+        self.record(image_data, "alternative", response)
+        return response
+    
+    async def detect_primary_async(self, image_data: bytes, image_width: int, image_height: int) -> str:
+        """Async primary detection, recorded"""
+        response = await self.inner.detect_primary_async(image_data, image_width, image_height)
+        await self._record_async(image_data, "primary", response)
+        return response
+    
+    async def detect_alternative_async(self, image_data: bytes) -> str:
+        """Async alternative detection, recorded"""
+        response = await self.inner.detect_alternative_async(image_data)
+        await self._record_async(image_data, "alternative", response)
+        return response
+    
+    async def _stream(self, image_data: bytes, prompt: str, chunks: AsyncIterator[str]) -> AsyncIterator[str]:
+        """Yield the inner stream and record the full text once it completes"""
+        parts = []
+        async for chunk in chunks:
+            parts.append(chunk)
+            yield chunk
+        await self._record_async(image_data, prompt, "".join(parts))
+    
+    def stream_primary_async(self, image_data: bytes, image_width: int, image_height: int) -> AsyncIterator[str]:
+        """Stream the primary response, recorded"""
+        return self._stream(image_data, "primary",
+                            self.inner.stream_primary_async(image_data, image_width, image_height))
+    
+    def stream_alternative_async(self, image_data: bytes) -> AsyncIterator[str]:
+        """Stream the alternative response, recorded"""
+        return self._stream(image_data, "alternative", self.inner.stream_alternative_async(image_data))
+
+
+class RoutedDetectionBackend(DetectionBackend):
+    """
+    Per-request routing between the local detector and a remote backend
+    
+    - local_first: the local detector answers unless its mean score is
+      below min_confidence (or it finds nothing); then the remote one does
+    - race: both start together; a confident local answer or the first
+      remote answer wins and the other call is cancelled. A remote failure
+      falls back to the local answer.
+      
+    If the local detector is unavailable or fails, requests go to the remote
+    backend. Streaming uses local_first in both policies.
+    """
+    
+    def __init__(self, policy: str, local: LocalDetectorBackend, remote: DetectionBackend,
+                 min_confidence: float = LOCAL_MIN_CONFIDENCE):
+        """
+        Initialize router
+        
+        Args:
+            policy: "local_first" or "race"
+            local: Local detector
+            remote: Remote backend (Gemini)
+            min_confidence: Mean local score needed to skip the remote backend
+        """
+        self.name = policy
+        self.policy = policy
+        self.local = local
+        self.remote = remote
+        self.min_confidence = min_confidence
+        self.PROMPT_VERSION = f"{policy}-{local.PROMPT_VERSION}-{remote.PROMPT_VERSION}"
+        self.structured_output = remote.structured_output
+    
+    async def start(self) -> None:
+        """Start both backends"""
+        await asyncio.gather(self.local.start(), self.remote.start())
+    
+    def is_available(self) -> bool:
+        """Available if either backend is"""
+        return self.local.is_available() or self.remote.is_available()
+    
+    def describe(self) -> dict:
+        """Policy plus the state of both backends"""
+        return {
+            **super().describe(),
+            "min_confidence": self.min_confidence,
+            "backends": [self.local.describe(), self.remote.describe()]
+        }
+    
+    def startup_timings(self) -> dict:
+        """Startup timings of both backends"""
+        return {**self.local.startup_timings(), **self.remote.startup_timings()}
+    
+    def _confident(self, detection: LocalDetection) -> bool:
+        """Whether a local answer is good enough to skip the remote backend"""
+        return detection.confidence >= self.min_confidence or not self.remote.is_available()
+    
+    def _threshold(self, alternative: bool) -> Optional[float]:
+        """Local score threshold for the primary or alternative detection"""
+        return self.local.score_threshold / 2 if alternative else None
+    
+    def _route(self, image_data: bytes, alternative: bool, remote_call: Callable[[], str]) -> str:
+        """Blocking local_first routing (also used for race)"""
+        if self.local.is_available():
+            try:
+                detection = self.local.detect_scored(image_data, self._threshold(alternative))
+                if self._confident(detection):
+                    return detection.text
+            except Exception as e:
+                print(f"⚠️ Local detector failed, using {self.remote.name}: {e}")
+        return remote_call()
+    
+    async def _route_async(self, image_data: bytes, alternative: bool,
+                           remote_call: Callable[[], Awaitable[str]]) -> str:
+        """Async routing per policy"""
+        if not self.local.is_available():
+            return await remote_call()
+        local_call = self.local.detect_scored_async(image_data, self._threshold(alternative))
+        if self.policy == "race" and self.remote.is_available():
+            return await self._race(local_call, remote_call())
+        
+        try:
+            detection = await local_call
+            if self._confident(detection):
+                return detection.text
+        except Exception as e:
+            print(f"⚠️ Local detector failed, using {self.remote.name}: {e}")
+        return await remote_call()
+    
+    async def _race(self, local_call: Awaitable[LocalDetection], remote_call: Awaitable[str]) -> str:
+        """Run both backends; a confident local answer or the remote answer wins"""
+        local_task = asyncio.ensure_future(local_call)
+        remote_task = asyncio.ensure_future(remote_call)
+        fallback = None
+        pending = {local_task, remote_task}
+        try:
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                if local_task in done and local_task.exception() is None:
+                    detection = local_task.result()
+                    if detection.confidence >= self.min_confidence:
+                        return detection.text
+                    fallback = detection.text
+                if remote_task in done:
+                    if remote_task.exception() is None:
+                        return remote_task.result()
+                    if fallback is not None:
+                        return fallback
+                    if local_task not in pending:
+                        raise remote_task.exception()
+            # Remote call failed after a low-confidence local answer
+            if fallback is not None:
+                return fallback
+            return remote_task.result()
+        finally:
+            for task in (local_task, remote_task):
+                if not task.done():
+                    task.cancel()
+    
+    def detect_primary(self, image_data: bytes, image_width: int, image_height: int) -> str:
+        """Routed primary detection"""
+        return self._route(image_data, False, lambda: self.remote.detect_primary(image_data, image_width, image_height))
+    
+    def detect_alternative(self, image_data: bytes) -> str:
+        """Routed alternative detection"""
+        return self._route(image_data, True, lambda: self.remote.detect_alternative(image_data))
+    
+    async def detect_primary_async(self, image_data: bytes, image_width: int, image_height: int) -> str:
+        """Routed async primary detection"""
+        return await self._route_async(
+            image_data, False, lambda: self.remote.detect_primary_async(image_data, image_width, image_height)
+        )
+    
+    async def detect_alternative_async(self, image_data: bytes) -> str:
+        """Routed async alternative detection"""
+        return await self._route_async(image_data, True, lambda: self.remote.detect_alternative_async(image_data))
+    
+    async def _stream(self, image_data: bytes, alternative: bool,
+                      remote_stream: Callable[[], AsyncIterator[str]]) -> AsyncIterator[str]:
+        """Yield a confident local answer at once, else stream the remote response"""
+        if self.local.is_available():
+            try:
+                detection = await self.local.detect_scored_async(image_data, self._threshold(alternative))
+                if self._confident(detection):
+                    yield detection.text
+                    return
+            except Exception as e:
+                print(f"⚠️ Local detector failed, using {self.remote.name}: {e}")
+        async for chunk in remote_stream():
+            yield chunk
+    
+    def stream_primary_async(self, image_data: bytes, image_width: int, image_height: int) -> AsyncIterator[str]:
+        """Routed primary stream"""
+        return self._stream(
+            image_data, False, lambda: self.remote.stream_primary_async(image_data, image_width, image_height)
+        )
+    
+    def stream_alternative_async(self, image_data: bytes) -> AsyncIterator[str]:
+        """Routed alternative stream"""
+        return self._stream(image_data, True, lambda: self.remote.stream_alternative_async(image_data))
+
+
+def create_detection_backend(name: str, record_path: str = RECORD_FIXTURES_PATH) -> DetectionBackend:
+    """
+    Build the backend for a DETECTION_BACKEND value
+    
+    Args:
+        name: "gemini", "local", "replay", "local_first" or "race"
+        record_path: Fixtures file to record responses to (empty to disable)
+        
+    Returns:
+        Detection backend
+    """
+    from ai_service import GeminiAIService
+    
+    if name == "gemini":
+        backend = GeminiAIService()
+    elif name == "local":
+        backend = LocalDetectorBackend()
+    elif name == "replay":
+        backend = ReplayBackend()
+    else:
+        backend = RoutedDetectionBackend(name, LocalDetectorBackend(), GeminiAIService())
+    return RecordingBackend(backend, record_path) if record_path else backend
@@ -3,90 +3,171 @@ Detection parsing utilities for processing AI responses
 """
 import re
 import numpy as np
-from typing import List, Tuple, Any
-from config import NON_FOOD_ITEMS, CONFIDENCE_BASE, CONFIDENCE_VARIATION, ALTERNATIVE_CONFIDENCE_BASE
+import orjson
+from typing import List, Tuple, Any, Mapping, Optional
+from config import (
+    NON_FOOD_ITEMS, CONFIDENCE_BASE, CONFIDENCE_VARIATION, ALTERNATIVE_CONFIDENCE_BASE, DEBUG,
+    DEDUP_SAME_LABEL_IOU, DEDUP_CROSS_LABEL_IOU
+)
+import box_ops
+
+# Coordinate: integer or decimal, optionally signed. Digits and separators are
+# disjoint character classes, so a failed match cannot backtrack far
+_NUMBER = r'([-+]?\d+(?:\.\d+)?)'
+# Separator between fields: commas and/or whitespace
+_SEPARATOR = r'[\s,]+'
+
+# Single pattern for every supported format:
+#   [123, 456, 789, 12, ingredient]  /  [ 123 , 456 , 789 , 12 , ingredient ]  /  [123 456 789 12 ingredient]
+DETECTION_PATTERN = re.compile(
+    r'\[\s*' + _SEPARATOR.join([_NUMBER] * 4) + _SEPARATOR + r'([^\[\]\n]+)\]'
+)
+
+# Characters stripped from labels (quotes and markdown emphasis)
+_LABEL_STRIP_CHARS = ' \t"\'`*,'
+
+# Keys of each detection object in the structured (JSON) response
+STRUCTURED_BOX_KEY = "box_2d"
+STRUCTURED_LABEL_KEY = "label"
+
 
 class DetectionParser:
     """Handles parsing of AI detection responses"""
     
-    @staticmethod
-    def get_regex_patterns() -> List[str]:
-        """Get regex patterns for parsing detection responses"""
-        return [
-            # Standard format: [123, 456, 789, 012, ingredient]
-            r'\[(\d+(?:\.\d+)?),?\s*(\d+(?:\.\d+)?),?\s*(\d+(?:\.\d+)?),?\s*(\d+(?:\.\d+)?),?\s*([^\]]+)\]',
-            # With spaces: [ 123 , 456 , 789 , 012 , ingredient ]
-            r'\[\s*(\d+(?:\.\d+)?)\s*,\s*(\d+(?:\.\d+)?)\s*,\s*(\d+(?:\.\d+)?)\s*,\s*(\d+(?:\.\d+)?)\s*,\s*([^\]]+)\s*\]',
-            # Different separators: [123 456 789 012 ingredient]
-            r'\[(\d+(?:\.\d+)?)\s+(\d+(?:\.\d+)?)\s+(\d+(?:\.\d+)?)\s+(\d+(?:\.\d+)?)\s+([^\]]+)\]'
-        ]
+    def __init__(self):
+        """Initialize parse counters"""
+        self.structured_parses = 0
+        self.regex_fallbacks = 0
     
-    @classmethod
-    def parse_detection_response(cls, response_text: str) -> List[Tuple[float, float, float, float, str]]:
+    def parse_detection_response(self, response_text: str) -> List[Tuple[float, float, float, float, str]]:
         """
         Parse AI response text to extract bounding boxes
         
+        Structured (JSON) responses are decoded directly; anything else falls
+        back to the regex scan, which is counted in get_stats().
+        
         Args:
             response_text: Raw AI response text
             
         Returns:
             List of tuples (ymin, xmin, ymax, xmax, label)
         """
-        print(f"Raw AI response: {response_text}")
+        if DEBUG:
+            print(f"Raw AI response: {response_text}")
         
-        bounding_boxes = []
-        patterns = cls.get_regex_patterns()
+        bounding_boxes = self.parse_structured_response(response_text)
+        self.record_parse(bounding_boxes is not None)
+        if bounding_boxes is None:
+            bounding_boxes = self.parse_text_response(response_text)
         
-        # Primary parsing with regex patterns
-        for pattern in patterns:
-            matches = re.findall(pattern, response_text)
-            if matches:
-                bounding_boxes.extend(matches)
-                break
+        if DEBUG:
+            print(f"Parsed bounding boxes: {bounding_boxes}")
+        return bounding_boxes
+    
+    def record_parse(self, structured: bool) -> None:
+        """
+        Count a parsed response
         
-        # Alternative parsing if regex fails
-        if not bounding_boxes:
-            print("Primary regex failed, trying line-by-line parsing...")
-            bounding_boxes = cls._parse_line_by_line(response_text)
+        Args:
+            structured: True if the response was decoded as JSON, False if the regex fallback ran
+        """
+        if structured:
+            self.structured_parses += 1
+        else:
+            self.regex_fallbacks += 1
+    
+    def get_stats(self) -> dict:
+        """
+        Get parse counters
         
-        print(f"Parsed bounding boxes: {bounding_boxes}")
-        return bounding_boxes
+        Returns:
+            Dictionary with structured parses, regex fallbacks and fallback rate
+        """
+        total = self.structured_parses + self.regex_fallbacks
+        return {
+            "structured_parses": self.structured_parses,
+            "regex_fallbacks": self.regex_fallbacks,
+            "fallback_rate": round(self.regex_fallbacks / total, 4) if total else 0.0
+        }
     
     @staticmethod
-    def _parse_line_by_line(response_text: str) -> List[Tuple[float, float, float, float, str]]:
+    def parse_structured_response(response_text: str) -> Optional[List[Tuple[float, float, float, float, str]]]:
         """
-        Parse response line by line as fallback method
+        Decode a structured response: {"detections": [{"box_2d": [ymin, xmin, ymax, xmax], "label": ...}]}
         
         Args:
             response_text: Raw AI response text
             
         Returns:
-            List of tuples (ymin, xmin, ymax, xmax, label)
+            List of tuples (ymin, xmin, ymax, xmax, label), or None if the
+            text is not a structured response
         """
-        bounding_boxes = []
-        lines = response_text.split('\n')
-        
-        for line in lines:
-            line = line.strip()
-            if '[' in line and ']' in line:
-                # Extract content between brackets
-                bracket_content = re.search(r'\[([^\]]+)\]', line)
-                if bracket_content:
-                    content = bracket_content.group(1)
-                    parts = [part.strip() for part in re.split(r'[,\s]+', content)]
-                    if len(parts) >= 5:
-                        try:
-                            # Try to parse first 4 as numbers, rest as label
-                            numbers = []
-                            for i in range(4):
-                                numbers.append(float(parts[i]))
-                            label = ' '.join(parts[4:])
-                            bounding_boxes.append((*numbers, label))
-                        except (ValueError, IndexError):
-                            continue
+        if not response_text.lstrip().startswith('{'):
+            return None
+        try:
+            # orjson only accepts exact str, not subclasses such as BackendResponse
+            data = orjson.loads(str(response_text))
+        except orjson.JSONDecodeError:
+            return None
+        
+        detections = data.get("detections") if isinstance(data, dict) else None
+        if not isinstance(detections, list):
+            return None
         
+        bounding_boxes = []
+        for item in detections:
+            box = DetectionParser.parse_structured_item(item)
+            if box is not None:
+                bounding_boxes.append(box)
         return bounding_boxes
     
+    @staticmethod
+    def parse_structured_item(item: Any) -> Optional[Tuple[float, float, float, float, str]]:
+        """
+        Validate one decoded detection object
+        
+        Args:
+            item: Decoded JSON value
+            
+        Returns:
+            Tuple (ymin, xmin, ymax, xmax, label) or None if the object is malformed
+        """
+        if not isinstance(item, dict):
+            return None
+        box = item.get(STRUCTURED_BOX_KEY)
+        label = item.get(STRUCTURED_LABEL_KEY)
+        if not isinstance(box, list) or len(box) != 4 or not isinstance(label, str):
+            return None
+        try:
+            ymin, xmin, ymax, xmax = (float(value) for value in box)
+        except (TypeError, ValueError):
+            return None
+        label = label.strip(_LABEL_STRIP_CHARS)
+        if not label:
+            return None
+        return ymin, xmin, ymax, xmax, label
+    
+    @staticmethod
+    def parse_text_response(response_text: str) -> List[Tuple[float, float, float, float, str]]:
+        """
+        Extract bounding boxes from free-text responses with a single regex scan
+        
+        Accepts comma-, spaced-comma- and whitespace-separated detections,
+        signed or decimal coordinates, and ignores surrounding prose, markdown
+        fences and truncated trailing boxes.
+        
+        Args:
+            response_text: Raw AI response text
+            
+        Returns:
+            List of tuples (ymin, xmin, ymax, xmax, label)
+        """
+        bounding_boxes = [
+            (float(ymin), float(xmin), float(ymax), float(xmax), label.strip(_LABEL_STRIP_CHARS))
+            for ymin, xmin, ymax, xmax, label in DETECTION_PATTERN.findall(response_text)
+        ]
+        return [box for box in bounding_boxes if box[4]]
+    
     @staticmethod
     def is_food_item(label: str) -> bool:
         """
@@ -118,7 +199,7 @@ class DetectionParser:
     
     @classmethod
     def create_detection_result(cls, detection_id: int, label: str, bbox: List[int], 
-                              normalized_bbox: List[int], nutrition_info: dict, 
+                              normalized_bbox: List[int], nutrition_info: Mapping[str, Any], 
                               is_primary: bool = True) -> dict:
         """
         Create detection result dictionary
@@ -128,7 +209,7 @@ class DetectionParser:
             label: Ingredient label
             bbox: Pixel coordinates [x1, y1, x2, y2]
             normalized_bbox: Normalized coordinates [ymin, xmin, ymax, xmax]
-            nutrition_info: Nutritional information
+            nutrition_info: Nutritional information (copied into the result)
             is_primary: Whether from primary detection
             
         Returns:
@@ -143,32 +224,110 @@ class DetectionParser:
             "bbox": bbox,
             "normalized_bbox": normalized_bbox,
             "area": (x2 - x1) * (y2 - y1),
-            "nutrition": nutrition_info
+            "source": "primary" if is_primary else "alternative",
+            "nutrition": dict(nutrition_info)
         }
     
     @staticmethod
-    def remove_duplicates(results: List[dict]) -> List[dict]:
+    def remove_duplicates(results: List[dict], same_label_iou: float = DEDUP_SAME_LABEL_IOU,
+                          cross_label_iou: float = DEDUP_CROSS_LABEL_IOU) -> List[dict]:
         """
-        Remove duplicate detections based on labels
+        Remove duplicate detections
+        
+        Overlapping boxes with the same label are merged into one (so the same
+        ingredient reported twice becomes a single detection, while two
+        separate eggs stay two). Then class-agnostic NMS drops boxes of a
+        different label that almost coincide with a higher-ranked one.
+        Boxes are ranked by rank_scores (primary before alternative, then
+        parse order), not by the displayed confidence, so the outcome is
+        the same on every run.
         
         Args:
             results: List of detection results
+            same_label_iou: IoU above which same-label boxes are merged
+            cross_label_iou: IoU above which different-label boxes are suppressed
             
         Returns:
-            List without duplicates
+            List without duplicates, renumbered from 1
         """
-        unique_results = []
-        seen_labels = set()
+        if not results:
+            return []
         
-        for i, result in enumerate(results):
-            label_key = result['label'].lower()
-            if label_key not in seen_labels:
-                result['id'] = i + 1
-                unique_results.append(result)
-                seen_labels.add(label_key)
+        boxes = box_ops.as_boxes([result['bbox'] for result in results])
+        normalized = box_ops.as_boxes([result['normalized_bbox'] for result in results])
+        scores = DetectionParser.rank_scores(results)
+        labels = [result['label'].lower() for result in results]
         
+        merged_results = []
+        merged_scores = []
+        for index, members, merged_box in box_ops.merge_boxes(boxes, scores, labels, same_label_iou):
+            result = results[index]
+            if len(members) > 1:
+                weights = scores[members] / scores[members].sum()
+                x1, y1, x2, y2 = np.rint(merged_box).astype(int).tolist()
+                result = {
+                    **result,
+                    "bbox": [x1, y1, x2, y2],
+                    "normalized_bbox": np.rint(weights @ normalized[members]).astype(int).tolist(),
+                    "area": (x2 - x1) * (y2 - y1)
+                }
+            merged_results.append(result)
+            merged_scores.append(scores[index])
+        
+        boxes = box_ops.as_boxes([result['bbox'] for result in merged_results])
+        keep = sorted(box_ops.nms(boxes, np.array(merged_scores), cross_label_iou).tolist())
+        
+        unique_results = []
+        for i, index in enumerate(keep):
+            result = merged_results[index]
+            result['id'] = i + 1
+            unique_results.append(result)
         return unique_results
     
+    @staticmethod
+    def rank_scores(results: List[dict]) -> np.ndarray:
+        """
+        Deterministic ranking scores for deduplication
+        
+        Primary detections outrank alternative ones; within a source the
+        order is kept by the stable sorts in box_ops, so earlier-parsed
+        boxes win.
+        
+        Args:
+            results: List of detection results, in parse order
+            
+        Returns:
+            Score per result (1.0 primary, 0.5 alternative)
+        """
+        return np.array([1.0 if result.get('source', 'primary') == 'primary' else 0.5 for result in results],
+                        dtype=np.float64)
+    
+    @staticmethod
+    def is_duplicate(result: dict, kept: List[dict], same_label_iou: float = DEDUP_SAME_LABEL_IOU,
+                     cross_label_iou: float = DEDUP_CROSS_LABEL_IOU) -> bool:
+        """
+        Check whether remove_duplicates would fold a detection into an earlier one
+        
+        Used while streaming: the kept detections were emitted earlier, so
+        they rank at least as high as the new one.
+        
+        Args:
+            result: New detection result
+            kept: Detection results already accepted
+            same_label_iou: IoU above which same-label boxes are merged
+            cross_label_iou: IoU above which different-label boxes are suppressed
+            
+        Returns:
+            True if the detection overlaps an accepted one past either threshold
+        """
+        if not kept:
+            return False
+        ious = box_ops.iou_matrix(box_ops.as_boxes([result['bbox']]),
+                                  box_ops.as_boxes([other['bbox'] for other in kept]))[0]
+        label = result['label'].lower()
+        same_label = np.array([other['label'].lower() == label for other in kept])
+        return bool(np.any(ious > cross_label_iou) or np.any((ious > same_label_iou) & same_label))
+    
     @staticmethod
     def sort_by_area(results: List[dict]) -> List[dict]:
         """
@@ -181,3 +340,64 @@ class DetectionParser:
             Sorted list
         """
         return sorted(results, key=lambda x: x.get('area', 0), reverse=True)
+
+
+class IncrementalDetectionParser:
+    """Parses detections from a streamed AI response as chunks arrive"""
+    
+    def __init__(self):
+        """Initialize with an empty buffer"""
+        self._buffer = ""
+        # Decided by the first non-blank character: '{' means a structured (JSON) response
+        self.structured: Optional[bool] = None
+    
+    def feed(self, chunk: str) -> List[Tuple[float, float, float, float, str]]:
+        """
+        Add a response chunk and return detections completed by it
+        
+        A detection is emitted as soon as its closing bracket (or closing
+        brace, for structured responses) arrives; text after it stays
+        buffered for the next chunk.
+        
+        Args:
+            chunk: Next piece of the AI response text
+            
+        Returns:
+            List of tuples (ymin, xmin, ymax, xmax, label)
+        """
+        self._buffer += chunk
+        if self.structured is None:
+            head = self._buffer.lstrip()
+            if not head:
+                return []
+            self.structured = head.startswith('{')
+        
+        close, open_ = ('}', '{') if self.structured else (']', '[')
+        bounding_boxes = []
+        
+        while True:
+            end = self._buffer.find(close)
+            if end == -1:
+                break
+            segment = self._buffer[:end + 1]
+            self._buffer = self._buffer[end + 1:]
+            
+            start = segment.rfind(open_)
+            if start == -1:
+                continue
+            if self.structured:
+                box = self._parse_object(segment[start:])
+                if box is not None:
+                    bounding_boxes.append(box)
+            else:
+                bounding_boxes.extend(DetectionParser.parse_text_response(segment[start:]))
+        
+        return bounding_boxes
+    
+    @staticmethod
+    def _parse_object(segment: str) -> Optional[Tuple[float, float, float, float, str]]:
+        """Decode one streamed detection object"""
+        try:
+            return DetectionParser.parse_structured_item(orjson.loads(segment))
+        except orjson.JSONDecodeError:
+            return None
@@ -2,106 +2,960 @@
 Main detection service that orchestrates the ingredient detection process
 """
 import os
-from typing import Dict, Any, List
+import time
+import asyncio
+import contextvars
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from typing import Dict, Any, AsyncIterator, Awaitable, List, Optional, Tuple
 from fastapi import HTTPException
 
-from ai_service import GeminiAIService
-from image_processor import ImageProcessor
-from detection_parser import DetectionParser
-from nutrition import get_nutritional_info, calculate_nutritional_summary
-from config import MIN_INGREDIENTS_THRESHOLD
+from detection_backends import DetectionBackend, create_detection_backend, image_key
+from image_processor import ImageProcessor, JPEG_QUALITY
+from detection_parser import DetectionParser, IncrementalDetectionParser
+from nutrition import (
+    get_nutrition_index, get_nutritional_info, calculate_nutritional_summary, estimate_portion_grams
+)
+from result_cache import DetectionResultCache, compute_image_key
+from single_flight import SingleFlight
+from annotated_images import AnnotatedImageStore
+from tiling import Tile, plan_tiles, tile_box_to_image
+from cpu_stages import CpuStagePool, prepare_image, encode_upload, encode_tiles
+import box_ops
+import metrics
+import resilience
+from config import (
+    MIN_INGREDIENTS_THRESHOLD, IMAGE_PROCESSING_WORKERS, CPU_PROCESS_WORKERS, OVERLAP_IOU_THRESHOLD,
+    DETECTION_STRATEGY, DETECTION_BACKEND, HEDGE_DELAY_SECONDS, TARGET_IMAGE_SIZE,
+    TILING_ENABLED, TILING_MIN_SIDE, TILING_MIN_DETECTIONS, TILING_TILE_SIZE,
+    TILING_OVERLAP, TILING_MAX_TILES, TILING_CONCURRENCY, TILING_SEAM_IOS,
+    RESULT_CACHE_ENABLED, RESULT_CACHE_MAX_ENTRIES, RESULT_CACHE_TTL_SECONDS,
+    RESULT_CACHE_SQLITE_PATH, RESULT_CACHE_SQLITE_MAX_ENTRIES,
+    NEAR_DUPLICATE_ENABLED, NEAR_DUPLICATE_MAX_DISTANCE, NEAR_DUPLICATE_MAX_ENTRIES,
+    PROCESSED_IMAGE_DEFAULT_MODE, ANNOTATED_IMAGE_MAX_ENTRIES, ANNOTATED_IMAGE_TTL_SECONDS,
+    ANNOTATED_IMAGE_SQLITE_PATH, REQUEST_DEADLINE_SECONDS, COALESCING_ENABLED
+)
 
 class IngredientDetectionService:
     """Main service for ingredient detection"""
     
-    def __init__(self):
-        """Initialize detection service"""
-        self.ai_service = GeminiAIService()
+    def __init__(self, ai_service: Optional[DetectionBackend] = None):
+        """
+        Initialize detection service
+        
+        Args:
+            ai_service: Optional detection backend (defaults to the DETECTION_BACKEND one)
+        """
+        self.ai_service = ai_service if ai_service is not None else create_detection_backend(DETECTION_BACKEND)
         self.image_processor = ImageProcessor()
         self.parser = DetectionParser()
+        self.result_cache = DetectionResultCache(
+            RESULT_CACHE_MAX_ENTRIES, RESULT_CACHE_TTL_SECONDS,
+            RESULT_CACHE_SQLITE_PATH or None, RESULT_CACHE_SQLITE_MAX_ENTRIES,
+            NEAR_DUPLICATE_MAX_DISTANCE if NEAR_DUPLICATE_ENABLED else None,
+            NEAR_DUPLICATE_MAX_ENTRIES or None
+        ) if RESULT_CACHE_ENABLED else None
+        # Read from the environment here: serve.py sets the variable after config was imported
+        self.annotated_images = AnnotatedImageStore(
+            ANNOTATED_IMAGE_MAX_ENTRIES, ANNOTATED_IMAGE_TTL_SECONDS,
+            os.environ.get("ANNOTATED_IMAGE_SQLITE_PATH", ANNOTATED_IMAGE_SQLITE_PATH) or None
+        )
+        # Bounded pool for the CPU-bound OpenCV stages of the async pipeline
+        self.executor = ThreadPoolExecutor(
+            max_workers=IMAGE_PROCESSING_WORKERS,
+            thread_name_prefix="image-processing"
+        )
+        # Decode/resize and upload encoding, optionally in worker processes
+        self.cpu_stages = CpuStagePool(CPU_PROCESS_WORKERS, self.executor)
+        # Identical requests in flight share one pipeline run
+        self.single_flight = SingleFlight() if COALESCING_ENABLED else None
+        # Set by start(): readiness and how long each startup step took
+        self.ready = False
+        self.startup: Dict[str, Any] = {"state": "pending"}
     
-    def process_image(self, image_bytes: bytes) -> Dict[str, Any]:
+    async def start(self) -> None:
+        """
+        Warm the service up in the background after the server starts listening
+        
+        Opens the nutrition table and builds its index, and starts the
+        detection backend (builds the Gemini client, loads the local model).
+        Requests are served meanwhile; they build what they need on first use.
+        A backend that fails to start (e.g. no GOOGLE_API_KEY) only makes
+        detection calls fail, so the service still becomes ready.
+        """
+        start = time.perf_counter()
+        self.startup = {"state": "starting", "timings_ms": {}}
+        try:
+            await asyncio.to_thread(get_nutrition_index)
+            self.startup["timings_ms"]["nutrition"] = round((time.perf_counter() - start) * 1000, 1)
+            backend_start = time.perf_counter()
+            await self.ai_service.start()
+            self.startup["timings_ms"]["detection_backend"] = round((time.perf_counter() - backend_start) * 1000, 1)
+            self.startup["timings_ms"].update(self.ai_service.startup_timings())
+            self.startup["state"] = "ready"
+            self.ready = True
+        except Exception as e:
+            print(f"⚠️ Warning: startup failed: {e}")
+            self.startup["state"] = "failed"
+            self.startup["error"] = str(e)
+        self.startup["timings_ms"]["total"] = round((time.perf_counter() - start) * 1000, 1)
+    
+    def shutdown(self) -> None:
+        """Stop the worker processes and threads"""
+        self.cpu_stages.shutdown()
+        self.executor.shutdown(wait=False, cancel_futures=True)
+    
+    def process_image(self, image_bytes: bytes, image_mode: str = PROCESSED_IMAGE_DEFAULT_MODE) -> Dict[str, Any]:
         """
         Process image and return ingredient detection results
         
+        The blocking path always uses the lazy strategy: the alternative
+        prompt is only sent when the primary misses MIN_INGREDIENTS_THRESHOLD.
+        
+        Args:
+            image_bytes: Raw image bytes
+            image_mode: How to return processed_image ("none", "inline" or "url")
+            
+        Returns:
+            Detection results dictionary
+        """
+        with resilience.request_deadline(REQUEST_DEADLINE_SECONDS):
+            try:
+                # Decode and resize image
+                _, img_resized, image_width, image_height, preparation = self._prepare_image(image_bytes)
+                
+                # Serve repeated images from the result cache
+                cache_key, image_hash, cached = self._lookup_cache(img_resized, image_width, image_height)
+                if cached is not None:
+                    return self._attach_processed_image(cached, img_resized, None, image_mode, preparation)
+                
+                # Encode once; the same buffer goes to the AI service
+                image_data = self._encode_upload(img_resized, preparation)
+                report = {"strategy": "lazy", "alternative_used": False, "calls": []}
+                
+                # Primary detections
+                start = time.perf_counter()
+                with metrics.call_in_flight("primary"):
+                    primary_response = self.ai_service.detect_primary(image_data, image_width, image_height)
+                self._record_call(report, "primary", "completed", start, primary_response)
+                results = self._process_detections(
+                    primary_response, image_width, image_height, is_primary=True
+                )
+                
+                # If not enough ingredients found, try alternative detections
+                if len(results) < MIN_INGREDIENTS_THRESHOLD:
+                    print(f"Only {len(results)} ingredients detected, processing alternative detections...")
+                    start = time.perf_counter()
+                    with metrics.call_in_flight("alternative"):
+                        alternative_response = self.ai_service.detect_alternative(image_data)
+                    self._record_call(report, "alternative", "completed", start, alternative_response)
+                    results.extend(self._process_detections(
+                        alternative_response, image_width, image_height, 
+                        is_primary=False, existing_results=results
+                    ))
+                    report["alternative_used"] = True
+                
+                result = self._build_response(results, image_width, image_height, report)
+                self._store_cache(cache_key, image_hash, result)
+                return self._attach_processed_image(result, img_resized, image_data, image_mode, preparation)
+                
+            except HTTPException:
+                raise
+            except Exception as e:
+                raise HTTPException(status_code=500, detail=f"Error processing image: {str(e)}")
+    
+    async def process_image_async(self, image_bytes: bytes,
+                                  image_mode: str = PROCESSED_IMAGE_DEFAULT_MODE) -> Dict[str, Any]:
+        """
+        Process image without blocking the event loop
+        
+        Concurrent requests with the same image bytes and image_mode are
+        coalesced: the first runs the pipeline and the others await its
+        result (or error) instead of calling the AI service again.
+        
         Args:
             image_bytes: Raw image bytes
+            image_mode: How to return processed_image ("none", "inline" or "url")
             
         Returns:
             Detection results dictionary
         """
-        image_path = None
+        if self.single_flight is None:
+            return await self._process_image_async(image_bytes, image_mode)
         
+        digest = await self._run_in_executor(image_key, image_bytes)
         try:
-            # Decode and resize image
-            img = self.image_processor.decode_image(image_bytes)
-            img_resized, image_width, image_height, orig_width, orig_height = self.image_processor.resize_image(img)
+            # The shared run has no caller's deadline; each request waits only for its own
+            result, shared = await self.single_flight.run(
+                (digest, image_mode), partial(self._process_image_async, image_bytes, image_mode),
+                resilience.remaining_seconds()
+            )
+        except asyncio.TimeoutError:
+            raise HTTPException(status_code=504, detail="Request deadline exceeded waiting for the image analysis")
+        return dict(result) if shared else result
+    
+    async def _process_image_async(self, image_bytes: bytes, image_mode: str) -> Dict[str, Any]:
+        """
+        Run the async pipeline for one image
+        
+        The Gemini round trips are awaited through the async chat API and the
+        OpenCV stages (decode, resize, draw, encode) run on the bounded
+        image-processing executor.
+        The Gemini calls share the request's REQUEST_DEADLINE_SECONDS budget.
+        
+        Args:
+            image_bytes: Raw image bytes
+            image_mode: How to return processed_image ("none", "inline" or "url")
+            
+        Returns:
+            Detection results dictionary
+        """
+        with resilience.request_deadline(REQUEST_DEADLINE_SECONDS):
+            try:
+                # Decode and resize image; the decoded image is kept only for tiles cut on this process
+                img, img_resized, image_width, image_height, preparation = await self.cpu_stages.run(
+                    prepare_image, image_bytes, self._decode_min_side(),
+                    TILING_ENABLED and not self.cpu_stages.enabled
+                )
+                self._record_preparation(preparation)
+                
+                # Serve repeated images from the result cache without calling the AI service
+                cache_key, image_hash, cached = await self._run_in_executor(
+                    self._lookup_cache, img_resized, image_width, image_height
+                )
+                if cached is not None:
+                    return await self._run_in_executor(
+                        self._attach_processed_image, cached, img_resized, None, image_mode, preparation
+                    )
+                
+                # Encode once; the same buffer goes to the AI service
+                image_data, encoding = await self.cpu_stages.run(encode_upload, img_resized)
+                self._record_upload(preparation, encoding)
+                
+                # Get AI detections using the configured strategy (or tiled mode)
+                results, report = await self._detect_with_strategy(
+                    image_data, image_width, image_height, image_bytes, preparation["decoded_size"], img
+                )
+                
+                result = await self._run_in_executor(
+                    self._build_response, results, image_width, image_height, report
+                )
+                await self._run_in_executor(self._store_cache, cache_key, image_hash, result)
+                return await self._run_in_executor(
+                    self._attach_processed_image, result, img_resized, image_data, image_mode, preparation
+                )
+                
+            except HTTPException:
+                raise
+            except Exception as e:
+                raise HTTPException(status_code=500, detail=f"Error processing image: {str(e)}")
+    
+    async def process_image_stream(self, image_bytes: bytes,
+                                   image_mode: str = PROCESSED_IMAGE_DEFAULT_MODE) -> AsyncIterator[Dict[str, Any]]:
+        """
+        Process image and yield detections as the model generates them
+        
+        Uses the streaming chat API and emits each detection as soon as its
+        closing bracket arrives. The alternative prompt is streamed afterwards
+        only if the primary misses MIN_INGREDIENTS_THRESHOLD. The last event
+        carries the full result with the annotated image and nutritional summary.
+        
+        Args:
+            image_bytes: Raw image bytes
+            image_mode: How to return processed_image ("none", "inline" or "url")
+            
+        Yields:
+            {"type": "detection", ...} events, then {"type": "result", ...}
+            or {"type": "error", ...}
+        """
+        start = time.perf_counter()
+        
+        with resilience.request_deadline(REQUEST_DEADLINE_SECONDS):
+            try:
+                # Decode and resize image
+                _, img_resized, image_width, image_height, preparation = await self.cpu_stages.run(
+                    prepare_image, image_bytes, self._decode_min_side()
+                )
+                self._record_preparation(preparation)
+                
+                # Serve repeated images from the result cache
+                cache_key, image_hash, cached = await self._run_in_executor(
+                    self._lookup_cache, img_resized, image_width, image_height
+                )
+                if cached is not None:
+                    for detection in cached["detections"]:
+                        yield {"type": "detection", "detection": detection}
+                    result = await self._run_in_executor(
+                        self._attach_processed_image, cached, img_resized, None, image_mode, preparation
+                    )
+                    yield {"type": "result", "result": result}
+                    return
+                
+                image_data, encoding = await self.cpu_stages.run(encode_upload, img_resized)
+                self._record_upload(preparation, encoding)
+                report = {"strategy": "stream", "alternative_used": False, "calls": []}
+                results = []
+                # Detections the final deduplication would keep, in emission order
+                emitted = []
+                
+                # Primary detections
+                async for detection in self._stream_detections(
+                    report, "primary", self.ai_service.stream_primary_async(image_data, image_width, image_height),
+                    image_width, image_height, True, [], results
+                ):
+                    if not self.parser.is_duplicate(detection, emitted):
+                        emitted.append(detection)
+                        report.setdefault("first_detection_ms", round((time.perf_counter() - start) * 1000, 1))
+                        yield {"type": "detection", "detection": detection}
+                
+                # If not enough ingredients found, try alternative detections
+                if len(results) < MIN_INGREDIENTS_THRESHOLD:
+                    print(f"Only {len(results)} ingredients detected, processing alternative detections...")
+                    report["alternative_used"] = True
+                    async for detection in self._stream_detections(
+                        report, "alternative", self.ai_service.stream_alternative_async(image_data),
+                        image_width, image_height, False, list(results), results
+                    ):
+                        if not self.parser.is_duplicate(detection, emitted):
+                            emitted.append(detection)
+                            report.setdefault("first_detection_ms", round((time.perf_counter() - start) * 1000, 1))
+                            yield {"type": "detection", "detection": detection}
+                
+                result = await self._run_in_executor(
+                    self._build_response, results, image_width, image_height, report
+                )
+                await self._run_in_executor(self._store_cache, cache_key, image_hash, result)
+                result = await self._run_in_executor(
+                    self._attach_processed_image, result, img_resized, image_data, image_mode, preparation
+                )
+                yield {"type": "result", "result": result}
+                
+            except HTTPException as he:
+                event = {"type": "error", "status_code": he.status_code, "error": he.detail}
+                if he.headers and "Retry-After" in he.headers:
+                    event["retry_after"] = int(he.headers["Retry-After"])
+                yield event
+            except Exception as e:
+                yield {"type": "error", "status_code": 500, "error": f"Error processing image: {str(e)}"}
+    
+    async def _stream_detections(self, report: Dict[str, Any], prompt: str, chunks: AsyncIterator[str],
+                                 image_width: int, image_height: int, is_primary: bool,
+                                 existing_results: List[dict], results: List[dict]) -> AsyncIterator[dict]:
+        """
+        Parse a streamed AI response incrementally and yield each accepted detection
+        
+        Args:
+            report: Strategy report to record the call in
+            prompt: Prompt name ("primary" or "alternative")
+            chunks: Async iterator of response text chunks
+            image_width, image_height: Image dimensions
+            is_primary: Whether this is primary or alternative detection
+            existing_results: Detection results to check for overlaps
+            results: Running list of results; accepted detections are appended
             
-            # Save temporary image
-            image_path = self.image_processor.save_temp_image(img_resized)
+        Yields:
+            Detection result dictionaries
+        """
+        parser = IncrementalDetectionParser()
+        start = time.perf_counter()
+        status = "error"
+        
+        try:
+            with metrics.call_in_flight(prompt):
+                async for chunk in chunks:
+                    for box in parser.feed(chunk):
+                        try:
+                            result = self._process_box(
+                                box, image_width, image_height, is_primary, existing_results, len(results) + 1
+                            )
+                        except (ValueError, IndexError) as e:
+                            print(f"Error processing streamed box: {e}")
+                            continue
+                        if result is not None:
+                            results.append(result)
+                            yield result
+            if parser.structured is not None:
+                self.parser.record_parse(parser.structured)
+            status = "completed"
+        finally:
+            self._record_call(report, prompt, status, start, backend=self.ai_service.name)
+    
+    async def _detect_with_strategy(self, image_data: bytes, image_width: int, image_height: int,
+                                    image_bytes: Optional[bytes] = None,
+                                    decoded_size: Optional[Dict[str, int]] = None,
+                                    img: Optional[Any] = None) -> Tuple[List[dict], Dict[str, Any]]:
+        """
+        Run the primary and, if needed, alternative prompts per DETECTION_STRATEGY
+        
+        - lazy: the alternative prompt is sent only after the primary misses the threshold
+        - concurrent: both prompts start together; the alternative is consumed only if needed
+        - hedged: the alternative starts if the primary exceeds HEDGE_DELAY_SECONDS
+        
+        With the uploaded image, tiled mode replaces the alternative prompt when
+        the primary returns TILING_MIN_DETECTIONS or more boxes, or from the
+        start for photos of at least TILING_MIN_SIDE pixels (when set).
+        
+        Args:
+            image_data: Encoded resized image
+            image_width, image_height: Image dimensions
+            image_bytes: Raw uploaded image, needed for tiled mode
+            decoded_size: {"width", "height"} of the image decoded by prepare_image
+            img: That decoded image, if kept (tiles are otherwise cut from image_bytes)
             
-            # Get AI detections
-            primary_response, alternative_response = self.ai_service.detect_ingredients(
-                image_path, image_width, image_height
+        Returns:
+            Tuple of (detection results, strategy report)
+        """
+        strategy = DETECTION_STRATEGY
+        report = {"strategy": strategy, "alternative_used": False, "calls": []}
+        
+        if self._tiling_trigger(image_bytes, decoded_size) == "resolution":
+            results = await self._detect_tiled(
+                image_bytes, decoded_size, img, image_data, image_width, image_height, report, "resolution"
             )
+            return results, report
+        
+        primary_task = asyncio.create_task(self._timed_call(
+            report, "primary", self.ai_service.detect_primary_async(image_data, image_width, image_height)
+        ))
+        alternative_task = None
+        
+        def start_alternative() -> asyncio.Task:
+            return asyncio.create_task(self._timed_call(
+                report, "alternative", self.ai_service.detect_alternative_async(image_data)
+            ))
+        
+        try:
+            if strategy == "concurrent":
+                alternative_task = start_alternative()
+            elif strategy == "hedged":
+                done, _ = await asyncio.wait({primary_task}, timeout=HEDGE_DELAY_SECONDS)
+                if not done:
+                    print(f"Primary prompt exceeded {HEDGE_DELAY_SECONDS}s, hedging with alternative prompt...")
+                    report["hedge_fired"] = True
+                    alternative_task = start_alternative()
             
-            # Process primary detections
-            results = self._process_detections(
-                primary_response, img_resized, image_width, image_height, is_primary=True
+            primary_response = await primary_task
+            results = await self._run_in_executor(
+                self._process_detections, primary_response, image_width, image_height
             )
             
+            # Crowded plate: look again at full resolution, tile by tile
+            if self._tiling_trigger(image_bytes, decoded_size, len(results)) == "density":
+                results = await self._detect_tiled(
+                    image_bytes, decoded_size, img, image_data, image_width, image_height,
+                    report, "density", primary_response
+                )
+                return results, report
+            
             # If not enough ingredients found, try alternative detections
             if len(results) < MIN_INGREDIENTS_THRESHOLD:
                 print(f"Only {len(results)} ingredients detected, processing alternative detections...")
-                alt_results = self._process_detections(
-                    alternative_response, img_resized, image_width, image_height, 
-                    is_primary=False, existing_results=results
+                if alternative_task is None:
+                    alternative_task = start_alternative()
+                alternative_response = await alternative_task
+                alt_results = await self._run_in_executor(
+                    partial(
+                        self._process_detections, alternative_response,
+                        image_width, image_height, is_primary=False, existing_results=results
+                    )
                 )
                 results.extend(alt_results)
+                report["alternative_used"] = True
+            
+            return results, report
+        
+        finally:
+            # Cancel calls whose result is no longer needed and wait so the report is complete
+            pending = [task for task in (primary_task, alternative_task) if task is not None and not task.done()]
+            for task in pending:
+                task.cancel()
+            if pending:
+                await asyncio.gather(*pending, return_exceptions=True)
+    
+    def _tiling_trigger(self, image_bytes: Optional[bytes], decoded_size: Optional[Dict[str, int]],
+                        detection_count: Optional[int] = None) -> Optional[str]:
+        """
+        Decide whether an image should be analysed in tiled mode
+        
+        Args:
+            image_bytes: Raw uploaded image (None disables tiling)
+            decoded_size: {"width", "height"} of the decoded image
+            detection_count: Boxes found by the whole-image primary prompt, if known
+            
+        Returns:
+            "resolution", "density" or None
+        """
+        if not TILING_ENABLED or TILING_MAX_TILES < 2 or image_bytes is None or decoded_size is None:
+            return None
+        longest_side = max(decoded_size["width"], decoded_size["height"])
+        if 0 < TILING_MIN_SIDE <= longest_side:
+            return "resolution"
+        if (detection_count is not None and detection_count >= TILING_MIN_DETECTIONS
+                and longest_side > TARGET_IMAGE_SIZE):
+            return "density"
+        return None
+    
+    async def _detect_tiled(self, image_bytes: bytes, decoded_size: Dict[str, int], img: Optional[Any],
+                            image_data: bytes, image_width: int, image_height: int,
+                            report: Dict[str, Any], trigger: str,
+                            global_response: Optional[str] = None) -> List[dict]:
+        """
+        Detect ingredients on overlapping tiles of the decoded image
+        
+        The tiles go to the primary prompt concurrently next to the whole
+        resized image (unless its response is already known), which still sees
+        ingredients larger than a tile; at most TILING_CONCURRENCY calls run at
+        a time. Boxes are mapped back to the whole image and fused at the
+        seams. A failed call is skipped; the request fails only if all fail.
+        
+        Tiles are cut and encoded by the CPU stage pool: from img when this
+        process kept it, otherwise in a worker that decodes image_bytes again.
+        
+        Args:
+            image_bytes: Raw uploaded image
+            decoded_size: {"width", "height"} of the decoded image the tiles are planned on
+            img: That decoded image, if kept
+            image_data: Encoded resized image
+            image_width, image_height: Resized image dimensions
+            report: Strategy report to record the calls and the tile grid in
+            trigger: Why tiled mode was chosen ("resolution" or "density")
+            global_response: Whole-image primary response, if already received
+            
+        Returns:
+            List of detection results in resized image coordinates
+        """
+        original_width, original_height = decoded_size["width"], decoded_size["height"]
+        tiles, rows, columns = plan_tiles(
+            original_width, original_height, TILING_TILE_SIZE, TILING_OVERLAP, TILING_MAX_TILES
+        )
+        report["tiling"] = {
+            "trigger": trigger,
+            "grid": [rows, columns],
+            "tile_size": [tiles[0].width, tiles[0].height]
+        }
+        print(f"Tiled mode ({trigger}): {rows}x{columns} tiles of {tiles[0].width}x{tiles[0].height}")
+        
+        encoded_tiles, elapsed = await self.cpu_stages.run(
+            encode_tiles, image_bytes, self._decode_min_side(), tiles, img
+        )
+        metrics.record_stage("tile_encode", elapsed)
+        report["tiling"]["upload_bytes"] = sum(len(tile_data) for tile_data, _, _ in encoded_tiles)
+        semaphore = asyncio.Semaphore(TILING_CONCURRENCY)
+        
+        async def bounded(prompt: str, call: Awaitable[str]) -> str:
+            async with semaphore:
+                return await self._timed_call(report, prompt, call)
+        
+        # The whole-image call goes first so it is not queued behind the tiles
+        calls = [] if global_response is not None else [bounded(
+            "primary", self.ai_service.detect_primary_async(image_data, image_width, image_height)
+        )]
+        calls.extend(
+            bounded(f"tile_{index}", self.ai_service.detect_primary_async(tile_data, tile_width, tile_height))
+            for index, (tile_data, tile_width, tile_height) in enumerate(encoded_tiles)
+        )
+        responses = await asyncio.gather(*calls, return_exceptions=True)
+        
+        failures = [response for response in responses if isinstance(response, BaseException)]
+        if len(failures) == len(responses):
+            raise failures[0]
+        for failure in failures:
+            print(f"Tiled mode: call failed: {failure!r}")
+        if global_response is None:
+            global_response = responses.pop(0)
+        
+        results = await self._run_in_executor(
+            self._process_tiled_detections, global_response, list(zip(tiles, responses)),
+            original_width, original_height, image_width, image_height
+        )
+        print(f"Tiled mode: {len(results)} detections after seam merge")
+        return results
+    
+    @metrics.timed("parse")
+    def _process_tiled_detections(self, global_response: Any, tile_responses: List[Tuple[Tile, Any]],
+                                  original_width: int, original_height: int,
+                                  image_width: int, image_height: int) -> List[dict]:
+        """
+        Merge whole-image and tile responses into one set of detections
+        
+        Tile boxes are mapped to whole-image coordinates, then same-label boxes
+        that are fragments of each other (cut at a seam, seen by two
+        overlapping tiles or also by the whole-image view) are fused into
+        their enclosing box.
+        
+        Args:
+            global_response: Whole-image primary response text (or the exception it raised)
+            tile_responses: (tile, response text or exception) pairs
+            original_width, original_height: Original image dimensions
+            image_width, image_height: Resized image dimensions
+            
+        Returns:
+            List of detection results in resized image coordinates
+        """
+        boxes = []
+        if isinstance(global_response, str):
+            boxes.extend(self.parser.parse_detection_response(global_response))
+        for tile, response in tile_responses:
+            if isinstance(response, str):
+                boxes.extend(
+                    tile_box_to_image(box, tile, original_width, original_height)
+                    for box in self.parser.parse_detection_response(response)
+                )
+        
+        boxes = [box for box in boxes if len(box) >= 5 and box[0] < box[2] and box[1] < box[3]]
+        if not boxes:
+            return []
+        
+        # [ymin, xmin, ymax, xmax] -> [x1, y1, x2, y2]; IoS does not depend on the axis scale
+        coordinates = box_ops.as_boxes([(box[1], box[0], box[3], box[2]) for box in boxes])
+        labels = [box[4].strip().lower() for box in boxes]
+        
+        results = []
+        for members, fused in box_ops.fuse_fragments(coordinates, labels, TILING_SEAM_IOS):
+            xmin, ymin, xmax, ymax = fused.tolist()
+            try:
+                result = self._process_box(
+                    (ymin, xmin, ymax, xmax, boxes[members[0]][4]),
+                    image_width, image_height, True, [], len(results) + 1
+                )
+            except (ValueError, IndexError) as e:
+                print(f"Error processing tiled box: {e}")
+                continue
+            if result is not None:
+                results.append(result)
+        return results
+    
+    async def _timed_call(self, report: Dict[str, Any], prompt: str, call: Awaitable[str]) -> str:
+        """
+        Await an AI call and record its duration and outcome in the report
+        
+        Args:
+            report: Strategy report to append the call record to
+            prompt: Prompt name ("primary" or "alternative")
+            call: Awaitable AI call
             
-            # Clean up results
-            results = self.parser.remove_duplicates(results)
-            results = self.parser.sort_by_area(results)
+        Returns:
+            AI response text
+        """
+        start = time.perf_counter()
+        status = "error"
+        response = None
+        try:
+            with metrics.call_in_flight(prompt):
+                response = await call
+            status = "completed"
+            return response
+        except asyncio.CancelledError:
+            status = "cancelled"
+            raise
+        finally:
+            self._record_call(report, prompt, status, start, response, self.ai_service.name)
+    
+    @staticmethod
+    def _record_call(report: Dict[str, Any], prompt: str, status: str, start: float,
+                     response: Optional[str] = None, backend: Optional[str] = None) -> None:
+        """
+        Append an AI call record to the strategy report
+        
+        Args:
+            report: Strategy report
+            prompt: Prompt name ("primary" or "alternative")
+            status: Call outcome ("completed", "cancelled" or "error")
+            start: perf_counter value when the call started
+            response: Response text; its backend is recorded when tagged (BackendResponse)
+            backend: Backend called, for the metrics of untagged responses and failed calls
+        """
+        duration = time.perf_counter() - start
+        call = {
+            "prompt": prompt,
+            "status": status,
+            "duration_ms": round(duration * 1000, 1)
+        }
+        tagged_backend = getattr(response, "backend", None)
+        if tagged_backend is not None:
+            call["backend"] = tagged_backend
+        report["calls"].append(call)
+        metrics.record_call(prompt, tagged_backend or backend or "unknown", status, duration)
+    
+    def _run_in_executor(self, func: Any, *args: Any) -> Awaitable[Any]:
+        """
+        Run a function on the image-processing executor in the caller's context
+        
+        The context carries the request's stage timings, so stages timed on
+        the executor thread show up in its Server-Timing header.
+        
+        Args:
+            func: Function to run
+            *args: Its arguments
             
-            # Calculate nutritional summary
-            nutritional_summary = calculate_nutritional_summary(results)
+        Returns:
+            Awaitable result
+        """
+        context = contextvars.copy_context()
+        return asyncio.get_running_loop().run_in_executor(self.executor, partial(context.run, func, *args))
+    
+    @staticmethod
+    def _decode_min_side() -> int:
+        """
+        Smallest longest side the decoded image must keep
+        
+        Sources much larger than needed are decoded at 1/2, 1/4 or 1/8 size.
+        The decoded image keeps at least TARGET_IMAGE_SIZE pixels; while tiled
+        mode is enabled, at least one tile (so tiles still add detail) and
+        TILING_MIN_SIDE when set (so the resolution trigger still fires).
+        """
+        if not TILING_ENABLED:
+            return TARGET_IMAGE_SIZE
+        return max(TARGET_IMAGE_SIZE, TILING_TILE_SIZE, TILING_MIN_SIDE)
+    
+    def _prepare_image(self, image_bytes: bytes) -> Tuple[Any, Any, int, int, Dict[str, Any]]:
+        """
+        Decode and resize image for the AI service
+        
+        Args:
+            image_bytes: Raw image bytes
             
-            # Convert processed image to base64
-            processed_image_base64 = self.image_processor.convert_to_base64(img_resized)
+        Returns:
+            Tuple of (decoded_image, resized_image, image_width, image_height, preparation),
+            where preparation reports sizes and decode/resize timings
+        """
+        prepared = prepare_image(image_bytes, self._decode_min_side())
+        self._record_preparation(prepared[4])
+        return prepared
+    
+    def _encode_upload(self, img_resized: Any, preparation: Dict[str, Any]) -> bytes:
+        """
+        Encode the resized image for the AI service and record size and timing
+        
+        Args:
+            img_resized: Resized OpenCV image
+            preparation: Preparation report from _prepare_image (updated in place)
+            
+        Returns:
+            Encoded image bytes (UPLOAD_IMAGE_FORMAT within UPLOAD_MAX_BYTES when possible)
+        """
+        image_data, encoding = encode_upload(img_resized)
+        self._record_upload(preparation, encoding)
+        return image_data
+    
+    @staticmethod
+    def _record_preparation(preparation: Dict[str, Any]) -> None:
+        """
+        Record the decode and resize timings of a preparation report as stage metrics
+        
+        Args:
+            preparation: Report from cpu_stages.prepare_image
+        """
+        timings = preparation["timings_ms"]
+        metrics.record_stage("decode", timings["decode"] / 1000)
+        metrics.record_stage("resize", timings["resize"] / 1000)
+    
+    @staticmethod
+    def _record_upload(preparation: Dict[str, Any], encoding: Dict[str, Any]) -> None:
+        """
+        Add an upload encoding report to the preparation report
+        
+        Args:
+            preparation: Preparation report (updated in place)
+            encoding: Report from cpu_stages.encode_upload
+        """
+        preparation["timings_ms"]["encode"] = encoding["encode_ms"]
+        metrics.record_stage("encode", encoding["encode_ms"] / 1000)
+        preparation["upload_bytes"] = encoding["upload_bytes"]
+        preparation["upload_format"] = encoding["upload_format"]
+        preparation["upload_quality"] = encoding["upload_quality"]
+    
+    @metrics.timed("cache_lookup")
+    def _lookup_cache(self, img_resized: Any, image_width: int,
+                      image_height: int) -> Tuple[Optional[str], Optional[int], Optional[Dict[str, Any]]]:
+        """
+        Look up a previous result for the same or a near-duplicate image
+        
+        An exact content match is returned as is. Otherwise, if a perceptually
+        similar image was analysed, its detections are rescaled to this image.
+        Either way the stored strategy report is replaced, since this request
+        made none of its AI calls.
+        
+        Args:
+            img_resized: Resized OpenCV image
+            image_width, image_height: Image dimensions
+            
+        Returns:
+            Tuple of (cache_key, image_hash, cached_result); all None when caching is disabled
+        """
+        if self.result_cache is None:
+            return None, None, None
+        
+        cache_key = compute_image_key(img_resized, self.ai_service.PROMPT_VERSION)
+        cached = self.result_cache.get(cache_key)
+        if cached is not None:
+            print(f"Result cache hit: {cache_key[:12]}")
+            return cache_key, None, {**cached, "cache_hit": True, "detection_strategy": self._cache_report()}
+        
+        if self.result_cache.near_duplicates is None:
+            return cache_key, None, None
+        
+        image_hash = self.image_processor.compute_dhash(img_resized)
+        match = self.result_cache.get_near_duplicate(image_hash)
+        if match is None:
+            return cache_key, image_hash, None
+        
+        cached, distance = match
+        print(f"Near-duplicate cache hit at distance {distance}")
+        rescaled = self._rescale_cached_result(cached, image_width, image_height, distance)
+        return cache_key, image_hash, {**rescaled, "detection_strategy": self._cache_report()}
+    
+    @staticmethod
+    def _rescale_cached_result(cached: Dict[str, Any], image_width: int,
+                               image_height: int, distance: int) -> Dict[str, Any]:
+        """
+        Adapt a near-duplicate's detections to the current image dimensions
+        
+        Args:
+            cached: Cached detection result of the similar image
+            image_width, image_height: Image dimensions
+            distance: Hamming distance between the perceptual hashes
             
-            # Log final results
-            self._log_results(results)
+        Returns:
+            Detection results dictionary for the current image
+        """
+        scale_x = image_width / cached["original_size"]["width"]
+        scale_y = image_height / cached["original_size"]["height"]
+        
+        results = []
+        for detection in cached["detections"]:
+            x1, y1, x2, y2 = detection["bbox"]
+            x1, x2 = int(x1 * scale_x), int(x2 * scale_x)
+            y1, y2 = int(y1 * scale_y), int(y2 * scale_y)
+            results.append({**detection, "bbox": [x1, y1, x2, y2], "area": (x2 - x1) * (y2 - y1)})
+        
+        return {
+            **cached,
+            "detections": results,
+            "original_size": {"width": image_width, "height": image_height},
+            "cache_hit": True,
+            "near_duplicate_distance": distance
+        }
+    
+    @staticmethod
+    def _cache_report() -> Dict[str, Any]:
+        """Strategy report of a result served from the cache: no AI calls"""
+        return {"strategy": "cache", "alternative_used": False, "calls": []}
+    
+    @metrics.timed("cache_store")
+    def _store_cache(self, cache_key: Optional[str], image_hash: Optional[int],
+                     result: Dict[str, Any]) -> None:
+        """
+        Store a detection result in the result cache
+        
+        Args:
+            cache_key: Key returned by _lookup_cache
+            image_hash: Perceptual hash returned by _lookup_cache
+            result: Detection results dictionary
+        """
+        if self.result_cache is not None and cache_key is not None:
+            self.result_cache.set(cache_key, result, image_hash)
+    
+    @metrics.timed("build")
+    def _build_response(self, results: List[dict], image_width: int,
+                        image_height: int, report: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        Turn processed detections into the detection results dictionary
+        
+        The annotated image is not part of this dictionary (and so not of the
+        cached result); _attach_processed_image adds it per request.
+        
+        Args:
+            results: Detection results from the primary and alternative prompts
+            image_width, image_height: Image dimensions
+            report: Strategy report with per-call timings
             
-            return {
-                "success": True,
-                "detections": results,
-                "processed_image": processed_image_base64,
-                "original_size": {"width": image_width, "height": image_height},
-                "total_objects": len(results),
-                "nutritional_summary": nutritional_summary,
-                "message": f"Detectados {len(results)} ingredientes alimentarios con información nutricional" if len(results) > 0 else "No se detectaron ingredientes específicos"
-            }
+        Returns:
+            Detection results dictionary
+        """
+        # Clean up results
+        results = self.parser.remove_duplicates(results)
+        results = self.parser.sort_by_area(results)
+        
+        # Estimate portion weights, then the portion-weighted nutritional summary
+        portions = estimate_portion_grams(results, image_width * image_height)
+        for result, grams in zip(results, portions.tolist()):
+            result["portion_grams"] = grams
+        nutritional_summary = calculate_nutritional_summary(results)
+        
+        if report["alternative_used"]:
+            metrics.ALTERNATIVE_FALLBACKS.labels(report["strategy"]).inc()
+        
+        # Log final results
+        self._log_results(results)
+        print(f"Detection strategy: {report['strategy']} - calls: {report['calls']}")
+        
+        return {
+            "success": True,
+            "detections": results,
+            "original_size": {"width": image_width, "height": image_height},
+            "total_objects": len(results),
+            "nutritional_summary": nutritional_summary,
+            "detection_strategy": report,
+            "cache_hit": False,
+            "message": f"Detectados {len(results)} ingredientes alimentarios con información nutricional" if len(results) > 0 else "No se detectaron ingredientes específicos"
+        }
+    
+    def _attach_processed_image(self, result: Dict[str, Any], img_resized: Any,
+                                image_data: Optional[bytes], image_mode: str,
+                                preparation: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+        """
+        Add processed_image (and the per-request image_preparation report) to a detection result
+        
+        - none: no annotated image; bounding boxes are not drawn at all
+        - inline: boxes drawn now and the JPEG inlined as a base64 data URL
+        - url: a short-lived /images/{id} URL that renders on first fetch
+        
+        Args:
+            result: Detection results dictionary
+            img_resized: Resized OpenCV image (drawn on in inline mode)
+            image_data: Upload encoding of the undrawn image, if already encoded
+                        (reused only when it is a JPEG at JPEG_QUALITY)
+            image_mode: "none", "inline" or "url"
+            preparation: Upload preparation report (bytes and timings) of this request
             
-        except Exception as e:
-            raise HTTPException(status_code=500, detail=f"Error processing image: {str(e)}")
+        Returns:
+            Detection results dictionary with processed_image
+        """
+        detections = result["detections"]
+        # The upload buffer stands in for the undrawn image only when it is what encode_jpeg
+        # would produce; a WebP or a lower rung of the quality ladder would look worse
+        reusable = (image_data is not None and preparation is not None
+                    and preparation.get("upload_format") == "jpeg"
+                    and preparation.get("upload_quality") == JPEG_QUALITY)
         
-        finally:
-            # Clean up temporary file
-            if image_path and os.path.exists(image_path):
-                try:
-                    os.unlink(image_path)
-                except:
-                    pass
-    
-    def _process_detections(self, response_text: str, img: Any, image_width: int, 
+        if image_mode == "none":
+            processed_image = None
+        elif image_mode == "url":
+            if not reusable:
+                image_data = self.image_processor.encode_jpeg(img_resized)
+            processed_image = f"/images/{self.annotated_images.add(image_data, detections)}"
+        elif not detections and reusable:
+            # Nothing to draw: the buffer sent to the AI service is the final image
+            with metrics.stage_timer("base64"):
+                processed_image = self.image_processor.encoded_to_base64(image_data)
+        else:
+            with metrics.stage_timer("draw"):
+                self.image_processor.draw_detections(img_resized, detections)
+            with metrics.stage_timer("base64"):
+                processed_image = self.image_processor.convert_to_base64(img_resized)
+        
+        return {**result, "processed_image": processed_image, "image_preparation": preparation}
+    
+    @metrics.timed("parse")
+    def _process_detections(self, response_text: str, image_width: int, 
                           image_height: int, is_primary: bool = True, 
                           existing_results: List[dict] = None) -> List[dict]:
         """
-        Process AI detection response and draw bounding boxes
+        Process AI detection response into detection results
         
         Args:
             response_text: AI response text
-            img: OpenCV image to draw on
             image_width, image_height: Image dimensions
             is_primary: Whether this is primary or alternative detection
             existing_results: Existing detection results to check for overlaps
@@ -116,58 +970,14 @@ class IngredientDetectionService:
         bounding_boxes = self.parser.parse_detection_response(response_text)
         results = []
         
-        # Color for drawing (green for primary, red for alternative)
-        color = (0, 255, 0) if is_primary else (255, 0, 0)
-        
         for i, box in enumerate(bounding_boxes):
             try:
-                # Extract coordinates and label
-                if len(box) < 5:
-                    continue
-                
-                ymin, xmin, ymax, xmax, label = box[:5]
-                ymin, xmin, ymax, xmax = float(ymin), float(xmin), float(ymax), float(xmax)
-                
-                # Skip invalid coordinates
-                if ymin >= ymax or xmin >= xmax:
-                    continue
-                
-                # Convert to pixel coordinates
-                x1, y1, x2, y2 = self.image_processor.normalize_coordinates(
-                    ymin, xmin, ymax, xmax, image_width, image_height
-                )
-                
-                # Skip invalid boxes
-                if not self.image_processor.is_valid_box(x1, y1, x2, y2):
-                    continue
-                
-                # Filter non-food items
-                label_clean = label.strip().lower()
-                if not self.parser.is_food_item(label_clean):
-                    print(f"Filtering out non-food item: {label_clean}")
-                    continue
-                
-                # Check for overlaps with existing detections
-                if self._has_overlap([x1, y1, x2, y2], existing_results):
-                    continue
-                
-                # Draw bounding box
-                self.image_processor.draw_bounding_box(img, x1, y1, x2, y2, label_clean, color)
-                
-                # Get nutritional information
-                nutrition_info = get_nutritional_info(label_clean)
-                
-                # Create detection result
-                result = self.parser.create_detection_result(
-                    len(results) + len(existing_results) + 1,
-                    label_clean,
-                    [x1, y1, x2, y2],
-                    [int(ymin), int(xmin), int(ymax), int(xmax)],
-                    nutrition_info,
-                    is_primary
+                result = self._process_box(
+                    box, image_width, image_height, is_primary,
+                    existing_results, len(results) + len(existing_results) + 1
                 )
-                
-                results.append(result)
+                if result is not None:
+                    results.append(result)
                 
             except (ValueError, IndexError) as e:
                 print(f"Error processing box {i}: {e}")
@@ -175,7 +985,66 @@ class IngredientDetectionService:
         
         return results
     
-    def _has_overlap(self, bbox: List[int], existing_results: List[dict], threshold: float = 0.3) -> bool:
+    def _process_box(self, box: tuple, image_width: int, image_height: int,
+                     is_primary: bool, existing_results: List[dict],
+                     detection_id: int) -> Optional[dict]:
+        """
+        Validate a parsed box and build its detection result
+        
+        Args:
+            box: Parsed tuple (ymin, xmin, ymax, xmax, label)
+            image_width, image_height: Image dimensions
+            is_primary: Whether this is primary or alternative detection
+            existing_results: Detection results to check for overlaps
+            detection_id: ID for the new detection
+            
+        Returns:
+            Detection result, or None if the box is skipped
+        """
+        # Extract coordinates and label
+        if len(box) < 5:
+            return None
+        
+        ymin, xmin, ymax, xmax, label = box[:5]
+        
+        # Skip invalid coordinates
+        if ymin >= ymax or xmin >= xmax:
+            return None
+        
+        # Convert to pixel coordinates
+        x1, y1, x2, y2 = self.image_processor.normalize_coordinates(
+            ymin, xmin, ymax, xmax, image_width, image_height
+        )
+        
+        # Skip invalid boxes
+        if not self.image_processor.is_valid_box(x1, y1, x2, y2):
+            return None
+        
+        # Filter non-food items
+        label_clean = label.strip().lower()
+        if not self.parser.is_food_item(label_clean):
+            print(f"Filtering out non-food item: {label_clean}")
+            return None
+        
+        # Check for overlaps with existing detections
+        if self._has_overlap([x1, y1, x2, y2], existing_results):
+            return None
+        
+        # Get nutritional information
+        nutrition_info = get_nutritional_info(label_clean)
+        
+        # Create detection result
+        return self.parser.create_detection_result(
+            detection_id,
+            label_clean,
+            [x1, y1, x2, y2],
+            [int(ymin), int(xmin), int(ymax), int(xmax)],
+            nutrition_info,
+            is_primary
+        )
+    
+    def _has_overlap(self, bbox: List[int], existing_results: List[dict],
+                     threshold: float = OVERLAP_IOU_THRESHOLD) -> bool:
         """
         Check if bounding box overlaps with existing detections
         
@@ -187,12 +1056,10 @@ class IngredientDetectionService:
         Returns:
             True if overlap exists
         """
-        for existing in existing_results:
-            existing_bbox = existing['bbox']
-            iou = self.image_processor.calculate_overlap(bbox, existing_bbox)
-            if iou > threshold:
-                return True
-        return False
+        if not existing_results:
+            return False
+        existing_boxes = box_ops.as_boxes([existing['bbox'] for existing in existing_results])
+        return box_ops.max_iou(bbox, existing_boxes) > threshold
     
     def _log_results(self, results: List[dict]) -> None:
         """
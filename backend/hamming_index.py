@@ -0,0 +1,178 @@
+"""
+Multi-index hashing for Hamming-distance search over 64-bit perceptual hashes
+"""
+import threading
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+
+HASH_BITS = 64
+
+# Bit counts for every byte value, used to popcount uint64 arrays
+_POPCOUNT_TABLE = np.array([bin(i).count('1') for i in range(256)], dtype=np.uint8)
+
+
+def hamming_distances(hashes: np.ndarray, query: int) -> np.ndarray:
+    """
+    Compute Hamming distances between a query and an array of hashes
+    
+    Args:
+        hashes: uint64 array of stored hashes
+        query: 64-bit query hash
+        
+    Returns:
+        Array of distances (0-64)
+    """
+    xor = np.bitwise_xor(hashes, np.uint64(query))
+    return _POPCOUNT_TABLE[xor.view(np.uint8)].reshape(-1, 8).sum(axis=1)
+
+
+class HammingIndex:
+    """
+    Near-duplicate index using multi-index hashing
+    
+    Each 64-bit hash is split into `chunks` substrings, each with its own
+    bucket table. By the pigeonhole principle, any hash within distance r
+    of the query matches the query in at least one substring within
+    distance r // chunks, so only those buckets need to be probed before
+    verifying candidates with a vectorized popcount.
+    
+    Each payload is stored once. Removed entries leave their buckets at once
+    and their slot is reused by the next add; with max_entries set, adding
+    beyond it removes the oldest entry.
+    """
+    
+    def __init__(self, max_distance: int, chunks: int = 4, initial_capacity: int = 1024,
+                 max_entries: Optional[int] = None):
+        """
+        Initialize index
+        
+        Args:
+            max_distance: Largest Hamming distance considered a match
+            chunks: Number of substrings (must divide 64)
+            initial_capacity: Initial size of the hash array
+            max_entries: Entries kept before the oldest is removed (None = unbounded)
+        """
+        if HASH_BITS % chunks:
+            raise ValueError("chunks must divide 64")
+        self.max_distance = max_distance
+        self.chunks = chunks
+        self.chunk_bits = HASH_BITS // chunks
+        self.max_entries = max_entries
+        self._chunk_mask = (1 << self.chunk_bits) - 1
+        self._probe_offsets = self._build_probe_offsets(max_distance // chunks)
+        self._lock = threading.Lock()
+        self.reset(initial_capacity)
+    
+    def reset(self, initial_capacity: int = 1024) -> None:
+        """Remove every stored hash"""
+        self._hashes = np.zeros(initial_capacity, dtype=np.uint64)
+        self._payloads: List[Any] = []
+        self._tables: List[Dict[int, List[int]]] = [{} for _ in range(self.chunks)]
+        # Payload -> slot, in insertion order (oldest first)
+        self._slots: Dict[Any, int] = {}
+        self._free: List[int] = []
+    
+    def _build_probe_offsets(self, radius: int) -> List[int]:
+        """List every XOR mask of chunk_bits bits with at most `radius` bits set"""
+        offsets = [0]
+        frontier = [0]
+        for _ in range(radius):
+            next_frontier = []
+            for mask in frontier:
+                highest = mask.bit_length()
+                for bit in range(highest, self.chunk_bits):
+                    next_frontier.append(mask | (1 << bit))
+            offsets.extend(next_frontier)
+            frontier = next_frontier
+        return offsets
+    
+    def _split(self, value: int) -> List[int]:
+        """Split a 64-bit hash into its substrings"""
+        return [(value >> (i * self.chunk_bits)) & self._chunk_mask for i in range(self.chunks)]
+    
+    def add(self, value: int, payload: Any) -> None:
+        """
+        Store a hash with its payload, replacing the payload's previous hash
+        
+        Args:
+            value: 64-bit perceptual hash
+            payload: Hashable object returned by search for this hash
+        """
+        with self._lock:
+            self._remove(payload)
+            if self.max_entries is not None:
+                while self._slots and len(self._slots) >= self.max_entries:
+                    self._remove(next(iter(self._slots)))
+            
+            if self._free:
+                index = self._free.pop()
+                self._payloads[index] = payload
+            else:
+                index = len(self._payloads)
+                if index == len(self._hashes):
+                    grown = np.zeros(len(self._hashes) * 2, dtype=np.uint64)
+                    grown[:index] = self._hashes
+                    self._hashes = grown
+                self._payloads.append(payload)
+            self._hashes[index] = value
+            self._slots[payload] = index
+            for table, chunk in zip(self._tables, self._split(value)):
+                table.setdefault(chunk, []).append(index)
+    
+    def remove(self, payload: Any) -> bool:
+        """
+        Remove a payload's hash
+        
+        Args:
+            payload: Payload given to add
+            
+        Returns:
+            True if it was stored
+        """
+        with self._lock:
+            return self._remove(payload)
+    
+    def _remove(self, payload: Any) -> bool:
+        index = self._slots.pop(payload, None)
+        if index is None:
+            return False
+        for table, chunk in zip(self._tables, self._split(int(self._hashes[index]))):
+            bucket = table[chunk]
+            bucket.remove(index)
+            if not bucket:
+                del table[chunk]
+        self._payloads[index] = None
+        self._free.append(index)
+        return True
+    
+    def search(self, value: int) -> Optional[Tuple[Any, int]]:
+        """
+        Find the closest stored hash within max_distance
+        
+        Args:
+            value: 64-bit query hash
+            
+        Returns:
+            Tuple of (payload, distance) or None if nothing is close enough
+        """
+        with self._lock:
+            candidates: List[int] = []
+            for table, chunk in zip(self._tables, self._split(value)):
+                for offset in self._probe_offsets:
+                    bucket = table.get(chunk ^ offset)
+                    if bucket:
+                        candidates.extend(bucket)
+            if not candidates:
+                return None
+            
+            # Duplicates (a hash matching in several substrings) do not affect the minimum
+            ids = np.array(candidates, dtype=np.int64)
+            distances = hamming_distances(self._hashes[ids], value)
+            best = int(np.argmin(distances))
+            if distances[best] > self.max_distance:
+                return None
+            return self._payloads[ids[best]], int(distances[best])
+    
+    def __len__(self) -> int:
+        return len(self._slots)
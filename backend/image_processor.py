@@ -2,11 +2,38 @@
 Image processing utilities for ingredient detection
 """
 import cv2
+import io
 import numpy as np
-import tempfile
 import base64
-from typing import Tuple, List, Dict, Any
-from config import TARGET_IMAGE_SIZE, BBOX_OFFSET_X, BBOX_OFFSET_Y, MIN_BOX_SIZE
+from typing import Tuple, List, Dict, Any, Optional, Sequence
+from PIL import Image
+from config import (
+    TARGET_IMAGE_SIZE, BBOX_OFFSET_X, BBOX_OFFSET_Y, MIN_BOX_SIZE,
+    UPLOAD_IMAGE_FORMAT, UPLOAD_MAX_BYTES, UPLOAD_QUALITY_LADDER
+)
+
+# Reduced-size decode flags, largest factor first (JPEG is decoded straight at 1/8, 1/4 or 1/2 scale)
+REDUCED_DECODE_FLAGS = (
+    (8, cv2.IMREAD_REDUCED_COLOR_8),
+    (4, cv2.IMREAD_REDUCED_COLOR_4),
+    (2, cv2.IMREAD_REDUCED_COLOR_2)
+)
+
+# Image headers (format, dimensions) are read from at most this many leading bytes
+IMAGE_HEADER_BYTES = 1024 * 1024
+
+# Pillow only reads headers here; the pixel cap is INTAKE_MAX_PIXELS (upload_intake.py),
+# so its decompression bomb check must not hide the dimensions of large images
+Image.MAX_IMAGE_PIXELS = None
+
+# Quality of encode_jpeg (OpenCV's default), the one processed_image is returned at
+JPEG_QUALITY = 95
+
+# Upload format -> (file extension, quality parameter)
+UPLOAD_ENCODINGS = {
+    "jpeg": (".jpg", cv2.IMWRITE_JPEG_QUALITY),
+    "webp": (".webp", cv2.IMWRITE_WEBP_QUALITY)
+}
 
 class ImageProcessor:
     """Handles image processing operations"""
@@ -30,6 +57,52 @@ class ImageProcessor:
         
         return img
     
+    @staticmethod
+    def read_image_size(image_bytes: bytes) -> Optional[Tuple[str, int, int]]:
+        """
+        Read the format and dimensions from the image header without decoding pixels
+        
+        Only the first IMAGE_HEADER_BYTES are inspected, so a partial upload is enough.
+        
+        Args:
+            image_bytes: Raw image bytes (or their first bytes)
+            
+        Returns:
+            Tuple of (format, width, height), or None if the header is not recognized
+        """
+        try:
+            with Image.open(io.BytesIO(image_bytes[:IMAGE_HEADER_BYTES])) as image:
+                return image.format, image.width, image.height
+        except Exception:
+            return None
+    
+    @classmethod
+    def decode_reduced(cls, image_bytes: bytes, min_side: int) -> Tuple[np.ndarray, int]:
+        """
+        Decode an image at the smallest reduced size that keeps min_side pixels
+        
+        The largest factor (8, 4 or 2) whose result still has a longest side
+        of at least min_side is used, so a 48 MP photo is never decoded at
+        full size when only an 800 px image is needed.
+        
+        Args:
+            image_bytes: Raw image bytes
+            min_side: Minimum longest side of the decoded image
+            
+        Returns:
+            Tuple of (OpenCV image, reduction factor; 1 for a full decode)
+        """
+        header = cls.read_image_size(image_bytes)
+        if header is not None:
+            longest_side = max(header[1], header[2])
+            for factor, flag in REDUCED_DECODE_FLAGS:
+                if longest_side // factor >= min_side:
+                    img = cv2.imdecode(np.frombuffer(image_bytes, np.uint8), flag)
+                    if img is None:
+                        raise ValueError("Could not decode image")
+                    return img, factor
+        return cls.decode_image(image_bytes), 1
+    
     @staticmethod
     def resize_image(img: np.ndarray) -> Tuple[np.ndarray, int, int, int, int]:
         """
@@ -51,7 +124,9 @@ class ImageProcessor:
             new_height = TARGET_IMAGE_SIZE
             new_width = int((TARGET_IMAGE_SIZE * original_width) / original_height)
         
-        img_resized = cv2.resize(img, (new_width, new_height))
+        # Area interpolation averages the source pixels when shrinking (no aliasing)
+        interpolation = cv2.INTER_AREA if new_width < original_width else cv2.INTER_LINEAR
+        img_resized = cv2.resize(img, (new_width, new_height), interpolation=interpolation)
         
         print(f"Original size: {original_width}x{original_height}")
         print(f"Resized to: {new_width}x{new_height}")
@@ -59,19 +134,123 @@ class ImageProcessor:
         return img_resized, new_width, new_height, original_width, original_height
     
     @staticmethod
-    def save_temp_image(img: np.ndarray) -> str:
+    def fit_within(img: np.ndarray, max_side: int = TARGET_IMAGE_SIZE) -> np.ndarray:
+        """
+        Downscale an image so its longest side is at most max_side (never upscales)
+        
+        Args:
+            img: OpenCV image
+            max_side: Maximum width or height in pixels
+            
+        Returns:
+            The image itself if it already fits, else a downscaled copy
+        """
+        height, width = img.shape[:2]
+        scale = max_side / max(width, height)
+        if scale >= 1:
+            return img
+        size = (max(1, round(width * scale)), max(1, round(height * scale)))
+        return cv2.resize(img, size, interpolation=cv2.INTER_AREA)
+    
+    @staticmethod
+    def compute_dhash(img: np.ndarray) -> int:
+        """
+        Compute a 64-bit difference hash (dHash) for near-duplicate lookup
+        
+        The image is reduced to a 9x8 grayscale thumbnail and each bit records
+        whether a pixel is brighter than its right neighbour, so the hash
+        survives re-encoding, rescaling and small crops.
+        
+        Args:
+            img: OpenCV image
+            
+        Returns:
+            Perceptual hash as an integer
+        """
+        gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
+        thumbnail = cv2.resize(gray, (9, 8), interpolation=cv2.INTER_AREA)
+        bits = thumbnail[:, 1:] > thumbnail[:, :-1]
+        return int.from_bytes(np.packbits(bits).tobytes(), 'big')
+    
+    @staticmethod
+    def encode_jpeg(img: np.ndarray) -> bytes:
+        """
+        Encode image as JPEG in memory
+        
+        Args:
+            img: OpenCV image
+            
+        Returns:
+            JPEG bytes
+        """
+        success, buffer = cv2.imencode('.jpg', img, [cv2.IMWRITE_JPEG_QUALITY, JPEG_QUALITY])
+        if not success:
+            raise ValueError("Could not encode image")
+        return buffer.tobytes()
+    
+    @staticmethod
+    def encode_for_upload(img: np.ndarray, image_format: str = UPLOAD_IMAGE_FORMAT,
+                          max_bytes: int = UPLOAD_MAX_BYTES,
+                          qualities: Sequence[int] = UPLOAD_QUALITY_LADDER) -> Tuple[bytes, int]:
         """
-        Save image to temporary file
+        Encode an image for the AI service within a byte budget
+        
+        The highest quality is tried first (the common case for a resized
+        photo), then a binary search over the rest of the ladder finds the
+        highest quality that fits max_bytes; if none fits, the lowest is used.
         
         Args:
             img: OpenCV image
+            image_format: "jpeg" or "webp"
+            max_bytes: Byte budget for the encoded image
+            qualities: Qualities to try, highest first
             
         Returns:
-            Path to temporary file
+            Tuple of (encoded bytes, quality used)
         """
-        with tempfile.NamedTemporaryFile(delete=False, suffix=".jpg") as tmp:
-            cv2.imwrite(tmp.name, img)
-            return tmp.name
+        extension, quality_flag = UPLOAD_ENCODINGS[image_format]
+        
+        def encode(quality: int) -> bytes:
+            success, buffer = cv2.imencode(extension, img, [quality_flag, quality])
+            if not success:
+                raise ValueError("Could not encode image")
+            return buffer.tobytes()
+        
+        data = encode(qualities[0])
+        if len(data) <= max_bytes or len(qualities) == 1:
+            return data, qualities[0]
+        
+        low, high = 1, len(qualities) - 1
+        best = None
+        while low <= high:
+            middle = (low + high) // 2
+            data = encode(qualities[middle])
+            if len(data) <= max_bytes:
+                best = (data, qualities[middle])
+                high = middle - 1
+            else:
+                low = middle + 1
+        if best is None:
+            # Nothing fits: the search ended on the lowest quality, which was encoded last
+            best = (data, qualities[-1])
+        return best
+    
+    @staticmethod
+    def mime_type(image_data: bytes) -> str:
+        """
+        MIME type of encoded image bytes, from their signature
+        
+        Args:
+            image_data: Encoded image bytes
+            
+        Returns:
+            "image/webp", "image/png" or "image/jpeg"
+        """
+        if image_data[:4] == b"RIFF" and image_data[8:12] == b"WEBP":
+            return "image/webp"
+        if image_data[:8] == b"\x89PNG\r\n\x1a\n":
+            return "image/png"
+        return "image/jpeg"
     
     @staticmethod
     def draw_bounding_box(img: np.ndarray, x1: int, y1: int, x2: int, y2: int, 
@@ -114,8 +293,36 @@ class ImageProcessor:
             cv2.FONT_HERSHEY_SIMPLEX, font_scale, (255, 255, 255), font_thickness
         )
     
-    @staticmethod
-    def convert_to_base64(img: np.ndarray) -> str:
+    @classmethod
+    def draw_detections(cls, img: np.ndarray, detections: List[Dict[str, Any]]) -> None:
+        """
+        Draw every detection on the image (green for primary, red for alternative)
+        
+        Args:
+            img: OpenCV image
+            detections: Detection results with bbox, label and source
+        """
+        for detection in detections:
+            x1, y1, x2, y2 = detection['bbox']
+            color = (255, 0, 0) if detection.get('source') == 'alternative' else (0, 255, 0)
+            cls.draw_bounding_box(img, x1, y1, x2, y2, detection['label'].lower(), color)
+    
+    @classmethod
+    def encoded_to_base64(cls, image_data: bytes) -> str:
+        """
+        Convert encoded image bytes (JPEG or WebP) to a base64 data URL
+        
+        Args:
+            image_data: Encoded image bytes
+            
+        Returns:
+            Base64 encoded image string
+        """
+        image_base64 = base64.b64encode(image_data).decode('utf-8')
+        return f"data:{cls.mime_type(image_data)};base64,{image_base64}"
+    
+    @classmethod
+    def convert_to_base64(cls, img: np.ndarray) -> str:
         """
         Convert OpenCV image to base64 string
         
@@ -125,9 +332,7 @@ class ImageProcessor:
         Returns:
             Base64 encoded image string
         """
-        _, buffer = cv2.imencode('.jpg', img)
-        image_base64 = base64.b64encode(buffer).decode('utf-8')
-        return f"data:image/jpeg;base64,{image_base64}"
+        return cls.encoded_to_base64(cls.encode_jpeg(img))
     
     @staticmethod
     def normalize_coordinates(ymin: float, xmin: float, ymax: float, xmax: float, 
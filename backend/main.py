@@ -2,23 +2,81 @@
 DetectiVision AI - Main FastAPI Application
 API para detección de ingredientes en imágenes usando Google Gemini AI
 """
-import base64
-import uvicorn
-from fastapi import FastAPI, File, UploadFile, HTTPException
+import json
+import asyncio
+from contextlib import asynccontextmanager
+from typing import List, Literal
+from fastapi import FastAPI, File, UploadFile, HTTPException, Query, Request
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, StreamingResponse, Response
 
 from config import (
     APP_TITLE, APP_DESCRIPTION, APP_VERSION, 
-    ALLOWED_ORIGINS, HOST, PORT
+    ALLOWED_ORIGINS, HOST, PORT,
+    BATCH_MAX_IMAGES, BATCH_MAX_BYTES, BATCH_DEFAULT_CONCURRENCY, BATCH_MAX_CONCURRENCY,
+    BATCH_DEFAULT_DEADLINE_SECONDS, BATCH_MAX_DEADLINE_SECONDS,
+    PROCESSED_IMAGE_DEFAULT_MODE, INTAKE_MAX_BYTES, METRICS_ENABLED, REQUEST_DEADLINE_SECONDS,
+    ADMISSION_ENABLED, ADMISSION_MAX_IN_FLIGHT, ADMISSION_BATCH_MAX_IN_FLIGHT, ADMISSION_MAX_QUEUE,
+    ADMISSION_INTERACTIVE_API_KEYS, ADMISSION_BATCH_API_KEYS
 )
 from detection_service import IngredientDetectionService
+from batch_processor import BatchBudget, is_archive, extract_archive, stream_batch
+from nutrition import calculate_combined_summary
+from upload_intake import read_upload, read_base64_image, RequestBodyLimitMiddleware
+from admission import AdmissionController, AdmissionMiddleware
+import metrics
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """
+    Start warming the detection service in the background and stop it on shutdown
+    
+    The server accepts requests (and answers /health/live) at once;
+    /health/ready turns 200 when the warm-up has finished.
+    """
+    startup = asyncio.create_task(detection_service.start())
+    yield
+    startup.cancel()
+    detection_service.shutdown()
 
 # Initialize FastAPI app
 app = FastAPI(
     title=APP_TITLE,
     description=APP_DESCRIPTION,
-    version=APP_VERSION
+    version=APP_VERSION,
+    lifespan=lifespan
+)
+
+# Admission control and load shedding of the detection endpoints (inside CORS, so
+# refused requests still carry the CORS headers)
+admission = AdmissionController(
+    ADMISSION_MAX_IN_FLIGHT, ADMISSION_BATCH_MAX_IN_FLIGHT, ADMISSION_MAX_QUEUE
+) if ADMISSION_ENABLED else None
+if admission is not None:
+    app.add_middleware(
+        AdmissionMiddleware,
+        controller=admission,
+        routes={
+            "/detect-objects": ("interactive", 1, REQUEST_DEADLINE_SECONDS),
+            "/detect-objects/stream": ("interactive", 1, REQUEST_DEADLINE_SECONDS),
+            "/detect-objects-base64": ("batch", 1, REQUEST_DEADLINE_SECONDS),
+            "/detect-objects/batch": ("batch", BATCH_DEFAULT_CONCURRENCY, BATCH_DEFAULT_DEADLINE_SECONDS)
+        },
+        batch_paths=["/detect-objects/batch"],
+        interactive_keys=ADMISSION_INTERACTIVE_API_KEYS,
+        batch_keys=ADMISSION_BATCH_API_KEYS
+    )
+
+# Hard cap on request bodies of the detection endpoints (images plus multipart/JSON overhead),
+# inside CORS so browsers can read its 413 and outside admission so no slot is taken
+app.add_middleware(
+    RequestBodyLimitMiddleware,
+    limits={
+        "/detect-objects": INTAKE_MAX_BYTES + 64 * 1024,
+        "/detect-objects/stream": INTAKE_MAX_BYTES + 64 * 1024,
+        "/detect-objects-base64": INTAKE_MAX_BYTES * 4 // 3 + 64 * 1024,
+        "/detect-objects/batch": BATCH_MAX_BYTES + 1024 * 1024
+    }
 )
 
 # Configure CORS
@@ -28,8 +86,16 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["Server-Timing", "Retry-After"],
 )
 
+# Request metrics and Server-Timing header (outermost, so rejected bodies are counted too)
+if METRICS_ENABLED:
+    app.add_middleware(metrics.MetricsMiddleware)
+
+# processed_image response mode: none, inline base64 JPEG or /images/{id} URL
+ProcessedImageMode = Literal["none", "inline", "url"]
+
 # Initialize detection service
 detection_service = IngredientDetectionService()
 
@@ -49,16 +115,75 @@ async def health_check():
     return {
         "status": "healthy", 
         "service": "ingredient-detection-api",
-        "ai_service_available": detection_service.ai_service.is_available()
+        "ready": detection_service.ready,
+        "startup": detection_service.startup,
+        "ai_service_available": detection_service.ai_service.is_available(),
+        "detection_backend": detection_service.ai_service.describe(),
+        "result_cache": detection_service.result_cache.get_stats() if detection_service.result_cache else None,
+        "coalescing": detection_service.single_flight.get_stats() if detection_service.single_flight else None,
+        "admission": admission.get_stats() if admission is not None else None,
+        "parser": {
+            "structured_output": detection_service.ai_service.structured_output,
+            **detection_service.parser.get_stats()
+        }
     }
 
+@app.get("/health/live")
+async def liveness():
+    """Liveness probe: the process is up and serving requests"""
+    return {"status": "alive"}
+
+@app.get("/health/ready")
+async def readiness():
+    """Readiness probe: 200 once the startup warm-up finished, 503 before"""
+    if not detection_service.ready:
+        return JSONResponse({"status": "starting", "startup": detection_service.startup}, status_code=503)
+    return {"status": "ready"}
+
+@app.get("/metrics")
+async def metrics_endpoint():
+    """
+    Prometheus metrics: per-stage and detection call histograms, fallbacks,
+    requests in flight and response sizes (summed over all workers)
+    """
+    if not METRICS_ENABLED:
+        raise HTTPException(status_code=404, detail="Metrics are disabled")
+    return Response(content=metrics.render(), media_type=metrics.CONTENT_TYPE)
+
+@app.get("/images/{image_id}")
+async def get_annotated_image(image_id: str):
+    """
+    Endpoint serving an annotated image requested with processed_image=url
+    
+    The image is rendered on first fetch and cached until it expires.
+    
+    Args:
+        image_id: Id from the processed_image URL
+        
+    Returns:
+        JPEG image with bounding boxes
+    """
+    loop = asyncio.get_running_loop()
+    image = await loop.run_in_executor(
+        detection_service.executor, detection_service.annotated_images.render, image_id
+    )
+    if image is None:
+        raise HTTPException(status_code=404, detail="Image not found or expired")
+    
+    max_age = int(detection_service.annotated_images.ttl_seconds)
+    return Response(content=image, media_type="image/jpeg", headers={"Cache-Control": f"private, max-age={max_age}"})
+
 @app.post("/detect-objects")
-async def detect_objects(file: UploadFile = File(...)):
+async def detect_objects(
+    file: UploadFile = File(...),
+    processed_image: ProcessedImageMode = Query(PROCESSED_IMAGE_DEFAULT_MODE)
+):
     """
     Endpoint to detect ingredients in uploaded image
     
     Args:
         file: Uploaded image file
+        processed_image: Annotated image as "none", "inline" base64 or "url"
         
     Returns:
         Detection results with bounding boxes and nutritional information
@@ -68,11 +193,11 @@ async def detect_objects(file: UploadFile = File(...)):
         raise HTTPException(status_code=400, detail="File must be an image")
     
     try:
-        # Read image file
-        image_bytes = await file.read()
+        # Read image file in chunks, rejecting oversize or non-image uploads early
+        image_bytes = await read_upload(file)
         
         # Process image
-        result = detection_service.process_image(image_bytes)
+        result = await detection_service.process_image_async(image_bytes, processed_image)
         
         return JSONResponse(content=result)
         
@@ -81,38 +206,157 @@ async def detect_objects(file: UploadFile = File(...)):
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Internal server error: {str(e)}")
 
-@app.post("/detect-objects-base64")
-async def detect_objects_base64(image_data: dict):
+@app.post("/detect-objects/stream")
+async def detect_objects_stream(
+    file: UploadFile = File(...),
+    processed_image: ProcessedImageMode = Query(PROCESSED_IMAGE_DEFAULT_MODE)
+):
+    """
+    Endpoint to detect ingredients with detections streamed as they are generated
+    
+    Args:
+        file: Uploaded image file
+        processed_image: Annotated image as "none", "inline" base64 or "url"
+        
+    Returns:
+        NDJSON stream: one "detection" event per ingredient, then a "result"
+        event with the annotated image and nutritional summary
+    """
+    # Validate file type
+    if not file.content_type.startswith('image/'):
+        raise HTTPException(status_code=400, detail="File must be an image")
+    
+    image_bytes = await read_upload(file)
+    
+    async def ndjson():
+        async for event in detection_service.process_image_stream(image_bytes, processed_image):
+            yield json.dumps(event) + "\n"
+    
+    return StreamingResponse(ndjson(), media_type="application/x-ndjson")
+
+@app.post("/detect-objects/batch")
+async def detect_objects_batch(
+    request: Request,
+    files: List[UploadFile] = File(...),
+    concurrency: int = Query(BATCH_DEFAULT_CONCURRENCY, ge=1, le=BATCH_MAX_CONCURRENCY),
+    deadline_seconds: float = Query(BATCH_DEFAULT_DEADLINE_SECONDS, gt=0, le=BATCH_MAX_DEADLINE_SECONDS),
+    processed_image: ProcessedImageMode = Query(PROCESSED_IMAGE_DEFAULT_MODE)
+):
+    """
+    Endpoint to detect ingredients in many images per request
+    
+    Accepts several image files and/or zip/tar archives of images. Results
+    stream back as NDJSON, one line per image as soon as it finishes,
+    followed by a summary line.
+    
+    Args:
+        files: Uploaded images or archives
+        request: Incoming request (admission state)
+        concurrency: Maximum images processed at the same time (at most the admission slots granted)
+        deadline_seconds: Total time budget for the batch
+        processed_image: Annotated image as "none", "inline" base64 or "url"
+        
+    Returns:
+        NDJSON stream of per-image results
+    """
+    # Admission may grant fewer slots than requested (ADMISSION_BATCH_MAX_IN_FLIGHT)
+    concurrency = min(concurrency, getattr(request.state, "admission_slots", concurrency))
+    images = []
+    budget = BatchBudget(BATCH_MAX_IMAGES, BATCH_MAX_BYTES)
+    for file in files:
+        if is_archive(file.filename, file.content_type):
+            # The whole body is capped by RequestBodyLimitMiddleware; entries are checked before decompressing
+            data = await file.read()
+            images.extend(await asyncio.to_thread(extract_archive, file.filename, data, budget))
+        elif file.content_type and file.content_type.startswith('image/'):
+            image_bytes = await read_upload(file)
+            budget.reserve(len(image_bytes))
+            images.append((file.filename, image_bytes))
+        else:
+            raise HTTPException(status_code=400, detail=f"File must be an image or archive: {file.filename}")
+    
+    if not images:
+        raise HTTPException(status_code=400, detail="No images found in batch")
+    
+    async def ndjson():
+        async for item in stream_batch(detection_service, images, concurrency, deadline_seconds, processed_image):
+            yield json.dumps(item) + "\n"
+    
+    return StreamingResponse(ndjson(), media_type="application/x-ndjson")
+
+@app.post(
+    "/detect-objects-base64",
+    openapi_extra={
+        "requestBody": {
+            "required": True,
+            "content": {
+                "application/json": {
+                    "schema": {
+                        "type": "object",
+                        "required": ["image"],
+                        "properties": {"image": {"type": "string", "description": "Base64 image or data URL"}}
+                    }
+                }
+            }
+        }
+    }
+)
+async def detect_objects_base64(
+    request: Request,
+    processed_image: ProcessedImageMode = Query(PROCESSED_IMAGE_DEFAULT_MODE)
+):
     """
     Endpoint to detect ingredients from base64 encoded image
     
+    The JSON body {"image": "<base64 or data URL>"} is decoded while it
+    streams in, without materializing the body, the string and the bytes.
+    
     Args:
-        image_data: Dictionary containing base64 encoded image
+        request: Request with the JSON body
+        processed_image: Annotated image as "none", "inline" base64 or "url"
         
     Returns:
         Detection results with bounding boxes and nutritional information
     """
+    content_length = request.headers.get("content-length")
+    image_bytes = await read_base64_image(
+        request.stream(), int(content_length) if content_length and content_length.isdigit() else None
+    )
+    
     try:
-        # Extract base64 data
-        if "image" not in image_data:
-            raise HTTPException(status_code=400, detail="Missing 'image' field")
-        
-        base64_string = image_data["image"]
-        
-        # Remove data URL prefix if present
-        if base64_string.startswith('data:image'):
-            base64_string = base64_string.split(',')[1]
-        
-        # Decode base64
-        image_bytes = base64.b64decode(base64_string)
-        
         # Process image
-        result = detection_service.process_image(image_bytes)
+        result = await detection_service.process_image_async(image_bytes, processed_image)
         
         return JSONResponse(content=result)
         
+    except HTTPException as he:
+        raise he
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error processing base64 image: {str(e)}")
 
+@app.post("/nutritional-summary")
+async def nutritional_summary(payload: dict):
+    """
+    Endpoint combining the nutrition of several analysed images (e.g. a day's meals)
+    
+    Args:
+        payload: {"images": [detection result, ...]}, each with its "detections"
+        
+    Returns:
+        Portion-weighted summary per image and the combined total
+    """
+    images = payload.get("images")
+    if not isinstance(images, list) or not all(
+        isinstance(image, dict) and isinstance(image.get("detections"), list) for image in images
+    ):
+        raise HTTPException(status_code=400, detail="'images' must be a list of detection results")
+    
+    try:
+        return calculate_combined_summary([image["detections"] for image in images])
+    except (KeyError, TypeError, ValueError) as e:
+        raise HTTPException(status_code=400, detail=f"Invalid detection result: {str(e)}")
+
 if __name__ == "__main__":
+    import uvicorn
+    
     uvicorn.run("main:app", host=HOST, port=PORT, reload=True)
@@ -0,0 +1,324 @@
+"""
+Prometheus metrics (prometheus_client), plus per-request stage timings
+
+Counters, gauges and histograms are prometheus_client objects, cheap enough
+to stay on in production; GET /metrics renders them. With several pre-forked
+workers (serve.py) the client's multiprocess mode is used: every worker
+writes its values to memory-mapped files in METRICS_MULTIPROCESS_DIR and
+/metrics adds up the files of all of them; gauges count only workers that
+are still alive.
+
+Pipeline stages are timed with stage_timer / record_stage. Besides the
+stage histogram, the durations go to the current request's timings (a
+context variable set by MetricsMiddleware), which become its Server-Timing
+header.
+"""
+import contextvars
+import functools
+import os
+import time
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterator, Optional
+
+from config import ALLOWED_ORIGINS, METRICS_ENABLED, METRICS_MULTIPROCESS_DIR
+
+# prometheus_client chooses multiprocess mode from the environment when it is imported
+# (serve.py sets the variable itself when it picks a temporary directory)
+if METRICS_MULTIPROCESS_DIR:
+    os.environ.setdefault("PROMETHEUS_MULTIPROC_DIR", METRICS_MULTIPROCESS_DIR)
+MULTIPROCESS_DIR = os.environ.get("PROMETHEUS_MULTIPROC_DIR", "")
+if MULTIPROCESS_DIR:
+    os.makedirs(MULTIPROCESS_DIR, exist_ok=True)
+
+from prometheus_client import CollectorRegistry, Counter, Gauge, Histogram, generate_latest, multiprocess
+
+# Text exposition format (Starlette appends the charset)
+CONTENT_TYPE = "text/plain; version=0.0.4"
+
+# Stage durations (seconds): from sub-millisecond parsing to multi-second decodes
+STAGE_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+# Detection calls and whole requests (seconds)
+CALL_BUCKETS = (0.1, 0.25, 0.5, 1.0, 2.0, 4.0, 8.0, 16.0, 32.0, 64.0)
+# Response bodies (bytes): 1 KB to 16 MB
+SIZE_BUCKETS = tuple(1024 * 4 ** i for i in range(8))
+
+_request_timings: contextvars.ContextVar[Optional[Dict[str, float]]] = contextvars.ContextVar(
+    "request_timings", default=None
+)
+
+# The service's metrics only (no process/platform collectors)
+REGISTRY = CollectorRegistry()
+
+
+def render() -> bytes:
+    """All metrics in the Prometheus text format, summed over the workers in multiprocess mode"""
+    if not MULTIPROCESS_DIR:
+        return generate_latest(REGISTRY)
+    registry = CollectorRegistry()
+    multiprocess.MultiProcessCollector(registry, MULTIPROCESS_DIR)
+    return generate_latest(registry)
+
+
+def mark_process_dead(pid: int) -> None:
+    """Stop counting a worker that exited in the live gauges (its counters are kept)"""
+    if MULTIPROCESS_DIR:
+        multiprocess.mark_process_dead(pid, MULTIPROCESS_DIR)
+
+
+REQUESTS = Counter("nutrivision_requests_total", "HTTP requests by endpoint, method and status code",
+                   ["endpoint", "method", "status"], registry=REGISTRY)
+REQUEST_SECONDS = Histogram("nutrivision_request_duration_seconds",
+                            "HTTP request duration until the last body byte", ["endpoint"],
+                            buckets=CALL_BUCKETS, registry=REGISTRY)
+RESPONSE_BYTES = Histogram("nutrivision_response_size_bytes", "HTTP response body size", ["endpoint"],
+                           buckets=SIZE_BUCKETS, registry=REGISTRY)
+REQUESTS_IN_FLIGHT = Gauge("nutrivision_requests_in_flight", "HTTP requests being served", ["endpoint"],
+                           registry=REGISTRY, multiprocess_mode="livesum")
+STAGE_SECONDS = Histogram("nutrivision_stage_duration_seconds", "Duration of each pipeline stage", ["stage"],
+                          buckets=STAGE_BUCKETS, registry=REGISTRY)
+DETECTION_CALLS = Counter("nutrivision_detection_calls_total",
+                          "Detection backend calls by backend, prompt and outcome", ["backend", "prompt", "status"],
+                          registry=REGISTRY)
+DETECTION_CALL_SECONDS = Histogram("nutrivision_detection_call_duration_seconds",
+                                   "Duration of completed detection backend calls", ["backend", "prompt"],
+                                   buckets=CALL_BUCKETS, registry=REGISTRY)
+DETECTION_CALLS_IN_FLIGHT = Gauge("nutrivision_detection_calls_in_flight",
+                                  "Detection backend calls awaiting a response", ["prompt"],
+                                  registry=REGISTRY, multiprocess_mode="livesum")
+ALTERNATIVE_FALLBACKS = Counter("nutrivision_alternative_fallbacks_total",
+                                "Requests that used the alternative prompt, by detection strategy", ["strategy"],
+                                registry=REGISTRY)
+DETECTION_RETRIES = Counter("nutrivision_detection_retries_total",
+                            "Detection call attempts retried, by backend and error kind", ["backend", "reason"],
+                            registry=REGISTRY)
+CIRCUIT_REJECTIONS = Counter("nutrivision_circuit_rejections_total",
+                             "Detection calls refused at once by an open circuit breaker", ["backend"],
+                             registry=REGISTRY)
+ADMISSION_DECISIONS = Counter("nutrivision_admission_total",
+                              "Detection requests by priority class and admission outcome", ["priority", "outcome"],
+                              registry=REGISTRY)
+ADMISSION_WAIT_SECONDS = Histogram("nutrivision_admission_wait_seconds",
+                                   "Time admitted requests waited for a slot", ["priority"],
+                                   buckets=CALL_BUCKETS, registry=REGISTRY)
+ADMISSION_QUEUED = Gauge("nutrivision_admission_queued", "Detection requests waiting for a slot", ["priority"],
+                         registry=REGISTRY, multiprocess_mode="livesum")
+COALESCED_REQUESTS = Counter("nutrivision_coalesced_requests_total",
+                             "Detection requests that joined an identical request already in flight",
+                             registry=REGISTRY)
+CIRCUIT_STATE = Gauge("nutrivision_circuit_state",
+                      "Circuit breaker state per backend (0 closed, 1 half-open, 2 open; worst live worker)",
+                      ["backend"], registry=REGISTRY, multiprocess_mode="livemax")
+
+
+def prompt_kind(prompt: str) -> str:
+    """Metric label of a call's prompt (tile_3 -> tile) to keep label values bounded"""
+    return "tile" if prompt.startswith("tile_") else prompt
+
+
+def record_stage(stage: str, seconds: float) -> None:
+    """
+    Record the duration of a pipeline stage
+    
+    Args:
+        stage: Stage name (decode, resize, encode, parse, draw, ...)
+        seconds: Duration
+    """
+    if not METRICS_ENABLED:
+        return
+    STAGE_SECONDS.labels(stage).observe(seconds)
+    timings = _request_timings.get()
+    if timings is not None:
+        timings[stage] = timings.get(stage, 0.0) + seconds
+
+
+def track_timings() -> Dict[str, float]:
+    """
+    Collect stage timings in the current context, apart from any request's
+    
+    For work detached from a request (a coalesced flight): its stages still
+    feed the histograms, and the returned dictionary can be added to the
+    timings of each request that waited for it.
+    """
+    timings: Dict[str, float] = {}
+    _request_timings.set(timings)
+    return timings
+
+
+def add_timings(timings: Dict[str, float]) -> None:
+    """Add stage timings measured elsewhere to the current request's Server-Timing (not the histograms)"""
+    current = _request_timings.get()
+    if current is not None:
+        for stage, seconds in timings.items():
+            current[stage] = current.get(stage, 0.0) + seconds
+
+
+@contextmanager
+def stage_timer(stage: str) -> Iterator[None]:
+    """Time the enclosed block as a pipeline stage"""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        record_stage(stage, time.perf_counter() - start)
+
+
+def timed(stage: str) -> Callable:
+    """Decorator timing every call of a (synchronous) function as a pipeline stage"""
+    def decorator(func: Callable) -> Callable:
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with stage_timer(stage):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def record_call(prompt: str, backend: str, status: str, seconds: float) -> None:
+    """
+    Record a detection backend call
+    
+    Args:
+        prompt: Prompt name (primary, alternative, tile_N)
+        backend: Backend that answered, or "unknown"
+        status: "completed", "cancelled" or "error"
+        seconds: Call duration
+    """
+    if not METRICS_ENABLED:
+        return
+    kind = prompt_kind(prompt)
+    DETECTION_CALLS.labels(backend, kind, status).inc()
+    if status == "completed":
+        DETECTION_CALL_SECONDS.labels(backend, kind).observe(seconds)
+    timings = _request_timings.get()
+    if timings is not None:
+        timings[prompt] = timings.get(prompt, 0.0) + seconds
+
+
+def record_retry(backend: str, reason: str) -> None:
+    """Count a retried detection call attempt"""
+    if METRICS_ENABLED:
+        DETECTION_RETRIES.labels(backend, reason).inc()
+
+
+def record_admission(priority: str, outcome: str, wait: Optional[float] = None) -> None:
+    """
+    Record an admission decision
+    
+    Args:
+        priority: Priority class ("interactive" or "batch")
+        outcome: "admitted", "queue_full", "over_deadline" or "expired"
+        wait: Time an admitted request waited for its slot (a "queue" stage)
+    """
+    if not METRICS_ENABLED:
+        return
+    ADMISSION_DECISIONS.labels(priority, outcome).inc()
+    if wait is not None:
+        ADMISSION_WAIT_SECONDS.labels(priority).observe(wait)
+        record_stage("queue", wait)
+
+
+def record_coalesced() -> None:
+    """Count a detection request served by an identical in-flight one"""
+    if METRICS_ENABLED:
+        COALESCED_REQUESTS.inc()
+
+
+def record_circuit(backend: str, state: str, rejected: bool = False) -> None:
+    """
+    Record a circuit breaker's state
+    
+    Args:
+        backend: Backend guarded by the breaker
+        state: "closed", "half_open" or "open"
+        rejected: Whether a call was just refused
+    """
+    if not METRICS_ENABLED:
+        return
+    CIRCUIT_STATE.labels(backend).set(("closed", "half_open", "open").index(state))
+    if rejected:
+        CIRCUIT_REJECTIONS.labels(backend).inc()
+
+
+@contextmanager
+def call_in_flight(prompt: str) -> Iterator[None]:
+    """Count the enclosed detection call as in flight"""
+    gauge = DETECTION_CALLS_IN_FLIGHT.labels(prompt_kind(prompt))
+    gauge.inc()
+    try:
+        yield
+    finally:
+        gauge.dec()
+
+
+def server_timing(timings: Dict[str, float], total: float) -> str:
+    """Server-Timing header value (durations in ms)"""
+    entries = [f"{name};dur={seconds * 1000:.1f}" for name, seconds in timings.items()]
+    entries.append(f"total;dur={total * 1000:.1f}")
+    return ", ".join(entries)
+
+
+class MetricsMiddleware:
+    """
+    ASGI middleware recording request metrics and adding the Server-Timing header
+    
+    The header lists the stages recorded while the request was handled, up to
+    the moment the response starts: the whole pipeline for JSON responses,
+    only what ran before the first line for streamed ones. Endpoints are
+    labelled by route template (/images/{image_id}); unknown paths as "other".
+    """
+    
+    def __init__(self, app):
+        """
+        Initialize middleware
+        
+        Args:
+            app: ASGI application
+        """
+        self.app = app
+        self.timing_allow_origin = " ".join(ALLOWED_ORIGINS).encode()
+    
+    @staticmethod
+    def _endpoint(scope) -> str:
+        """Route template matching the request, or "other" """
+        from starlette.routing import Match
+        
+        for route in scope["app"].routes:
+            match, _ = route.matches(scope)
+            if match == Match.FULL:
+                return getattr(route, "path", "other")
+        return "other"
+    
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        
+        endpoint = self._endpoint(scope)
+        start = time.perf_counter()
+        timings: Dict[str, float] = {}
+        token = _request_timings.set(timings)
+        status = 500
+        body_bytes = 0
+        in_flight = REQUESTS_IN_FLIGHT.labels(endpoint)
+        in_flight.inc()
+        
+        async def timed_send(message):
+            nonlocal status, body_bytes
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                headers = list(message.get("headers", []))
+                headers.append((b"server-timing", server_timing(timings, time.perf_counter() - start).encode()))
+                headers.append((b"timing-allow-origin", self.timing_allow_origin))
+                message = {**message, "headers": headers}
+            elif message["type"] == "http.response.body":
+                body_bytes += len(message.get("body", b""))
+            await send(message)
+        
+        try:
+            await self.app(scope, receive, timed_send)
+        finally:
+            _request_timings.reset(token)
+            in_flight.dec()
+            REQUESTS.labels(endpoint, scope["method"], str(status)).inc()
+            REQUEST_SECONDS.labels(endpoint).observe(time.perf_counter() - start)
+            RESPONSE_BYTES.labels(endpoint).observe(body_bytes)
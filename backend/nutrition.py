@@ -1,273 +1,182 @@
 """
 Nutritional database and utility functions
 """
-from typing import Dict, Any
+from functools import lru_cache
+from typing import Dict, Any, List, Mapping, Tuple
+import numpy as np
+from config import (
+    NUTRITION_CSV_PATH, NUTRITION_DB_PATH, NUTRITION_MATCH_THRESHOLD, NUTRITION_LOOKUP_CACHE_SIZE,
+    PORTION_FULL_FRAME_GRAMS, PORTION_MIN_GRAMS, PORTION_MAX_GRAMS, PORTION_DEFAULT_DENSITY
+)
+from nutrition_index import NutritionIndex
+from nutrition_store import NutritionStore, load_nutrition_store
 
-def round_nutritional_values(nutrition_info: Dict[str, Any]) -> Dict[str, Any]:
+# Alternative names (English, regional, plural-irregular) -> database name
+NUTRITION_SYNONYMS = {
+    "tomato": "tomate", "jitomate": "tomate",
+    "lettuce": "lechuga",
+    "onion": "cebolla",
+    "carrot": "zanahoria",
+    "pepper": "pimiento", "bell pepper": "pimiento", "pimenton": "pimiento", "chile": "pimiento",
+    "avocado": "aguacate", "palta": "aguacate",
+    "chicken": "pollo", "pechuga": "pollo",
+    "beef": "res", "carne de res": "res", "ternera": "res", "vaca": "res", "bistec": "res", "steak": "res",
+    "pork": "cerdo", "puerco": "cerdo", "chancho": "cerdo",
+    "fish": "pescado", "salmon": "pescado", "atun": "pescado", "tuna": "pescado",
+    "ham": "jamón",
+    "sausage": "salchicha", "chorizo": "salchicha",
+    "rice": "arroz",
+    "beans": "frijoles", "judias": "frijoles", "porotos": "frijoles", "alubias": "frijoles",
+    "lentils": "lentejas",
+    "cheese": "queso",
+    "egg": "huevo",
+    "lemon": "limón", "lima": "limón", "lime": "limón",
+    "oil": "aceite", "olive oil": "aceite"
+}
+
+# Returned when an ingredient is not in the database
+UNKNOWN_NUTRITION = {
+    "calories": "N/A",
+    "protein": "N/A",
+    "carbs": "N/A",
+    "fat": "N/A",
+    "fiber": "N/A",
+    "vitamin_c": "N/A",
+    "benefits": "Información nutricional no disponible"
+}
+
+@lru_cache(maxsize=None)
+def get_nutrition_store() -> NutritionStore:
+    """Memory-mapped nutrition database, built from NUTRITION_CSV_PATH on first use if needed"""
+    return load_nutrition_store(NUTRITION_CSV_PATH, NUTRITION_DB_PATH)
+
+@lru_cache(maxsize=None)
+def get_nutrition_index() -> NutritionIndex:
+    """Name index over the nutrition database, built on first use"""
+    return NutritionIndex(
+        get_nutrition_store().names(),
+        synonyms=NUTRITION_SYNONYMS,
+        min_similarity=NUTRITION_MATCH_THRESHOLD,
+        cache_size=NUTRITION_LOOKUP_CACHE_SIZE
+    )
+
+def get_nutritional_info(ingredient_name: str) -> Mapping[str, Any]:
     """
-    Round nutritional values to maximum 2 decimal places
+    Get nutritional information for an ingredient
+    
+    Accents, plurals, synonyms and small misspellings are tolerated; see
+    NutritionIndex for how the best match is chosen.
     
     Args:
-        nutrition_info: Dictionary with nutritional information
+        ingredient_name: Name of the ingredient
         
     Returns:
-        Dictionary with rounded values
+        Read-only view of the database row (per 100 g), or UNKNOWN_NUTRITION
     """
-    rounded_info = {}
-    for key, value in nutrition_info.items():
-        if isinstance(value, (int, float)):
-            # Round to 2 decimal places maximum
-            rounded_info[key] = round(value, 2)
-        else:
-            rounded_info[key] = value
-    return rounded_info
+    row = get_nutrition_index().lookup(ingredient_name)
+    return get_nutrition_store().record(row) if row is not None else UNKNOWN_NUTRITION
 
-# Nutritional database for common ingredients (per 100g)
-NUTRITIONAL_DATABASE = {
-    # Vegetables
-    "tomate": {
-        "calories": 18,
-        "protein": 0.9,
-        "carbs": 3.9,
-        "fat": 0.2,
-        "fiber": 1.2,
-        "vitamin_c": 14,
-        "benefits": "Rico en licopeno, vitamina C y antioxidantes"
-    },
-    "lechuga": {
-        "calories": 15,
-        "protein": 1.4,
-        "carbs": 2.9,
-        "fat": 0.2,
-        "fiber": 1.3,
-        "vitamin_c": 9,
-        "benefits": "Alta en folato, vitamina A y baja en calorías"
-    },
-    "cebolla": {
-        "calories": 40,
-        "protein": 1.1,
-        "carbs": 9.3,
-        "fat": 0.1,
-        "fiber": 1.7,
-        "vitamin_c": 7,
-        "benefits": "Propiedades antiinflamatorias y antioxidantes"
-    },
-    "zanahoria": {
-        "calories": 41,
-        "protein": 0.9,
-        "carbs": 9.6,
-        "fat": 0.2,
-        "fiber": 2.8,
-        "vitamin_c": 6,
-        "benefits": "Rica en beta-caroteno y vitamina A"
-    },
-    "pimiento": {
-        "calories": 31,
-        "protein": 1.0,
-        "carbs": 7.3,
-        "fat": 0.3,
-        "fiber": 2.5,
-        "vitamin_c": 128,
-        "benefits": "Excelente fuente de vitamina C y antioxidantes"
-    },
-    "aguacate": {
-        "calories": 160,
-        "protein": 2.0,
-        "carbs": 8.5,
-        "fat": 14.7,
-        "fiber": 6.7,
-        "vitamin_c": 10,
-        "benefits": "Rico en grasas saludables y potasio"
-    },
-    
-    # Meats
-    "pollo": {
-        "calories": 165,
-        "protein": 31.0,
-        "carbs": 0.0,
-        "fat": 3.6,
-        "fiber": 0.0,
-        "vitamin_c": 0,
-        "benefits": "Excelente fuente de proteína magra y vitaminas B"
-    },
-    "res": {
-        "calories": 250,
-        "protein": 26.0,
-        "carbs": 0.0,
-        "fat": 15.0,
-        "fiber": 0.0,
-        "vitamin_c": 0,
-        "benefits": "Rica en proteína, hierro y vitamina B12"
-    },
-    "cerdo": {
-        "calories": 242,
-        "protein": 27.0,
-        "carbs": 0.0,
-        "fat": 14.0,
-        "fiber": 0.0,
-        "vitamin_c": 0,
-        "benefits": "Buena fuente de proteína y tiamina"
-    },
-    "pescado": {
-        "calories": 206,
-        "protein": 22.0,
-        "carbs": 0.0,
-        "fat": 12.0,
-        "fiber": 0.0,
-        "vitamin_c": 0,
-        "benefits": "Rico en omega-3 y proteína de alta calidad"
-    },
-    "jamón": {
-        "calories": 145,
-        "protein": 21.0,
-        "carbs": 1.5,
-        "fat": 5.5,
-        "fiber": 0.0,
-        "vitamin_c": 0,
-        "benefits": "Fuente de proteína, pero alto en sodio"
-    },
-    "salchicha": {
-        "calories": 301,
-        "protein": 13.0,
-        "carbs": 2.0,
-        "fat": 27.0,
-        "fiber": 0.0,
-        "vitamin_c": 0,
-        "benefits": "Procesado, consumir con moderación"
-    },
-    
-    # Grains and legumes
-    "arroz": {
-        "calories": 130,
-        "protein": 2.7,
-        "carbs": 28.0,
-        "fat": 0.3,
-        "fiber": 0.4,
-        "vitamin_c": 0,
-        "benefits": "Carbohidrato de fácil digestión, energía rápida"
-    },
-    "frijoles": {
-        "calories": 127,
-        "protein": 9.0,
-        "carbs": 23.0,
-        "fat": 0.5,
-        "fiber": 6.4,
-        "vitamin_c": 2,
-        "benefits": "Alto en proteína vegetal y fibra"
-    },
-    "lentejas": {
-        "calories": 116,
-        "protein": 9.0,
-        "carbs": 20.0,
-        "fat": 0.4,
-        "fiber": 7.9,
-        "vitamin_c": 1,
-        "benefits": "Excelente fuente de proteína vegetal y hierro"
-    },
-    
-    # Dairy
-    "queso": {
-        "calories": 402,
-        "protein": 25.0,
-        "carbs": 1.3,
-        "fat": 33.0,
-        "fiber": 0.0,
-        "vitamin_c": 0,
-        "benefits": "Rico en calcio y proteína"
-    },
-    "huevo": {
-        "calories": 155,
-        "protein": 13.0,
-        "carbs": 1.1,
-        "fat": 11.0,
-        "fiber": 0.0,
-        "vitamin_c": 0,
-        "benefits": "Proteína completa con todos los aminoácidos esenciales"
-    },
-    
-    # Others
-    "limón": {
-        "calories": 29,
-        "protein": 1.1,
-        "carbs": 9.3,
-        "fat": 0.3,
-        "fiber": 2.8,
-        "vitamin_c": 53,
-        "benefits": "Alto en vitamina C y antioxidantes"
-    },
-    "aceite": {
-        "calories": 884,
-        "protein": 0.0,
-        "carbs": 0.0,
-        "fat": 100.0,
-        "fiber": 0.0,
-        "vitamin_c": 0,
-        "benefits": "Fuente de grasas, usar con moderación"
-    }
-}
+def _food_rows(results: List[dict]) -> np.ndarray:
+    """Database row of each detection (-1 if unknown), via the memoized label index"""
+    index = get_nutrition_index()
+    rows = [index.lookup(result['label']) for result in results]
+    return np.array([-1 if row is None else row for row in rows], dtype=np.int64)
 
-def get_nutritional_info(ingredient_name: str) -> Dict[str, Any]:
+def estimate_portion_grams(results: List[dict], image_area: float) -> np.ndarray:
     """
-    Get nutritional information for an ingredient
+    Estimate the weight of each detected ingredient
+    
+    The share of the image covered by a detection's box is scaled by
+    PORTION_FULL_FRAME_GRAMS (food covering the whole photo) and by the
+    food's density prior from the database, then clipped to a sane range.
     
     Args:
-        ingredient_name: Name of the ingredient
+        results: Detection results with 'label' and 'area' (pixels)
+        image_area: Image width * height in pixels
         
     Returns:
-        Dictionary with nutritional information
+        Array of portion weights in grams, one per detection
     """
-    ingredient_key = ingredient_name.lower().strip()
+    if not results or image_area <= 0:
+        return np.zeros(len(results))
     
-    # Try exact match first
-    if ingredient_key in NUTRITIONAL_DATABASE:
-        return round_nutritional_values(NUTRITIONAL_DATABASE[ingredient_key])
+    store = get_nutrition_store()
+    areas = np.array([result.get('area', 0) for result in results], dtype=np.float64)
+    if "density" in store.columns:
+        density = store.gather(_food_rows(results), ["density"])[:, 0]
+        density = np.where(np.isnan(density), PORTION_DEFAULT_DENSITY, density)
+    else:
+        density = np.full(len(results), PORTION_DEFAULT_DENSITY)
+    
+    grams = areas / image_area * PORTION_FULL_FRAME_GRAMS * density
+    return np.round(np.clip(grams, PORTION_MIN_GRAMS, PORTION_MAX_GRAMS), 1)
+
+def _weighted_nutrients(results: List[dict]) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Nutrient matrix (detections x nutrients) scaled from 100 g to each portion
     
-    # Try partial matches for common variations
-    for key, value in NUTRITIONAL_DATABASE.items():
-        if key in ingredient_key or ingredient_key in key:
-            return round_nutritional_values(value)
+    Detections without 'portion_grams' count as 100 g; unknown values count as 0.
     
-    # Default nutritional info if not found
+    Returns:
+        Tuple of (weighted nutrient matrix, portion grams per detection)
+    """
+    store = get_nutrition_store()
+    per_100g = store.gather(_food_rows(results), store.nutrients)
+    grams = np.array([result.get('portion_grams', 100.0) for result in results], dtype=np.float64)
+    return np.nan_to_num(per_100g) * (grams / 100.0)[:, None], grams
+
+def _format_summary(totals: np.ndarray, grams: float, count: int) -> Dict[str, Any]:
+    """Build the summary dictionary from a vector of nutrient totals"""
+    rounded = dict(zip(get_nutrition_store().nutrients, np.round(totals, 2).tolist()))
     return {
-        "calories": "N/A",
-        "protein": "N/A",
-        "carbs": "N/A",
-        "fat": "N/A",
-        "fiber": "N/A",
-        "vitamin_c": "N/A",
-        "benefits": "Información nutricional no disponible"
+        "total_calories": rounded.get("calories", 0.0),
+        "total_protein": rounded.get("protein", 0.0),
+        "total_carbs": rounded.get("carbs", 0.0),
+        "total_fat": rounded.get("fat", 0.0),
+        "totals": rounded,
+        "total_portion_grams": round(float(grams), 1),
+        "ingredients_count": count
     }
 
-def calculate_nutritional_summary(results: list) -> Dict[str, float]:
+def calculate_nutritional_summary(results: list) -> Dict[str, Any]:
     """
     Calculate total nutritional summary from detection results
     
+    Every nutrient in the database is totalled in one matrix operation,
+    weighted by each detection's portion_grams.
+    
     Args:
-        results: List of detection results with nutrition data
+        results: List of detection results (label, portion_grams)
         
     Returns:
         Dictionary with total nutritional values
     """
-    total_calories = 0
-    total_protein = 0
-    total_carbs = 0
-    total_fat = 0
+    weighted, grams = _weighted_nutrients(results)
+    return _format_summary(weighted.sum(axis=0), grams.sum(), len(results))
+
+def calculate_combined_summary(images: List[List[dict]]) -> Dict[str, Any]:
+    """
+    Summarize many images (e.g. a day's meals) in one batched computation
+    
+    Args:
+        images: Detection results of each image
+        
+    Returns:
+        Dictionary with one summary per image and the combined total
+    """
+    counts = np.array([len(results) for results in images], dtype=np.int64)
+    flat = [result for results in images for result in results]
+    weighted, grams = _weighted_nutrients(flat)
     
-    for result in results:
-        nutrition = result['nutrition']
-        if isinstance(nutrition['calories'], (int, float)):
-            total_calories += nutrition['calories']
-        if isinstance(nutrition['protein'], (int, float)):
-            total_protein += nutrition['protein']
-        if isinstance(nutrition['carbs'], (int, float)):
-            total_carbs += nutrition['carbs']
-        if isinstance(nutrition['fat'], (int, float)):
-            total_fat += nutrition['fat']
+    image_index = np.repeat(np.arange(len(images)), counts)
+    per_image = np.zeros((len(images), weighted.shape[1]))
+    np.add.at(per_image, image_index, weighted)
+    per_image_grams = np.bincount(image_index, weights=grams, minlength=len(images))
     
     return {
-        "total_calories": round(total_calories, 2),
-        "total_protein": round(total_protein, 2),
-        "total_carbs": round(total_carbs, 2),
-        "total_fat": round(total_fat, 2),
-        "ingredients_count": len(results)
+        "images": [
+            _format_summary(per_image[i], per_image_grams[i], int(counts[i]))
+            for i in range(len(images))
+        ],
+        "total": _format_summary(per_image.sum(axis=0), grams.sum(), len(flat))
     }
@@ -0,0 +1,209 @@
+"""
+Indexed fuzzy lookup of nutrition records by ingredient label
+"""
+import unicodedata
+from collections import defaultdict
+from functools import lru_cache
+from typing import Dict, Iterable, List, Mapping, Optional, Tuple
+
+import numpy as np
+
+# Connector words ignored when matching multi-word labels
+STOPWORDS = frozenset({
+    'de', 'del', 'con', 'y', 'e', 'en', 'al', 'a', 'la', 'el', 'los', 'las',
+    'the', 'with', 'and', 'of', 'in'
+})
+
+# Consonants after which Spanish plurals add "-es" (limón -> limones, frijol -> frijoles)
+_ES_PLURAL_STEMS = frozenset('lnrdzj')
+
+
+def fold_text(text: str) -> str:
+    """
+    Lowercase, strip accents and replace punctuation with spaces
+    
+    Args:
+        text: Raw label or database key
+        
+    Returns:
+        Folded text with single spaces between words
+    """
+    decomposed = unicodedata.normalize('NFKD', text.lower())
+    chars = [
+        char if char.isalnum() else ' '
+        for char in decomposed if not unicodedata.combining(char)
+    ]
+    return ' '.join(''.join(chars).split())
+
+
+def singularize(token: str) -> str:
+    """
+    Reduce a Spanish or English plural to its singular form
+    
+    Args:
+        token: Folded word
+        
+    Returns:
+        Singular form (tomates -> tomate, limones -> limon, frijoles -> frijol)
+    """
+    if len(token) > 4 and token.endswith('es') and token[-3] in _ES_PLURAL_STEMS:
+        return token[:-2]
+    if len(token) > 3 and token.endswith('s') and not token.endswith('ss'):
+        return token[:-1]
+    return token
+
+
+def trigrams(token: str) -> frozenset:
+    """Character trigrams of a word, padded so short words still have some"""
+    padded = f' {token} '
+    return frozenset(padded[i:i + 3] for i in range(len(padded) - 2))
+
+
+class NutritionIndex:
+    """
+    Fuzzy lookup of database rows by ingredient name
+    
+    Keys are accent-folded, split into singularized words and indexed twice:
+    word -> keys for exact word hits, and character trigram -> words for
+    misspellings. Only the keys on the posting lists of the label's words
+    (or similar enough words) are scored, at once with NumPy, so a lookup
+    costs as much as the keys it matches rather than the database size:
+    the sum of each label word's best similarity, divided by the longer
+    word count. The best key wins, ties going to the key matching the
+    earliest word of the label, so "arroz con pollo" resolves to "arroz"
+    regardless of database order. Lookups are memoized per label.
+    """
+    
+    def __init__(self, names: Iterable[str], synonyms: Optional[Mapping[str, str]] = None,
+                 min_similarity: float = 0.6, cache_size: int = 4096):
+        """
+        Build the index
+        
+        Args:
+            names: Ingredient names in database row order
+            synonyms: Mapping of alternative name (word or phrase) -> database key
+            min_similarity: Minimum trigram Dice similarity for two words to match
+            cache_size: Labels memoized by lookup
+        """
+        self.min_similarity = min_similarity
+        self._rows: List[int] = []
+        self._key_tokens: List[Tuple[str, ...]] = []
+        self._exact: Dict[str, int] = {}
+        token_keys: Dict[str, List[int]] = defaultdict(list)
+        self._trigram_tokens: Dict[str, List[str]] = defaultdict(list)
+        self._token_trigrams: Dict[str, frozenset] = {}
+        
+        for row, name in enumerate(names):
+            self._add(row, name, token_keys)
+        
+        # Posting lists as arrays so candidate scoring is vectorized
+        self._token_keys: Dict[str, np.ndarray] = {
+            token: np.array(indices, dtype=np.int32) for token, indices in token_keys.items()
+        }
+        self._key_lengths = np.array([len(tokens) for tokens in self._key_tokens], dtype=np.float32)
+        
+        self._synonyms: Dict[str, str] = {}
+        for alias, key in (synonyms or {}).items():
+            target = self._normalize_tokens(key)
+            if ' '.join(target) in self._exact:
+                self._synonyms[' '.join(self._normalize_tokens(alias))] = ' '.join(target)
+        
+        # lookup(label) -> row number or None, memoized per label
+        self.lookup = lru_cache(maxsize=cache_size)(self._lookup)
+    
+    @staticmethod
+    def _normalize_tokens(text: str) -> Tuple[str, ...]:
+        """Fold, split, drop connector words and singularize"""
+        return tuple(singularize(token) for token in fold_text(text).split() if token not in STOPWORDS)
+    
+    def _add(self, row: int, name: str, token_keys: Dict[str, List[int]]) -> None:
+        """Index one database row; later duplicates of a folded name are ignored"""
+        tokens = self._normalize_tokens(name)
+        canonical = ' '.join(tokens)
+        if not tokens or canonical in self._exact:
+            return
+        
+        index = len(self._rows)
+        self._rows.append(row)
+        self._key_tokens.append(tokens)
+        self._exact[canonical] = index
+        
+        for token in set(tokens):
+            token_keys[token].append(index)
+            if token not in self._token_trigrams:
+                grams = trigrams(token)
+                self._token_trigrams[token] = grams
+                for gram in grams:
+                    self._trigram_tokens[gram].append(token)
+    
+    def _similar_tokens(self, token: str) -> Dict[str, float]:
+        """Indexed words whose trigram Dice similarity with `token` reaches min_similarity"""
+        if token in self._token_keys:
+            return {token: 1.0}
+        
+        grams = trigrams(token)
+        shared: Dict[str, int] = defaultdict(int)
+        for gram in grams:
+            for candidate in self._trigram_tokens.get(gram, ()):
+                shared[candidate] += 1
+        
+        similar = {}
+        for candidate, count in shared.items():
+            score = 2 * count / (len(grams) + len(self._token_trigrams[candidate]))
+            if score >= self.min_similarity:
+                similar[candidate] = score
+        return similar
+    
+    def _lookup(self, label: str) -> Optional[int]:
+        """
+        Find the database row best matching a label
+        
+        Args:
+            label: Detected ingredient label
+            
+        Returns:
+            Row number or None if nothing matches
+        """
+        tokens = self._normalize_tokens(label)
+        canonical = ' '.join(tokens)
+        canonical = self._synonyms.get(canonical, canonical)
+        if canonical in self._exact:
+            return self._rows[self._exact[canonical]]
+        
+        tokens = tuple(self._synonyms.get(token, token) for token in tokens)
+        # A synonym may point to a multi-word key
+        tokens = tuple(word for token in tokens for word in token.split())
+        if not tokens:
+            return None
+        
+        postings = [
+            (position, similarity, self._token_keys[word])
+            for position, token in enumerate(tokens)
+            for word, similarity in self._similar_tokens(token).items()
+        ]
+        if not postings:
+            return None
+        
+        # Only keys on the posting lists of the matching words are scored, so the
+        # cost follows the keys that match rather than the size of the database
+        candidates, slots = np.unique(
+            np.concatenate([indices for _, _, indices in postings]), return_inverse=True
+        )
+        # scores[position, candidate] = best similarity of label word `position` to any word of the key
+        scores = np.zeros((len(tokens), len(candidates)), dtype=np.float32)
+        offset = 0
+        for position, similarity, indices in postings:
+            columns = slots[offset:offset + len(indices)]
+            scores[position, columns] = np.maximum(scores[position, columns], similarity)
+            offset += len(indices)
+        
+        totals = scores.sum(axis=0)
+        lengths = self._key_lengths[candidates]
+        similarity = totals / np.maximum(lengths, len(tokens))
+        first_position = np.argmax(scores > 0, axis=0)
+        # np.lexsort sorts by the last key first
+        order = np.lexsort((candidates, lengths, first_position, -similarity))
+        return self._rows[candidates[order[0]]]
+    
+    def __len__(self) -> int:
+        return len(self._rows)
@@ -0,0 +1,268 @@
+"""
+Compact memory-mapped nutrition database built from CSV
+
+File layout (little-endian):
+    8 bytes   magic "NUTRDB01"
+    8 bytes   header length (uint64)
+    header    JSON: row count, numeric field names and the offset/dtype/shape of each section
+    sections  from the first 64-byte boundary after the header, each aligned to 64 bytes:
+              values          structured array (rows,), one int32 field per numeric column, fixed point (value * 100)
+              name_offsets    int64 (rows + 1) into name_bytes
+              name_bytes      UTF-8 names
+              benefit_offsets int64 (rows + 1) into benefit_bytes
+              benefit_bytes   UTF-8 benefit texts
+              
+The file is opened with np.memmap, so every worker process maps the same
+page-cache pages instead of holding its own copy of the table.
+
+Usage (from backend/):
+    python nutrition_store.py data/nutrition.csv data/nutrition.bin
+"""
+import csv
+import json
+import os
+import struct
+import sys
+from collections.abc import Mapping
+from typing import Any, Dict, Iterator, List, Sequence, Tuple
+
+import numpy as np
+
+MAGIC = b"NUTRDB01"
+ALIGNMENT = 64
+# Values are stored as integers in hundredths, i.e. already rounded to 2 decimals
+SCALE = 100
+MISSING = np.iinfo(np.int32).min
+MISSING_VALUE = "N/A"
+TEXT_COLUMNS = ("name", "benefits")
+# Numeric columns describing the food rather than its nutrients (not part of records)
+NON_NUTRIENT_COLUMNS = ("density",)
+
+
+def _encode_strings(values: List[str]) -> Tuple[np.ndarray, np.ndarray]:
+    """Pack strings into (offsets, UTF-8 bytes) arrays"""
+    encoded = [value.encode("utf-8") for value in values]
+    offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+    np.cumsum([len(value) for value in encoded], out=offsets[1:])
+    return offsets, np.frombuffer(b"".join(encoded), dtype=np.uint8)
+
+
+def _data_start(header_length: int) -> int:
+    """File offset of the first section"""
+    end = len(MAGIC) + 8 + header_length
+    return end + (-end % ALIGNMENT)
+
+
+def _parse_value(text: str) -> int:
+    """Convert a CSV cell to fixed point, MISSING if empty or not a number"""
+    try:
+        return int(round(float(text) * SCALE))
+    except ValueError:
+        return MISSING
+
+
+def build_nutrition_file(csv_path: str, output_path: str) -> int:
+    """
+    Convert a nutrition CSV into the memory-mappable binary format
+    
+    The CSV needs a "name" column; an optional "benefits" column holds text,
+    an optional "density" column holds the portion density prior and every
+    other column is treated as a numeric nutrient per 100 g.
+    The output is written to a temporary file and renamed into place, so
+    concurrent workers never see a partial file.
+    
+    Args:
+        csv_path: Source CSV path
+        output_path: Binary file path
+        
+    Returns:
+        Number of rows written
+    """
+    with open(csv_path, newline="", encoding="utf-8") as f:
+        reader = csv.DictReader(f)
+        if "name" not in (reader.fieldnames or []):
+            raise ValueError(f"{csv_path}: missing 'name' column")
+        fields = [column for column in reader.fieldnames if column not in TEXT_COLUMNS]
+        
+        names, benefits, rows = [], [], []
+        for row in reader:
+            name = (row.get("name") or "").strip()
+            if not name:
+                continue
+            names.append(name)
+            benefits.append((row.get("benefits") or "").strip())
+            rows.append([_parse_value((row.get(column) or "").strip()) for column in fields])
+    
+    dtype = np.dtype([(column, "<i4") for column in fields])
+    values = np.array(rows, dtype=np.int32).reshape(len(rows), len(fields)).view(dtype).reshape(len(rows))
+    name_offsets, name_bytes = _encode_strings(names)
+    benefit_offsets, benefit_bytes = _encode_strings(benefits)
+    arrays = {
+        "values": values,
+        "name_offsets": name_offsets,
+        "name_bytes": name_bytes,
+        "benefit_offsets": benefit_offsets,
+        "benefit_bytes": benefit_bytes
+    }
+    
+    # Section offsets are relative to the first aligned byte after the header
+    sections = {}
+    offset = 0
+    for key, array in arrays.items():
+        offset += -offset % ALIGNMENT
+        sections[key] = {"offset": offset, "dtype": array.dtype.descr if array.dtype.names else array.dtype.str, "shape": list(array.shape)}
+        offset += array.nbytes
+    header = json.dumps({"rows": len(names), "fields": fields, "scale": SCALE, "sections": sections}).encode("utf-8")
+    base = _data_start(len(header))
+    
+    temp_path = f"{output_path}.{os.getpid()}.tmp"
+    with open(temp_path, "wb") as f:
+        f.write(MAGIC)
+        f.write(struct.pack("<Q", len(header)))
+        f.write(header)
+        for key, array in arrays.items():
+            f.write(b"\0" * (base + sections[key]["offset"] - f.tell()))
+            f.write(array.tobytes())
+    os.replace(temp_path, output_path)
+    return len(names)
+
+
+class NutritionRecord(Mapping):
+    """Read-only view of one row of a NutritionStore; the row is read on first field access"""
+    
+    __slots__ = ("_store", "row", "_values")
+    
+    def __init__(self, store: "NutritionStore", row: int):
+        self._store = store
+        self.row = row
+        self._values = None
+    
+    def __getitem__(self, key: str) -> Any:
+        if key == "benefits":
+            return self._store.benefits(self.row)
+        if self._values is None:
+            self._values = self._store.matrix[self.row].tolist()
+        value = self._values[self._store.columns[key]]
+        return MISSING_VALUE if value == MISSING else value / SCALE
+    
+    def __iter__(self) -> Iterator[str]:
+        yield from self._store.nutrients
+        yield "benefits"
+    
+    def __len__(self) -> int:
+        return len(self._store.nutrients) + 1
+    
+    def __repr__(self) -> str:
+        return f"NutritionRecord({self._store.name(self.row)!r}, {dict(self)!r})"
+
+
+class NutritionStore:
+    """Memory-mapped nutrition table; see the module docstring for the file layout"""
+    
+    def __init__(self, path: str):
+        """
+        Map a binary nutrition file
+        
+        Args:
+            path: File written by build_nutrition_file
+        """
+        self.path = path
+        # Plain ndarray view of the mapping: indexing np.memmap subclasses is much slower
+        self._mmap = np.memmap(path, dtype=np.uint8, mode="r").view(np.ndarray)
+        if bytes(self._mmap[:len(MAGIC)]) != MAGIC:
+            raise ValueError(f"{path} is not a nutrition database file")
+        header_length = struct.unpack("<Q", bytes(self._mmap[len(MAGIC):len(MAGIC) + 8]))[0]
+        start = len(MAGIC) + 8
+        header = json.loads(bytes(self._mmap[start:start + header_length]))
+        
+        self.fields: Tuple[str, ...] = tuple(header["fields"])
+        self.nutrients: Tuple[str, ...] = tuple(f for f in self.fields if f not in NON_NUTRIENT_COLUMNS)
+        self.columns: Dict[str, int] = {name: i for i, name in enumerate(self.fields)}
+        self.rows: int = header["rows"]
+        base = _data_start(header_length)
+        self.values = self._section(header, base, "values")
+        # Same bytes as an int32 (rows, fields) matrix for whole-row reads
+        self.matrix = self.values.view(np.int32).reshape(self.rows, len(self.fields))
+        self._name_offsets = self._section(header, base, "name_offsets")
+        self._name_bytes = self._section(header, base, "name_bytes")
+        self._benefit_offsets = self._section(header, base, "benefit_offsets")
+        self._benefit_bytes = self._section(header, base, "benefit_bytes")
+    
+    def _section(self, header: Dict[str, Any], base: int, key: str) -> np.ndarray:
+        """Zero-copy array view of one section of the mapped file"""
+        section = header["sections"][key]
+        if isinstance(section["dtype"], list):
+            dtype = np.dtype([tuple(field) for field in section["dtype"]])
+        else:
+            dtype = np.dtype(section["dtype"])
+        start = base + section["offset"]
+        count = int(np.prod(section["shape"]))
+        return self._mmap[start:start + count * dtype.itemsize].view(dtype).reshape(section["shape"])
+    
+    @staticmethod
+    def _string(offsets: np.ndarray, data: np.ndarray, row: int) -> str:
+        """Decode one string of a string table"""
+        return bytes(data[offsets[row]:offsets[row + 1]]).decode("utf-8")
+    
+    def name(self, row: int) -> str:
+        """Ingredient name of a row"""
+        return self._string(self._name_offsets, self._name_bytes, row)
+    
+    def names(self) -> Iterator[str]:
+        """Iterate over every ingredient name in row order"""
+        for row in range(self.rows):
+            yield self.name(row)
+    
+    def benefits(self, row: int) -> str:
+        """Benefits text of a row"""
+        return self._string(self._benefit_offsets, self._benefit_bytes, row)
+    
+    def gather(self, rows: np.ndarray, fields: Sequence[str]) -> np.ndarray:
+        """
+        Read several fields of several rows at once
+        
+        Args:
+            rows: Row numbers; negative entries (no match) give NaN rows
+            fields: Field names
+            
+        Returns:
+            float64 array (len(rows), len(fields)) with NaN for missing values
+        """
+        rows = np.asarray(rows, dtype=np.int64)
+        columns = [self.columns[field] for field in fields]
+        raw = self.matrix[np.maximum(rows, 0)][:, columns]
+        values = raw / SCALE
+        values[(raw == MISSING) | (rows < 0)[:, None]] = np.nan
+        return values
+    
+    def record(self, row: int) -> NutritionRecord:
+        """Read-only view of a row"""
+        return NutritionRecord(self, row)
+    
+    def __len__(self) -> int:
+        return self.rows
+
+
+def load_nutrition_store(csv_path: str, db_path: str) -> NutritionStore:
+    """
+    Open the binary nutrition file, (re)building it from CSV if missing or stale
+    
+    Args:
+        csv_path: Source CSV path
+        db_path: Binary file path
+        
+    Returns:
+        Memory-mapped NutritionStore
+    """
+    if not os.path.exists(db_path) or (
+        os.path.exists(csv_path) and os.path.getmtime(csv_path) > os.path.getmtime(db_path)
+    ):
+        rows = build_nutrition_file(csv_path, db_path)
+        print(f"Built nutrition database {db_path} ({rows} rows)")
+    return NutritionStore(db_path)
+
+
+if __name__ == "__main__":
+    if len(sys.argv) != 3:
+        sys.exit("Usage: python nutrition_store.py <input.csv> <output.bin>")
+    print(f"Wrote {build_nutrition_file(sys.argv[1], sys.argv[2])} rows to {sys.argv[2]}")
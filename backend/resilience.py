@@ -0,0 +1,405 @@
+"""
+Request deadlines, retries with backoff and a circuit breaker for detection calls
+
+A request's deadline lives in a context variable: request_deadline() sets it
+around the pipeline and every LLM call made inside (including tasks started
+from it) sees the remaining budget through remaining_seconds().
+
+ResilientCaller wraps the calls of one backend: each attempt is capped by the
+per-call timeout and the remaining budget, retryable failures (timeouts,
+connection errors, 429 and 5xx) are retried with full jitter exponential
+backoff while budget remains, and a CircuitBreaker shared by all calls fails
+fast with 503 + Retry-After after repeated failures, letting a single probe
+through once the reset period has passed.
+"""
+import asyncio
+import contextvars
+import math
+import random
+import sys
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, Iterator, Optional
+
+from fastapi import HTTPException
+
+import metrics
+from config import (
+    LLM_CALL_TIMEOUT_SECONDS, LLM_RETRY_MAX_ATTEMPTS, LLM_RETRY_BASE_DELAY_SECONDS,
+    LLM_RETRY_MAX_DELAY_SECONDS, LLM_RETRY_MIN_BUDGET_SECONDS,
+    CIRCUIT_FAILURE_THRESHOLD, CIRCUIT_RESET_SECONDS
+)
+
+# Upstream status codes worth another attempt (rate limited, overloaded, server errors)
+RETRYABLE_STATUS_CODES = {408, 429, 500, 502, 503, 504}
+
+# Absolute time.monotonic() deadline of the current request, or None
+_deadline: contextvars.ContextVar[Optional[float]] = contextvars.ContextVar("request_deadline", default=None)
+
+
+@contextmanager
+def request_deadline(seconds: Optional[float]) -> Iterator[None]:
+    """
+    Give the enclosed work at most `seconds` (less if an outer deadline ends sooner)
+    
+    Args:
+        seconds: Time budget, or None to keep the outer deadline only
+    """
+    previous = _deadline.get()
+    deadline = time.monotonic() + seconds if seconds is not None else None
+    if previous is not None and (deadline is None or previous < deadline):
+        deadline = previous
+    _deadline.set(deadline)
+    try:
+        yield
+    finally:
+        # set() rather than reset(): an async generator may be closed from another context
+        _deadline.set(previous)
+
+
+def remaining_seconds() -> Optional[float]:
+    """Time left before the current request's deadline (None without a deadline)"""
+    deadline = _deadline.get()
+    return None if deadline is None else deadline - time.monotonic()
+
+
+def retry_reason(error: BaseException) -> Optional[str]:
+    """
+    Classify a failed call
+    
+    Args:
+        error: Exception raised by the call
+        
+    Returns:
+        "timeout", "connection" or "http_<code>" if the call is worth
+        retrying (and counts against the circuit breaker), else None
+    """
+    if isinstance(error, HTTPException):
+        return None
+    if isinstance(error, TimeoutError):
+        return "timeout"
+    # google-genai APIError carries .code; other HTTP clients .status_code
+    code = getattr(error, "code", None)
+    if not isinstance(code, int):
+        code = getattr(error, "status_code", None)
+    if isinstance(code, int):
+        return f"http_{code}" if code in RETRYABLE_STATUS_CODES else None
+    if isinstance(error, OSError):
+        return "connection"
+    # Errors of the HTTP client used by google-genai (only if it has been imported)
+    httpx = sys.modules.get("httpx")
+    if httpx is not None and isinstance(error, httpx.TransportError):
+        return "timeout" if isinstance(error, httpx.TimeoutException) else "connection"
+    return None
+
+
+class CircuitBreaker:
+    """Consecutive-failure circuit breaker with a single half-open probe"""
+    
+    def __init__(self, name: str, failure_threshold: int = CIRCUIT_FAILURE_THRESHOLD,
+                 reset_seconds: float = CIRCUIT_RESET_SECONDS):
+        """
+        Initialize circuit breaker
+        
+        Args:
+            name: Backend guarded by the breaker (messages and metrics)
+            failure_threshold: Consecutive failures that open the circuit
+            reset_seconds: How long the circuit stays open before a probe
+        """
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_seconds = reset_seconds
+        self.state = "closed"
+        self.consecutive_failures = 0
+        self.times_opened = 0
+        self.rejections = 0
+        self._opened_at = 0.0
+        self._probe_in_flight = False
+        self._lock = threading.Lock()
+    
+    def before_call(self) -> None:
+        """
+        Admit a call or refuse it
+        
+        Raises:
+            HTTPException: 503 with Retry-After while the circuit is open or
+                a half-open probe is already in flight
+        """
+        with self._lock:
+            if self.state == "open":
+                if time.monotonic() - self._opened_at < self.reset_seconds:
+                    raise self._rejection()
+                self._set_state("half_open")
+            if self.state == "half_open":
+                if self._probe_in_flight:
+                    raise self._rejection()
+                self._probe_in_flight = True
+    
+    def record_success(self) -> None:
+        """The upstream answered: close the circuit"""
+        with self._lock:
+            self.consecutive_failures = 0
+            self._probe_in_flight = False
+            if self.state != "closed":
+                print(f"✅ {self.name}: circuit closed")
+                self._set_state("closed")
+    
+    def record_failure(self) -> None:
+        """The upstream failed: open the circuit at the threshold or when the probe fails"""
+        with self._lock:
+            self.consecutive_failures += 1
+            self._probe_in_flight = False
+            if self.state == "half_open" or (
+                self.state == "closed" and self.consecutive_failures >= self.failure_threshold
+            ):
+                print(f"⚠️ {self.name}: circuit open after {self.consecutive_failures} failures, "
+                      f"failing fast for {self.reset_seconds}s")
+                self._opened_at = time.monotonic()
+                self.times_opened += 1
+                self._set_state("open")
+    
+    def release(self) -> None:
+        """A call ended without an outcome (cancelled): let another probe through"""
+        with self._lock:
+            self._probe_in_flight = False
+    
+    def retry_after(self) -> int:
+        """Whole seconds until the circuit lets a probe through"""
+        if self.state != "open":
+            return 1
+        return max(1, math.ceil(self.reset_seconds - (time.monotonic() - self._opened_at)))
+    
+    def describe(self) -> dict:
+        """State and counters for /health"""
+        state = self.state
+        if state == "open" and time.monotonic() - self._opened_at >= self.reset_seconds:
+            state = "half_open"
+        description = {
+            "state": state,
+            "consecutive_failures": self.consecutive_failures,
+            "times_opened": self.times_opened,
+            "rejected_calls": self.rejections,
+            "failure_threshold": self.failure_threshold,
+            "reset_seconds": self.reset_seconds
+        }
+        if state == "open":
+            description["retry_after_seconds"] = self.retry_after()
+        return description
+    
+    def _set_state(self, state: str) -> None:
+        self.state = state
+        metrics.record_circuit(self.name, state)
+    
+    def _rejection(self) -> HTTPException:
+        retry_after = self.retry_after()
+        self.rejections += 1
+        metrics.record_circuit(self.name, self.state, rejected=True)
+        return HTTPException(
+            status_code=503,
+            detail=f"{self.name} is failing; not calling it for now. Retry in {retry_after}s.",
+            headers={"Retry-After": str(retry_after)}
+        )
+
+
+class ResilientCaller:
+    """Deadline-aware timeouts, retries and circuit breaking for one backend's calls"""
+    
+    def __init__(self, name: str, breaker: Optional[CircuitBreaker] = None,
+                 max_attempts: int = LLM_RETRY_MAX_ATTEMPTS, base_delay: float = LLM_RETRY_BASE_DELAY_SECONDS,
+                 max_delay: float = LLM_RETRY_MAX_DELAY_SECONDS, call_timeout: float = LLM_CALL_TIMEOUT_SECONDS,
+                 min_budget: float = LLM_RETRY_MIN_BUDGET_SECONDS, seed: Optional[int] = None):
+        """
+        Initialize caller
+        
+        Args:
+            name: Backend name (messages and metrics)
+            breaker: Circuit breaker (default: a new one for this backend)
+            max_attempts: Attempts per call, the first included
+            base_delay: Backoff cap of the first retry; doubles per retry
+            max_delay: Largest backoff cap
+            call_timeout: Time limit of each attempt
+            min_budget: Deadline time that must remain after the backoff to retry
+            seed: Random seed of the backoff jitter
+        """
+        self.name = name
+        self.breaker = breaker if breaker is not None else CircuitBreaker(name)
+        self.max_attempts = max(1, max_attempts)
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.call_timeout = call_timeout
+        self.min_budget = min_budget
+        self.stats: Dict[str, Any] = {
+            "calls": 0, "attempts": 0, "retries": 0, "failed": 0,
+            "timeouts": 0, "deadline_exceeded": 0, "retry_reasons": {}
+        }
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+    
+    async def call(self, func: Callable[[], Awaitable[Any]]) -> Any:
+        """
+        Await func() with per-attempt timeouts, retries and the circuit breaker
+        
+        Args:
+            func: Starts one attempt (e.g. partial(llm.achat, messages=...))
+            
+        Returns:
+            Result of the first successful attempt
+        """
+        self._count("calls")
+        attempt = 0
+        while True:
+            attempt += 1
+            timeout = self._attempt_timeout()
+            self.breaker.before_call()
+            self._count("attempts")
+            try:
+                result = await asyncio.wait_for(func(), timeout)
+            except asyncio.CancelledError:
+                self.breaker.release()
+                raise
+            except Exception as e:
+                await asyncio.sleep(self._handle_failure(e, attempt))
+                continue
+            self.breaker.record_success()
+            return result
+    
+    def call_sync(self, func: Callable[[], Any]) -> Any:
+        """
+        Blocking version of call()
+        
+        The attempt itself cannot be interrupted here; the client's own HTTP
+        timeout bounds it and the deadline is checked before every attempt.
+        """
+        self._count("calls")
+        attempt = 0
+        while True:
+            attempt += 1
+            self._attempt_timeout()
+            self.breaker.before_call()
+            self._count("attempts")
+            try:
+                result = func()
+            except Exception as e:
+                time.sleep(self._handle_failure(e, attempt))
+                continue
+            self.breaker.record_success()
+            return result
+    
+    async def stream(self, open_stream: Callable[[], Awaitable[AsyncIterator[Any]]]) -> AsyncIterator[Any]:
+        """
+        Yield the items of a streamed call, retried until its first item arrives
+        
+        Once items have been yielded a failure cannot be retried and is raised.
+        
+        Args:
+            open_stream: Starts one attempt and returns its async iterator
+            
+        Yields:
+            Stream items
+        """
+        self._count("calls")
+        attempt = 0
+        while True:
+            attempt += 1
+            end = time.monotonic() + self._attempt_timeout()
+            self.breaker.before_call()
+            self._count("attempts")
+            received = False
+            try:
+                iterator = await asyncio.wait_for(open_stream(), end - time.monotonic())
+                while True:
+                    try:
+                        item = await asyncio.wait_for(iterator.__anext__(), end - time.monotonic())
+                    except StopAsyncIteration:
+                        break
+                    received = True
+                    yield item
+            except (asyncio.CancelledError, GeneratorExit):
+                self.breaker.release()
+                raise
+            except Exception as e:
+                await asyncio.sleep(self._handle_failure(e, attempt, retry=not received))
+                continue
+            self.breaker.record_success()
+            return
+    
+    def describe(self) -> dict:
+        """Breaker state and retry counters for /health"""
+        with self._lock:
+            stats = {**self.stats, "retry_reasons": dict(self.stats["retry_reasons"])}
+        return {
+            "circuit": self.breaker.describe(),
+            "max_attempts": self.max_attempts,
+            "call_timeout_seconds": self.call_timeout,
+            **stats
+        }
+    
+    def _count(self, key: str, reason: Optional[str] = None) -> None:
+        with self._lock:
+            self.stats[key] += 1
+            if reason is not None:
+                self.stats["retry_reasons"][reason] = self.stats["retry_reasons"].get(reason, 0) + 1
+    
+    def _attempt_timeout(self) -> float:
+        """Time limit of the next attempt; raises 504 once the request deadline has passed"""
+        budget = remaining_seconds()
+        if budget is None:
+            return self.call_timeout
+        if budget <= 0:
+            self._count("deadline_exceeded")
+            raise HTTPException(status_code=504, detail=f"Request deadline exceeded before calling {self.name}")
+        return min(self.call_timeout, budget)
+    
+    def _handle_failure(self, error: Exception, attempt: int, retry: bool = True) -> float:
+        """
+        Record a failed attempt and decide whether to retry it
+        
+        Args:
+            error: Exception raised by the attempt
+            attempt: Attempt number (1-based)
+            retry: False when the attempt can no longer be repeated
+            
+        Returns:
+            Backoff delay before the next attempt
+            
+        Raises:
+            The error, or an HTTPException (504 timeout, 502 upstream error)
+            describing it, when the call is not retried
+        """
+        reason = retry_reason(error)
+        if reason is None:
+            # The upstream answered (e.g. a 400); not a sign of an unhealthy service
+            self.breaker.record_success()
+        else:
+            self.breaker.record_failure()
+        if isinstance(error, TimeoutError):
+            self._count("timeouts")
+        
+        budget = remaining_seconds()
+        expired = budget is not None and budget <= 0
+        delay = None
+        if retry and reason is not None and not expired and attempt < self.max_attempts \
+                and self.breaker.state == "closed":
+            delay = self._random.uniform(0, min(self.max_delay, self.base_delay * 2 ** (attempt - 1)))
+            if budget is not None and budget - delay < self.min_budget:
+                delay = None
+        
+        if delay is not None:
+            self._count("retries", reason)
+            metrics.record_retry(self.name, reason)
+            print(f"⚠️ {self.name} call failed ({reason}: {error!r}), retrying in {delay:.2f}s "
+                  f"(attempt {attempt + 1}/{self.max_attempts})")
+            return delay
+        
+        self._count("failed")
+        if expired:
+            self._count("deadline_exceeded")
+            raise HTTPException(status_code=504, detail=f"Request deadline exceeded waiting for {self.name}") from error
+        if isinstance(error, TimeoutError):
+            raise HTTPException(status_code=504, detail=f"{self.name} did not answer in time "
+                                                        f"({attempt} attempt(s))") from error
+        if reason is not None:
+            raise HTTPException(status_code=502, detail=f"{self.name} failed after {attempt} attempt(s): "
+                                                        f"{error}") from error
+        raise error
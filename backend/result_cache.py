@@ -0,0 +1,358 @@
+"""
+Content-addressed cache for detection results
+"""
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import numpy as np
+
+from hamming_index import HammingIndex
+
+
+def compute_image_key(img: np.ndarray, prompt_version: str) -> str:
+    """
+    Compute the cache key for a resized image
+    
+    Args:
+        img: Resized OpenCV image (the exact pixels sent to the AI service)
+        prompt_version: Version of the prompts used to analyse the image
+        
+    Returns:
+        Hex digest identifying image content and prompt version
+    """
+    digest = hashlib.sha256()
+    digest.update(prompt_version.encode('utf-8'))
+    digest.update(repr(img.shape).encode('utf-8'))
+    digest.update(np.ascontiguousarray(img).data)
+    return digest.hexdigest()
+
+
+class MemoryLRUCache:
+    """In-process LRU cache with a maximum entry count and TTL"""
+    
+    def __init__(self, max_entries: int, ttl_seconds: float,
+                 on_evict: Optional[Callable[[str], None]] = None):
+        """
+        Initialize memory cache
+        
+        Args:
+            max_entries: Maximum number of cached results
+            ttl_seconds: Seconds before an entry expires
+            on_evict: Called with each key evicted by size or TTL (outside the lock)
+        """
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.on_evict = on_evict
+        self._entries: "OrderedDict[str, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.size_evictions = 0
+        self.ttl_evictions = 0
+    
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        """Return the cached value or None if missing or expired"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            stored_at, value = entry
+            if time.monotonic() - stored_at <= self.ttl_seconds:
+                self._entries.move_to_end(key)
+                return value
+            del self._entries[key]
+            self.ttl_evictions += 1
+        self._evicted([key])
+        return None
+    
+    def set(self, key: str, value: Dict[str, Any]) -> None:
+        """Store a value, evicting the least recently used entries if full"""
+        evicted = []
+        with self._lock:
+            self._entries[key] = (time.monotonic(), value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                evicted.append(self._entries.popitem(last=False)[0])
+                self.size_evictions += 1
+        self._evicted(evicted)
+    
+    def _evicted(self, keys: List[str]) -> None:
+        if self.on_evict is not None:
+            for key in keys:
+                self.on_evict(key)
+    
+    def __contains__(self, key: str) -> bool:
+        """Whether a live entry is stored, without touching its recency"""
+        with self._lock:
+            entry = self._entries.get(key)
+            return entry is not None and time.monotonic() - entry[0] <= self.ttl_seconds
+    
+    def __len__(self) -> int:
+        return len(self._entries)
+
+
+class SQLiteDatabase:
+    """
+    SQLite file in WAL mode with one connection per process
+    
+    Pre-forked workers share the file: a worker reopens its connection after
+    the fork and waits up to BUSY_TIMEOUT_SECONDS for another's write.
+    """
+    
+    BUSY_TIMEOUT_SECONDS = 10.0
+    
+    def __init__(self, path: str):
+        """
+        Open the database
+        
+        Args:
+            path: Database file path
+        """
+        self._lock = threading.Lock()
+        self._path = path
+        self._pid = None
+        self._connection = None
+        self._conn.execute("PRAGMA journal_mode=WAL")
+    
+    @property
+    def _conn(self) -> sqlite3.Connection:
+        """Connection of the current process, reopened after a fork (pre-forked workers)"""
+        if self._pid != os.getpid():
+            self._connection = sqlite3.connect(self._path, timeout=self.BUSY_TIMEOUT_SECONDS,
+                                               check_same_thread=False)
+            self._pid = os.getpid()
+        return self._connection
+
+
+class SQLiteCache(SQLiteDatabase):
+    """On-disk cache tier that survives restarts"""
+    
+    def __init__(self, path: str, max_entries: int, ttl_seconds: float,
+                 on_evict: Optional[Callable[[str], None]] = None):
+        """
+        Initialize SQLite cache
+        
+        Args:
+            path: Database file path
+            max_entries: Maximum number of stored results
+            ttl_seconds: Seconds before an entry expires
+            on_evict: Called with each key evicted by size or TTL (outside the lock)
+        """
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.on_evict = on_evict
+        super().__init__(path)
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS detection_cache ("
+            "key TEXT PRIMARY KEY, stored_at REAL NOT NULL, value TEXT NOT NULL)"
+        )
+        self._conn.execute(
+            "CREATE INDEX IF NOT EXISTS detection_cache_stored_at ON detection_cache (stored_at)"
+        )
+        self._conn.commit()
+        self.size_evictions = 0
+        self.ttl_evictions = 0
+    
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        """Return the cached value or None if missing or expired"""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT stored_at, value FROM detection_cache WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                return None
+            stored_at, value = row
+            if time.time() - stored_at <= self.ttl_seconds:
+                return json.loads(value)
+            self._conn.execute("DELETE FROM detection_cache WHERE key = ?", (key,))
+            self._conn.commit()
+            self.ttl_evictions += 1
+        if self.on_evict is not None:
+            self.on_evict(key)
+        return None
+    
+    def set(self, key: str, value: Dict[str, Any]) -> None:
+        """Store a value, deleting the oldest rows beyond max_entries"""
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO detection_cache (key, stored_at, value) VALUES (?, ?, ?)",
+                (key, time.time(), json.dumps(value))
+            )
+            evicted = [row[0] for row in self._conn.execute(
+                "SELECT key FROM detection_cache ORDER BY stored_at DESC LIMIT -1 OFFSET ?",
+                (self.max_entries,)
+            )]
+            self._conn.executemany("DELETE FROM detection_cache WHERE key = ?", [(k,) for k in evicted])
+            self.size_evictions += len(evicted)
+            self._conn.commit()
+        if self.on_evict is not None:
+            for evicted_key in evicted:
+                self.on_evict(evicted_key)
+    
+    def __contains__(self, key: str) -> bool:
+        """Whether a live row is stored"""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT stored_at FROM detection_cache WHERE key = ?", (key,)
+            ).fetchone()
+            return row is not None and time.time() - row[0] <= self.ttl_seconds
+    
+    def __len__(self) -> int:
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM detection_cache").fetchone()[0]
+
+
+class DetectionResultCache:
+    """
+    Two-tier detection result cache (memory LRU plus optional SQLite)
+    
+    Exact lookups use the content key. When a near-duplicate index is
+    configured, results are also indexed by perceptual hash so re-encoded
+    or slightly cropped copies of an image can reuse them. A hash leaves the
+    index when its key has been evicted from every tier, and the index
+    holds at most as many hashes as the tiers hold results.
+    """
+    
+    def __init__(self, max_entries: int, ttl_seconds: float,
+                 sqlite_path: Optional[str] = None, sqlite_max_entries: int = 10000,
+                 near_duplicate_distance: Optional[int] = None,
+                 near_duplicate_max_entries: Optional[int] = None):
+        """
+        Initialize result cache
+        
+        Args:
+            max_entries: Maximum entries kept in memory
+            ttl_seconds: Seconds before an entry expires (both tiers)
+            sqlite_path: Optional database path for the on-disk tier
+            sqlite_max_entries: Maximum entries kept on disk
+            near_duplicate_distance: Max Hamming distance for near-duplicate reuse (None disables it)
+            near_duplicate_max_entries: Hashes kept in the near-duplicate index before the
+                                        oldest is dropped (None = entries of both tiers)
+        """
+        self.memory = MemoryLRUCache(max_entries, ttl_seconds, on_evict=self._evicted)
+        self.disk = (SQLiteCache(sqlite_path, sqlite_max_entries, ttl_seconds, on_evict=self._evicted)
+                     if sqlite_path else None)
+        if near_duplicate_max_entries is None:
+            near_duplicate_max_entries = max_entries + (sqlite_max_entries if self.disk is not None else 0)
+        self.near_duplicates = (HammingIndex(near_duplicate_distance, max_entries=near_duplicate_max_entries)
+                                if near_duplicate_distance is not None else None)
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.near_duplicate_hits = 0
+        self.misses = 0
+    
+    def _get(self, key: str) -> Optional[Dict[str, Any]]:
+        """Look up a key in every tier without touching hit/miss counters"""
+        value = self.memory.get(key)
+        if value is not None:
+            return value
+        
+        if self.disk is not None:
+            value = self.disk.get(key)
+            if value is not None:
+                self.memory.set(key, value)
+        return value
+    
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        """
+        Look up a detection result, promoting disk hits into memory
+        
+        Args:
+            key: Cache key from compute_image_key
+            
+        Returns:
+            Cached detection result or None
+        """
+        value = self.memory.get(key)
+        if value is not None:
+            self.memory_hits += 1
+            return value
+        
+        if self.disk is not None:
+            value = self.disk.get(key)
+            if value is not None:
+                self.disk_hits += 1
+                self.memory.set(key, value)
+                return value
+        
+        self.misses += 1
+        return None
+    
+    def get_near_duplicate(self, image_hash: int) -> Optional[Tuple[Dict[str, Any], int]]:
+        """
+        Look up the result of a perceptually similar image
+        
+        Args:
+            image_hash: Perceptual hash of the query image
+            
+        Returns:
+            Tuple of (cached detection result, Hamming distance) or None
+        """
+        if self.near_duplicates is None:
+            return None
+        
+        while True:
+            match = self.near_duplicates.search(image_hash)
+            if match is None:
+                return None
+            key, distance = match
+            value = self._get(key)
+            if value is not None:
+                self.near_duplicate_hits += 1
+                return value, distance
+            # Expired in every tier since it was indexed: try the next-nearest hash
+            self.near_duplicates.remove(key)
+    
+    def set(self, key: str, value: Dict[str, Any], image_hash: Optional[int] = None) -> None:
+        """
+        Store a detection result in every tier
+        
+        Args:
+            key: Cache key from compute_image_key
+            value: Detection result dictionary
+            image_hash: Optional perceptual hash for near-duplicate lookup
+        """
+        self.memory.set(key, value)
+        if self.disk is not None:
+            self.disk.set(key, value)
+        if self.near_duplicates is not None and image_hash is not None:
+            self.near_duplicates.add(image_hash, key)
+    
+    def _evicted(self, key: str) -> None:
+        """Drop a key's hash from the near-duplicate index once no tier holds it"""
+        if self.near_duplicates is None or key in self.memory:
+            return
+        if self.disk is not None and key in self.disk:
+            return
+        self.near_duplicates.remove(key)
+    
+    def get_stats(self) -> Dict[str, Any]:
+        """
+        Get cache counters
+        
+        Returns:
+            Dictionary with hit, miss, eviction and size counters
+        """
+        stats = {
+            "hits": self.memory_hits + self.disk_hits,
+            "memory_hits": self.memory_hits,
+            "disk_hits": self.disk_hits,
+            "near_duplicate_hits": self.near_duplicate_hits,
+            "near_duplicate_entries": len(self.near_duplicates) if self.near_duplicates is not None else 0,
+            "misses": self.misses,
+            "memory_entries": len(self.memory),
+            "memory_size_evictions": self.memory.size_evictions,
+            "memory_ttl_evictions": self.memory.ttl_evictions,
+            "disk_enabled": self.disk is not None
+        }
+        if self.disk is not None:
+            stats.update({
+                "disk_entries": len(self.disk),
+                "disk_size_evictions": self.disk.size_evictions,
+                "disk_ttl_evictions": self.disk.ttl_evictions
+            })
+        return stats
@@ -0,0 +1,202 @@
+"""
+Production launcher: pre-fork server workers that share the preloaded application
+
+The parent process imports the app (configuration, Gemini client, compiled
+parsers), opens the memory-mapped nutrition table and builds its search
+index, binds the listening socket and then forks WORKERS uvicorn servers.
+The children share those pages copy-on-write and accept connections on the
+same socket; a worker that dies is replaced.
+
+Usage (from backend/):
+    python serve.py --workers 4
+"""
+import argparse
+import gc
+import os
+import shutil
+import signal
+import socket
+import sys
+import tempfile
+import time
+import traceback
+from typing import Any, Dict, Optional
+
+import uvicorn
+
+from config import (
+    HOST, PORT, WORKERS, WORKER_TIMEOUT_SECONDS, DETECTION_BACKEND, METRICS_MULTIPROCESS_DIR,
+    ANNOTATED_IMAGE_SQLITE_PATH
+)
+
+
+def preload() -> Any:
+    """
+    Import the application and build its read-only state before forking
+    
+    Returns:
+        ASGI application
+    """
+    import main
+    from ai_service import load_llm_modules
+    from nutrition import get_nutrition_index, get_nutritional_info
+    
+    get_nutrition_index()
+    get_nutritional_info("tomate")
+    # The LLM stack takes seconds to import; do it once here rather than in every
+    # worker (each worker still builds its own client at startup)
+    if DETECTION_BACKEND in ("gemini", "local_first", "race"):
+        load_llm_modules()
+    # Keep the preloaded objects out of future collections so the garbage
+    # collector does not write to (and un-share) their pages in every worker
+    gc.collect()
+    gc.freeze()
+    return main.app
+
+
+def bind_socket(host: str, port: int) -> socket.socket:
+    """Listening socket shared by all workers"""
+    sock = socket.socket(socket.AF_INET6 if ":" in host else socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((host, port))
+    sock.listen(2048)
+    sock.set_inheritable(True)
+    return sock
+
+
+def run_worker(app: Any, sock: socket.socket) -> None:
+    """Serve requests in a forked child until it is told to stop"""
+    signal.signal(signal.SIGINT, signal.SIG_DFL)
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    config = uvicorn.Config(app, timeout_graceful_shutdown=int(WORKER_TIMEOUT_SECONDS), log_level="info")
+    uvicorn.Server(config).run(sockets=[sock])
+
+
+def spawn(app: Any, sock: socket.socket) -> int:
+    """Fork one worker and return its pid"""
+    pid = os.fork()
+    if pid == 0:
+        exit_code = 0
+        try:
+            run_worker(app, sock)
+        except BaseException:
+            traceback.print_exc()
+            exit_code = 1
+        finally:
+            os._exit(exit_code)
+    return pid
+
+
+def prepare_metrics_dir(workers: int) -> Optional[str]:
+    """
+    Set up the directory where workers share their metric files
+    
+    Must run before the application (and prometheus_client) is imported.
+    Files of a previous run are removed. Without METRICS_MULTIPROCESS_DIR a
+    temporary directory is used when there is more than one worker.
+    
+    Returns:
+        Temporary directory to delete on exit, or None
+    """
+    if METRICS_MULTIPROCESS_DIR:
+        os.makedirs(METRICS_MULTIPROCESS_DIR, exist_ok=True)
+        for name in os.listdir(METRICS_MULTIPROCESS_DIR):
+            if name.endswith(".db"):
+                os.unlink(os.path.join(METRICS_MULTIPROCESS_DIR, name))
+        return None
+    if workers < 2:
+        return None
+    path = tempfile.mkdtemp(prefix="nutrivision-metrics-")
+    os.environ["PROMETHEUS_MULTIPROC_DIR"] = path
+    return path
+
+
+def prepare_annotated_image_store(workers: int) -> Optional[str]:
+    """
+    Give the workers one store for processed_image=url images
+    
+    Must run before the application is imported. An id issued by one worker
+    is usually fetched from another, so with more than one worker and no
+    ANNOTATED_IMAGE_SQLITE_PATH the images go to a SQLite file in a
+    temporary directory.
+    
+    Returns:
+        Temporary directory to delete on exit, or None
+    """
+    if ANNOTATED_IMAGE_SQLITE_PATH or workers < 2:
+        return None
+    path = tempfile.mkdtemp(prefix="nutrivision-images-")
+    os.environ["ANNOTATED_IMAGE_SQLITE_PATH"] = os.path.join(path, "annotated_images.sqlite")
+    return path
+
+
+def serve(app: Any, host: str = HOST, port: int = PORT, workers: int = WORKERS) -> None:
+    """
+    Run pre-forked workers until SIGINT or SIGTERM
+    
+    Args:
+        app: Preloaded ASGI application
+        host: Bind address
+        port: Bind port
+        workers: Number of server processes
+    """
+    # Imported with the application, after prepare_metrics_dir
+    import metrics
+    
+    sock = bind_socket(host, port)
+    children: Dict[int, int] = {}
+    stopping = False
+    
+    def stop(signum, frame):
+        nonlocal stopping
+        stopping = True
+        for pid in children:
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+    
+    signal.signal(signal.SIGINT, stop)
+    signal.signal(signal.SIGTERM, stop)
+    
+    for index in range(workers):
+        children[spawn(app, sock)] = index
+    print(f"🚀 {workers} workers listening on http://{host}:{port} (pids {', '.join(map(str, children))})")
+    
+    while children:
+        try:
+            pid, status = os.wait()
+        except ChildProcessError:
+            break
+        except InterruptedError:
+            continue
+        index = children.pop(pid, None)
+        metrics.mark_process_dead(pid)
+        if index is None or stopping:
+            continue
+        print(f"⚠️ Worker {pid} exited with status {os.waitstatus_to_exitcode(status)}, restarting")
+        time.sleep(1)  # Avoid a tight restart loop when workers fail at startup
+        children[spawn(app, sock)] = index
+    sock.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--workers", type=int, default=WORKERS)
+    parser.add_argument("--host", default=HOST)
+    parser.add_argument("--port", type=int, default=PORT)
+    args = parser.parse_args()
+    
+    if not hasattr(os, "fork"):
+        sys.exit("serve.py necesita os.fork (Linux/macOS); en Windows usa: uvicorn main:app --workers N")
+    temporary_dirs = [prepare_metrics_dir(args.workers), prepare_annotated_image_store(args.workers)]
+    try:
+        serve(preload(), args.host, args.port, args.workers)
+    finally:
+        for path in temporary_dirs:
+            if path is not None:
+                shutil.rmtree(path, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
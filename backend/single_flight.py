@@ -0,0 +1,94 @@
+"""
+Single-flight coalescing of identical in-flight work
+"""
+import asyncio
+import contextvars
+import time
+from typing import Any, Awaitable, Callable, Dict, Hashable, Optional, Tuple
+
+import metrics
+
+
+class _Flight:
+    """One running call, its stage timings and the number of callers awaiting it"""
+    
+    __slots__ = ("task", "timings", "waiters")
+    
+    def __init__(self, task: asyncio.Task, timings: Dict[str, float]):
+        self.task = task
+        self.timings = timings
+        self.waiters = 0
+
+
+class SingleFlight:
+    """
+    Runs at most one call per key at a time; concurrent callers share its outcome
+    
+    The call runs in its own task, so the caller that started it (the leader)
+    can go away without failing the others: the task is only cancelled when
+    every caller awaiting it has been cancelled. Errors reach every caller.
+    Keys are forgotten as soon as the call finishes, so this is not a cache.
+    Everything runs on the event loop thread; no lock is held across awaits.
+    
+    The call runs in a fresh context rather than the leader's, so it carries
+    no caller's request deadline: each caller bounds its own wait with
+    `timeout`. Its stage timings are collected apart and added to every
+    caller's Server-Timing; callers that joined also get a "coalesced"
+    stage with their wait.
+    """
+    
+    def __init__(self):
+        self._flights: Dict[Hashable, _Flight] = {}
+        self.leaders = 0
+        self.coalesced = 0
+    
+    async def run(self, key: Hashable, func: Callable[[], Awaitable[Any]],
+                  timeout: Optional[float] = None) -> Tuple[Any, bool]:
+        """
+        Await func() for the first caller of a key, or join the call in flight
+        
+        Args:
+            key: Identity of the work (e.g. image content hash)
+            func: Starts the work; only called by the leader, run in a fresh context
+            timeout: Seconds this caller waits (None = until the call finishes)
+            
+        Returns:
+            Tuple of (result, whether it was shared from another caller's call)
+            
+        Raises:
+            asyncio.TimeoutError: This caller's timeout passed (the call goes on for the others)
+        """
+        flight = self._flights.get(key)
+        shared = flight is not None
+        if flight is None:
+            context = contextvars.Context()
+            timings = context.run(metrics.track_timings)
+            # The task copies the context it is created in (create_task's context argument is 3.11+)
+            flight = _Flight(context.run(asyncio.create_task, func()), timings)
+            self._flights[key] = flight
+            flight.task.add_done_callback(lambda _, flight=flight: self._forget(key, flight))
+            self.leaders += 1
+        else:
+            self.coalesced += 1
+            metrics.record_coalesced()
+        
+        flight.waiters += 1
+        start = time.perf_counter()
+        try:
+            return await asyncio.wait_for(asyncio.shield(flight.task), timeout), shared
+        finally:
+            flight.waiters -= 1
+            if flight.waiters == 0 and not flight.task.done():
+                # Every caller was cancelled or timed out (e.g. clients disconnected): stop the work
+                flight.task.cancel()
+            metrics.add_timings(flight.timings)
+            if shared:
+                metrics.record_stage("coalesced", time.perf_counter() - start)
+    
+    def get_stats(self) -> Dict[str, int]:
+        """Calls in flight, calls started and callers that joined one, for /health"""
+        return {"in_flight": len(self._flights), "leaders": self.leaders, "coalesced": self.coalesced}
+    
+    def _forget(self, key: Hashable, flight: _Flight) -> None:
+        if self._flights.get(key) is flight:
+            del self._flights[key]
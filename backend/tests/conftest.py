@@ -0,0 +1,11 @@
+"""
+Test setup: import the flat backend modules and stay offline
+
+Run from backend/:
+    python -m pytest tests
+"""
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("GOOGLE_API_KEY", "offline-tests")
@@ -0,0 +1,256 @@
+"""
+Admission control: priority slots, queue limits, deadline shedding and request classification
+"""
+import asyncio
+
+import httpx
+import pytest
+from fastapi import FastAPI, HTTPException
+
+import admission
+import main
+from admission import AdmissionController, AdmissionMiddleware
+from benchmarks.bench_async_pipeline import make_image_bytes
+
+ROUTES = {
+    "/detect-objects": ("interactive", 1, 30.0),
+    "/detect-objects/batch": ("batch", 4, 300.0)
+}
+
+
+def make_middleware(controller: AdmissionController) -> AdmissionMiddleware:
+    """Middleware over an empty app with one interactive and one batch key"""
+    return AdmissionMiddleware(None, controller, ROUTES, batch_paths=["/detect-objects/batch"],
+                               interactive_keys=["web"], batch_keys=["nightly"])
+
+
+def scope(path: str, headers: dict = None, query: bytes = b"") -> dict:
+    """HTTP scope with lower-cased header names, as servers pass them"""
+    return {
+        "type": "http", "path": path, "query_string": query,
+        "headers": [(name.lower().encode(), value.encode()) for name, value in (headers or {}).items()]
+    }
+
+
+async def rejection(controller: AdmissionController, priority: str, weight: int = 1,
+                    deadline: float = None) -> HTTPException:
+    """The HTTPException an acquire is refused with"""
+    with pytest.raises(HTTPException) as refused:
+        await controller.acquire(priority, weight, deadline)
+    return refused.value
+
+
+def test_batch_never_takes_the_slots_kept_for_interactive_requests():
+    controller = AdmissionController(max_in_flight=4, batch_max_in_flight=2, max_queue=10)
+    
+    async def scenario():
+        await controller.acquire("batch", 2)
+        queued_batch = asyncio.create_task(controller.acquire("batch", 1))
+        await asyncio.sleep(0)
+        # Two slots are free, but only for interactive requests
+        batch_admitted = queued_batch.done()
+        await controller.acquire("interactive", 2)
+        controller.release("batch", 1)
+        await queued_batch
+        return batch_admitted
+    
+    assert asyncio.run(scenario()) is False
+    assert controller.in_flight == {"interactive": 2, "batch": 2}
+
+
+def test_waiting_interactive_requests_go_before_batch_ones():
+    controller = AdmissionController(max_in_flight=1, batch_max_in_flight=1, max_queue=10)
+    order = []
+    
+    async def wait(priority: str):
+        await controller.acquire(priority)
+        order.append(priority)
+    
+    async def scenario():
+        await controller.acquire("interactive")
+        batch = asyncio.create_task(wait("batch"))
+        await asyncio.sleep(0)
+        interactive = asyncio.create_task(wait("interactive"))
+        await asyncio.sleep(0)
+        controller.release("interactive")
+        await interactive
+        controller.release("interactive")
+        await batch
+    
+    asyncio.run(scenario())
+    
+    assert order == ["interactive", "batch"]
+
+
+def test_full_queue_is_refused_with_429_and_retry_after():
+    controller = AdmissionController(max_in_flight=1, batch_max_in_flight=1, max_queue=1)
+    
+    async def scenario():
+        await controller.acquire("interactive")
+        waiting = asyncio.create_task(controller.acquire("interactive"))
+        await asyncio.sleep(0)
+        refused = await rejection(controller, "interactive")
+        waiting.cancel()
+        await asyncio.gather(waiting, return_exceptions=True)
+        return refused
+    
+    refused = asyncio.run(scenario())
+    
+    assert refused.status_code == 429
+    assert int(refused.headers["Retry-After"]) >= 1
+    assert controller.counts["interactive"]["queue_full"] == 1
+    assert controller._queued("interactive") == 0
+
+
+def test_request_that_cannot_meet_its_deadline_is_shed_up_front():
+    controller = AdmissionController(max_in_flight=1, batch_max_in_flight=1, max_queue=10)
+    
+    async def scenario():
+        await controller.acquire("interactive")
+        controller.release("interactive", held_seconds=2.0)
+        await controller.acquire("interactive")
+        # One slot ahead (2s) plus the usual 2s of work do not fit in 3s
+        return await rejection(controller, "interactive", deadline=3.0)
+    
+    refused = asyncio.run(scenario())
+    
+    assert refused.status_code == 503
+    assert refused.headers["Retry-After"] == "2"
+    assert controller.counts["interactive"]["over_deadline"] == 1
+    assert controller._queued("interactive") == 0
+
+
+def test_request_still_queued_at_its_deadline_expires_with_503():
+    controller = AdmissionController(max_in_flight=1, batch_max_in_flight=1, max_queue=10)
+    
+    async def scenario():
+        await controller.acquire("interactive")
+        return await rejection(controller, "interactive", deadline=0.05)
+    
+    refused = asyncio.run(scenario())
+    
+    assert refused.status_code == 503
+    assert "Retry-After" in refused.headers
+    assert controller.counts["interactive"]["expired"] == 1
+    assert controller.in_flight["interactive"] == 1
+
+
+def test_slot_granted_as_the_wait_times_out_is_handed_back(monkeypatch):
+    controller = AdmissionController(max_in_flight=1, batch_max_in_flight=1, max_queue=10)
+    timed_out = asyncio.Event()
+    
+    async def wait_for(future, timeout):
+        # The timeout fires in the same loop iteration the slot is granted
+        await timed_out.wait()
+        raise asyncio.TimeoutError
+    
+    monkeypatch.setattr(admission.asyncio, "wait_for", wait_for)
+    
+    async def scenario():
+        await controller.acquire("interactive")
+        waiting = asyncio.create_task(rejection(controller, "interactive", deadline=5.0))
+        await asyncio.sleep(0)
+        controller.release("interactive")
+        granted = controller.in_flight["interactive"]
+        timed_out.set()
+        return granted, await waiting
+    
+    granted, refused = asyncio.run(scenario())
+    
+    assert granted == 1
+    assert refused.status_code == 503
+    assert controller.in_flight["interactive"] == 0
+    assert controller.counts["interactive"]["expired"] == 1
+
+
+def test_cancelled_waiter_leaves_no_slot_behind():
+    controller = AdmissionController(max_in_flight=1, batch_max_in_flight=1, max_queue=10)
+    
+    async def scenario():
+        await controller.acquire("interactive")
+        waiting = asyncio.create_task(controller.acquire("interactive"))
+        await asyncio.sleep(0)
+        controller.release("interactive")
+        waiting.cancel()
+        outcome = (await asyncio.gather(waiting, return_exceptions=True))[0]
+        if not isinstance(outcome, BaseException):
+            # Granted before the cancellation was delivered: the caller owns the slot
+            controller.release("interactive")
+    
+    asyncio.run(scenario())
+    
+    assert controller.in_flight["interactive"] == 0
+    assert controller._queued("interactive") == 0
+
+
+def test_classify_by_api_key_priority_header_and_batch_query():
+    controller = AdmissionController(max_in_flight=8, batch_max_in_flight=3, max_queue=10)
+    middleware = make_middleware(controller)
+    
+    assert middleware.classify(scope("/detect-objects")) == ("interactive", 1, 30.0)
+    assert middleware.classify(scope("/detect-objects", {"X-API-Key": "nightly"}))[0] == "batch"
+    assert middleware.classify(scope("/detect-objects", {"X-Priority": "Batch"}))[0] == "batch"
+    # An API key's class wins over the header
+    web_marked_batch = scope("/detect-objects", {"X-API-Key": "web", "X-Priority": "batch"})
+    assert middleware.classify(web_marked_batch)[0] == "interactive"
+    assert middleware.classify(scope("/detect-objects", {"X-Priority": "urgent"}))[0] == "interactive"
+    
+    assert middleware.classify(scope("/detect-objects/batch")) == ("batch", 3, 300.0)
+    assert middleware.classify(scope("/detect-objects/batch", query=b"concurrency=2&deadline_seconds=60")) == (
+        "batch", 2, 60.0
+    )
+    # Invalid values fall back to the route's, and X-Deadline-Seconds only shortens the deadline
+    assert middleware.classify(scope("/detect-objects/batch", {"X-Deadline-Seconds": "10"},
+                                     b"concurrency=-1")) == ("batch", 3, 10.0)
+    assert middleware.classify(scope("/detect-objects/batch", {"X-API-Key": "web"},
+                                     b"concurrency=6"))[:2] == ("interactive", 6)
+
+
+def test_middleware_answers_refusals_with_retry_after():
+    controller = AdmissionController(max_in_flight=1, batch_max_in_flight=1, max_queue=0)
+    app = FastAPI()
+    
+    @app.post("/detect-objects")
+    async def detect():
+        return {"ok": True}
+    
+    app.add_middleware(AdmissionMiddleware, controller=controller, routes=ROUTES)
+    
+    async def scenario():
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+            admitted = await client.post("/detect-objects")
+            await controller.acquire("interactive")
+            refused = await client.post("/detect-objects")
+            return admitted, refused
+    
+    admitted, refused = asyncio.run(scenario())
+    
+    assert admitted.status_code == 200
+    assert refused.status_code == 429
+    assert refused.headers["retry-after"] == "1"
+    assert controller.counts["interactive"]["admitted"] == 2
+
+
+def test_batch_runs_no_more_images_at_once_than_its_admitted_slots(monkeypatch):
+    capacity = main.admission.capacity("batch")
+    concurrencies = []
+    
+    async def stream_batch(service, images, concurrency, deadline_seconds, image_mode):
+        concurrencies.append(concurrency)
+        yield {"type": "summary"}
+    
+    monkeypatch.setattr(main, "stream_batch", stream_batch)
+    
+    async def scenario():
+        transport = httpx.ASGITransport(app=main.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+            files = {"files": ("plate.jpg", make_image_bytes(), "image/jpeg")}
+            for concurrency in (capacity * 2, 1):
+                response = await client.post(f"/detect-objects/batch?concurrency={concurrency}", files=files)
+                assert response.status_code == 200
+    
+    asyncio.run(scenario())
+    
+    assert concurrencies == [capacity, 1]
+    assert main.admission.in_flight["batch"] == 0
@@ -0,0 +1,61 @@
+"""
+processed_image=url ids issued by one worker process and fetched from another
+"""
+import os
+import subprocess
+import sys
+import time
+
+from annotated_images import AnnotatedImageStore
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+ISSUE = """
+import sys
+import numpy as np
+from annotated_images import AnnotatedImageStore
+from image_processor import ImageProcessor
+store = AnnotatedImageStore(16, 60.0, sys.argv[1])
+image = ImageProcessor.encode_jpeg(np.full((120, 160, 3), 200, dtype=np.uint8))
+detections = [{"label": "tomate", "bbox": [10, 10, 90, 90], "source": "primary"}]
+print(store.add(image, detections))
+"""
+
+FETCH = """
+import sys
+from annotated_images import AnnotatedImageStore
+store = AnnotatedImageStore(16, 60.0, sys.argv[1])
+image = store.render(sys.argv[2])
+print("missing" if image is None else image[:2].hex())
+"""
+
+
+def run_python(code: str, *args: str) -> str:
+    """Run code in a fresh interpreter, as another worker would, and return its output"""
+    completed = subprocess.run([sys.executable, "-c", code, *args], cwd=BACKEND_DIR,
+                               capture_output=True, text=True, check=True)
+    return completed.stdout.strip()
+
+
+def test_url_issued_by_one_process_is_served_by_another(tmp_path):
+    path = str(tmp_path / "annotated_images.sqlite")
+    
+    image_id = run_python(ISSUE, path)
+    
+    # Rendered by a second process, then read back already rendered by a third
+    assert run_python(FETCH, path, image_id) == "ffd8"
+    assert run_python(FETCH, path, image_id) == "ffd8"
+    assert run_python(FETCH, path, "unknown-id") == "missing"
+
+
+def test_shared_store_expires_and_bounds_its_entries(tmp_path):
+    store = AnnotatedImageStore(2, 60.0, str(tmp_path / "annotated_images.sqlite"))
+    ids = [store.add(b"jpeg", []) for _ in range(3)]
+    
+    assert len(store._entries) == 2
+    assert store.render(ids[0]) is None
+    
+    expired = AnnotatedImageStore(2, 0.01, str(tmp_path / "expired.sqlite"))
+    image_id = expired.add(b"jpeg", [])
+    time.sleep(0.02)
+    assert expired.render(image_id) is None
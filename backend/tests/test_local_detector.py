@@ -0,0 +1,34 @@
+"""
+Local detector: the model loads at startup or on first use, never at construction
+"""
+import asyncio
+import contextlib
+import io
+
+import pytest
+from fastapi import HTTPException
+
+from detection_backends import LocalDetectorBackend
+
+
+def test_model_loads_at_start_and_its_time_is_reported(tmp_path):
+    backend = LocalDetectorBackend(model_path=str(tmp_path / "missing.onnx"), labels_path="")
+    
+    assert not backend.initialized and backend.is_available()
+    assert backend.startup_timings() == {}
+    
+    with contextlib.redirect_stdout(io.StringIO()):
+        asyncio.run(backend.start())
+    
+    assert backend.initialized and not backend.is_available()
+    assert set(backend.startup_timings()) == {"local_model"}
+
+
+def test_first_detection_loads_the_model_when_startup_has_not():
+    backend = LocalDetectorBackend(model_path="", labels_path="")
+    
+    with pytest.raises(HTTPException) as unavailable:
+        backend.detect_scored(b"jpeg")
+    
+    assert unavailable.value.status_code == 503
+    assert backend.initialized
@@ -0,0 +1,88 @@
+"""
+Server-Timing and /metrics rendering, in one process and summed over worker processes
+"""
+import asyncio
+import os
+import subprocess
+import sys
+
+import httpx
+from fastapi import FastAPI
+
+import metrics
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+WORKER = """
+import os, metrics
+metrics.REQUESTS.labels("/detect-objects", "POST", "200").inc()
+metrics.REQUESTS_IN_FLIGHT.labels("/detect-objects").inc()
+metrics.STAGE_SECONDS.labels("decode").observe(0.02)
+print(os.getpid())
+"""
+
+SCRAPE = """
+import sys, metrics
+metrics.mark_process_dead(int(sys.argv[1]))
+print(metrics.render().decode())
+"""
+
+
+def run_python(code: str, multiprocess_dir: str, *args: str) -> str:
+    """Run code in a fresh interpreter with the metrics directory set, and return its output"""
+    env = {**os.environ, "METRICS_MULTIPROCESS_DIR": multiprocess_dir}
+    env.pop("PROMETHEUS_MULTIPROC_DIR", None)
+    completed = subprocess.run([sys.executable, "-c", code, *args], cwd=BACKEND_DIR, env=env,
+                               capture_output=True, text=True, check=True)
+    return completed.stdout.strip()
+
+
+def sample(exposition: str, name: str) -> float:
+    """Value of the one sample line starting with name"""
+    values = [float(line.rsplit(" ", 1)[1]) for line in exposition.splitlines() if line.startswith(name)]
+    assert len(values) == 1, (name, values)
+    return values[0]
+
+
+def test_request_stages_reach_server_timing_and_the_histograms():
+    app = FastAPI()
+    
+    @app.get("/work")
+    async def work():
+        metrics.record_stage("decode", 0.012)
+        metrics.record_call("tile_2", "gemini", "completed", 0.5)
+        return {"ok": True}
+    
+    app.add_middleware(metrics.MetricsMiddleware)
+    
+    async def scenario():
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+            return await client.get("/work")
+    
+    before = metrics.REGISTRY.get_sample_value(
+        "nutrivision_stage_duration_seconds_count", {"stage": "decode"}
+    ) or 0.0
+    response = asyncio.run(scenario())
+    
+    timing = response.headers["server-timing"]
+    assert "decode;dur=12.0" in timing and "tile_2;dur=500.0" in timing and "total;dur=" in timing
+    exposition = metrics.render().decode()
+    assert sample(exposition, 'nutrivision_stage_duration_seconds_count{stage="decode"}') == before + 1
+    assert 'nutrivision_detection_calls_total{backend="gemini",prompt="tile",status="completed"}' in exposition
+    assert 'nutrivision_requests_total{endpoint="/work",method="GET",status="200"}' in exposition
+
+
+def test_workers_are_summed_and_dead_workers_leave_the_live_gauges(tmp_path):
+    multiprocess_dir = str(tmp_path)
+    first = run_python(WORKER, multiprocess_dir)
+    run_python(WORKER, multiprocess_dir)
+    
+    exposition = run_python(SCRAPE, multiprocess_dir, first)
+    
+    labels = '{endpoint="/detect-objects",method="POST",status="200"}'
+    assert sample(exposition, f"nutrivision_requests_total{labels}") == 2.0
+    assert sample(exposition, 'nutrivision_stage_duration_seconds_count{stage="decode"}') == 2.0
+    assert sample(exposition, 'nutrivision_stage_duration_seconds_sum{stage="decode"}') == 0.04
+    # Only the worker not marked dead still counts as serving a request
+    assert sample(exposition, 'nutrivision_requests_in_flight{endpoint="/detect-objects"}') == 1.0
@@ -0,0 +1,109 @@
+"""
+Near-duplicate lookup: multi-index Hamming search and its sync with the result cache tiers
+"""
+import numpy as np
+
+from hamming_index import HammingIndex, hamming_distances
+from result_cache import DetectionResultCache
+
+
+def flip_bits(value: int, bits) -> int:
+    """Hash with the given bit positions inverted"""
+    for bit in bits:
+        value ^= 1 << int(bit)
+    return value
+
+
+def brute_force(hashes: dict, query: int, max_distance: int):
+    """Smallest distance to any stored hash, or None beyond max_distance"""
+    distances = hamming_distances(np.array(list(hashes.values()), dtype=np.uint64), query)
+    best = int(distances.min())
+    return best if best <= max_distance else None
+
+
+def test_search_finds_every_hash_within_the_distance_like_a_linear_scan():
+    rng = np.random.default_rng(3)
+    # 10 over 4 substrings: a match within 10 agrees with the query within 2 bits on some substring
+    index = HammingIndex(max_distance=10, chunks=4, initial_capacity=8)
+    hashes = {key: int(value) for key, value in enumerate(rng.integers(0, 2 ** 63, 300, dtype=np.uint64))}
+    for key, value in hashes.items():
+        index.add(value, key)
+    
+    for distance in range(0, 14):
+        for key in rng.choice(len(hashes), 10, replace=False):
+            query = flip_bits(hashes[int(key)], rng.choice(64, distance, replace=False))
+            match = index.search(query)
+            expected = brute_force(hashes, query, 10)
+            if expected is None:
+                assert match is None
+            else:
+                assert match is not None and match[1] == expected
+                assert int(hamming_distances(np.array([hashes[match[0]]], dtype=np.uint64), query)[0]) == expected
+
+
+def test_removed_slots_are_reused_and_leave_no_stale_buckets():
+    index = HammingIndex(max_distance=4, initial_capacity=2)
+    first, second, third = 0x0123456789ABCDEF, 0x7EDCBA9876543210, 0x00FF00FF00FF00FF
+    index.add(first, "a")
+    index.add(second, "b")
+    
+    assert index.remove("a")
+    assert not index.remove("a")
+    assert index.search(first) is None
+    
+    index.add(third, "c")
+    assert len(index) == 2
+    assert len(index._payloads) == 2 and len(index._hashes) == 2
+    assert index.search(third) == ("c", 0)
+    assert index.search(flip_bits(second, [1, 30])) == ("b", 2)
+    stored = {slot for table in index._tables for bucket in table.values() for slot in bucket}
+    assert stored == {0, 1}
+
+
+def test_readding_a_payload_replaces_its_hash_and_the_oldest_goes_first():
+    index = HammingIndex(max_distance=2, max_entries=2)
+    index.add(0x1111, "a")
+    index.add(0x2222_0000_0000, "b")
+    index.add(0x3333_0000_0000_0000, "a")
+    
+    assert index.search(0x1111) is None
+    assert index.search(0x3333_0000_0000_0000) == ("a", 0)
+    
+    # "b" is now the oldest
+    index.add(0x4444_0000, "c")
+    assert len(index) == 2
+    assert index.search(0x2222_0000_0000) is None
+    assert index.search(0x4444_0000) == ("c", 0)
+
+
+def test_hash_stays_indexed_while_the_disk_tier_holds_its_result(tmp_path):
+    cache = DetectionResultCache(1, 60.0, sqlite_path=str(tmp_path / "cache.sqlite"),
+                                 sqlite_max_entries=10, near_duplicate_distance=4)
+    cache.set("first", {"detections": ["tomate"]}, image_hash=0xAAAA)
+    # Pushes "first" out of memory; it is still on disk
+    cache.set("second", {"detections": ["arroz"]}, image_hash=0xAAAA_0000_0000)
+    
+    assert "first" not in cache.memory and "first" in cache.disk
+    assert len(cache.near_duplicates) == 2
+    assert cache.get_near_duplicate(flip_bits(0xAAAA, [0])) == ({"detections": ["tomate"]}, 1)
+
+
+def test_hash_leaves_the_index_once_no_tier_holds_its_result(tmp_path):
+    memory_only = DetectionResultCache(1, 60.0, near_duplicate_distance=4)
+    memory_only.set("first", {"detections": []}, image_hash=0xAAAA)
+    memory_only.set("second", {"detections": []}, image_hash=0xAAAA_0000_0000)
+    
+    assert len(memory_only.near_duplicates) == 1
+    assert memory_only.get_near_duplicate(0xAAAA) is None
+    
+    # Evicted from disk while memory still holds it, then from memory too
+    both = DetectionResultCache(2, 60.0, sqlite_path=str(tmp_path / "cache.sqlite"),
+                                sqlite_max_entries=1, near_duplicate_distance=4)
+    both.set("first", {"detections": []}, image_hash=0xAAAA)
+    both.set("second", {"detections": []}, image_hash=0xAAAA_0000_0000)
+    assert "first" not in both.disk and len(both.near_duplicates) == 2
+    
+    both.set("third", {"detections": []}, image_hash=0xAAAA_0000_0000_0000)
+    assert "first" not in both.memory
+    assert len(both.near_duplicates) == 2
+    assert both.near_duplicates.search(0xAAAA) is None
@@ -0,0 +1,30 @@
+"""
+processed_image built from the upload buffer or re-encoded at the display quality
+"""
+import numpy as np
+
+from ai_service import GeminiAIService
+from benchmarks.fake_llm import FakeLLM
+from detection_service import IngredientDetectionService
+from image_processor import JPEG_QUALITY, ImageProcessor
+
+IMAGE = np.full((60, 80, 3), 128, dtype=np.uint8)
+
+
+def attach(upload_format: str, upload_quality: int, image_data: bytes) -> str:
+    """Inline processed_image of a result without detections"""
+    service = IngredientDetectionService(ai_service=GeminiAIService(llm=FakeLLM(0.0)))
+    preparation = {"upload_format": upload_format, "upload_quality": upload_quality}
+    result = service._attach_processed_image({"detections": []}, IMAGE.copy(), image_data, "inline", preparation)
+    return result["processed_image"]
+
+
+def test_upload_buffer_is_reused_only_as_a_default_quality_jpeg():
+    upload = ImageProcessor.encode_jpeg(IMAGE)
+    assert attach("jpeg", JPEG_QUALITY, upload) == ImageProcessor.encoded_to_base64(upload)
+    
+    baseline = ImageProcessor.convert_to_base64(IMAGE)
+    low_rung, _ = ImageProcessor.encode_for_upload(IMAGE, "jpeg", qualities=[50])
+    webp, _ = ImageProcessor.encode_for_upload(IMAGE, "webp", qualities=[90])
+    assert attach("jpeg", 50, low_rung) == baseline
+    assert attach("webp", 90, webp) == baseline
@@ -0,0 +1,62 @@
+"""
+Responses recorded through RecordingBackend replay offline to the same detections
+"""
+import asyncio
+import contextlib
+import io
+
+import numpy as np
+import orjson
+
+from ai_service import GeminiAIService
+from benchmarks.bench_image_upload import synthetic_photo
+from benchmarks.fake_llm import FakeLLM
+from detection_backends import RecordingBackend, ReplayBackend
+from detection_service import IngredientDetectionService
+
+
+def detect(backend, image_bytes: bytes) -> dict:
+    """One uncached /detect-objects pipeline run on a backend"""
+    service = IngredientDetectionService(ai_service=backend)
+    service.result_cache = None
+    service.single_flight = None
+    with contextlib.redirect_stdout(io.StringIO()):
+        return asyncio.run(service.process_image_async(image_bytes, "none"))
+
+
+def without_confidence(detections: list) -> list:
+    """Detections minus the confidence, which carries random variation"""
+    return [{key: value for key, value in detection.items() if key != "confidence"}
+            for detection in detections]
+
+
+def test_replay_of_a_recording_gives_the_same_detections(tmp_path):
+    fixtures_path = str(tmp_path / "recorded.json")
+    image_bytes = synthetic_photo(0.3, np.random.default_rng(0))
+    llm = FakeLLM(0.001)
+    
+    recorded = detect(RecordingBackend(GeminiAIService(llm=llm), fixtures_path), image_bytes)
+    replayed = detect(ReplayBackend(fixtures_path, latency=0.0, jitter=0.0), image_bytes)
+    
+    assert recorded["total_objects"] > 0
+    assert without_confidence(replayed["detections"]) == without_confidence(recorded["detections"])
+    assert replayed["nutritional_summary"] == recorded["nutritional_summary"]
+    assert replayed["original_size"] == recorded["original_size"]
+    # Every upstream call was recorded under the uploaded image, and replay made none
+    with open(fixtures_path, "rb") as f:
+        responses = orjson.loads(f.read())["responses"]
+    assert len(responses) == 1
+    assert "primary" in next(iter(responses.values()))
+    assert llm.calls == sum(len(prompts) for prompts in responses.values())
+
+
+def test_replay_without_a_recording_detects_nothing(tmp_path):
+    fixtures_path = str(tmp_path / "empty.json")
+    with open(fixtures_path, "wb") as f:
+        f.write(orjson.dumps({"responses": {}}))
+    image_bytes = synthetic_photo(0.3, np.random.default_rng(0))
+    
+    result = detect(ReplayBackend(fixtures_path, latency=0.0, jitter=0.0), image_bytes)
+    
+    assert result["total_objects"] == 0
+    assert result["detections"] == []
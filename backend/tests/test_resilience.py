@@ -0,0 +1,188 @@
+"""
+Deadlines, retries and the circuit breaker of the Gemini call path, against the local fake LLM
+"""
+import asyncio
+import time
+
+import pytest
+from fastapi import HTTPException
+
+from ai_service import GeminiAIService
+from benchmarks.fake_llm import FakeAPIError, FakeLLM
+from resilience import CircuitBreaker, ResilientCaller, request_deadline
+
+IMAGE = b"\xff\xd8fake-jpeg"
+
+
+def make_service(llm: FakeLLM, max_attempts: int = 1, failure_threshold: int = 100,
+                 reset_seconds: float = 60.0, **caller_options) -> GeminiAIService:
+    """Gemini service on the fake LLM with its own breaker"""
+    caller = ResilientCaller(
+        "gemini", CircuitBreaker("gemini", failure_threshold, reset_seconds),
+        max_attempts=max_attempts, seed=0, **caller_options
+    )
+    return GeminiAIService(llm=llm, resilience=caller)
+
+
+async def detect(service: GeminiAIService, deadline: float = None):
+    """One primary detection call, optionally under a request deadline"""
+    with request_deadline(deadline):
+        return await service.detect_primary_async(IMAGE, 800, 600)
+
+
+async def outcome(service: GeminiAIService, deadline: float = None):
+    """Status code of one call (200 on success) and its Retry-After header"""
+    try:
+        await detect(service, deadline)
+        return 200, None
+    except HTTPException as he:
+        return he.status_code, (he.headers or {}).get("Retry-After")
+
+
+def test_breaker_opens_after_threshold_and_fails_fast_with_retry_after():
+    llm = FakeLLM(0.001, error_rate=1.0)
+    service = make_service(llm, failure_threshold=3, reset_seconds=30.0)
+    
+    async def scenario():
+        return [await outcome(service) for _ in range(5)]
+    
+    results = asyncio.run(scenario())
+    
+    assert [status for status, _ in results[:3]] == [502, 502, 502]
+    for status, retry_after in results[3:]:
+        assert status == 503
+        assert 1 <= int(retry_after) <= 30
+    # Refused calls never reach the upstream
+    assert llm.failures == 3
+    assert service.resilience.breaker.state == "open"
+    assert service.resilience.breaker.rejections == 2
+
+
+def test_half_open_lets_a_single_probe_through_and_closes_on_success():
+    llm = FakeLLM(0.001, error_rate=1.0)
+    service = make_service(llm, failure_threshold=1, reset_seconds=0.05)
+    breaker = service.resilience.breaker
+    
+    async def scenario():
+        first = await outcome(service)
+        await asyncio.sleep(0.06)
+        llm.error_rate = 0.0
+        llm.latency = 0.1
+        burst = await asyncio.gather(*(outcome(service) for _ in range(5)))
+        after = await outcome(service)
+        return first, burst, after
+    
+    first, burst, after = asyncio.run(scenario())
+    
+    assert first[0] == 502
+    statuses = sorted(status for status, _ in burst)
+    assert statuses == [200, 503, 503, 503, 503]
+    assert all(retry_after is not None for status, retry_after in burst if status == 503)
+    assert llm.calls == 2
+    assert after == (200, None)
+    assert breaker.state == "closed"
+
+
+def test_failed_probe_reopens_the_circuit():
+    llm = FakeLLM(0.001, error_rate=1.0)
+    service = make_service(llm, failure_threshold=1, reset_seconds=0.05)
+    breaker = service.resilience.breaker
+    
+    async def scenario():
+        await outcome(service)
+        await asyncio.sleep(0.06)
+        probe = await outcome(service)
+        refused = await outcome(service)
+        return probe, refused
+    
+    probe, refused = asyncio.run(scenario())
+    
+    assert probe[0] == 502
+    assert refused[0] == 503 and refused[1] is not None
+    assert breaker.state == "open"
+    assert breaker.times_opened == 2
+    assert llm.failures == 2
+
+
+def test_cancelled_probe_releases_the_half_open_slot():
+    llm = FakeLLM(0.001, error_rate=1.0)
+    service = make_service(llm, failure_threshold=1, reset_seconds=0.05)
+    breaker = service.resilience.breaker
+    
+    async def scenario():
+        await outcome(service)
+        await asyncio.sleep(0.06)
+        llm.error_rate = 0.0
+        llm.latency = 10.0
+        probe = asyncio.create_task(detect(service))
+        await asyncio.sleep(0.02)
+        while_probing = await outcome(service)
+        probe.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await probe
+        llm.latency = 0.001
+        after_cancel = await outcome(service)
+        return while_probing, after_cancel
+    
+    while_probing, after_cancel = asyncio.run(scenario())
+    
+    assert while_probing[0] == 503
+    assert after_cancel == (200, None)
+    assert breaker.state == "closed"
+
+
+def test_retries_stop_once_the_deadline_budget_is_used_up():
+    llm = FakeLLM(0.05, error_rate=1.0)
+    service = make_service(llm, max_attempts=50, base_delay=0.05, max_delay=0.1, min_budget=0.1)
+    
+    start = time.perf_counter()
+    status, _ = asyncio.run(outcome(service, deadline=0.5))
+    elapsed = time.perf_counter() - start
+    
+    stats = service.resilience.describe()
+    assert status in (502, 504)
+    assert elapsed < 0.6
+    assert 1 < llm.failures < 50
+    assert stats["retries"] == llm.failures - 1
+    assert stats["attempts"] == llm.failures
+
+
+def test_deadline_bounds_a_hanging_upstream():
+    llm = FakeLLM(30.0)
+    service = make_service(llm, max_attempts=3)
+    
+    start = time.perf_counter()
+    status, _ = asyncio.run(outcome(service, deadline=0.2))
+    
+    assert status == 504
+    assert time.perf_counter() - start < 0.5
+    assert service.resilience.describe()["timeouts"] == 1
+
+
+def test_retryable_errors_are_retried_until_success():
+    llm = FakeLLM(0.001, error_rate=1.0)
+    service = make_service(llm, max_attempts=3, base_delay=0.01)
+    
+    async def scenario():
+        task = asyncio.create_task(detect(service))
+        # Let the first attempt fail, then recover the upstream
+        await asyncio.sleep(0.005)
+        llm.error_rate = 0.0
+        return await task
+    
+    response = asyncio.run(scenario())
+    
+    assert "tomate" in str(response)
+    assert llm.failures >= 1
+    assert service.resilience.describe()["retries"] == llm.failures
+
+
+def test_client_errors_are_not_retried_and_keep_the_circuit_closed():
+    llm = FakeLLM(0.001, error_rate=1.0, error_code=400)
+    service = make_service(llm, max_attempts=3, failure_threshold=1)
+    
+    with pytest.raises(FakeAPIError):
+        asyncio.run(detect(service))
+    
+    assert llm.failures == 1
+    assert service.resilience.breaker.state == "closed"
@@ -0,0 +1,33 @@
+"""
+Results served from the detection result cache
+"""
+import asyncio
+
+from ai_service import GeminiAIService
+from benchmarks.bench_async_pipeline import make_image_bytes
+from benchmarks.fake_llm import FakeLLM
+from detection_service import IngredientDetectionService
+from resilience import CircuitBreaker, ResilientCaller
+
+
+def test_cache_hit_reports_no_ai_calls():
+    llm = FakeLLM(0.001)
+    caller = ResilientCaller("gemini", CircuitBreaker("gemini", 1000, 1.0), max_attempts=1)
+    service = IngredientDetectionService(ai_service=GeminiAIService(llm=llm, resilience=caller))
+    service.single_flight = None
+    image_bytes = make_image_bytes()
+    
+    async def scenario():
+        first = await service.process_image_async(image_bytes, "none")
+        second = await service.process_image_async(image_bytes, "none")
+        return first, second
+    
+    first, second = asyncio.run(scenario())
+    
+    assert not first["cache_hit"] and first["detection_strategy"]["calls"]
+    assert second["cache_hit"]
+    assert second["detection_strategy"] == {"strategy": "cache", "alternative_used": False, "calls": []}
+    assert second["detections"] == first["detections"]
+    # The stored result keeps the report of the run that made the calls
+    stored = [value for _, value in service.result_cache.memory._entries.values()]
+    assert stored[0]["detection_strategy"]["calls"]
@@ -0,0 +1,150 @@
+"""
+Single-flight coalescing: shared errors, cancellation of the leader and of every waiter, timeouts
+"""
+import asyncio
+
+import pytest
+from fastapi import HTTPException
+
+import metrics
+from ai_service import GeminiAIService
+from benchmarks.bench_async_pipeline import make_image_bytes
+from benchmarks.fake_llm import FakeLLM
+from detection_service import IngredientDetectionService
+from resilience import CircuitBreaker, ResilientCaller, request_deadline
+from single_flight import SingleFlight
+
+
+class GatedCall:
+    """Work that runs until released, counting starts and cancellations"""
+    
+    def __init__(self, result=None, error: Exception = None):
+        self.result = result
+        self.error = error
+        self.release = asyncio.Event()
+        self.started = 0
+        self.cancelled = 0
+    
+    async def __call__(self):
+        self.started += 1
+        try:
+            await self.release.wait()
+        except asyncio.CancelledError:
+            self.cancelled += 1
+            raise
+        if self.error is not None:
+            raise self.error
+        return self.result
+
+
+def make_service(llm: FakeLLM) -> IngredientDetectionService:
+    """Detection service on the fake LLM, coalescing on and without the result cache"""
+    caller = ResilientCaller("gemini", CircuitBreaker("gemini", 1000, 1.0), max_attempts=1)
+    service = IngredientDetectionService(ai_service=GeminiAIService(llm=llm, resilience=caller))
+    service.result_cache = None
+    service.single_flight = SingleFlight()
+    return service
+
+
+def coalesced_total() -> float:
+    """Current value of the coalesced requests counter"""
+    return metrics.REGISTRY.get_sample_value("nutrivision_coalesced_requests_total") or 0.0
+
+
+def test_followers_receive_the_leaders_exception():
+    flights = SingleFlight()
+    call = GatedCall(error=ValueError("upstream broke"))
+    
+    async def scenario():
+        callers = [asyncio.create_task(flights.run("image", call)) for _ in range(3)]
+        await asyncio.sleep(0)
+        call.release.set()
+        return await asyncio.gather(*callers, return_exceptions=True)
+    
+    results = asyncio.run(scenario())
+    
+    assert call.started == 1
+    assert all(isinstance(result, ValueError) for result in results)
+    assert flights.get_stats() == {"in_flight": 0, "leaders": 1, "coalesced": 2}
+
+
+def test_cancelling_the_leader_leaves_waiting_followers_running():
+    flights = SingleFlight()
+    call = GatedCall(result={"detections": []})
+    
+    async def scenario():
+        leader = asyncio.create_task(flights.run("image", call))
+        await asyncio.sleep(0)
+        follower = asyncio.create_task(flights.run("image", call))
+        await asyncio.sleep(0)
+        leader.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await leader
+        call.release.set()
+        return await follower
+    
+    result, shared = asyncio.run(scenario())
+    
+    assert result == {"detections": []} and shared
+    assert call.started == 1 and call.cancelled == 0
+
+
+def test_flight_is_cancelled_only_when_the_last_waiter_leaves():
+    flights = SingleFlight()
+    call = GatedCall()
+    
+    async def scenario():
+        waiters = [asyncio.create_task(flights.run("image", call)) for _ in range(3)]
+        await asyncio.sleep(0)
+        for waiter in waiters[:2]:
+            waiter.cancel()
+        await asyncio.gather(*waiters[:2], return_exceptions=True)
+        await asyncio.sleep(0)
+        still_running = call.cancelled == 0 and flights.get_stats()["in_flight"] == 1
+        waiters[2].cancel()
+        await asyncio.gather(waiters[2], return_exceptions=True)
+        await asyncio.sleep(0)
+        return still_running
+    
+    assert asyncio.run(scenario())
+    assert call.cancelled == 1
+    assert flights.get_stats()["in_flight"] == 0
+
+
+def test_follower_timeout_is_a_504_and_the_leader_still_completes():
+    llm = FakeLLM(0.3)
+    service = make_service(llm)
+    image_bytes = make_image_bytes()
+    
+    async def follow():
+        with request_deadline(0.05):
+            return await service.process_image_async(image_bytes, "none")
+    
+    async def scenario():
+        leader = asyncio.create_task(service.process_image_async(image_bytes, "none"))
+        await asyncio.sleep(0.01)
+        with pytest.raises(HTTPException) as timed_out:
+            await follow()
+        return timed_out.value, await leader
+    
+    error, result = asyncio.run(scenario())
+    
+    assert error.status_code == 504
+    assert result["detections"]
+    assert service.single_flight.get_stats()["coalesced"] == 1
+
+
+def test_identical_requests_share_one_run_and_are_counted():
+    llm = FakeLLM(0.05)
+    service = make_service(llm)
+    image_bytes = make_image_bytes()
+    before = coalesced_total()
+    
+    async def scenario():
+        return await asyncio.gather(*(service.process_image_async(image_bytes, "none") for _ in range(3)))
+    
+    results = asyncio.run(scenario())
+    
+    assert coalesced_total() == before + 2
+    assert service.single_flight.get_stats()["leaders"] == 1
+    assert all(result["detections"] == results[0]["detections"] for result in results)
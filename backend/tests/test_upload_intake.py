@@ -0,0 +1,28 @@
+"""
+Request body caps on the detection endpoints, as seen by the browser frontend
+"""
+import asyncio
+
+import httpx
+
+from config import INTAKE_MAX_BYTES
+from main import app
+
+ORIGIN = "http://localhost:3000"
+
+
+async def post(path: str, headers: dict, content: bytes) -> httpx.Response:
+    """POST to the application in process"""
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+        return await client.post(path, headers=headers, content=content)
+
+
+def test_oversized_content_length_is_rejected_with_cors_headers():
+    headers = {"Origin": ORIGIN, "Content-Type": "application/json",
+               "Content-Length": str(INTAKE_MAX_BYTES * 2)}
+    
+    response = asyncio.run(post("/detect-objects-base64", headers, b"{}"))
+    
+    assert response.status_code == 413
+    assert response.headers["access-control-allow-origin"] == ORIGIN
@@ -0,0 +1,88 @@
+"""
+Tiled high-resolution detection: tile planning and coordinate mapping
+
+Large or crowded photos lose small ingredients when shrunk to
+TARGET_IMAGE_SIZE. In tiled mode the original image is split into an
+overlapping grid, each tile is analysed on its own and the boxes, returned
+in tile-relative 0-1000 coordinates, are mapped back to the whole image.
+"""
+import math
+from typing import List, NamedTuple, Tuple
+
+
+class Tile(NamedTuple):
+    """Region of the original image, in pixels"""
+    x: int
+    y: int
+    width: int
+    height: int
+
+
+def _tile_length(length: int, count: int, overlap: float) -> float:
+    """Tile side covering `length` with `count` tiles overlapping by `overlap` of a tile"""
+    return length / (count - (count - 1) * overlap)
+
+
+def plan_tiles(width: int, height: int, tile_size: int, overlap: float, max_tiles: int) -> Tuple[List[Tile], int, int]:
+    """
+    Split an image into a grid of overlapping tiles
+    
+    The grid uses tiles of about tile_size pixels. If that needs more than
+    max_tiles tiles, the axis with the smaller tiles loses a row or column
+    until the grid fits, so tiles grow but stay close to square.
+    
+    Args:
+        width, height: Original image dimensions
+        tile_size: Preferred tile side in pixels
+        overlap: Overlap between neighbouring tiles as a fraction of a tile (0-0.5)
+        max_tiles: Maximum number of tiles
+        
+    Returns:
+        Tuple of (tiles in row-major order, rows, columns)
+    """
+    step = tile_size * (1 - overlap)
+    columns = max(1, math.ceil((width - tile_size * overlap) / step))
+    rows = max(1, math.ceil((height - tile_size * overlap) / step))
+    
+    while rows * columns > max(1, max_tiles):
+        if columns > 1 and (rows == 1 or _tile_length(width, columns, overlap) <= _tile_length(height, rows, overlap)):
+            columns -= 1
+        else:
+            rows -= 1
+    
+    tile_width = min(width, math.ceil(_tile_length(width, columns, overlap)))
+    tile_height = min(height, math.ceil(_tile_length(height, rows, overlap)))
+    xs = [round(i * (width - tile_width) / (columns - 1)) if columns > 1 else 0 for i in range(columns)]
+    ys = [round(i * (height - tile_height) / (rows - 1)) if rows > 1 else 0 for i in range(rows)]
+    tiles = [Tile(x, y, tile_width, tile_height) for y in ys for x in xs]
+    return tiles, rows, columns
+
+
+def tile_box_to_image(box: Tuple[float, float, float, float, str], tile: Tile,
+                      image_width: int, image_height: int) -> Tuple[float, float, float, float, str]:
+    """
+    Map a box from tile-relative to image-relative normalized coordinates
+    
+    The tile's 0-1000 coordinates are converted to global pixels of the
+    original image, then normalized against the whole image.
+    
+    Args:
+        box: Parsed tuple (ymin, xmin, ymax, xmax, label) relative to the tile
+        tile: Tile the box was detected in
+        image_width, image_height: Original image dimensions
+        
+    Returns:
+        Tuple (ymin, xmin, ymax, xmax, label) with 0-1000 coordinates of the whole image
+    """
+    ymin, xmin, ymax, xmax, label = box[:5]
+    ymin, xmin, ymax, xmax = (max(0.0, min(1000.0, value)) for value in (ymin, xmin, ymax, xmax))
+    
+    # Tile-relative 0-1000 -> global pixels
+    x1 = tile.x + xmin / 1000 * tile.width
+    x2 = tile.x + xmax / 1000 * tile.width
+    y1 = tile.y + ymin / 1000 * tile.height
+    y2 = tile.y + ymax / 1000 * tile.height
+    
+    # Global pixels -> image-relative 0-1000
+    return (y1 / image_height * 1000, x1 / image_width * 1000,
+            y2 / image_height * 1000, x2 / image_width * 1000, label)
@@ -0,0 +1,339 @@
+"""
+Streaming upload intake: byte caps, early image header sniffing and incremental base64 decoding
+
+Uploads are read in chunks into one preallocated buffer instead of being
+materialized (and, for base64, copied several times) in memory. The image
+header is sniffed from the first kilobytes so unsupported formats and
+oversize images are rejected before the rest is read or decoded.
+"""
+import binascii
+import re
+from typing import AsyncIterator, Iterable, Optional
+
+import orjson
+from fastapi import HTTPException, UploadFile
+from fastapi.responses import JSONResponse
+
+from config import (
+    INTAKE_MAX_BYTES, INTAKE_MAX_PIXELS, INTAKE_CHUNK_SIZE,
+    INTAKE_SNIFF_BYTES, INTAKE_IMAGE_FORMATS
+)
+from image_processor import ImageProcessor, IMAGE_HEADER_BYTES
+
+# Start of the "image" string value in a JSON body, after any simple scalar fields
+_IMAGE_VALUE_START = re.compile(
+    rb'\s*\{\s*(?:"(?:[^"\\]|\\.)*"\s*:\s*(?:"(?:[^"\\]|\\.)*"|[^"{}\[\],\s]+)\s*,\s*)*"image"\s*:\s*"'
+)
+# Bodies with other fields this long (or nested values) before "image" are parsed in one go
+_MAX_PREFIX_BYTES = 64 * 1024
+# Longest data URL prefix ("data:image/jpeg;base64,") accepted before the payload
+_MAX_DATA_URL_PREFIX = 256
+_BASE64_IGNORED = b" \t\r\n"
+
+
+def _too_large(max_bytes: int) -> HTTPException:
+    """413 error for uploads above the byte cap"""
+    return HTTPException(status_code=413, detail=f"Image exceeds {max_bytes // (1024 * 1024)} MB")
+
+
+class ImageHeaderCheck:
+    """Sniffs the format and dimensions of an upload from its first bytes and enforces the limits"""
+    
+    def __init__(self, max_pixels: int = INTAKE_MAX_PIXELS, sniff_bytes: int = INTAKE_SNIFF_BYTES,
+                 formats: Iterable[str] = INTAKE_IMAGE_FORMATS):
+        """
+        Initialize check
+        
+        Args:
+            max_pixels: Largest width * height accepted
+            sniff_bytes: Bytes received before the first sniff attempt
+            formats: Accepted Pillow format names
+        """
+        self.max_pixels = max_pixels
+        self.formats = set(formats)
+        self.header = None
+        self._next_attempt = sniff_bytes
+    
+    def feed(self, data: bytearray, size: int, complete: bool = False) -> None:
+        """
+        Sniff the header once enough bytes have arrived
+        
+        A header that is not found in the first sniff_bytes (e.g. behind large
+        EXIF blocks) is retried at twice the size, up to IMAGE_HEADER_BYTES.
+        
+        Args:
+            data: Upload buffer
+            size: Bytes of data received so far
+            complete: True once the whole upload has been received
+            
+        Raises:
+            HTTPException: 415 for unrecognized or unsupported formats, 413 for too many pixels
+        """
+        if self.header is not None or (size < self._next_attempt and not complete):
+            return
+        
+        header = ImageProcessor.read_image_size(memoryview(data)[:size])
+        if header is None:
+            if complete or size >= IMAGE_HEADER_BYTES:
+                raise HTTPException(status_code=415, detail="Unrecognized image format")
+            self._next_attempt = min(size * 2, IMAGE_HEADER_BYTES)
+            return
+        
+        image_format, width, height = header
+        if image_format not in self.formats:
+            raise HTTPException(status_code=415, detail=f"Unsupported image format: {image_format}")
+        if width * height > self.max_pixels:
+            raise HTTPException(
+                status_code=413,
+                detail=f"Image too large: {width}x{height} exceeds {self.max_pixels // 1_000_000} MP"
+            )
+        self.header = header
+
+
+async def read_upload(file: UploadFile, max_bytes: int = INTAKE_MAX_BYTES) -> bytearray:
+    """
+    Read an uploaded image in chunks into a preallocated buffer
+    
+    The declared size is checked first, the header is sniffed as soon as
+    INTAKE_SNIFF_BYTES arrive and reading stops at max_bytes.
+    
+    Args:
+        file: Uploaded file
+        max_bytes: Hard cap on the image size
+        
+    Returns:
+        Image bytes
+        
+    Raises:
+        HTTPException: 413 above the byte or pixel cap, 415 for non-image data
+    """
+    if file.size is not None and file.size > max_bytes:
+        raise _too_large(max_bytes)
+    
+    buffer = bytearray(file.size or 0)
+    check = ImageHeaderCheck()
+    size = 0
+    while True:
+        chunk = await file.read(INTAKE_CHUNK_SIZE)
+        if not chunk:
+            break
+        if size + len(chunk) > max_bytes:
+            raise _too_large(max_bytes)
+        # Slice assignment overwrites the preallocated bytes and grows past them if needed
+        buffer[size:size + len(chunk)] = chunk
+        size += len(chunk)
+        check.feed(buffer, size)
+    
+    del buffer[size:]
+    check.feed(buffer, size, complete=True)
+    return buffer
+
+
+class Base64StreamDecoder:
+    """Decodes base64 text fed in chunks into a preallocated buffer"""
+    
+    def __init__(self, expected_size: int, max_bytes: int = INTAKE_MAX_BYTES):
+        """
+        Initialize decoder
+        
+        Args:
+            expected_size: Upper bound of the decoded size used to preallocate (0 if unknown)
+            max_bytes: Hard cap on the decoded size
+        """
+        self.buffer = bytearray(min(expected_size, max_bytes))
+        self.size = 0
+        self.max_bytes = max_bytes
+        self.check = ImageHeaderCheck()
+        self._carry = b""
+    
+    def feed(self, text: bytes) -> None:
+        """
+        Decode the complete 4-character groups of a chunk; the rest waits for the next one
+        
+        Args:
+            text: Base64 text, possibly with whitespace or JSON-escaped slashes
+        """
+        text = self._carry + text
+        # A trailing backslash is half of a JSON escape: keep it for the next chunk
+        split = len(text) - 1 if text.endswith(b"\\") else len(text)
+        text, tail = text[:split], text[split:]
+        if b"\\" in text:
+            text = text.replace(b"\\n", b"").replace(b"\\r", b"").replace(b"\\/", b"/")
+        text = text.translate(None, _BASE64_IGNORED)
+        
+        usable = len(text) - len(text) % 4
+        self._carry = text[usable:] + tail
+        if usable:
+            self._write(text[:usable])
+    
+    def finish(self) -> bytearray:
+        """
+        Decode what is left and return the image bytes
+        
+        Returns:
+            Decoded bytes
+            
+        Raises:
+            HTTPException: 400 for invalid base64, 413/415 from the header check
+        """
+        if self._carry:
+            self._write(self._carry)
+            self._carry = b""
+        del self.buffer[self.size:]
+        self.check.feed(self.buffer, self.size, complete=True)
+        return self.buffer
+    
+    def _write(self, text: bytes) -> None:
+        """Decode complete base64 groups into the buffer"""
+        try:
+            decoded = binascii.a2b_base64(text)
+        except binascii.Error as e:
+            raise HTTPException(status_code=400, detail=f"Invalid base64 image: {e}")
+        if self.size + len(decoded) > self.max_bytes:
+            raise _too_large(self.max_bytes)
+        self.buffer[self.size:self.size + len(decoded)] = decoded
+        self.size += len(decoded)
+        self.check.feed(self.buffer, self.size)
+
+
+def _strip_data_url(value: bytes) -> Optional[bytes]:
+    """
+    Remove a "data:image/...;base64," prefix from the start of the image value
+    
+    Returns:
+        The value without the prefix, or None if more bytes are needed to tell
+    """
+    if len(value) < 5 and b"data:".startswith(value):
+        return None
+    if not value.startswith(b"data:"):
+        return value
+    comma = value.find(b",", 0, _MAX_DATA_URL_PREFIX)
+    if comma != -1:
+        return value[comma + 1:]
+    if len(value) >= _MAX_DATA_URL_PREFIX:
+        raise HTTPException(status_code=400, detail="Invalid data URL in 'image'")
+    return None
+
+
+def _decode_json_body(body: bytes, expected_size: int, max_bytes: int) -> bytearray:
+    """Fallback for bodies the streaming scan does not handle: parse the JSON, then decode"""
+    try:
+        data = orjson.loads(body)
+    except orjson.JSONDecodeError:
+        raise HTTPException(status_code=400, detail="Invalid JSON body")
+    if not isinstance(data, dict) or not isinstance(data.get("image"), str):
+        raise HTTPException(status_code=400, detail="Missing 'image' field")
+    
+    value = data["image"].encode("ascii", "ignore")
+    if value.startswith(b"data:image"):
+        value = value.split(b",", 1)[-1]
+    decoder = Base64StreamDecoder(expected_size, max_bytes)
+    decoder.feed(value)
+    return decoder.finish()
+
+
+async def read_base64_image(chunks: AsyncIterator[bytes], content_length: Optional[int],
+                            max_bytes: int = INTAKE_MAX_BYTES) -> bytearray:
+    """
+    Decode the "image" field of a {"image": "<base64 or data URL>"} JSON body as it streams in
+    
+    Only the bytes before the value are buffered; the value is decoded
+    chunk by chunk into a buffer sized from Content-Length, and reading
+    stops at its closing quote. Bodies with nested or very long fields
+    before "image" fall back to a full JSON parse.
+    
+    Args:
+        chunks: Request body chunks
+        content_length: Declared body size, if any
+        max_bytes: Hard cap on the decoded image size
+        
+    Returns:
+        Image bytes
+        
+    Raises:
+        HTTPException: 400 for malformed bodies, 413 above the byte or pixel cap,
+            415 for non-image data
+    """
+    expected_size = (content_length or 0) * 3 // 4
+    prefix = b""
+    decoder = None
+    pending = None
+    
+    async for chunk in chunks:
+        if decoder is None:
+            prefix += chunk
+            match = _IMAGE_VALUE_START.match(prefix)
+            if match is None:
+                if len(prefix) > _MAX_PREFIX_BYTES:
+                    break
+                continue
+            decoder = Base64StreamDecoder(expected_size, max_bytes)
+            chunk, prefix = prefix[match.end():], b""
+            pending = b""
+        
+        if pending is not None:
+            # Still deciding whether the value starts with a data URL prefix
+            pending += chunk
+            value = _strip_data_url(pending)
+            if value is None:
+                continue
+            chunk, pending = value, None
+        
+        end = chunk.find(b'"')
+        decoder.feed(chunk if end == -1 else chunk[:end])
+        if end != -1:
+            return decoder.finish()
+    
+    if decoder is not None:
+        raise HTTPException(status_code=400, detail="Unterminated 'image' field")
+    
+    # Unusual body layout: read the rest (still capped by RequestBodyLimitMiddleware) and parse it
+    async for chunk in chunks:
+        prefix += chunk
+    return _decode_json_body(prefix, expected_size, max_bytes)
+
+
+class RequestBodyLimitMiddleware:
+    """
+    ASGI middleware enforcing a hard cap on request body size for some paths
+    
+    A declared Content-Length above the cap is rejected at once; otherwise
+    the received bytes are counted and the request fails with 413 as soon
+    as they pass the cap, before the body is fully buffered or spooled.
+    """
+    
+    def __init__(self, app, limits: dict):
+        """
+        Initialize middleware
+        
+        Args:
+            app: ASGI application
+            limits: Path -> maximum body bytes
+        """
+        self.app = app
+        self.limits = limits
+    
+    async def __call__(self, scope, receive, send):
+        limit = self.limits.get(scope["path"]) if scope["type"] == "http" else None
+        if limit is None:
+            await self.app(scope, receive, send)
+            return
+        
+        for name, value in scope["headers"]:
+            if name == b"content-length" and value.isdigit() and int(value) > limit:
+                response = JSONResponse({"detail": f"Request body exceeds {limit} bytes"}, status_code=413)
+                await response(scope, receive, send)
+                return
+        
+        received = 0
+        
+        async def limited_receive():
+            nonlocal received
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                if received > limit:
+                    raise HTTPException(status_code=413, detail=f"Request body exceeds {limit} bytes")
+            return message
+        
+        await self.app(scope, limited_receive, send)